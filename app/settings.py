@@ -489,6 +489,24 @@ CELERY_TASK_ROUTES = {
     "commercehq_core.tasks.product_export": {"queue": "priority_high"},
     "commercehq_core.tasks.product_update": {"queue": "priority_high"},
 }
+CELERY_BEAT_SCHEDULE = {
+    'sync-tracks-costs': {
+        'task': 'profit_dashboard.tasks.sync_tracks_costs',
+        'schedule': 60.0,
+    },
+    'sync-profit-rollups': {
+        'task': 'profit_dashboard.tasks.sync_profit_rollups',
+        'schedule': 60.0,
+    },
+    'flush-last-seen': {
+        'task': 'last_seen.tasks.flush_last_seen',
+        'schedule': 60.0,
+    },
+    'flush-products-index': {
+        'task': 'product_core.tasks.flush_products_index',
+        'schedule': 10.0,
+    },
+}
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
@@ -497,7 +515,7 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
-    'DEFAULT_PAGINATION_CLASS': 'shopified_core.paginators.RESTResultsPagination',
+    'DEFAULT_PAGINATION_CLASS': 'shopified_core.paginators.KeysetResultsPagination',
     'PAGE_SIZE': 20,
 }
 
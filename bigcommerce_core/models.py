@@ -14,7 +14,6 @@ from pusher import Pusher
 
 from shopified_core.utils import (
     get_domain,
-    safe_str,
     url_join,
 )
 from shopified_core.decorators import add_to_class
@@ -197,10 +196,7 @@ class BigCommerceProduct(ProductBase):
 
     @property
     def parsed(self):
-        try:
-            return json.loads(self.data)
-        except:
-            return {}
+        return self.data_json
 
     @property
     def bigcommerce_url(self):
@@ -243,22 +239,12 @@ class BigCommerceProduct(ProductBase):
     def save(self, *args, **kwargs):
         data = json.loads(self.data)
 
-        self.title = data.get('title', '')
-        self.tags = safe_str(data.get('tags', ''))[:1024]
-        self.product_type = safe_str(data.get('type', ''))[:254]
-
-        try:
-            self.price = '%.02f' % float(data['price'])
-        except:
-            self.price = 0.0
+        self.update_list_columns(data)
 
         super(BigCommerceProduct, self).save(*args, **kwargs)
 
     def get_config(self):
-        try:
-            return json.loads(self.config)
-        except:
-            return {}
+        return self.config_json
 
     def update_data(self, data):
         if type(data) is not dict:
@@ -44,7 +44,7 @@ from .utils import (
 
 from product_alerts.utils import (
     get_supplier_variants,
-    variant_index_from_supplier_sku,
+    VariantMatcher,
 )
 
 
@@ -398,10 +398,11 @@ def sync_bigcommerce_product_quantities(self, product_id):
 
         variant_quantities = get_supplier_variants(product.default_supplier.supplier_type(), product.default_supplier.get_source_id())
         if product_data and variant_quantities:
+            variant_matcher = VariantMatcher(product, product_data['variants'])
             for variant in variant_quantities:
                 sku = variant.get('sku')
                 variant_id = 0
-                idx = variant_index_from_supplier_sku(product, sku, product_data['variants'])
+                idx = variant_matcher.match(sku)
                 if idx is not None:
                     variant_id = product_data['variants'][idx]['id']
                 if variant_id > 0:
@@ -531,6 +532,7 @@ def products_supplier_sync(self, store_id, products, sync_price, price_markup, c
                     updated = True
 
             if (sync_price and not seem_price) or sync_inventory:
+                variant_matcher = VariantMatcher(product, product_data['variants'])
                 for i, variant in enumerate(supplier_variants):
                     sku = variant.get('sku')
                     if not sku:
@@ -539,7 +541,7 @@ def products_supplier_sync(self, store_id, products, sync_price, price_markup, c
                         else:
                             continue
                     else:
-                        idx = variant_index_from_supplier_sku(product, sku, product_data['variants'])
+                        idx = variant_matcher.match(sku)
 
                     variant_id = 0
                     if idx is not None:
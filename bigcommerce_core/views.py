@@ -46,6 +46,7 @@ from shopified_core.utils import (
     safe_float,
     http_excption_status_code,
     order_data_cache,
+    order_data_cache_set_many,
     format_queueable_orders
 )
 from shopified_core.tasks import keen_order_event
@@ -1249,8 +1250,8 @@ class OrdersList(ListView):
                         args=[pls_order_id, self.store.id, 'bigcommerce'],
                         countdown=5
                     )
-        caches['orders'].set_many(orders_cache, timeout=86400 if self.bulk_queue else 21600)
-        caches['orders'].set_many(raw_orders_cache, timeout=86400 if self.bulk_queue else 21600)
+        order_data_cache_set_many(orders_cache, timeout=86400 if self.bulk_queue else 21600)
+        order_data_cache_set_many(raw_orders_cache, timeout=86400 if self.bulk_queue else 21600)
 
 
 class OrdersTrackList(ListView):
@@ -0,0 +1,39 @@
+# Generated by Django 3.2.14 on 2026-10-18 14:05
+
+import django.contrib.postgres.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('commercehq_core', '0022_commercehqordertrack_sync'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='commercehqproduct',
+            name='image',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='commercehqproduct',
+            name='original_url',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='commercehqproduct',
+            name='price_range',
+            field=django.contrib.postgres.fields.ArrayField(base_field=models.FloatField(), blank=True, null=True, size=2),
+        ),
+        migrations.AddField(
+            model_name='commercehqproduct',
+            name='variants_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='commercehqproduct',
+            name='vendor',
+            field=models.CharField(blank=True, default='', max_length=255),
+        ),
+    ]
@@ -16,7 +16,6 @@ from pusher import Pusher
 from shopified_core.utils import (
     hash_url_filename,
     get_domain,
-    safe_str,
     safe_int,
     add_http_schema,
 )
@@ -191,23 +190,13 @@ class CommerceHQProduct(ProductBase):
     def save(self, *args, **kwargs):
         data = json.loads(self.data)
 
-        self.title = data.get('title', '')
-        self.tags = safe_str(data.get('tags', ''))[:1024]
-        self.product_type = safe_str(data.get('type', ''))[:254]
-
-        try:
-            self.price = '%.02f' % float(data['price'])
-        except:
-            self.price = 0.0
+        self.update_list_columns(data)
 
         super(CommerceHQProduct, self).save(*args, **kwargs)
 
     @property
     def parsed(self):
-        try:
-            return json.loads(self.data)
-        except:
-            return {}
+        return self.data_json
 
     @property
     def commercehq_url(self):
@@ -335,10 +324,7 @@ class CommerceHQProduct(ProductBase):
         return product
 
     def get_config(self):
-        try:
-            return json.loads(self.config)
-        except:
-            return {}
+        return self.config_json
 
     def get_mapping_config(self):
         try:
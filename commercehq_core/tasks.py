@@ -43,6 +43,7 @@ from .models import (
 )
 
 from product_alerts.utils import (
+    VariantMatcher,
     get_supplier_variants,
     variant_index_from_supplier_sku
 )
@@ -737,6 +738,7 @@ def products_supplier_sync(self, store_id, products, sync_price, price_markup, c
                     updated = True
 
             if (sync_price and not same_price) or sync_inventory:
+                variant_matcher = VariantMatcher(product, product_data['variants'])
                 for i, variant in enumerate(supplier_variants):
                     sku = variant.get('sku')
                     if not sku:
@@ -745,7 +747,7 @@ def products_supplier_sync(self, store_id, products, sync_price, price_markup, c
                         else:
                             continue
                     else:
-                        idx = variant_index_from_supplier_sku(product, sku, product_data['variants'])
+                        idx = variant_matcher.match(sku)
 
                         if idx is None:
                             if len(product_data['variants']) == 1 and len(supplier_variants) == 1:
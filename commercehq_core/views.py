@@ -50,6 +50,7 @@ from shopified_core.utils import (
     clean_query_id,
     http_excption_status_code,
     order_data_cache,
+    order_data_cache_set_many,
     format_queueable_orders,
 )
 from shopified_core.tasks import keen_order_event
@@ -1232,8 +1233,8 @@ class OrdersList(ListView):
             orders[odx] = order
 
         bulk_queue = bool(self.request.GET.get('bulk_queue'))
-        caches['orders'].set_many(orders_cache, timeout=86400 if bulk_queue else 21600)
-        caches['orders'].set_many(raw_orders_cache, timeout=86400 if bulk_queue else 21600)
+        order_data_cache_set_many(orders_cache, timeout=86400 if bulk_queue else 21600)
+        order_data_cache_set_many(raw_orders_cache, timeout=86400 if bulk_queue else 21600)
 
         return orders
 
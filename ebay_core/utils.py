@@ -6,7 +6,7 @@ import re
 import requests
 
 from django.contrib.auth.models import User
-from django.core.cache import cache, caches
+from django.core.cache import cache
 from django.core.exceptions import PermissionDenied
 from django.db.models import Q
 from django.shortcuts import get_object_or_404
@@ -25,6 +25,7 @@ from shopified_core.utils import (
     fix_order_data,
     http_exception_response,
     http_excption_status_code,
+    order_data_cache_set_many,
     products_filter,
     safe_float,
     safe_int,
@@ -944,8 +945,8 @@ class EbayUtils(SureDoneUtils):
 
                 normalized_orders.append(norm_item)
 
-        caches['orders'].set_many(orders_cache, timeout=86400 if filters.get('bulk_queue') else 21600)
-        caches['orders'].set_many(raw_orders_cache, timeout=86400 if filters.get('bulk_queue') else 21600)
+        order_data_cache_set_many(orders_cache, timeout=86400 if filters.get('bulk_queue') else 21600)
+        order_data_cache_set_many(raw_orders_cache, timeout=86400 if filters.get('bulk_queue') else 21600)
 
         return normalized_orders, total_products_count
 
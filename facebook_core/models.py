@@ -181,10 +181,7 @@ class FBProduct(SureDoneProductBase):
 
     @property
     def parsed(self):
-        try:
-            return json.loads(self.data)
-        except:
-            return {}
+        return self.data_json
 
     @property
     def variants_config_parsed(self):
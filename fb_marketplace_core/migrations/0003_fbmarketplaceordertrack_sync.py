@@ -0,0 +1,17 @@
+# Generated by Django 3.2.14 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fb_marketplace_core', '0002_auto_20220907_1813'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='fbmarketplaceordertrack',
+            index=models.Index(condition=models.Q(('hidden', False), ('source_tracking', '')), fields=['store', 'created_at'], name='fbmarketplaceordertrack_sync'),
+        ),
+    ]
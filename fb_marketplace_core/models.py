@@ -4,7 +4,7 @@ from django.contrib.auth.models import User
 from django.db import models
 
 from shopified_core.models import BoardBase, OrderTrackBase, ProductBase, StoreBase, SupplierBase, UserUploadBase
-from shopified_core.utils import hash_url_filename, safe_str
+from shopified_core.utils import hash_url_filename
 
 
 class FBMarketplaceStore(StoreBase):
@@ -49,23 +49,13 @@ class FBMarketplaceProduct(ProductBase):
     def save(self, *args, **kwargs):
         data = json.loads(self.data)
 
-        self.title = data.get('title', '')
-        self.tags = safe_str(data.get('tags', ''))[:1024]
-        self.product_type = safe_str(data.get('type', ''))[:254]
-
-        try:
-            self.price = '%.02f' % float(data['price'])
-        except:
-            self.price = 0.0
+        self.update_list_columns(data)
 
         super(FBMarketplaceProduct, self).save(*args, **kwargs)
 
     @property
     def parsed(self):
-        try:
-            return json.loads(self.data)
-        except:
-            return {}
+        return self.data_json
 
     @property
     def is_connected(self):
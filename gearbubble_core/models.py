@@ -11,7 +11,7 @@ from django.contrib.auth.models import User
 from django.utils.crypto import get_random_string
 from django.urls import reverse
 
-from shopified_core.utils import get_domain, safe_str
+from shopified_core.utils import get_domain
 from shopified_core.decorators import add_to_class
 from shopified_core.models import StoreBase, ProductBase, SupplierBase, BoardBase, OrderTrackBase, UserUploadBase
 
@@ -152,10 +152,7 @@ class GearBubbleProduct(ProductBase):
 
     @property
     def parsed(self):
-        try:
-            return json.loads(self.data)
-        except:
-            return {}
+        return self.data_json
 
     @property
     def gearbubble_url(self):
@@ -189,14 +186,7 @@ class GearBubbleProduct(ProductBase):
     def save(self, *args, **kwargs):
         data = json.loads(self.data)
 
-        self.title = data.get('title', '')
-        self.tags = safe_str(data.get('tags', ''))[:1024]
-        self.product_type = safe_str(data.get('type', ''))[:254]
-
-        try:
-            self.price = '%.02f' % float(data['price'])
-        except:
-            self.price = 0.0
+        self.update_list_columns(data)
 
         super(GearBubbleProduct, self).save(*args, **kwargs)
 
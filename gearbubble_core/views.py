@@ -29,6 +29,7 @@ from shopified_core.utils import (
     clean_query_id,
     http_excption_status_code,
     order_data_cache,
+    order_data_cache_set_many,
 )
 from shopified_core.tasks import keen_order_event
 from leadgalaxy.utils import (
@@ -441,7 +442,7 @@ class OrdersList(ListView):
                 key = '{}_{}'.format(order['id'], item['id'])
                 item['order_track'] = order_tracks_by_item.get(key)
 
-        caches['orders'].set_many(orders_cache, timeout=21600)
+        order_data_cache_set_many(orders_cache, timeout=21600)
 
         return orders
 
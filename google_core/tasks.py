@@ -13,7 +13,7 @@ from django.utils import timezone
 
 from app.celery_base import CaptureFailure, celery_app, retry_countdown
 from lib.exceptions import capture_exception, capture_message
-from product_alerts.utils import get_supplier_variants, variant_index_from_supplier_sku
+from product_alerts.utils import get_supplier_variants, VariantMatcher
 from shopified_core import permissions
 from shopified_core.utils import get_domain, http_exception_response, http_excption_status_code, safe_json
 from suredone_core.models import SureDoneAccount
@@ -773,6 +773,7 @@ def products_supplier_sync(self, store_id, user_id, products, sync_price, price_
 
             if (sync_price and not same_price) or sync_inventory:
                 indexes = []
+                variant_matcher = VariantMatcher(product, variants)
                 for i, variant in enumerate(supplier_variants):
                     sku = variant.get('sku')
                     if not sku:
@@ -781,7 +782,7 @@ def products_supplier_sync(self, store_id, user_id, products, sync_price, price_
                         else:
                             continue
                     else:
-                        idx = variant_index_from_supplier_sku(product, sku, variants)
+                        idx = variant_matcher.match(sku)
                         if idx is None and len(variants) > 1:
                             for j, v in enumerate(variants):
                                 if j not in indexes and variant.get('sku_short') == v.get('supplier_sku') and v.get('supplier_sku'):
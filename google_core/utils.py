@@ -6,7 +6,6 @@ import csv
 import itertools
 from requests.exceptions import HTTPError
 
-from django.core.cache import caches
 from django.core.exceptions import PermissionDenied
 from django.db.models import Q
 from django.shortcuts import get_object_or_404
@@ -21,7 +20,7 @@ from multichannel_products_core.utils import set_master_product, rewrite_master_
 from shopified_core import permissions
 from shopified_core.decorators import add_to_class
 from shopified_core.paginators import SimplePaginator
-from shopified_core.utils import fix_order_data, products_filter, safe_float, safe_int, safe_json, safe_str
+from shopified_core.utils import fix_order_data, order_data_cache_set_many, products_filter, safe_float, safe_int, safe_json, safe_str
 from suredone_core.models import SureDoneAccount
 from suredone_core.utils import SureDoneOrderUpdater, SureDoneUtils, parse_suredone_date, sd_customer_address, \
     SureDonePusher
@@ -671,8 +670,8 @@ class GoogleUtils(SureDoneUtils):
 
                 normalized_orders.append(norm_item)
 
-        caches['orders'].set_many(orders_cache, timeout=86400 if filters.get('bulk_queue') else 21600)
-        caches['orders'].set_many(raw_orders_cache, timeout=86400 if filters.get('bulk_queue') else 21600)
+        order_data_cache_set_many(orders_cache, timeout=86400 if filters.get('bulk_queue') else 21600)
+        order_data_cache_set_many(raw_orders_cache, timeout=86400 if filters.get('bulk_queue') else 21600)
 
         return normalized_orders, total_products_count
 
@@ -20,7 +20,6 @@ from shopified_core.decorators import add_to_class
 from shopified_core.models import StoreBase, ProductBase, SupplierBase, BoardBase, OrderTrackBase, UserUploadBase
 from shopified_core.utils import (
     get_domain,
-    safe_str,
     dict_val,
     safe_int,
 )
@@ -262,14 +261,7 @@ class GrooveKartProduct(ProductBase):
     def save(self, *args, **kwargs):
         data = json.loads(self.data)
 
-        self.title = data.get('title', '')
-        self.tags = safe_str(data.get('tags', ''))[:1024]
-        self.product_type = safe_str(data.get('type', ''))[:254]
-
-        try:
-            self.price = '%.02f' % float(data['price'])
-        except:
-            self.price = 0.0
+        self.update_list_columns(data)
 
         super().save(*args, **kwargs)
 
@@ -353,10 +345,7 @@ class GrooveKartProduct(ProductBase):
                 raise
 
     def get_config(self):
-        try:
-            return json.loads(self.config)
-        except:
-            return {}
+        return self.config_json
 
     def update_data(self, data):
         if type(data) is not dict:
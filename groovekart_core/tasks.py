@@ -36,7 +36,7 @@ from .utils import (
 
 from product_alerts.utils import (
     get_supplier_variants,
-    variant_index_from_supplier_sku
+    VariantMatcher
 )
 
 
@@ -635,6 +635,7 @@ def products_supplier_sync(self, store_id, products, sync_price, price_markup, c
                     updated = True
 
             if (sync_price and not same_price) or sync_inventory:
+                variant_matcher = VariantMatcher(product, product_data['variants'])
                 for i, variant in enumerate(supplier_variants):
                     sku = variant.get('sku')
                     if not sku:
@@ -643,7 +644,7 @@ def products_supplier_sync(self, store_id, products, sync_price, price_markup, c
                         else:
                             continue
                     else:
-                        idx = variant_index_from_supplier_sku(product, sku, product_data['variants'])
+                        idx = variant_matcher.match(sku)
 
                         if idx is not None:
                             variant_id = utils.safe_int(product_data['variants'][idx]['id_product_variant'])
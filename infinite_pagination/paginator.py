@@ -1,4 +1,9 @@
-from django.core.paginator import Paginator, Page, PageNotAnInteger, EmptyPage
+import base64
+import datetime
+import json
+
+from django.core.paginator import Paginator, Page, PageNotAnInteger, EmptyPage, InvalidPage
+from django.db.models import F, Q
 
 
 class InfinitePaginator(Paginator):
@@ -91,4 +96,164 @@ class InfinitePage(Page):
         )
 
 
-__all__ = ["InfinitePaginator", "InfinitePage"]
+class KeysetPaginator:
+    """
+    Paginator that seeks to the next page using the sort key values of the
+    last row instead of ``OFFSET``, so deep pages cost the same as the first.
+
+    ``ordering`` is a list of field names (prefixed with ``-`` for descending)
+    and the primary key is always appended as a tie breaker. Pages are
+    addressed by opaque cursors returned by ``KeysetPage.next_cursor`` and
+    ``KeysetPage.previous_cursor``. NULL values sort last in ascending and
+    first in descending order, same as PostgreSQL.
+    """
+
+    is_infinte = True
+    is_keyset = True
+
+    def __init__(self, object_list, per_page, ordering=None):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+
+        ordering = [i for i in (ordering or []) if i.lstrip('-') not in ('pk', 'id')]
+        descending = ordering[-1].startswith('-') if ordering else True
+        self.ordering = ordering + ['-pk' if descending else 'pk']
+
+        model = object_list.model
+        self.fields = []
+        for name in self.ordering:
+            field_name = name.lstrip('-')
+            if field_name == 'pk':
+                attname = model._meta.pk.attname
+            else:
+                attname = model._meta.get_field(field_name).attname
+
+            self.fields.append((field_name, attname, name.startswith('-')))
+
+    @property
+    def signature(self):
+        return ','.join(self.ordering)
+
+    def encode_cursor(self, values, number, reverse=False):
+        cursor = json.dumps({'o': self.signature, 'v': values, 'n': number, 'r': reverse}, default=self._json_default)
+        return base64.urlsafe_b64encode(cursor.encode()).decode().rstrip('=')
+
+    def _json_default(self, value):
+        # Keep full microsecond precision, the cursor is compared for equality
+        if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+            return value.isoformat()
+
+        return str(value)
+
+    def decode_cursor(self, cursor):
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+            assert cursor['o'] == self.signature
+            assert len(cursor['v']) == len(self.fields)
+            return cursor['v'], max(int(cursor['n']), 1), bool(cursor['r'])
+        except Exception:
+            raise InvalidPage('Invalid cursor')
+
+    def _order_by(self, reverse):
+        order_by = []
+        for name, _, descending in self.fields:
+            if descending != reverse:
+                order_by.append(F(name).desc(nulls_first=True))
+            else:
+                order_by.append(F(name).asc(nulls_last=True))
+
+        return order_by
+
+    def _seek(self, values, reverse):
+        """ Filter rows that come after ``values`` in the requested direction """
+
+        seek = Q()
+        equal = Q()
+        for (name, _, descending), value in zip(self.fields, values):
+            if descending != reverse:
+                after = Q(**{f'{name}__isnull': False}) if value is None else Q(**{f'{name}__lt': value})
+            elif value is None:
+                after = None
+            else:
+                after = Q(**{f'{name}__gt': value}) | Q(**{f'{name}__isnull': True})
+
+            if after is not None:
+                seek |= equal & after
+
+            equal &= Q(**{f'{name}__isnull': True}) if value is None else Q(**{name: value})
+
+        return seek
+
+    def _values(self, obj):
+        return [getattr(obj, attname) for _, attname, _ in self.fields]
+
+    def page(self, cursor=None):
+        """
+        Returns the page for the given cursor, or the first page if
+        ``cursor`` is empty. Raises ``InvalidPage`` for a malformed cursor.
+        """
+
+        number, reverse = 1, False
+        object_list = self.object_list
+        if cursor:
+            values, number, reverse = self.decode_cursor(cursor)
+            object_list = object_list.filter(self._seek(values, reverse))
+
+        object_list = object_list.order_by(*self._order_by(reverse))
+
+        # this page objects + 1 extra
+        window_items = list(object_list[:self.per_page + 1])
+        page_items = window_items[:self.per_page]
+        has_more = len(window_items) > len(page_items)
+
+        if reverse:
+            page_items.reverse()
+            has_next, has_previous = True, has_more
+            if not has_previous:
+                number = 1
+        else:
+            has_next, has_previous = has_more, number > 1
+
+        return KeysetPage(page_items, number, self, has_next, has_previous)
+
+    def get_page(self, cursor=None):
+        """ Same as ``page()`` but falls back to the first page on an invalid cursor """
+
+        try:
+            return self.page(cursor)
+        except InvalidPage:
+            return self.page()
+
+
+class KeysetPage(InfinitePage):
+    is_keyset = True
+
+    def __init__(self, object_list, number, paginator, has_next, has_previous):
+        super(KeysetPage, self).__init__(object_list, number, paginator, has_next)
+        self._has_previous = has_previous
+
+    def has_previous(self):
+        return self._has_previous
+
+    def start_index(self):
+        if not self.object_list:
+            return 0
+
+        return (self.number - 1) * self.paginator.per_page + 1
+
+    @property
+    def next_cursor(self):
+        if not self.has_next() or not self.object_list:
+            return None
+
+        return self.paginator.encode_cursor(self.paginator._values(self.object_list[-1]), self.number + 1)
+
+    @property
+    def previous_cursor(self):
+        if not self.has_previous() or not self.object_list:
+            return None
+
+        return self.paginator.encode_cursor(self.paginator._values(self.object_list[0]), self.number - 1, reverse=True)
+
+
+__all__ = ["InfinitePaginator", "InfinitePage", "KeysetPaginator", "KeysetPage"]
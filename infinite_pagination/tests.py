@@ -0,0 +1,63 @@
+from django.core.paginator import InvalidPage
+
+from lib.test import BaseTestCase
+from leadgalaxy.models import ShopifyOrderTrack
+from leadgalaxy.tests.factories import ShopifyOrderTrackFactory, ShopifyStoreFactory, UserFactory
+
+from .paginator import KeysetPaginator
+
+
+class KeysetPaginatorTestCase(BaseTestCase):
+    def setUp(self):
+        self.user = UserFactory()
+        self.store = ShopifyStoreFactory(user=self.user)
+
+        # Duplicate sort keys and NULLs must not skip or repeat rows
+        for i in range(7):
+            ShopifyOrderTrackFactory(user=self.user, store=self.store, order_id=i // 2,
+                                     source_status_details=None if i % 3 == 0 else f'reason-{i // 2}')
+
+        self.orders = ShopifyOrderTrack.objects.filter(store=self.store)
+
+    def walk(self, paginator):
+        pages = [paginator.page()]
+        while pages[-1].has_next():
+            pages.append(paginator.page(pages[-1].next_cursor))
+
+        return pages
+
+    def test_pages_follow_queryset_order(self):
+        for ordering in (['order_id'], ['-order_id'], ['source_status_details'], ['-source_status_details', 'order_id']):
+            paginator = KeysetPaginator(self.orders, 3, ordering)
+            pages = self.walk(paginator)
+
+            expected = list(self.orders.order_by(*paginator._order_by(False)))
+            self.assertEqual([i for page in pages for i in page.object_list], expected)
+            self.assertEqual([page.number for page in pages], [1, 2, 3])
+            self.assertFalse(pages[0].has_previous())
+
+    def test_previous_page(self):
+        paginator = KeysetPaginator(self.orders, 3, ['-order_id'])
+        pages = self.walk(paginator)
+
+        previous = paginator.page(pages[2].previous_cursor)
+        self.assertEqual(list(previous.object_list), list(pages[1].object_list))
+        self.assertEqual(previous.number, 2)
+        self.assertTrue(previous.has_next())
+
+        first = paginator.page(previous.previous_cursor)
+        self.assertEqual(list(first.object_list), list(pages[0].object_list))
+        self.assertEqual(first.number, 1)
+        self.assertFalse(first.has_previous())
+
+    def test_invalid_cursor(self):
+        paginator = KeysetPaginator(self.orders, 3, ['order_id'])
+        cursor = paginator.page().next_cursor
+
+        with self.assertRaises(InvalidPage):
+            paginator.page('invalid')
+
+        with self.assertRaises(InvalidPage):
+            KeysetPaginator(self.orders, 3, ['-order_id']).page(cursor)
+
+        self.assertEqual(paginator.get_page('invalid').number, 1)
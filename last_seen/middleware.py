@@ -1,4 +1,4 @@
-from .models import user_seen
+from .models import buffer_user_seen
 from django.http import Http404
 
 from lib.exceptions import capture_exception
@@ -32,11 +32,10 @@ class LastSeenMiddleware(object):
                 user = request.user
 
             try:
-                user_seen(user, module=module)
+                # Saved to the database in bulk by last_seen.tasks.flush_last_seen
+                buffer_user_seen(user, module=module)
                 if request.user.is_subuser and user != request.user:
-                    interval = 600 if module is None else None
-
-                    user_seen(request.user, module=module, interval=interval)
+                    buffer_user_seen(request.user, module=module)
             except:
                 capture_exception(level='warning')
 
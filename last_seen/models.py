@@ -1,5 +1,7 @@
 import time
 import datetime
+import json
+
 from django.db import models
 from django.utils import timezone
 from django.core.cache import cache
@@ -7,11 +9,16 @@ from django.contrib.auth.models import User
 from django.contrib.sessions.models import Session
 
 import httpagentparser
+from django_redis import get_redis_connection
 
 from shopified_core.shipping_helper import country_from_code
 
 from . import settings
 
+# Redis hashes holding the presence recorded by the middlewares until `flush_last_seen` saves it
+LAST_SEEN_BUFFER_KEY = 'last_seen_buffer'
+USER_IP_BUFFER_KEY = 'last_seen_user_ip_buffer'
+
 
 class LastSeenManager(models.Manager):
     """
@@ -53,6 +60,47 @@ class LastSeenManager(models.Manager):
 
         return seen
 
+    def bulk_seen(self, seen):
+        """
+            Save many users last seen with a few queries
+
+            `seen` maps (user_id, module) to the last seen datetime,
+            existing objects are only updated when the new value is more recent
+        """
+
+        user_ids = set(User.objects.filter(id__in=set(k[0] for k in seen)).values_list('id', flat=True))
+        seen = {k: v for k, v in seen.items() if k[0] in user_ids}
+        if not seen:
+            return
+
+        existing = {}
+        duplicates = []
+        for last_seen in self.filter(user_id__in=user_ids, module__in=set(k[1] for k in seen)).order_by('id'):
+            key = (last_seen.user_id, last_seen.module)
+            if key not in seen:
+                continue
+
+            if key in existing:
+                duplicates.append(last_seen.id)
+            else:
+                existing[key] = last_seen
+
+        if duplicates:
+            self.filter(id__in=duplicates).delete()
+
+        to_update = []
+        for key, last_seen in existing.items():
+            if last_seen.last_seen < seen[key]:
+                last_seen.last_seen = seen[key]
+                to_update.append(last_seen)
+
+        if to_update:
+            self.bulk_update(to_update, ['last_seen'], batch_size=500)
+
+        to_create = [self.model(user_id=k[0], module=k[1], last_seen=v) for k, v in seen.items() if k not in existing]
+        if to_create:
+            self.bulk_create(to_create, batch_size=500)
+
     def when(self, user, module=None):
         args = {'user': user}
 
@@ -176,3 +224,146 @@ def clear_interval(user):
 
     if keys:
         cache.set_many(keys)
+
+
+def buffer_user_seen(user, module=None):
+    """
+        Record the user presence in Redis, the `flush_last_seen` task
+        saves the buffered presence to LastSeen in bulk
+    """
+
+    if not module:
+        module = settings.LAST_SEEN_DEFAULT_MODULE
+
+    get_redis_connection('default').hset(LAST_SEEN_BUFFER_KEY, f'{user.pk}:{module}', time.time())
+
+
+def buffer_user_ip(user, ip, user_agent, version=None, session_key=None):
+    """
+        Record the user IP in Redis, the `flush_last_seen` task
+        saves the buffered IPs to UserIpRecord in bulk
+    """
+
+    field = json.dumps([user.pk, ip, user_agent, version, session_key])
+    get_redis_connection('default').hset(USER_IP_BUFFER_KEY, field, time.time())
+
+
+def pop_buffer(key):
+    """
+        Return and clear a buffer hash, values are converted to datetime
+    """
+
+    with get_redis_connection('default').pipeline() as pipe:
+        pipe.hgetall(key)
+        pipe.delete(key)
+        data, _ = pipe.execute()
+
+    return {k.decode(): datetime.datetime.fromtimestamp(float(v), tz=datetime.timezone.utc) for k, v in data.items()}
+
+
+def restore_buffer(key, data):
+    """
+        Put back the values returned by `pop_buffer` without overwriting the ones recorded since
+    """
+
+    with get_redis_connection('default').pipeline() as pipe:
+        for field, when in data.items():
+            pipe.hsetnx(key, field, when.timestamp())
+
+        pipe.execute()
+
+
+def _get_or_create_by(model, cache_map, field, value):
+    if value not in cache_map:
+        obj = model.objects.filter(**{field: value}).first()
+        if obj is None:
+            obj = model.objects.create(**{field: value})
+
+        cache_map[value] = obj
+
+    return cache_map[value]
+
+
+def save_user_ips(records):
+    """
+        Update or create many UserIpRecord
+
+        Args:
+            records (dict): Map (user_id, ip, user_agent, version, session_key) tuples to the last seen datetime
+
+        Returns:
+            (list): IDs of the records missing their IP details
+    """
+
+    from leadgalaxy.models import UserProfile
+
+    user_ids = set(User.objects.filter(id__in=set(k[0] for k in records)).values_list('id', flat=True))
+    records = {k: v for k, v in records.items() if k[0] in user_ids}
+    if not records:
+        return []
+
+    sessions = set(Session.objects.filter(session_key__in=set(k[4] for k in records if k[4])).values_list('session_key', flat=True))
+
+    browsers = {}
+    extensions = {}
+    matches = {}
+    for (user_id, ip, user_agent, version, session_key), when in records.items():
+        browser = _get_or_create_by(BrowserUserAgent, browsers, 'user_agent', user_agent)
+        extension = _get_or_create_by(ExtensionVersion, extensions, 'version', version) if version else None
+        session_key = session_key if session_key in sessions else None
+
+        key = (user_id, ip, browser.id, session_key)
+        if key not in matches or matches[key][0] < when:
+            matches[key] = (when, extension)
+
+    existing = {}
+    duplicates = []
+    records_qs = UserIpRecord.objects.filter(user_id__in=user_ids, ip__in=set(k[1] for k in matches))
+    for user_ip in records_qs.order_by('-last_seen_at'):
+        key = (user_ip.user_id, user_ip.ip, user_ip.browser_id, user_ip.session_id)
+        if key not in matches:
+            continue
+
+        if key in existing:
+            duplicates.append(user_ip.id)
+        else:
+            existing[key] = user_ip
+
+    if duplicates:
+        UserIpRecord.objects.filter(id__in=duplicates).delete()
+
+    to_update = []
+    for key, user_ip in existing.items():
+        when, extension = matches[key]
+        user_ip.last_seen_at = max(user_ip.last_seen_at, when)
+        if extension and not user_ip.extension_id:
+            user_ip.extension = extension
+
+        to_update.append(user_ip)
+
+    if to_update:
+        UserIpRecord.objects.bulk_update(to_update, ['last_seen_at', 'extension'], batch_size=500)
+
+    to_create = []
+    for key, (when, extension) in matches.items():
+        if key not in existing:
+            user_id, ip, browser_id, session_key = key
+            to_create.append(UserIpRecord(
+                user_id=user_id,
+                ip=ip,
+                browser_id=browser_id,
+                session_id=session_key,
+                extension=extension))
+
+    if to_create:
+        UserIpRecord.objects.bulk_create(to_create, batch_size=500)
+
+    user_ips = {}
+    for user_id, ip, browser_id, session_key in matches:
+        user_ips.setdefault(user_id, []).append(ip)
+
+    for profile in UserProfile.objects.filter(user_id__in=user_ips.keys()):
+        for ip in user_ips[profile.user_id]:
+            profile.add_ip(ip)
+
+    return [i.id for i in to_create] + [i.id for i in to_update if not i.country]
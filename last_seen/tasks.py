@@ -1,7 +1,18 @@
+import json
+
 import requests
 
 from app.celery_base import celery_app, CaptureFailure
-from last_seen.models import UserIpRecord
+from lib.exceptions import capture_exception
+from last_seen.models import (
+    LAST_SEEN_BUFFER_KEY,
+    USER_IP_BUFFER_KEY,
+    LastSeen,
+    UserIpRecord,
+    pop_buffer,
+    restore_buffer,
+    save_user_ips,
+)
 
 
 @celery_app.task(base=CaptureFailure, ignore_result=True)
@@ -16,3 +27,27 @@ def update_ip_details(user_ip_id):
             user_ip.city = data['city']
             user_ip.org = data.get('org')
             user_ip.save()
+
+
+@celery_app.task(base=CaptureFailure, ignore_result=True)
+def flush_last_seen():
+    """ Save the presence buffered by the middlewares (scheduled by Celery beat) """
+
+    seen = pop_buffer(LAST_SEEN_BUFFER_KEY)
+    if seen:
+        try:
+            LastSeen.objects.bulk_seen({(int(k.split(':', 1)[0]), k.split(':', 1)[1]): v for k, v in seen.items()})
+        except:
+            capture_exception()
+            restore_buffer(LAST_SEEN_BUFFER_KEY, seen)
+
+    user_ips = pop_buffer(USER_IP_BUFFER_KEY)
+    if user_ips:
+        try:
+            missing_details = save_user_ips({tuple(json.loads(k)): v for k, v in user_ips.items()})
+        except:
+            capture_exception()
+            restore_buffer(USER_IP_BUFFER_KEY, user_ips)
+        else:
+            for user_ip_id in missing_details:
+                update_ip_details.apply_async(args=[user_ip_id], expires=600)
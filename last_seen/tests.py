@@ -7,7 +7,7 @@ from django.core.cache import cache
 from django.utils import timezone
 
 from lib.test import BaseTestCase
-from last_seen.models import LastSeen, user_seen, clear_interval
+from last_seen.models import LastSeen, UserIpRecord, user_seen, clear_interval, save_user_ips
 from last_seen import settings
 from last_seen import middleware
 
@@ -213,14 +213,14 @@ class TestMiddleware(BaseTestCase):
 
     middleware = middleware.LastSeenMiddleware(Mock())
 
-    @patch('last_seen.middleware.user_seen')
+    @patch('last_seen.middleware.buffer_user_seen')
     def test_process_request(self, user_seen):
         request = Mock()
         request.user.is_authenticated.return_value = False
         self.middleware(request)
         self.assertFalse(user_seen.called)
 
-    @patch('last_seen.middleware.user_seen')
+    @patch('last_seen.middleware.buffer_user_seen')
     def test_process_request_auth(self, user_seen):
         request = Mock()
         request.path = ''
@@ -229,3 +229,41 @@ class TestMiddleware(BaseTestCase):
         request.user.is_subuser = False
         self.middleware(request)
         user_seen.assert_called_with(request.user.models_user, module=None)
+
+
+class TestBufferedLastSeen(BaseTestCase):
+
+    def test_bulk_seen(self):
+        user = User.objects.create(username='testuser')
+        old = timezone.now() - datetime.timedelta(hours=1)
+        LastSeen.objects.create(user=user, module='website', last_seen=old)
+
+        now = timezone.now()
+        LastSeen.objects.bulk_seen({
+            (user.id, 'website'): now,
+            (user.id, 'api'): now,
+            (user.id + 1000, 'website'): now,  # Deleted user
+        })
+
+        self.assertEqual(LastSeen.objects.filter(user=user).count(), 2)
+        self.assertEqual(LastSeen.objects.when(user, 'website'), now)
+
+        # Older values don't overwrite newer ones
+        LastSeen.objects.bulk_seen({(user.id, 'website'): old})
+        self.assertEqual(LastSeen.objects.when(user, 'website'), now)
+
+    def test_save_user_ips(self):
+        user = User.objects.create(username='testuser')
+        now = timezone.now()
+
+        created = save_user_ips({(user.id, '127.0.0.1', 'Mozilla/5.0', '3.0.0', None): now})
+        self.assertEqual(len(created), 1)
+
+        user_ip = UserIpRecord.objects.get(user=user)
+        self.assertEqual(user_ip.browser.user_agent, 'Mozilla/5.0')
+        self.assertEqual(user_ip.extension.version, '3.0.0')
+
+        later = now + datetime.timedelta(minutes=5)
+        save_user_ips({(user.id, '127.0.0.1', 'Mozilla/5.0', None, None): later})
+        self.assertEqual(UserIpRecord.objects.filter(user=user).count(), 1)
+        self.assertEqual(UserIpRecord.objects.get(user=user).last_seen_at, later)
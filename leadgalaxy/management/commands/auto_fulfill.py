@@ -1,14 +1,17 @@
 import re
 import time
+from queue import Queue
+from threading import Lock, Thread
 
 import requests
 import arrow
 from simplejson import JSONDecodeError
 
+from django.db import connection
 from django.utils import timezone
 
 from metrics.tasks import add_number_metric
-from shopified_core.utils import http_exception_response, using_replica, last_executed
+from shopified_core.utils import http_exception_response, using_replica, last_executed_many
 from shopified_core.commands import DropifiedBaseCommand
 from leadgalaxy.models import ShopifyOrderTrack
 from shopify_orders.models import ShopifyOrderLog
@@ -28,6 +31,7 @@ class Command(DropifiedBaseCommand):
         parser.add_argument('--days', action='store', type=int, default=30, help='Fulfill orders created this number of days ago.')
         parser.add_argument('--max', action='store', type=int, default=500, help='Fulfill orders count limit')
         parser.add_argument('--uptime', action='store', type=float, default=8, help='Maximuim task uptime (minutes)')
+        parser.add_argument('--threads', action='store', type=int, default=8, help='Number of stores to fulfill at the same time')
 
         parser.add_argument('--new', action='store_true', help='Fulfill newest orders first')
         parser.add_argument('--progress', action='store_true', help='Show Reset Progress')
@@ -38,10 +42,10 @@ class Command(DropifiedBaseCommand):
         fulfill_store = options.get('store')
         fulfill_user = options.get('user')
         fulfill_max = options.get('max')
-        uptime = options.get('uptime')
         days = options.get('days')
 
         orders = using_replica(ShopifyOrderTrack, options['replica']) \
+            .select_related('store', 'store__user') \
             .filter(shopify_status='') \
             .exclude(source_tracking='') \
             .filter(hidden=False) \
@@ -63,63 +67,219 @@ class Command(DropifiedBaseCommand):
 
         self.write('Start Auto Fulfill')
 
+        if fulfill_max:
+            orders = orders[:fulfill_max]
+
+        orders = list(orders)
+
         if options['progress']:
-            self.progress_total(orders.count())
+            self.progress_total(len(orders))
 
-        counter = {
+        self.counter = {
             'fulfilled': 0,
-            'need_fulfill': 0,
+            'need_fulfill': len(orders),
             'skipped': 0,
         }
 
         self.store_countdown = {}
         self.store_locations = {}
         self.start_at = timezone.now()
+        self.deadline = self.start_at + timezone.timedelta(seconds=options['uptime'] * 60)
+        self.timed_out = False
+        self.lock = Lock()
+
+        stores = self.group_by_store(orders)
+
+        # Each store is handled by one thread at a time to keep its API calls in order
+        threads = min(options['threads'], len(stores))
+        if threads > 1:
+            q = Queue()
+            for store_orders in sorted(stores.values(), key=lambda i: len(i['fulfill']), reverse=True):
+                q.put(store_orders)
+
+            workers = []
+            for i in range(threads):
+                q.put(None)
+
+                t = Thread(target=self.fulfill_stores_worker, args=(q,))
+                t.daemon = True
+                t.start()
+                workers.append(t)
+
+            for t in workers:
+                t.join()
+        else:
+            for store_orders in stores.values():
+                self.fulfill_store_orders(store_orders)
+
+        if self.timed_out:
+            capture_message(
+                'Auto fulfill taking too long',
+                level="warning",
+                extra={'delta': (timezone.now() - self.start_at).total_seconds()})
+
+        took = max((timezone.now() - self.start_at).total_seconds(), 1)
+        counter = self.counter
+
+        self.write(f"Fulfilled Orders: {counter['fulfilled']} / {counter['need_fulfill']} - Skipped: {counter['skipped']}"
+                   f" - Stores: {len(stores)} - Took: {int(took)}s")
 
-        if fulfill_max:
-            orders = orders[:fulfill_max]
+        add_number_metric.apply_async(args=['order.auto.fulfilled', 'shopify', counter['fulfilled']], expires=500)
+        add_number_metric.apply_async(args=['order.auto.skipped', 'shopify', counter['skipped']], expires=500)
+        add_number_metric.apply_async(args=['order.auto.stores', 'shopify', len(stores)], expires=500)
+        add_number_metric.apply_async(args=['order.auto.per_minute', 'shopify', int(counter['fulfilled'] * 60 / took)], expires=500)
 
+        if self.timed_out:
+            add_number_metric.apply_async(args=['order.auto.backlog', 'shopify', counter['need_fulfill'] - counter['done']], expires=500)
+
+    def group_by_store(self, orders):
+        """ Group the tracks by store and drop the ones that were already tried in the last 6 hours """
+
+        self.counter['done'] = 0
+
+        # Tracks are marked as tried when fulfill_store_orders reaches them, not the ones left by the deadline
+        tried = last_executed_many([f'order-auto-fulfill4-{order.id}' for order in orders], 21600, save=False)
+        synced = last_executed_many([f'order-auto-fulfill-sync-{order.id}' for order in orders if f'order-auto-fulfill4-{order.id}' in tried], 21600)
+
+        stores = {}
         for order in orders:
-            if options['progress']:
-                self.progress_update(desc=order.store.shop)
+            store_orders = stores.setdefault(order.store_id, {'fulfill': [], 'sync': []})
+
+            if f'order-auto-fulfill4-{order.id}' in tried:
+                self.progress_write(f'Skipping Order #{order.id} for {order.store.shop}')
+                self.counter['skipped'] += 1
+                self.counter['done'] += 1
+
+                if f'order-auto-fulfill-sync-{order.id}' not in synced:
+                    store_orders['sync'].append(order)
+            else:
+                store_orders['fulfill'].append(order)
+
+        return stores
 
+    def fulfill_stores_worker(self, q):
+        try:
+            while True:
+                store_orders = q.get()
+                if store_orders is None:
+                    break
+
+                self.fulfill_store_orders(store_orders)
+        finally:
+            connection.close()
+
+    def fulfill_store_orders(self, store_orders):
+        for i in range(0, len(store_orders['sync']), 50):
             try:
-                counter['need_fulfill'] += 1
+                orders = store_orders['sync'][i:i + 50]
+                utils.get_tracking_orders(orders[0].store, orders)
+            except:
+                capture_exception()
 
-                if last_executed(f'order-auto-fulfill4-{order.id}', 21600):
-                    if not last_executed(f'order-auto-fulfill-sync-{order.id}', 21600):
-                        utils.get_tracking_orders(order.store, [order])
+        # Lines of the same order with the same tracking number are fulfilled together
+        order_lines = {}
+        for order in store_orders['fulfill']:
+            order_lines.setdefault((order.order_id, order.source_tracking), []).append(order)
 
-                    self.progress_write(f'Skipping Order #{order.id} for {order.store.shop}')
-                    counter['skipped'] += 1
-                    continue
+        for lines in order_lines.values():
+            if timezone.now() > self.deadline:
+                self.timed_out = True
+                break
 
-                if self.fulfill_order(order):
-                    order.shopify_status = 'fulfilled'
-                    order.auto_fulfilled = True
-                    order.save()
+            self.progress_update(len(lines), desc=lines[0].store.shop)
+
+            try:
+                last_executed_many([f'order-auto-fulfill4-{order.id}' for order in lines], 21600)
 
-                    counter['fulfilled'] += 1
-                    if not options['progress'] and counter['fulfilled'] % 50 == 0:
-                        self.write('Fulfill Progress: %d' % counter['fulfilled'])
+                if len(lines) > 1:
+                    fulfilled = self.fulfill_order_lines(lines)
+                else:
+                    fulfilled = None
 
-                    # process fulfilment fee
-                    process_sale_transaction_fee(order)
+                if fulfilled is None:
+                    fulfilled = [order for order in lines if self.fulfill_order(order)]
 
-                if (timezone.now() - self.start_at) > timezone.timedelta(seconds=uptime * 60):
-                    capture_message(
-                        'Auto fulfill taking too long',
-                        level="warning",
-                        extra={'delta': (timezone.now() - self.start_at).total_seconds()})
+                for order in fulfilled:
+                    self.order_fulfilled(order)
 
-                    break
             except:
                 capture_exception()
 
-        self.write(f"Fulfilled Orders: {counter['fulfilled']} / {counter['need_fulfill']} - Skipped: {counter['skipped']}")
+            with self.lock:
+                self.counter['done'] += len(lines)
 
-        add_number_metric.apply_async(args=['order.auto.fulfilled', 'shopify', counter['fulfilled']], expires=500)
-        add_number_metric.apply_async(args=['order.auto.skipped', 'shopify', counter['skipped']], expires=500)
+    def order_fulfilled(self, order):
+        order.shopify_status = 'fulfilled'
+        order.auto_fulfilled = True
+        order.save()
+
+        with self.lock:
+            self.counter['fulfilled'] += 1
+            if not self.progress_bar and self.counter['fulfilled'] % 50 == 0:
+                self.write('Fulfill Progress: %d' % self.counter['fulfilled'])
+
+        # process fulfilment fee
+        process_sale_transaction_fee(order)
+
+    def fulfill_order_lines(self, orders):
+        """ Fulfill lines of the same order in one Shopify API call
+
+        Returns:
+            list: the fulfilled orders, or None when the lines should be fulfilled one by one
+        """
+
+        store = orders[0].store
+        if store.need_reauthorization():
+            return None
+
+        user_config = store.user.get_config()
+
+        api_data = None
+        lines = []
+        fulfilled_lines = []  # Saved as fulfilled by order_fulfillment_saved once the API call succeeds
+        try:
+            for order in orders:
+                data, line = utils.order_track_fulfillment(
+                    order_track=order,
+                    user_config=user_config,
+                    return_line=True,
+                    fulfilled_lines=fulfilled_lines,
+                    location_id=self.store_locations.get(store.id))
+
+                lines.append(line)
+
+                if api_data is None:
+                    api_data = data
+                    continue
+
+                if data['fulfillment']['location_id'] != api_data['fulfillment']['location_id']:
+                    return None
+
+                fulfillment_orders = {i['fulfillment_order_id']: i for i in api_data['fulfillment']['line_items_by_fulfillment_order']}
+                for item in data['fulfillment']['line_items_by_fulfillment_order']:
+                    if item['fulfillment_order_id'] in fulfillment_orders:
+                        fulfillment_orders[item['fulfillment_order_id']]['fulfillment_order_line_items'].extend(
+                            item['fulfillment_order_line_items'])
+                    else:
+                        api_data['fulfillment']['line_items_by_fulfillment_order'].append(item)
+
+                # Notify the customer when the whole order is fulfilled by this call
+                api_data['fulfillment']['notify_customer'] = \
+                    api_data['fulfillment'].get('notify_customer') or data['fulfillment'].get('notify_customer')
+
+            rep = store.request.post(url=store.api('fulfillments'), json=api_data)
+            if not rep.ok or 'fulfillment' not in rep.json():
+                # Let fulfill_order handle the errors of each line
+                return None
+
+        except:
+            capture_exception(level='warning')
+            return None
+
+        for order, line in zip(orders, lines):
+            self.order_fulfillment_saved(order, line, api_data)
+
+        return orders
 
     def fulfill_order(self, order):
         store = order.store
@@ -168,15 +328,14 @@ class Command(DropifiedBaseCommand):
                 continue
             except requests.exceptions.HTTPError as e:
                 if e.response.status_code == 429:
-                    # Wait and retry
-                    self.write('Sleep for 5 sec')
-                    time.sleep(5)
+                    # The store bucket is still full, wait as long as Shopify asks before trying again
+                    time.sleep(float(e.response.headers.get('Retry-After') or 2))
                     continue
 
                 elif e.response.status_code in [422, 404]:
                     if e.response.status_code == 404:
                         if check_order_exist:
-                            r = requests.get(store.api(f'orders/{order.order_id}'))
+                            r = store.request.get(store.api(f'orders/{order.order_id}'))
                             if r.status_code == 404:
                                 self.log_fulfill_error(order, 'Order Not Found')
 
@@ -236,7 +395,7 @@ class Command(DropifiedBaseCommand):
                         return False
 
                     elif 'your shop does not have the \'oberlo\' fulfillment service enabled' in rep.text.lower():
-                        r = requests.post(
+                        r = store.request.post(
                             url=store.api('fulfillment_services'),
                             json={
                                 "fulfillment_service": {
@@ -258,7 +417,7 @@ class Command(DropifiedBaseCommand):
                                 'response': r.text
                             }, level='warning')
 
-                            r = requests.post(
+                            r = store.request.post(
                                 url=store.api('fulfillment_services'),
                                 json={
                                     "fulfillment_service": {
@@ -367,30 +526,36 @@ class Command(DropifiedBaseCommand):
                 tries -= 1
 
         if fulfilled:
-            if user.get_config('aliexpress_as_notes', True):
-                note = "Auto Fulfilled by Dropified (Item #{} - Confirmation Email: {})".format(
-                    order.line_id, 'Yes' if api_data['fulfillment'].get('notify_customer') else 'No')
+            self.order_fulfillment_saved(order, line, api_data)
 
-                countdown = self.store_countdown.get(store.id, 30)
-                tasks.add_ordered_note.apply_async(args=[store.id, order.order_id, note], countdown=countdown)
+        return fulfilled
+
+    def order_fulfillment_saved(self, order, line, api_data):
+        store = order.store
+
+        if store.user.get_config('aliexpress_as_notes', True):
+            note = "Auto Fulfilled by Dropified (Item #{} - Confirmation Email: {})".format(
+                order.line_id, 'Yes' if api_data['fulfillment'].get('notify_customer') else 'No')
 
+            with self.lock:
+                countdown = self.store_countdown.get(store.id, 30)
                 self.store_countdown[store.id] = countdown + 5
 
-            if line:
-                line.fulfillment_status = 'fulfilled'
-                line.save()
+            tasks.add_ordered_note.apply_async(args=[store.id, order.order_id, note], countdown=countdown)
 
-            ShopifyOrderLog.objects.update_order_log(
-                store=store,
-                user=None,
-                log='Marked as fulfilled By Dropified',
-                level='success',
-                icon='check',
-                order_id=order.order_id,
-                line_id=order.line_id
-            )
+        if line:
+            line.fulfillment_status = 'fulfilled'
+            line.save()
 
-        return fulfilled
+        ShopifyOrderLog.objects.update_order_log(
+            store=store,
+            user=None,
+            log='Marked as fulfilled By Dropified',
+            level='success',
+            icon='check',
+            order_id=order.order_id,
+            line_id=order.line_id
+        )
 
     def log_fulfill_error(self, order, msg, shopify_api=True):
         if shopify_api:
@@ -1,8 +1,12 @@
+from django.core.cache import cache
+from django.db import connection
 from django.utils import timezone
 
 import arrow
 import json
 import time
+from queue import Queue
+from threading import Lock, Thread
 
 from aliexpress_core.models import AliexpressAccount
 from shopified_core.commands import DropifiedBaseCommand
@@ -19,8 +23,14 @@ class Command(DropifiedBaseCommand):
     def add_arguments(self, parser):
         parser.add_argument('--store', action='store', type=int, help='Fulfill orders for the given store')
         parser.add_argument('--days', action='store', type=int, default=30, help='Auto Track orders created this number of days ago.')
-        parser.add_argument('--max', action='store', type=int, default=500, help='Orders track count limit')
+        parser.add_argument('--max', action='store', type=int, default=500,
+                            help='Orders track count limit, tracks of the same Aliexpress order are looked up together')
         parser.add_argument('--uptime', action='store', type=float, default=8, help='Maximuim task uptime (minutes)')
+        parser.add_argument('--threads', action='store', type=int, default=8, help='Number of Aliexpress accounts to check at the same time')
+        parser.add_argument('--account-rate', dest='account_rate', action='store', type=float, default=5,
+                            help='Maximum Aliexpress API calls per second for each account')
+        parser.add_argument('--recheck', action='store', type=float, default=60,
+                            help='Minutes to wait before checking the same Aliexpress order again')
 
         parser.add_argument('--new', action='store_true', help='Auro track newest orders first')
         parser.add_argument('--progress', action='store_true', help='Show Reset Progress')
@@ -28,20 +38,23 @@ class Command(DropifiedBaseCommand):
 
     def start_command(self, *args, **options):
         order_store = options.get('store')
-        # track_max = options.get('max')
-        # uptime = options.get('uptime')
+        track_max = options.get('max')
         days = options.get('days')
 
-        user_ids = AliexpressAccount.objects.all().values_list('user', flat=True).distinct()
+        accounts = {}
+        for account in AliexpressAccount.objects.only('id', 'user_id').order_by('-id'):
+            # Same account as get_order_info_via_api: the first one connected by the user
+            accounts[account.user_id] = account
 
-        orders = ShopifyOrderTrack.objects.filter(user__in=user_ids) \
+        orders = ShopifyOrderTrack.objects.filter(user__in=list(accounts.keys())) \
+            .select_related('store', 'store__user') \
             .filter(shopify_status='') \
             .filter(source_tracking='') \
             .filter(hidden=False) \
             .filter(created_at__gte=arrow.now().replace(days=-days).datetime) \
             .filter(store__is_active=True) \
             .filter(store__auto_fulfill='enable') \
-            .order_by('-created_at')
+            .order_by('-created_at' if options['new'] else 'created_at')
 
         if order_store is not None:
             orders = orders.filter(store=order_store)
@@ -50,60 +63,191 @@ class Command(DropifiedBaseCommand):
             self.write(f'Orders to auto track {orders.count()}')
             return
 
-        self.write(f'Started Auto tracking Shopify orders with count {orders.count()} on {arrow.now().datetime}')
-
-        if options['progress']:
-            self.progress_total(orders.count())
-
-        if options['progress']:
-            self.progress_total(orders.count())
+        self.start_at = timezone.now()
+        self.deadline = self.start_at + timezone.timedelta(seconds=options['uptime'] * 60)
+        self.recheck_after = options['recheck'] * 60
+        self.account_interval = 1.0 / options['account_rate'] if options['account_rate'] > 0 else 0
+        self.lock = Lock()
+        self.timed_out = False
 
-        counter = {
+        self.counter = {
             'tracked': 0,
             'need_tracking': 0,
+            'lookups': 0,
             'skipped': 0,
             'status_update': 0
         }
 
-        self.store_countdown = {}
-        self.start_at = timezone.now()
+        lookups = self.group_lookups(orders, accounts, track_max)
+
+        self.write(f"Started Auto tracking {self.counter['need_tracking']} Shopify orders with {len(lookups)} lookups on {arrow.now().datetime}")
+
+        if options['progress']:
+            self.progress_total(len(lookups))
+
+        # Lookups of the same Aliexpress account are done by one thread to respect the account rate limit
+        account_lookups = {}
+        for key, orders in lookups.items():
+            account_lookups.setdefault(key[0], []).append((key, orders))
+
+        threads = min(options['threads'], len(account_lookups))
+        if threads > 1:
+            q = Queue()
+            for account_id in sorted(account_lookups, key=lambda i: len(account_lookups[i]), reverse=True):
+                q.put(account_lookups[account_id])
+
+            workers = []
+            for i in range(threads):
+                q.put(None)
+
+                t = Thread(target=self.track_accounts_worker, args=(q,))
+                t.daemon = True
+                t.start()
+                workers.append(t)
+
+            for t in workers:
+                t.join()
+        else:
+            for items in account_lookups.values():
+                self.track_account_orders(items)
+
+        if self.timed_out:
+            self.write(f"Uptime limit reached after {self.counter['lookups']} lookups", self.style.WARNING)
+
+        self.write(f"Tracked Orders API:{self.counter['tracked']}/{self.counter['need_tracking']}"
+                   f"- Lookups: {self.counter['lookups']} - Skipped: {self.counter['skipped']} - Status Change: {self.counter['status_update']}")
+
+    def status_key(self, account_id, source_id):
+        return f'auto_track_status_{account_id}_{source_id}'
+
+    def group_lookups(self, orders, accounts, track_max=None):
+        """ Group tracks by (Aliexpress account, source_id), each group needs only one Aliexpress API call
+
+        Groups looked up in the last `--recheck` minutes are skipped, `track_max` limits the number of tracks
+        """
+
+        store_accounts = {}
+        lookups = {}
+        for order in orders.iterator():
+            if not order.source_id:
+                continue
+
+            if order.store_id not in store_accounts:
+                store_accounts[order.store_id] = accounts.get(order.store.user.models_user.id)
+
+            account = store_accounts[order.store_id]
+            if account is None:
+                continue
+
+            self.counter['need_tracking'] += 1
+            lookups.setdefault((account.id, order.source_id), []).append(order)
+
+        last_status = cache.get_many([self.status_key(*key) for key in lookups])
+        self.last_status = {key: last_status.get(self.status_key(*key)) for key in lookups}
+
+        now = time.time()
+        for key in list(lookups.keys()):
+            status = self.last_status[key]
+            if status and now - status['checked_at'] < self.recheck_after:
+                self.counter['skipped'] += len(lookups.pop(key))
+
+        if track_max:
+            tracks_count = 0
+            for key in list(lookups.keys()):
+                if tracks_count >= track_max:
+                    del lookups[key]
+                else:
+                    tracks_count += len(lookups[key])
+
+        return lookups
+
+    def track_accounts_worker(self, q):
+        try:
+            while True:
+                items = q.get()
+                if items is None:
+                    break
+
+                self.track_account_orders(items)
+        finally:
+            connection.close()
+
+    def track_account_orders(self, items):
+        last_lookup = 0
+        for key, orders in items:
+            if timezone.now() > self.deadline:
+                self.timed_out = True
+                break
+
+            wait = self.account_interval - (time.time() - last_lookup)
+            if wait > 0:
+                time.sleep(wait)
+
+            last_lookup = time.time()
 
-        for order in orders:
             try:
-                counter['need_tracking'] += 1
-                user = order.store.user
-                data = shopify_orders_tasks.get_order_info_via_api(order, order.source_id, order.store.id, 'shopify', user)
-                time.sleep(.1)
-                if isinstance(data, str):
-                    self.write(f"Skipping tracking orders for user {user}: {data}")
-                    continue
-                if data and not data.get('error_msg'):
-                    new_tracking_number = (data.get('tracking_number') and data.get('tracking_number') not in order.source_tracking)
-                    if new_tracking_number:
-                        self.write(f"Adding tracking number to {order.store} with order id {order.order_id}")
-                        self.add_tracking_number_to_order(order, user, data)
-                        counter['tracked'] += 1
-                    else:
-                        self.write(f"No new tracking number found for {order.order_id} for store {order.store}")
-                        if data.get('status') != order.source_status:  # Save the new Aliexpress Order status
-                            order.source_status = data.get('status')
-                            order.save()
-                            self.write(f"Changed Status to {data.get('status')} for {order.store} with order id {order.order_id}-{order.line_id}")
-                            counter['status_update'] += 1
-                            self.addShopifyOrderLogs(order, user, ' New Order Status saved via Quick Tracking')
-                        else:
-                            counter['skipped'] += 1
-                else:  # No data would mean error querying Aliexpress API
-                    self.write(f"Skipping tracking order with Id {order.order_id} for store {order.store} due to an error - {data.get('error_msg')}")
-                    counter['skipped'] += 1
-                    continue
-                if not options['progress'] and counter['tracked'] % 50 == 0:
-                    self.write('Tracking Progress: %d' % counter['tracked'])
+                self.track_orders(key, orders)
             except Exception as e:
                 capture_exception(e)
 
-        self.write(f"Tracked Orders API:{counter['tracked']}/{counter['need_tracking']}"
-                   f"- Skipped: {counter['skipped']} - Status Change: {counter['status_update']}")
+            self.progress_update()
+
+    def track_orders(self, key, orders):
+        order = orders[0]
+        user = order.store.user
+
+        data = shopify_orders_tasks.get_order_info_via_api(order, order.source_id, order.store_id, 'shopify', user)
+
+        with self.lock:
+            self.counter['lookups'] += 1
+
+        if isinstance(data, str):
+            self.write(f"Skipping tracking orders for user {user}: {data}")
+            return
+
+        if not data or data.get('error_msg'):  # No data would mean error querying Aliexpress API
+            self.write(f"Skipping tracking order with Id {order.order_id} for store {order.store} due to an error - {(data or {}).get('error_msg')}")
+            with self.lock:
+                self.counter['skipped'] += len(orders)
+            return
+
+        # Tracks already saved with the same result in a previous lookup are not changed
+        previous = self.last_status.get(key)
+        unchanged = previous and previous['status'] == data.get('status') and previous['tracking_number'] == data.get('tracking_number')
+
+        cache.set(self.status_key(*key), {
+            'status': data.get('status'),
+            'tracking_number': data.get('tracking_number'),
+            'checked_at': time.time(),
+        }, timeout=86400 * 7)
+
+        for order in orders:
+            if unchanged and order.source_status == data.get('status'):
+                with self.lock:
+                    self.counter['skipped'] += 1
+                continue
+
+            new_tracking_number = (data.get('tracking_number') and data.get('tracking_number') not in order.source_tracking)
+            if new_tracking_number:
+                self.write(f"Adding tracking number to {order.store} with order id {order.order_id}")
+                self.add_tracking_number_to_order(order, user, data)
+
+                with self.lock:
+                    self.counter['tracked'] += 1
+                    if not self.progress_bar and self.counter['tracked'] % 50 == 0:
+                        self.write('Tracking Progress: %d' % self.counter['tracked'])
+
+            elif data.get('status') != order.source_status:  # Save the new Aliexpress Order status
+                order.source_status = data.get('status')
+                order.save()
+                self.write(f"Changed Status to {data.get('status')} for {order.store} with order id {order.order_id}-{order.line_id}")
+                self.addShopifyOrderLogs(order, user, ' New Order Status saved via Quick Tracking')
+
+                with self.lock:
+                    self.counter['status_update'] += 1
+            else:
+                with self.lock:
+                    self.counter['skipped'] += 1
 
     def add_tracking_number_to_order(self, order, user, data):
         # models_user = user.models_user
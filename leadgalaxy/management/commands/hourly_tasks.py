@@ -11,6 +11,7 @@ from product_feed.feed import (
     generate_woo_product_feed,
     generate_gkart_product_feed,
     generate_bigcommerce_product_feed,
+    generate_product_feeds,
 )
 from product_feed.models import (
     FeedStatus,
@@ -25,12 +26,16 @@ from shopified_core.models_utils import get_store_model
 
 class Command(DropifiedBaseCommand):
 
+    def add_arguments(self, parser):
+        parser.add_argument('--feed-threads', dest='feed_threads', type=int, default=4,
+                            help='Number of product feeds to generate at the same time')
+
     def start_command(self, *args, **options):
         plan = GroupPlan.objects.get(slug='subuser-plan')
         UserProfile.objects.exclude(subuser_parent=None).exclude(plan=plan).update(plan=plan)
 
         for store_type in ['shopify', 'chq', 'woo', 'gkart', 'bigcommerce']:
-            self.generate_product_feeds(store_type=store_type, verbosity=options['verbosity'])
+            self.generate_product_feeds(store_type=store_type, verbosity=options['verbosity'], threads=options['feed_threads'])
             self.record_metrics(store_type)
 
     def get_feed_status_model(self, store_type=''):
@@ -57,7 +62,7 @@ class Command(DropifiedBaseCommand):
         elif store_type == 'bigcommerce':
             return generate_bigcommerce_product_feed
 
-    def generate_product_feeds(self, store_type='', verbosity=1):
+    def generate_product_feeds(self, store_type='', verbosity=1, threads=4):
         FeedStatusModel = self.get_feed_status_model(store_type)
         gen_product_feed = self.get_generate_product_feed(store_type)
 
@@ -67,11 +72,11 @@ class Command(DropifiedBaseCommand):
         if verbosity >= 1:
             self.stdout.write(f'Generate {store_type} {len(statuses)} feeds')
 
-        for status in statuses:
+        def feed_queued(status):
             if verbosity >= 2:
                 self.stdout.write(f'{store_type} Store Feed: {status.store.shop}')
 
-            gen_product_feed(status, nocache=True)
+        generate_product_feeds(statuses, gen_product_feed, nocache=True, threads=threads, callback=feed_queued)
 
     def record_metrics(self, store_type):
         add_number_metric.apply_async(
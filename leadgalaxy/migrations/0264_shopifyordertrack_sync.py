@@ -0,0 +1,17 @@
+# Generated by Django 3.2.14 on 2026-10-18 10:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leadgalaxy', '0263_auto_20221116_1551'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='shopifyordertrack',
+            index=models.Index(condition=models.Q(('hidden', False), ('source_tracking', '')), fields=['store', 'created_at'], name='shopifyordertrack_sync'),
+        ),
+    ]
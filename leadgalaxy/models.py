@@ -1,4 +1,5 @@
 import arrow
+import copy
 import hashlib
 import re
 import requests
@@ -18,6 +19,7 @@ from django.utils.functional import cached_property
 from lib.exceptions import capture_exception
 from data_store.models import DataStore
 from leadgalaxy.graphql import ShopifyGraphQL
+from leadgalaxy.shopify import ShopifyClient
 from product_alerts.utils import monitor_product
 from shopified_core.decorators import add_to_class
 from shopified_core.models import BoardBase, OrderTrackBase, ProductBase, StoreBase, SupplierBase, UserUploadBase
@@ -135,6 +137,23 @@ PRICE_MARKUP_TYPES = (
     ('fixed_amount', 'Set to fixed amount'),
 )
 
+PERMISSIONS_VERSION_KEY = 'user_permissions_version'
+
+
+def get_permissions_version():
+    version = cache.get(PERMISSIONS_VERSION_KEY)
+    if version is None:
+        version = get_random_string(8)
+        cache.set(PERMISSIONS_VERSION_KEY, version, timeout=None)
+
+    return version
+
+
+def bump_permissions_version():
+    """ Invalidate the cached permissions of all users """
+
+    cache.set(PERMISSIONS_VERSION_KEY, get_random_string(8), timeout=None)
+
 
 class UserProfile(models.Model):
     user = models.OneToOneField(User, related_name='profile', on_delete=models.CASCADE)
@@ -659,25 +678,59 @@ class UserProfile(models.Model):
             return self.warehouse_account == item.shipstation_account
         return True
 
+    @property
+    def permissions_cache_key(self):
+        return f'user_permissions_{self.id}_{self.plan_id}_{get_permissions_version()}'
+
+    @cached_property
+    def compiled_perms(self):
+        """ Return (permissions, subuser_codenames) frozensets
+
+        Permissions are the lower-cased plan, bundles and addons permissions, subuser_codenames are
+        the subuser permissions codenames. Both are cached until the signals in leadgalaxy.signals
+        clear the profile cache or bump the permissions version
+        """
+
+        perms = cache.get(self.permissions_cache_key)
+        if perms is None:
+            perms = {
+                'perms': [i.lower() for i in self.get_perms],
+                'subuser': [],
+            }
+
+            if self.is_subuser:
+                perms['subuser'] = list(set(self.subuser_permissions.values_list('codename', flat=True)))
+
+            cache.set(self.permissions_cache_key, perms, timeout=86400)
+
+        return frozenset(perms['perms']), frozenset(perms['subuser'])
+
+    def clear_permissions_cache(self):
+        cache.delete(self.permissions_cache_key)
+
+        for name in ['compiled_perms', 'get_perms']:
+            self.__dict__.pop(name, None)
+
     def can(self, perm_name, store=None):
         if perm_name[-4:] == '.sub':
             codename = perm_name[:-4]
+            if store is None and self.is_subuser:
+                # Global subuser permission
+                return codename in self.compiled_perms[1]
+
             return self.has_subuser_permission(codename, store)
 
         if self.is_subuser:
             return self.subuser_parent.profile.can(perm_name)
 
+        perms = self.compiled_perms[0]
+
         perm_name = perm_name.lower()
-        view_perm = perm_name.replace('.use', '.view')
-        use_perm = perm_name.replace('.view', '.use')
-        for i in self.get_perms:
-            i = i.lower()
-            if perm_name.endswith('.view'):
-                if i == view_perm or i == use_perm:
-                    return True
-            else:
-                if i == perm_name:
-                    return True
+        if perm_name.endswith('.view'):
+            if perm_name in perms or perm_name.replace('.view', '.use') in perms:
+                return True
+        elif perm_name in perms:
+            return True
 
         return self.user.is_superuser
 
@@ -731,7 +784,7 @@ class UserProfile(models.Model):
 
     @property
     def is_subuser(self):
-        return self.subuser_parent is not None
+        return self.subuser_parent_id is not None
 
     def has_subuser_permission(self, codename, store=None):
         if not self.is_subuser:
@@ -1308,8 +1361,14 @@ class ShopifyStore(StoreBase):
     def gql(self):
         return ShopifyGraphQL(self)
 
+    @cached_property
+    def request(self):
+        """ Rate limited Shopify API client, usage: store.request.get(store.api('orders')) """
+
+        return ShopifyClient(self)
+
     def get_order(self, order_id):
-        response = requests.get(url=self.api('orders', order_id))
+        response = self.request.get(url=self.api('orders', order_id))
         order = response.json()['order']
 
         from leadgalaxy.utils import shopify_customer_address
@@ -1391,7 +1450,7 @@ class ShopifyStore(StoreBase):
             params['created_at_min'] = arrow.utcnow().replace(days=-abs(days)).isoformat()
 
         try:
-            return requests.get(
+            return self.request.get(
                 url=self.api('orders/count'),
                 params=params
             ).json().get('count', 0)
@@ -1412,7 +1471,7 @@ class ShopifyStore(StoreBase):
 
     @cached_property
     def get_info(self):
-        rep = requests.get(url=self.api('shop'))
+        rep = self.request.get(url=self.api('shop'))
         rep = rep.json()
 
         if 'shop' in rep:
@@ -1504,7 +1563,7 @@ class ShopifyStore(StoreBase):
             self.save()
             return self.primary_location
 
-        response = requests.get(self.api('locations'))
+        response = self.request.get(self.api('locations'))
         locations = response.json()['locations']
         primary_location = locations[0].get('id')
 
@@ -1527,7 +1586,7 @@ class ShopifyStore(StoreBase):
             }
         }
 
-        rep = requests.post(
+        rep = self.request.post(
             url=self.api('fulfillment_services'),
             json=api_data
         )
@@ -1540,12 +1599,12 @@ class ShopifyStore(StoreBase):
             return self.dropified_location
         else:
             if "You already have a location with this name" in rep.text:
-                rep = requests.get(url=self.api('fulfillment_services'))
+                rep = self.request.get(url=self.api('fulfillment_services'))
                 rep.raise_for_status()
 
                 for service in rep.json()['fulfillment_services']:
                     if service['name'] == 'Dropified':
-                        rep = requests.put(
+                        rep = self.request.put(
                             url=self.api('fulfillment_services', service['id']),
                             json=api_data
                         )
@@ -1566,7 +1625,7 @@ class ShopifyStore(StoreBase):
             locations = cache.get(locations_key)
             if locations is None:
 
-                rep = requests.get(self.api('locations'))
+                rep = self.request.get(self.api('locations'))
                 rep.raise_for_status()
 
                 locations = rep.json()['locations']
@@ -1694,29 +1753,16 @@ class ShopifyProduct(ProductBase):
 
         data = json.loads(self.data)
 
-        self.title = data.get('title', '')
-        self.tags = data.get('tags', '')[:1024]
-        self.product_type = data.get('type', '')[:254]
-
-        try:
-            self.price = '%.02f' % float(data['price'])
-        except:
-            self.price = 0.0
+        self.update_list_columns(data)
 
         super(ShopifyProduct, self).save(*args, **kwargs)
 
     def get_config(self):
-        try:
-            return json.loads(self.config)
-        except:
-            return {}
+        return self.config_json
 
     @property
     def parsed(self):
-        try:
-            return json.loads(self.data)
-        except:
-            return {}
+        return self.data_json
 
     @property
     def source_id(self):
@@ -1764,16 +1810,10 @@ class ShopifyProduct(ProductBase):
             return None
 
     def get_product(self):
-        try:
-            return json.loads(self.data)['title']
-        except:
-            return None
+        return self.data_json.get('title')
 
     def get_images(self):
-        try:
-            return json.loads(self.data)['images']
-        except:
-            return []
+        return self.data_json.get('images', [])
 
     def get_image(self):
         images = self.get_images()
@@ -1781,8 +1821,7 @@ class ShopifyProduct(ProductBase):
 
     def get_original_info(self, url=None):
         if not url:
-            data = json.loads(self.data)
-            url = data.get('original_url')
+            url = self.data_json.get('original_url')
 
         if url:
             # Extract domain name
@@ -1824,8 +1863,7 @@ class ShopifyProduct(ProductBase):
 
             return info
 
-        data = json.loads(self.data)
-        return data.get('store')
+        return self.data_json.get('store')
 
     def set_original_url(self, url, commit=False):
         data = json.loads(self.data)
@@ -1882,15 +1920,11 @@ class ShopifyProduct(ProductBase):
             else:
                 supplier = self.default_supplier
 
-        try:
-            if supplier and supplier.variants_map:
-                mapping = json.loads(supplier.variants_map)
-            elif self.variants_map:
-                mapping = json.loads(self.variants_map)
-            else:
-                mapping = {}
-        except:
-            mapping = {}
+        # Copies of the cached mapping, it's changed by the callers
+        if supplier and supplier.variants_map:
+            mapping = copy.deepcopy(supplier.variants_map_json)
+        else:
+            mapping = copy.deepcopy(self.variants_map_json)
 
         if name:
             mapping = mapping.get(str(name), default)
@@ -2009,14 +2043,7 @@ class ShopifyProduct(ProductBase):
             self.save()
 
     def get_suppliers_mapping(self, name=None, default=None):
-        mapping = {}
-        try:
-            if self.supplier_map:
-                mapping = json.loads(self.supplier_map)
-            else:
-                mapping = {}
-        except:
-            mapping = {}
+        mapping = copy.deepcopy(self.supplier_map_json)
 
         if name:
             mapping = mapping.get(str(name), default)
@@ -2089,14 +2116,7 @@ class ShopifyProduct(ProductBase):
             self.save()
 
     def get_shipping_mapping(self, supplier=None, variant=None, default=None):
-        mapping = {}
-        try:
-            if self.shipping_map:
-                mapping = json.loads(self.shipping_map)
-            else:
-                mapping = {}
-        except:
-            mapping = {}
+        mapping = copy.deepcopy(self.shipping_map_json)
 
         if supplier and variant:
             mapping = mapping.get('{}_{}'.format(supplier, variant), default)
@@ -2136,11 +2156,11 @@ class ShopifyProduct(ProductBase):
 
     def get_inventory_item_by_variant(self, variant_id, variant=None, ensure_tracking=True):
         if variant is None:
-            response = requests.get(url=self.store.api('variants', variant_id))
+            response = self.store.request.get(url=self.store.api('variants', variant_id))
             variant = response.json()['variant']
 
         if ensure_tracking and variant['inventory_management'] != 'shopify':
-            requests.put(
+            self.store.request.put(
                 url=self.store.api('inventory_items', variant['inventory_item_id']),
                 json={
                     "inventory_item": {
@@ -2158,7 +2178,7 @@ class ShopifyProduct(ProductBase):
 
             inventory_item_id = self.get_inventory_item_by_variant(variant_id, variant=variant)
 
-        return requests.post(
+        return self.store.request.post(
             url=self.store.api('inventory_levels/set'),
             json={
                 'location_id': self.store.get_dropified_location(),
@@ -2167,6 +2187,55 @@ class ShopifyProduct(ProductBase):
             }
         )
 
+    def set_variants_quantity(self, variants_quantity):
+        """ Set the inventory of many variants, only levels that changed are sent to Shopify
+
+        Args:
+            variants_quantity: list of (Shopify variant dict, quantity) tuples
+
+        Returns:
+            int: number of updated inventory levels
+        """
+
+        quantities = {}
+        for variant, quantity in variants_quantity:
+            quantities[self.get_inventory_item_by_variant(variant['id'], variant=variant)] = quantity
+
+        location_id = self.store.get_dropified_location()
+        inventory_items = list(quantities.keys())
+
+        current = {}
+        for i in range(0, len(inventory_items), 50):
+            response = self.store.request.get(
+                url=self.store.api('inventory_levels'),
+                params={
+                    'inventory_item_ids': ','.join([str(item) for item in inventory_items[i:i + 50]]),
+                    'location_ids': location_id
+                }
+            )
+            response.raise_for_status()
+
+            for level in response.json()['inventory_levels']:
+                current[level['inventory_item_id']] = level.get('available')
+
+        updated = 0
+        for inventory_item_id, quantity in quantities.items():
+            if inventory_item_id in current and current[inventory_item_id] == quantity:
+                continue
+
+            self.store.request.post(
+                url=self.store.api('inventory_levels/set'),
+                json={
+                    'location_id': location_id,
+                    'inventory_item_id': inventory_item_id,
+                    'available': quantity,
+                }
+            ).raise_for_status()
+
+            updated += 1
+
+        return updated
+
     def get_variant_quantity(self, variant_id=None, inventory_item_id=None, variant=None):
         if inventory_item_id is None:
             if variant_id is None:
@@ -2174,7 +2243,7 @@ class ShopifyProduct(ProductBase):
 
             inventory_item_id = self.get_inventory_item_by_variant(variant_id, variant=variant, ensure_tracking=False)
 
-        response = requests.get(
+        response = self.store.request.get(
             url=self.store.api('inventory_levels'),
             params={
                 'inventory_item_ids': inventory_item_id,
@@ -2395,7 +2464,7 @@ class ShopifyWebhook(models.Model):
 
         endpoint = self.store.api('webhooks', self.shopify_id)
         try:
-            requests.delete(endpoint)
+            self.store.request.delete(endpoint)
         except Exception as e:
             print('WEBHOOK: detach excption', repr(e))
             return None
@@ -1,4 +1,160 @@
+import time
+import threading
+
 import requests
+from requests.adapters import HTTPAdapter
+from django_redis import get_redis_connection
+
+from lib.exceptions import capture_exception
+
+# Reserve one leak interval in the store bucket, returns how long the caller should wait before sending its request
+SHOPIFY_BUCKET_RESERVE = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local burst = tonumber(ARGV[3])
+local tat = tonumber(redis.call('GET', KEYS[1]) or now)
+if tat < now then
+    tat = now
+end
+tat = tat + interval
+redis.call('SET', KEYS[1], tostring(tat), 'PX', math.ceil((tat - now) * 1000) + 1000)
+return tostring(math.max(tat - now - burst, 0))
+"""
+
+# Move the bucket level forward when Shopify reports more calls than we counted (calls made outside of ShopifyClient)
+SHOPIFY_BUCKET_SYNC = """
+local now = tonumber(ARGV[1])
+local tat = tonumber(ARGV[2])
+local current = tonumber(redis.call('GET', KEYS[1]) or 0)
+if current < tat then
+    redis.call('SET', KEYS[1], tostring(tat), 'PX', math.ceil((tat - now) * 1000) + 1000)
+end
+return 1
+"""
+
+_sessions = threading.local()
+
+
+def get_shopify_session():
+    """ Keep-alive session shared by all Shopify API calls made from the current thread """
+
+    session = getattr(_sessions, 'session', None)
+    if session is None:
+        session = requests.Session()
+        session.mount('https://', HTTPAdapter(pool_connections=100, pool_maxsize=10))
+
+        _sessions.session = session
+
+    return session
+
+
+class ShopifyClient:
+    """ HTTP client for the Shopify REST API of one store
+
+    Requests use a pooled keep-alive session and share a leaky bucket stored in Redis
+    with every other worker calling the same store, mirroring Shopify's own bucket:
+    `bucket_size` calls (read from X-Shopify-Shop-Api-Call-Limit) leaking `bucket_size / 20` calls per second.
+    429 responses are retried after the Retry-After delay.
+    """
+
+    max_retries = 3
+    bucket_margin = 4  # Calls kept free for requests not made through this client
+    default_bucket_size = 40
+
+    _bucket_sizes = {}
+    _scripts = {}
+
+    def __init__(self, store, rate_limit=True):
+        self.store = store
+        self.rate_limit = rate_limit
+
+    @property
+    def bucket_key(self):
+        return f'shopify_api_bucket_{self.store.id}'
+
+    @property
+    def bucket_size(self):
+        return self._bucket_sizes.get(self.store.id, self.default_bucket_size)
+
+    @property
+    def leak_interval(self):
+        return 20.0 / self.bucket_size
+
+    def _script(self, name, source):
+        if name not in self._scripts:
+            self._scripts[name] = get_redis_connection('default').register_script(source)
+
+        return self._scripts[name]
+
+    def _wait_for_bucket(self):
+        if not self.rate_limit or not self.store.id:
+            return
+
+        try:
+            burst = (self.bucket_size - self.bucket_margin) * self.leak_interval
+            wait = float(self._script('reserve', SHOPIFY_BUCKET_RESERVE)(
+                keys=[self.bucket_key],
+                args=[time.time(), self.leak_interval, burst]))
+        except:
+            # Redis is not available, Shopify will let us know with a 429 when we go over the limit
+            capture_exception(level='warning')
+            return
+
+        if wait > 0:
+            time.sleep(wait)
+
+    def _sync_bucket(self, response):
+        try:
+            used, size = [int(i) for i in response.headers['X-Shopify-Shop-Api-Call-Limit'].split('/')]
+        except (KeyError, ValueError):
+            return
+
+        self._bucket_sizes[self.store.id] = size
+
+        if not self.rate_limit or not self.store.id:
+            return
+
+        now = time.time()
+        try:
+            self._script('sync', SHOPIFY_BUCKET_SYNC)(
+                keys=[self.bucket_key],
+                args=[now, now + used * self.leak_interval])
+        except:
+            capture_exception(level='warning')
+
+    def request(self, method, url, **kwargs):
+        session = get_shopify_session()
+
+        retries = self.max_retries
+        while True:
+            self._wait_for_bucket()
+
+            response = session.request(method, url, **kwargs)
+            self._sync_bucket(response)
+
+            if response.status_code != 429 or not retries:
+                return response
+
+            retries -= 1
+
+            try:
+                retry_after = float(response.headers.get('Retry-After') or 2)
+            except ValueError:
+                retry_after = 2
+
+            time.sleep(retry_after)
+
+    def get(self, url, params=None, **kwargs):
+        return self.request('GET', url, params=params, **kwargs)
+
+    def post(self, url, data=None, json=None, **kwargs):
+        return self.request('POST', url, data=data, json=json, **kwargs)
+
+    def put(self, url, data=None, **kwargs):
+        return self.request('PUT', url, data=data, **kwargs)
+
+    def delete(self, url, **kwargs):
+        return self.request('DELETE', url, **kwargs)
 
 
 class ShopifyAPI:
@@ -62,7 +218,7 @@ class ShopifyAPI:
 
         return charges
 
-    def paginate_orders(self, **kwargs):
+    def paginate_orders(self, page_info=None, return_page_info=False, **kwargs):
         defaults = {
             'limit': self._pagination_limit,
             'status': 'any',
@@ -78,7 +234,7 @@ class ShopifyAPI:
             if type(kwargs['ids']) is list:
                 kwargs['ids'] = ','.join([str(n) for n in kwargs['ids']])
 
-        yield from self.paginate_resource('orders', params=kwargs)
+        yield from self.paginate_resource('orders', params=kwargs, page_info=page_info, return_page_info=return_page_info)
 
     def paginate_products(self, **kwargs):
         defaults = {
@@ -91,8 +247,16 @@ class ShopifyAPI:
 
         yield from self.paginate_resource('products', params=kwargs)
 
-    def paginate_resource(self, resource, params):
-        next_page_info = None
+    def paginate_resource(self, resource, params, page_info=None, return_page_info=False):
+        """ Yield the resource pages
+
+        Args:
+            page_info: Start from this page link instead of the first page
+            return_page_info: Yield (page, next_page_info) tuples, next_page_info
+                              can be saved to resume the pagination later
+        """
+
+        next_page_info = page_info
         first_page = True
         while first_page or next_page_info:
             links, rep = self._get_resource(resource=resource, params=params, page_info=next_page_info)
@@ -104,15 +268,18 @@ class ShopifyAPI:
 
             first_page = False
 
-            yield rep[resource]
+            if return_page_info:
+                yield rep[resource], next_page_info
+            else:
+                yield rep[resource]
 
     def _get_resource(self, resource, params, page_info=None, raise_for_status=False):
         tries = 3
         while tries:
             if not page_info:
-                rep = requests.get(url=self.store.api(resource), params=params)
+                rep = self.store.request.get(url=self.store.api(resource), params=params)
             else:
-                rep = requests.get(url=self.store.api(page_info))
+                rep = self.store.request.get(url=self.store.api(page_info))
 
             if rep.ok:
                 break
@@ -132,7 +132,7 @@ def get_menu_item_data(request):
             is_research = request.user.profile.plan.is_research
             is_plod = request.user.profile.plan.is_plod
             hide_dashboard = not is_research and not request.user.can('dashboard.view')
-            hide_profit_dashboard = 'profit_dashboard.view' not in request.user.profile.get_perms
+            hide_profit_dashboard = 'profit_dashboard.view' not in request.user.profile.compiled_perms[0]
             user = request.user
             bunles_ids = request.user.profile.bundles.values_list('id', flat=True)
     except:
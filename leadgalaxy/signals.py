@@ -3,12 +3,14 @@ import simplejson as json
 
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.contrib.auth.signals import user_logged_out
 from django.core.cache import cache
 from django.core.cache.utils import make_template_fragment_key
 from django.db.models import Q
 from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete, pre_save
 from django.dispatch import Signal, receiver
 
+from addons_core.models import Addon
 from addons_core.tasks import cancel_all_addons
 from goals.models import Goal, UserGoalRelationship
 from leadgalaxy.models import (
@@ -21,6 +23,9 @@ from leadgalaxy.models import (
     SUBUSER_STORE_PERMISSIONS,
     SUBUSER_WOO_STORE_PERMISSIONS,
     SUBUSER_GOOGLE_STORE_PERMISSIONS,
+    AccessToken,
+    AppPermission,
+    FeatureBundle,
     GroupPlan,
     GroupPlanChangeLog,
     ShopifyOrderTrack,
@@ -35,15 +40,17 @@ from leadgalaxy.models import (
     SubuserPermission,
     SubuserWooPermission,
     SubuserGooglePermission,
-    UserProfile
+    UserProfile,
+    bump_permissions_version
 )
 from leadgalaxy.utils import deactivate_suredone_account, activate_suredone_account
 from lib.exceptions import capture_exception
 from profit_dashboard.models import AliexpressFulfillmentCost
-from profit_dashboard.utils import get_costs_from_track
+from profit_dashboard.utils import queue_track_costs
 from stripe_subscription.stripe_api import stripe
+from shopified_core.mixins import clear_token_cache
 from shopified_core.tasks import keen_send_event
-from shopified_core.utils import get_domain
+from shopified_core.utils import bump_orders_sync_version, get_domain
 from suredone_core.utils import SureDoneUtils
 
 
@@ -63,6 +70,8 @@ def update_plan_changed_date(sender, instance, created, **kwargs):
         change_log.changed_at = arrow.utcnow().datetime
         change_log.save()
 
+        clear_token_cache(user_id=user.id)
+
         if not current_plan.support_addons or current_plan.is_active_free:
             cancel_all_addons.apply_async([user.id], countdown=5)
 
@@ -100,6 +109,28 @@ def invalidate_orders_status(sender, instance, created, **kwargs):
     cache.delete(make_template_fragment_key('orders_status', [instance.store_id]))
 
 
+@receiver(post_save, sender=ShopifyOrderTrack, dispatch_uid='shopify_track_orders_sync_version')
+@receiver(post_save, sender='commercehq_core.CommerceHQOrderTrack', dispatch_uid='chq_track_orders_sync_version')
+@receiver(post_save, sender='woocommerce_core.WooOrderTrack', dispatch_uid='woo_track_orders_sync_version')
+@receiver(post_save, sender='gearbubble_core.GearBubbleOrderTrack', dispatch_uid='gear_track_orders_sync_version')
+@receiver(post_save, sender='groovekart_core.GrooveKartOrderTrack', dispatch_uid='gkart_track_orders_sync_version')
+@receiver(post_save, sender='bigcommerce_core.BigCommerceOrderTrack', dispatch_uid='bigcommerce_track_orders_sync_version')
+@receiver(post_save, sender='ebay_core.EbayOrderTrack', dispatch_uid='ebay_track_orders_sync_version')
+@receiver(post_save, sender='facebook_core.FBOrderTrack', dispatch_uid='fb_track_orders_sync_version')
+@receiver(post_save, sender='google_core.GoogleOrderTrack', dispatch_uid='google_track_orders_sync_version')
+@receiver(post_delete, sender=ShopifyOrderTrack, dispatch_uid='delete_shopify_track_orders_sync_version')
+@receiver(post_delete, sender='commercehq_core.CommerceHQOrderTrack', dispatch_uid='delete_chq_track_orders_sync_version')
+@receiver(post_delete, sender='woocommerce_core.WooOrderTrack', dispatch_uid='delete_woo_track_orders_sync_version')
+@receiver(post_delete, sender='gearbubble_core.GearBubbleOrderTrack', dispatch_uid='delete_gear_track_orders_sync_version')
+@receiver(post_delete, sender='groovekart_core.GrooveKartOrderTrack', dispatch_uid='delete_gkart_track_orders_sync_version')
+@receiver(post_delete, sender='bigcommerce_core.BigCommerceOrderTrack', dispatch_uid='delete_bigcommerce_track_orders_sync_version')
+@receiver(post_delete, sender='ebay_core.EbayOrderTrack', dispatch_uid='delete_ebay_track_orders_sync_version')
+@receiver(post_delete, sender='facebook_core.FBOrderTrack', dispatch_uid='delete_fb_track_orders_sync_version')
+@receiver(post_delete, sender='google_core.GoogleOrderTrack', dispatch_uid='delete_google_track_orders_sync_version')
+def invalidate_orders_sync(sender, instance, **kwargs):
+    bump_orders_sync_version(instance.user_id)
+
+
 @receiver(post_save, sender=User, dispatch_uid="userprofile_creation")
 def userprofile_creation(sender, instance, created, **kwargs):
     if created:
@@ -138,6 +169,51 @@ def userprofile_creation(sender, instance, created, **kwargs):
             capture_exception()
 
 
+@receiver(post_save, sender=GroupPlan, dispatch_uid='plan_permissions_version')
+@receiver(post_save, sender=FeatureBundle, dispatch_uid='bundle_permissions_version')
+@receiver(post_save, sender=Addon, dispatch_uid='addon_permissions_version')
+@receiver(post_save, sender=AppPermission, dispatch_uid='app_permission_permissions_version')
+@receiver(post_delete, sender=GroupPlan, dispatch_uid='delete_plan_permissions_version')
+@receiver(post_delete, sender=FeatureBundle, dispatch_uid='delete_bundle_permissions_version')
+@receiver(post_delete, sender=Addon, dispatch_uid='delete_addon_permissions_version')
+@receiver(post_delete, sender=AppPermission, dispatch_uid='delete_app_permission_permissions_version')
+def invalidate_permissions_version(sender, instance, **kwargs):
+    bump_permissions_version()
+
+
+@receiver(m2m_changed, sender=GroupPlan.permissions.through, dispatch_uid='plan_permissions_changed')
+@receiver(m2m_changed, sender=FeatureBundle.permissions.through, dispatch_uid='bundle_permissions_changed')
+@receiver(m2m_changed, sender=Addon.permissions.through, dispatch_uid='addon_permissions_changed')
+def invalidate_permissions_version_m2m(sender, instance, action, **kwargs):
+    if action.startswith('post_'):
+        bump_permissions_version()
+
+
+@receiver(m2m_changed, sender=UserProfile.bundles.through, dispatch_uid='profile_bundles_changed')
+@receiver(m2m_changed, sender=UserProfile.addons.through, dispatch_uid='profile_addons_changed')
+@receiver(m2m_changed, sender=UserProfile.subuser_permissions.through, dispatch_uid='profile_subuser_permissions_changed')
+def invalidate_profile_permissions(sender, instance, action, **kwargs):
+    if not action.startswith('post_'):
+        return
+
+    if isinstance(instance, UserProfile):
+        instance.clear_permissions_cache()
+    else:
+        # Changed from the bundle, addon or permission side
+        bump_permissions_version()
+
+
+@receiver(post_delete, sender=AccessToken, dispatch_uid='clear_access_token_cache')
+def clear_access_token_cache(sender, instance, **kwargs):
+    clear_token_cache(token=instance.token)
+
+
+@receiver(user_logged_out, dispatch_uid='clear_logged_out_tokens_cache')
+def clear_logged_out_tokens_cache(sender, request, user, **kwargs):
+    if user is not None:
+        clear_token_cache(user_id=user.id)
+
+
 @receiver(post_save, sender=ShopifyStore)
 def add_store_permissions(sender, instance, created, **kwargs):
     if created:
@@ -307,12 +383,8 @@ def add_google_store_permissions_to_subuser(sender, instance, pk_set, action, **
 
 @receiver(post_save, sender=ShopifyOrderTrack, dispatch_uid='sync_aliexpress_fulfillment_cost')
 def sync_aliexpress_fulfillment_cost(sender, instance, created, **kwargs):
-
-    try:
-        if instance.user.can('profit_dashboard.use'):
-            get_costs_from_track(instance, commit=True)
-    except User.DoesNotExist:
-        pass
+    # Costs are saved in bulk by profit_dashboard.tasks.sync_tracks_costs
+    queue_track_costs(instance)
 
 
 @receiver(post_delete, sender=ShopifyOrderTrack, dispatch_uid='delete_aliexpress_fulfillment_cost')
@@ -19,14 +19,20 @@
             count = data.count;
             success = data.success;
             fail = data.fail;
-            if (data.status && data.count > 0) {
-                if (data.status == 'ok' && data.error) {
-                    data['warning'] = data.error;
-                    delete data['error'];
-                }
-
-                var product_el = $(product_sync_update_tpl(data));
-                $('#modal-product-supplier-sync .progress-table tbody').append(product_el);
+
+            // Products progress is sent in batches
+            var products = data.products || (data.status ? [data] : []);
+            if (products.length && data.count > 0) {
+                $.each(products, function(i, product) {
+                    if (product.status == 'ok' && product.error) {
+                        product['warning'] = product.error;
+                        delete product['error'];
+                    }
+
+                    var product_el = $(product_sync_update_tpl(product));
+                    $('#modal-product-supplier-sync .progress-table tbody').append(product_el);
+                });
+
                 $('#modal-product-supplier-sync .progress-bar-success').css('width', (success * 100.0 / count) + '%');
                 $('#modal-product-supplier-sync .progress-bar-danger').css('width', (fail * 100.0 / count) + '%');
             }
@@ -5,6 +5,8 @@ import tempfile
 import zipfile
 import re
 import os.path
+from queue import Queue
+from threading import Thread
 
 import simplejson as json
 from pusher import Pusher
@@ -61,7 +63,7 @@ from product_alerts.models import ProductChange
 from product_alerts.managers import ProductChangeManager
 from product_alerts.utils import (
     get_supplier_variants,
-    variant_index_from_supplier_sku
+    VariantMatcher
 )
 
 from product_feed.feed import (
@@ -84,7 +86,7 @@ from product_feed.models import (
 from order_exports.models import OrderExport
 from order_exports.utils import ShopifyOrderExport, ShopifyTrackOrderExport
 from metrics.statuspage import record_import_metric
-from shopify_orders.models import ShopifyOrder, ShopifyOrderRevenue, ShopifyOrderRisk
+from shopify_orders.models import ShopifyOrder, ShopifyOrderData, ShopifyOrderRevenue, ShopifyOrderRisk
 from woocommerce_core.models import (
     WooStore,
     WooProduct,
@@ -176,7 +178,7 @@ def export_product(req_data, target, user_id):
                 api_data['product']['id'] = product.get_shopify_id()
 
                 update_endpoint = store.api('products', product.get_shopify_id())
-                r = requests.put(update_endpoint, json=api_data)
+                r = store.request.put(update_endpoint, json=api_data)
 
                 if r.ok:
                     try:
@@ -223,7 +225,7 @@ def export_product(req_data, target, user_id):
 
                 api_data['product']['title'] = normalize_product_title(api_data['product']['title'])
 
-                r = requests.post(endpoint, json=api_data)
+                r = store.request.post(endpoint, json=api_data)
 
                 # Shopify can take too long to process each image
                 if len(remaining_images) > 0 and 'product' in r.json():
@@ -236,7 +238,7 @@ def export_product(req_data, target, user_id):
                             created_product = r.json()['product']
 
                         saved_images = [{'id': i['id']} for i in created_product.get('images', [])]
-                        r = requests.put(update_endpoint, json={'product': {
+                        r = store.request.put(update_endpoint, json={'product': {
                             'id': created_product['id'],
                             'images': saved_images + remaining_images[chunk:chunk + max_images_chunk]
                         }})
@@ -257,7 +259,7 @@ def export_product(req_data, target, user_id):
                             }
 
                             try:
-                                rep = requests.put(
+                                rep = store.request.put(
                                     url=store.api('products', product_to_map['id']),
                                     json=images_fix_data
                                 )
@@ -614,6 +616,7 @@ def sync_shopify_product_quantities(self, product_id):
 
         if product_data:
             if variant_quantities:
+                variant_matcher = VariantMatcher(product, product_data['variants'])
                 for variant in variant_quantities:
                     sku = variant.get('sku')
                     if not sku:
@@ -622,7 +625,7 @@ def sync_shopify_product_quantities(self, product_id):
                         else:
                             continue
                     else:
-                        idx = variant_index_from_supplier_sku(product, sku, product_data['variants'])
+                        idx = variant_matcher.match(sku)
                         if idx is None:
                             if len(product_data['variants']) == 1 and len(variant_quantities) == 1:
                                 idx = 0
@@ -792,6 +795,47 @@ def update_shopify_order(self, store_id, order_id, shopify_order=None, from_webh
             raise self.retry(exc=e, countdown=countdown, max_retries=3)
 
 
+@celery_app.task(base=CaptureFailure, ignore_result=True)
+def check_shopify_orders_freshness(store_id, order_ids):
+    """ Update the local copy of orders that changed in Shopify without us receiving their webhook """
+
+    try:
+        store = ShopifyStore.objects.get(id=store_id)
+
+        rep = store.request.get(
+            url=store.api('orders'),
+            params={
+                'ids': ','.join([str(i) for i in order_ids]),
+                'status': 'any',
+                'fulfillment_status': 'any',
+                'financial_status': 'any',
+                'fields': 'id,updated_at',
+            }
+        )
+
+        rep.raise_for_status()
+
+        saved_orders = {}
+        for order_data in ShopifyOrderData.objects.filter(order__store=store, order__order_id__in=order_ids).select_related('order'):
+            saved_orders[order_data.order.order_id] = order_data.updated_at
+
+        countdown = 1
+        for order in rep.json()['orders']:
+            saved_at = saved_orders.get(order['id'])
+            if saved_at is None or arrow.get(order['updated_at']) > arrow.get(saved_at):
+                update_shopify_order.apply_async(
+                    args=[store.id, order['id']],
+                    kwargs={'from_webhook': False},
+                    countdown=countdown,
+                    expires=1800)
+
+                countdown += 1
+
+    except Exception as e:
+        if http_excption_status_code(e) not in [401, 402, 403, 404, 429]:
+            capture_exception(level='warning')
+
+
 @celery_app.task(base=CaptureFailure, bind=True, ignore_result=True)
 def update_product_connection(self, store_id, shopify_id):
     store = ShopifyStore.objects.get(id=store_id)
@@ -953,7 +997,7 @@ def bulk_edit_products(self, store, products):
             title = product['title']
             del product['title']
 
-            rep = requests.put(api_url, json={'product': product})
+            rep = store.request.put(api_url, json={'product': product})
             rep.raise_for_status()
 
             time.sleep(0.5)
@@ -1007,18 +1051,28 @@ def generate_order_export(self, order_export_id):
         order_export = OrderExport.objects.get(pk=order_export_id)
 
         api = ShopifyOrderExport(order_export)
-        api.generate_export()
+        exported = api.generate_export()
     except:
         capture_exception()
+        return
+
+    if not exported and api.can_resume:
+        # Continue from the last uploaded page
+        raise self.retry(countdown=60, max_retries=3)
 
 
 @celery_app.task(bind=True, base=CaptureFailure)
 def generate_tracked_order_export(self, params):
+    track_order_export = None
     try:
         track_order_export = ShopifyTrackOrderExport(params["store_id"])
         track_order_export.generate_tracked_export(params)
 
-    except:
+    except Exception as e:
+        if track_order_export is not None and track_order_export.can_resume and self.request.retries < 3:
+            # Continue from the last uploaded chunk
+            raise self.retry(exc=e, countdown=60, max_retries=3)
+
         capture_exception()
 
     if params.get('cache_key'):
@@ -1308,7 +1362,7 @@ def shopify_orders_risk(self, store, order_ids):
         else:
             try:
                 api_url = store.api('orders', order_id, 'risks')
-                rep = requests.get(api_url)
+                rep = store.request.get(api_url)
                 rep.raise_for_status()
 
                 risks = rep.json()['risks']
@@ -1349,14 +1403,45 @@ def shopify_orders_risk(self, store, order_ids):
     })
 
 
+def products_supplier_sync_fetch(store, q, results):
+    """ Load supplier variants and Shopify product data of the products in `q` """
+
+    while True:
+        item = q.get()
+        if item is None:
+            break
+
+        product, supplier_type, source_id = item
+
+        try:
+            supplier_variants = get_supplier_variants(supplier_type, source_id)
+        except Exception:
+            results.put((product, None, None, 'Failed to load supplier data'))
+            continue
+
+        try:
+            product_data = utils.get_shopify_product(store, product.shopify_id)
+        except Exception:
+            results.put((product, None, None, 'Failed to load shopify data'))
+            continue
+
+        results.put((product, supplier_variants, product_data, None))
+
+
 @celery_app.task(base=CaptureFailure, bind=True, ignore_result=True)
 def products_supplier_sync(self, store_id, products, sync_price, price_markup, compare_markup, sync_inventory, cache_key):
     store = ShopifyStore.objects.get(id=store_id)
 
     products = ShopifyProduct.objects.filter(id__in=products, user=store.user, store=store, shopify_id__gt=0)
+
+    q = Queue()
     total_count = 0
     for product in products:
         if product.have_supplier() and (product.default_supplier.is_aliexpress or product.default_supplier.is_ebay):
+            supplier = product.default_supplier
+            product.supplier_link = supplier.product_url
+            q.put((product, supplier.supplier_type(), supplier.get_source_id()))
+
             total_count += 1
 
     push_data = {
@@ -1367,112 +1452,128 @@ def products_supplier_sync(self, store_id, products, sync_price, price_markup, c
     }
     store.pusher_trigger('products-supplier-sync', push_data)
 
-    for product in products:
-        if not product.have_supplier() or not (product.default_supplier.is_aliexpress or product.default_supplier.is_ebay):
-            continue
-
-        supplier = product.default_supplier
-        push_data['id'] = product.id
-        push_data['title'] = product.title
-        push_data['shopify_link'] = product.shopify_link()
-        push_data['supplier_link'] = supplier.product_url
-        push_data['status'] = 'ok'
-        push_data['error'] = None
+    # Supplier and Shopify data are loaded by the worker threads while this thread updates the products
+    results = Queue()
+    for i in range(min(4, total_count)):
+        q.put(None)
+
+        t = Thread(target=products_supplier_sync_fetch, args=(store, q, results))
+        t.daemon = True
+        t.start()
+
+    # Progress is sent to the browser in batches
+    pushed_at = time.time()
+    pending_products = []
+
+    for done in range(total_count):
+        product, supplier_variants, product_data, error = results.get()
+
+        product_push = {
+            'id': product.id,
+            'title': product.title,
+            'shopify_link': product.shopify_link(),
+            'supplier_link': product.supplier_link,
+            'status': 'ok',
+            'error': None,
+        }
 
         try:
-            # Fetch supplier variants
-            supplier_variants = get_supplier_variants(supplier.supplier_type(), supplier.get_source_id())
+            if error:
+                raise ValueError(error)
 
             supplier_prices = [v['price'] for v in supplier_variants]
             supplier_min_price = min(supplier_prices)
             supplier_max_price = max(supplier_prices)
         except Exception:
-            push_data['status'] = 'fail'
-            push_data['error'] = 'Failed to load supplier data'
-            push_data['fail'] += 1
-            store.pusher_trigger('products-supplier-sync', push_data)
-            continue
+            product_push['status'] = 'fail'
+            product_push['error'] = error or 'Failed to load supplier data'
+            supplier_variants = None
 
-        try:
-            # Fetch shopify variants
-            product_data = utils.get_shopify_product(store, product.shopify_id)
-        except Exception:
-            push_data['status'] = 'fail'
-            push_data['error'] = 'Failed to load shopify data'
-            push_data['fail'] += 1
-            store.pusher_trigger('products-supplier-sync', push_data)
-            continue
+        if supplier_variants is not None:
+            try:
+                # Check if there's only one price
+                seem_price = (len('variants') == 1
+                              or len(set([v['price'] for v in product_data['variants']])) == 1
+                              or len(supplier_variants) == 1
+                              or supplier_min_price == supplier_max_price)
+
+                # New Data
+                api_variants_data = [{'id': v['id']} for v in product_data['variants']]
+                updated = False
+                mapped_variants = {}
+                unmapped_variants = []
+                variants_quantity = []
+
+                if sync_price and seem_price:
+                    # Use one price for all variants
+                    for i, variant in enumerate(product_data['variants']):
+                        api_variants_data[i]['price'] = round(supplier_max_price * (100 + price_markup) / 100.0, 2)
+                        api_variants_data[i]['compare_at_price'] = round(api_variants_data[i]['price'] * (100 + compare_markup) / 100.0, 2)
+                        updated = True
 
-        try:
-            # Check if there's only one price
-            seem_price = (len('variants') == 1
-                          or len(set([v['price'] for v in product_data['variants']])) == 1
-                          or len(supplier_variants) == 1
-                          or supplier_min_price == supplier_max_price)
-
-            # New Data
-            api_variants_data = [{'id': v['id']} for v in product_data['variants']]
-            updated = False
-            mapped_variants = {}
-            unmapped_variants = []
-
-            if sync_price and seem_price:
-                # Use one price for all variants
-                for i, variant in enumerate(product_data['variants']):
-                    api_variants_data[i]['price'] = round(supplier_max_price * (100 + price_markup) / 100.0, 2)
-                    api_variants_data[i]['compare_at_price'] = round(api_variants_data[i]['price'] * (100 + compare_markup) / 100.0, 2)
-                    updated = True
-
-            if (sync_price and not seem_price) or sync_inventory:
-                for index, variant in enumerate(supplier_variants):
-                    sku = variant.get('sku')
-                    if not sku:
-                        if len(product_data['variants']) == 1 and len(supplier_variants) == 1:
-                            idx = 0
-                        else:
-                            continue
-                    else:
-                        idx = variant_index_from_supplier_sku(product, sku, product_data['variants'])
-                        if idx is None:
+                if (sync_price and not seem_price) or sync_inventory:
+                    variant_matcher = VariantMatcher(product, product_data['variants'])
+                    for index, variant in enumerate(supplier_variants):
+                        sku = variant.get('sku')
+                        if not sku:
                             if len(product_data['variants']) == 1 and len(supplier_variants) == 1:
                                 idx = 0
                             else:
                                 continue
+                        else:
+                            idx = variant_matcher.match(sku)
+                            if idx is None:
+                                if len(product_data['variants']) == 1 and len(supplier_variants) == 1:
+                                    idx = 0
+                                else:
+                                    continue
+
+                        mapped_variants[str(product_data['variants'][idx]['id'])] = True
+                        # Sync price
+                        if sync_price and not seem_price:
+                            api_variants_data[idx]['price'] = round(supplier_variants[index]['price'] * (100 + price_markup) / 100.0, 2)
+                            api_variants_data[idx]['compare_at_price'] = round(api_variants_data[idx]['price'] * (100 + compare_markup) / 100.0, 2)
+                            updated = True
+                        # Sync inventory
+                        if sync_inventory:
+                            variants_quantity.append((product_data['variants'][idx], variant['availabe_qty']))
+
+                    # check unmapped variants
+                    for variant in product_data['variants']:
+                        if not mapped_variants.get(str(variant['id']), False):
+                            unmapped_variants.append(variant['title'])
+
+                if updated:
+                    update_endpoint = product.store.api('products', product.shopify_id)
+                    rep = product.store.request.put(update_endpoint, json={
+                        "product": {
+                            "id": product_data['id'],
+                            "variants": api_variants_data,
+                        }
+                    })
+                    rep.raise_for_status()
 
-                    mapped_variants[str(product_data['variants'][idx]['id'])] = True
-                    # Sync price
-                    if sync_price and not seem_price:
-                        api_variants_data[idx]['price'] = round(supplier_variants[index]['price'] * (100 + price_markup) / 100.0, 2)
-                        api_variants_data[idx]['compare_at_price'] = round(api_variants_data[idx]['price'] * (100 + compare_markup) / 100.0, 2)
-                        updated = True
-                    # Sync inventory
-                    if sync_inventory:
-                        product.set_variant_quantity(quantity=variant['availabe_qty'], variant=product_data['variants'][idx])
-                        time.sleep(0.5)
+                if variants_quantity:
+                    product.set_variants_quantity(variants_quantity)
 
-                # check unmapped variants
-                for variant in product_data['variants']:
-                    if not mapped_variants.get(str(variant['id']), False):
-                        unmapped_variants.append(variant['title'])
-
-            if updated:
-                update_endpoint = product.store.api('products', product.shopify_id)
-                rep = requests.put(update_endpoint, json={
-                    "product": {
-                        "id": product_data['id'],
-                        "variants": api_variants_data,
-                    }
-                })
-                rep.raise_for_status()
-            if len(unmapped_variants) > 0:
-                push_data['error'] = 'Warning - Unmapped: {}'.format(','.join(unmapped_variants))
+                if len(unmapped_variants) > 0:
+                    product_push['error'] = 'Warning - Unmapped: {}'.format(','.join(unmapped_variants))
+            except Exception:
+                product_push['status'] = 'fail'
+                product_push['error'] = 'Failed to update data'
+
+        if product_push['status'] == 'ok':
             push_data['success'] += 1
-        except Exception:
-            push_data['status'] = 'fail'
-            push_data['error'] = 'Failed to update data'
+        else:
             push_data['fail'] += 1
 
-        store.pusher_trigger('products-supplier-sync', push_data)
+        pending_products.append(product_push)
+
+        if len(pending_products) >= 10 or time.time() - pushed_at > 2 or done + 1 == total_count:
+            store.pusher_trigger('products-supplier-sync', dict(push_data, products=pending_products))
+
+            pushed_at = time.time()
+            pending_products = []
 
     cache.delete(cache_key)
 
@@ -1495,7 +1596,7 @@ def product_randomize_image_names(self, product_id):
     images = []
     try:
         # Get shopify product images
-        rep = requests.get(url=store.api('products', shopify_id, 'images'))
+        rep = store.request.get(url=store.api('products', shopify_id, 'images'))
         rep.raise_for_status()
 
         images = rep.json()['images']
@@ -1516,7 +1617,7 @@ def product_randomize_image_names(self, product_id):
             # Post a shopify product image with new filename
             path, ext = os.path.splitext(image['src'])
             image['filename'] = '{}{}'.format(random_hash(), ext)
-            rep = requests.post(
+            rep = store.request.post(
                 store.api('products', shopify_id, 'images'),
                 json={'image': image}
             )
@@ -1530,7 +1631,7 @@ def product_randomize_image_names(self, product_id):
             data['variants_images'] = product.parsed.get('variants_images') or {}
 
             # Delete a original shopify product image
-            rep = requests.delete(
+            rep = store.request.delete(
                 store.api('products', shopify_id, 'images', image_id),
             )
             rep.raise_for_status()
@@ -138,6 +138,50 @@ class AutoFulfillTestCase(BaseTestCase):
 
         fulfill_order.assert_not_called()
 
+    @tag('slow')
+    @patch('requests.head', Mock())
+    @patch('leadgalaxy.management.commands.auto_fulfill.Command.write', Mock())
+    @patch('leadgalaxy.management.commands.auto_fulfill.process_sale_transaction_fee', Mock())
+    @patch('leadgalaxy.tasks.add_ordered_note.apply_async', Mock())
+    @patch('leadgalaxy.models.ShopifyStore.need_reauthorization', Mock(return_value=False))
+    @patch('leadgalaxy.models.ShopifyStore.request')
+    @patch('leadgalaxy.utils.order_track_fulfillment')
+    @patch('leadgalaxy.management.commands.auto_fulfill.Command.fulfill_order')
+    def test_fulfill_order_lines_together(self, fulfill_order, order_track_fulfillment, store_request):
+        tracks = [
+            ShopifyOrderTrackFactory(order_id='5415135171', line_id=line_id, source_tracking='MA7565915257226HK', store_id=self.store.id)
+            for line_id in ['1654811', '1654812']
+        ]
+
+        order_track_fulfillment.side_effect = [({
+            'fulfillment': {
+                'location_id': 1,
+                'notify_customer': False,
+                'line_items_by_fulfillment_order': [{
+                    'fulfillment_order_id': 100,
+                    'fulfillment_order_line_items': [{'id': line_item, 'quantity': 1}]
+                }],
+                'tracking_info': {'number': 'MA7565915257226HK', 'company': 'Other'},
+            }
+        }, None) for line_item in [201, 202]]
+
+        store_request.post.return_value = Mock(ok=True, json=Mock(return_value={'fulfillment': {'id': 1}}))
+
+        call_command('auto_fulfill')
+
+        fulfill_order.assert_not_called()
+        store_request.post.assert_called_once()
+
+        api_data = store_request.post.call_args[1]['json']
+        line_items = api_data['fulfillment']['line_items_by_fulfillment_order']
+        self.assertEqual(len(line_items), 1)
+        self.assertEqual([i['id'] for i in line_items[0]['fulfillment_order_line_items']], [201, 202])
+
+        for track in tracks:
+            track.refresh_from_db()
+            self.assertEqual(track.shopify_status, 'fulfilled')
+            self.assertTrue(track.auto_fulfilled)
+
 
 class FulfillApiTestCase(BaseTestCase):
     def setUp(self):
@@ -0,0 +1,69 @@
+from django.core.management import call_command
+
+from lib.test import BaseTestCase
+from aliexpress_core.models import AliexpressAccount
+from leadgalaxy.models import ShopifyOrderTrack
+
+from unittest.mock import patch
+
+from . import factories as f
+
+
+@patch('shopify_orders.tasks.check_track_errors')
+@patch('shopify_orders.tasks.get_order_info_via_api')
+class AutoTrackOrdersTestCase(BaseTestCase):
+    def setUp(self):
+        self.user = f.UserFactory()
+        self.store = f.ShopifyStoreFactory(user=self.user, auto_fulfill='enable')
+        AliexpressAccount.objects.create(user=self.user)
+
+    def create_track(self, source_id):
+        return f.ShopifyOrderTrackFactory(store=self.store, user=self.user, source_id=source_id)
+
+    def test_tracks_of_the_same_order_are_looked_up_once(self, get_order_info, check_track_errors):
+        get_order_info.return_value = {'status': 'WAIT_BUYER_ACCEPT_GOODS', 'tracking_number': 'LP001'}
+        tracks = [self.create_track('1001'), self.create_track('1001'), self.create_track('1002')]
+
+        call_command('auto_track_orders')
+
+        self.assertEqual(get_order_info.call_count, 2)
+        for track in tracks:
+            track.refresh_from_db()
+            self.assertEqual(track.source_tracking, 'LP001')
+
+    def test_recently_checked_orders_are_skipped(self, get_order_info, check_track_errors):
+        get_order_info.return_value = {'status': 'WAIT_SELLER_SEND_GOODS', 'tracking_number': ''}
+        self.create_track('1001')
+
+        call_command('auto_track_orders')
+        call_command('auto_track_orders')
+        self.assertEqual(get_order_info.call_count, 1)
+
+        call_command('auto_track_orders', '--recheck=0')
+        self.assertEqual(get_order_info.call_count, 2)
+
+    def test_unchanged_tracks_are_not_saved(self, get_order_info, check_track_errors):
+        get_order_info.return_value = {'status': 'WAIT_SELLER_SEND_GOODS', 'tracking_number': ''}
+        self.create_track('1001')
+
+        call_command('auto_track_orders')
+
+        new_track = self.create_track('1001')
+        with patch.object(ShopifyOrderTrack, 'save', autospec=True) as save:
+            call_command('auto_track_orders', '--recheck=0')
+
+            # Only the track added since the last lookup gets the status
+            self.assertEqual([i[0][0].id for i in save.call_args_list], [new_track.id])
+
+    def test_max_counts_tracks(self, get_order_info, check_track_errors):
+        get_order_info.return_value = {'status': 'WAIT_SELLER_SEND_GOODS', 'tracking_number': ''}
+        self.create_track('1001')
+        self.create_track('1001')
+        self.create_track('1002')
+        self.create_track('1003')
+
+        call_command('auto_track_orders', '--max=2')
+        self.assertEqual([i[0][1] for i in get_order_info.call_args_list], ['1001'])
+
+        call_command('auto_track_orders', '--max=2', '--new')
+        self.assertEqual([i[0][1] for i in get_order_info.call_args_list], ['1001', '1003', '1002'])
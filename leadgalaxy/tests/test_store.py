@@ -1,6 +1,9 @@
+from unittest.mock import Mock, patch
+
 from django.test import tag
 from lib.test import BaseTestCase
 from leadgalaxy.models import SHOPIFY_API_VERSION, User, ShopifyStore
+from leadgalaxy.shopify import ShopifyClient
 
 MYSHOPIFY_DOMAIN = 'shopified-app-ci.myshopify.com'
 PRIVATE_APP_URL = '6bace8a67988e75c29279ac08f7b31bc:41973440f95ee4529b8c739df75aa1f6@%s' % MYSHOPIFY_DOMAIN
@@ -84,3 +87,38 @@ class StoreTestCase(BaseTestCase):
             self.assertEqual(store.get_api_url(hide_keys=True), "https://*:*@%s" % MYSHOPIFY_DOMAIN)
 
             self.assertEqual(store.get_info['name'], "Shopified App CI")
+
+
+class ShopifyClientTestCase(BaseTestCase):
+    def setUp(self):
+        user = User.objects.create(username='me', email='me@localhost.com')
+        self.store = ShopifyStore.objects.create(user=user, title="test", api_url=SHOPIFY_APP_URL, version=2, shop=MYSHOPIFY_DOMAIN)
+        self.shopify_client = ShopifyClient(self.store, rate_limit=False)
+
+    def response(self, status_code=200, headers=None):
+        return Mock(status_code=status_code, headers=headers or {})
+
+    @patch('leadgalaxy.shopify.time.sleep')
+    @patch('leadgalaxy.shopify.get_shopify_session')
+    def test_retry_after_on_throttle(self, get_session, sleep):
+        get_session.return_value.request.side_effect = [
+            self.response(429, {'Retry-After': '1.5'}),
+            self.response(200, {'X-Shopify-Shop-Api-Call-Limit': '12/80'}),
+        ]
+
+        rep = self.shopify_client.get(self.store.api('orders'))
+
+        self.assertEqual(rep.status_code, 200)
+        sleep.assert_called_once_with(1.5)
+        self.assertEqual(self.shopify_client.bucket_size, 80)
+        self.assertEqual(self.shopify_client.leak_interval, 0.25)
+
+    @patch('leadgalaxy.shopify.time.sleep')
+    @patch('leadgalaxy.shopify.get_shopify_session')
+    def test_give_up_after_max_retries(self, get_session, sleep):
+        get_session.return_value.request.return_value = self.response(429)
+
+        rep = self.shopify_client.get(self.store.api('orders'))
+
+        self.assertEqual(rep.status_code, 429)
+        self.assertEqual(get_session.return_value.request.call_count, ShopifyClient.max_retries + 1)
@@ -1,10 +1,12 @@
+import json
+
 from unittest.mock import Mock, patch, PropertyMock
 
 import arrow
 
 from django.core.cache import cache
 
-from .factories import UserFactory, ShopifyStoreFactory, GroupPlanFactory
+from .factories import UserFactory, ShopifyStoreFactory, ShopifyProductFactory, GroupPlanFactory, AppPermissionFactory, FeatureBundleFactory
 
 from lib.test import BaseTestCase
 from leadgalaxy.utils import create_user_without_signals
@@ -14,6 +16,7 @@ from leadgalaxy.models import (
     SUBUSER_PERMISSIONS,
     SUBUSER_STORE_PERMISSIONS,
     GroupPlan,
+    ShopifyProduct,
     SubuserPermission,
     User,
 )
@@ -89,6 +92,90 @@ class ShopifyStoreTestCase(BaseTestCase):
         self.assertEqual(store.subuser_permissions.count(), len(SUBUSER_STORE_PERMISSIONS))
 
 
+class ShopifyProductTestCase(BaseTestCase):
+    @patch('leadgalaxy.models.ShopifyStore.get_dropified_location', Mock(return_value=10))
+    @patch('leadgalaxy.models.ShopifyStore.request')
+    def test_set_variants_quantity_must_skip_unchanged_levels(self, store_request):
+        product = ShopifyProductFactory()
+        store_request.get.return_value = Mock(json=Mock(return_value={'inventory_levels': [
+            {'inventory_item_id': 101, 'available': 5},
+            {'inventory_item_id': 102, 'available': 3},
+        ]}))
+
+        updated = product.set_variants_quantity([
+            ({'id': 1, 'inventory_item_id': 101, 'inventory_management': 'shopify'}, 5),
+            ({'id': 2, 'inventory_item_id': 102, 'inventory_management': 'shopify'}, 7),
+        ])
+
+        self.assertEqual(updated, 1)
+        store_request.get.assert_called_once()
+        store_request.post.assert_called_once()
+        self.assertEqual(store_request.post.call_args[1]['json'], {'location_id': 10, 'inventory_item_id': 102, 'available': 7})
+
+    def test_json_fields_are_decoded_once(self):
+        product = ShopifyProductFactory(data='{"title": "Product", "images": []}')
+
+        with patch('shopified_core.models.json.loads', wraps=json.loads) as loads:
+            self.assertEqual(product.get_product(), 'Product')
+            self.assertEqual(product.get_images(), [])
+            self.assertEqual(loads.call_count, 1)
+
+            product.data = '{"title": "Updated"}'
+            self.assertEqual(product.get_product(), 'Updated')
+            self.assertEqual(loads.call_count, 2)
+
+        product.config_json = {'alert_price_change': 'notify'}
+        self.assertEqual(json.loads(product.config), {'alert_price_change': 'notify'})
+        self.assertEqual(product.get_config()['alert_price_change'], 'notify')
+
+    def test_json_fields_of_another_type_use_the_default(self):
+        product = ShopifyProductFactory(data='null', variants_map='[1, 2]')
+
+        self.assertEqual(product.data_json, {})
+        self.assertEqual(product.variants_map_json, {})
+        self.assertIsNone(product.get_variant_mapping(name='1'))
+
+    def test_variant_mapping_does_not_change_the_cached_mapping(self):
+        product = ShopifyProductFactory(variants_map='{"1": "10,20"}')
+
+        self.assertEqual(product.get_variant_mapping(for_extension=True), {'1': ['10', '20']})
+        self.assertEqual(product.variants_map_json, {'1': '10,20'})
+
+    def test_list_columns_are_updated_on_save(self):
+        product = ShopifyProductFactory(data=json.dumps({
+            'title': 'Product',
+            'price': '12.5',
+            'price_range': ['10', 15],
+            'images': ['https://example.com/1.jpg', 'https://example.com/2.jpg'],
+            'vendor': 'Vendor',
+            'original_url': 'https://www.aliexpress.com/item/123.html',
+            'variants': [{'title': 'Color', 'values': ['Red', 'Blue']}, {'title': 'Size', 'values': ['S', 'M', 'L']}],
+        }))
+
+        product = ShopifyProduct.objects.defer('data').get(id=product.id)
+        with self.assertNumQueries(0):
+            data = product.list_data
+
+        self.assertEqual(data['title'], 'Product')
+        self.assertEqual(data['price'], 12.5)
+        self.assertEqual(data['price_range'], [10.0, 15.0])
+        self.assertEqual(data['images'], ['https://example.com/1.jpg'])
+        self.assertEqual(data['vendor'], 'Vendor')
+        self.assertEqual(data['original_url'], 'https://www.aliexpress.com/item/123.html')
+        self.assertEqual(data['variants_count'], 6)
+
+    def test_load_list_columns_of_old_products(self):
+        product = ShopifyProductFactory(data=json.dumps({'title': 'Product', 'images': ['https://example.com/1.jpg']}))
+        ShopifyProduct.objects.filter(id=product.id).update(image='', variants_count=None)
+
+        products = list(ShopifyProduct.objects.defer('data').filter(id=product.id))
+        with self.assertNumQueries(1):
+            ShopifyProduct.load_list_columns(products)
+
+        self.assertEqual(products[0].list_data['images'], ['https://example.com/1.jpg'])
+        self.assertEqual(products[0].variants_count, 1)
+
+
 class UserProfileTestCase(BaseTestCase):
     def tearDown(self):
         cache.clear()
@@ -179,6 +266,32 @@ class UserProfileTestCase(BaseTestCase):
             user.stripe_customer = StripeCustomerFactory()
             self.assertEquals(user.profile.trial_days_left, trial_days_left)
 
+    def test_can_uses_compiled_permissions(self):
+        user = User.objects.create_user(username='john', email='john.test@gmail.com', password='123456')
+        user.profile.plan = GroupPlanFactory()
+        user.profile.save()
+
+        user.profile.plan.permissions.add(AppPermissionFactory(name='orders.use'))
+
+        profile = User.objects.get(id=user.id).profile
+        self.assertTrue(profile.can('orders.use'))
+        self.assertTrue(profile.can('orders.view'))
+        self.assertFalse(profile.can('products.use'))
+
+        # Next requests use the cached permissions
+        profile = User.objects.select_related('profile').get(id=user.id).profile
+        with self.assertNumQueries(0):
+            self.assertTrue(profile.can('Orders.use'))
+
+        bundle = FeatureBundleFactory()
+        bundle.permissions.add(AppPermissionFactory(name='products.use'))
+        profile.bundles.add(bundle)
+
+        self.assertTrue(User.objects.get(id=user.id).profile.can('products.use'))
+
+        bundle.permissions.add(AppPermissionFactory(name='boards.use'))
+        self.assertTrue(User.objects.get(id=user.id).profile.can('boards.use'))
+
 
 class ShopifyOrderLogTestCase(BaseTestCase):
     def test_create_log(self):
@@ -1,3 +1,4 @@
+import gzip
 import re
 import random
 from unittest.mock import Mock, patch, MagicMock
@@ -240,6 +241,28 @@ class FulfillmentTestCase(BaseTestCase):
         data = utils.order_track_fulfillment(order_track=track, user_config={'send_shipping_confirmation': 'default'}, **self.get_fulfillment())
         self.assertTrue(data['fulfillment']['notify_customer'])
 
+    def test_default_confirmation_email_order_lines_fulfilled_together(self):
+        order = ShopifyOrderFactory(order_id='5415135170', store=self.store2)
+        lines = [
+            ShopifyOrderLineFactory(order=order, line_id='1654810', fulfillment_status=''),
+            ShopifyOrderLineFactory(order=order, line_id='1654811', fulfillment_status=''),
+        ]
+
+        order.items_count = order.shopifyorderline_set.count()
+        order.save()
+
+        fulfilled_lines = []
+        for line, notify_customer in zip(lines, [False, True]):
+            track = ShopifyOrderTrackFactory(order_id='5415135170', line_id=line.line_id, source_tracking='MA7565915257226HK', store=self.store2)
+
+            data = utils.order_track_fulfillment(order_track=track, user_config={'send_shipping_confirmation': 'default'},
+                                                 fulfilled_lines=fulfilled_lines, **self.get_fulfillment())
+            self.assertEqual(data['fulfillment']['notify_customer'], notify_customer)
+
+        # Lines are saved by the caller after the API call
+        self.assertEqual(fulfilled_lines, [i.id for i in lines])
+        self.assertFalse(order.shopifyorderline_set.filter(fulfillment_status='fulfilled').exists())
+
     def test_default_confirmation_email_order_with_multi_lines_partialy_fulfilled_duplicated(self):
         order = ShopifyOrderFactory(order_id='5415135170', store=self.store2)
         lines = [
@@ -1406,3 +1429,39 @@ class TestUploadFileToS3(BaseTestCase):
                 mimetype='image/jpeg',
                 bucket_name=settings.S3_UPLOADS_BUCKET
             )
+
+
+class TestAwsS3MultipartUpload(BaseTestCase):
+    def test_resumed_upload_is_a_single_gzip_file(self):
+        parts = {}
+
+        def upload_part(fp, part_num):
+            parts[part_num] = fp.read()
+
+        multipart = Mock(id='upload-id', upload_part_from_file=Mock(side_effect=upload_part))
+        bucket = Mock(initiate_multipart_upload=Mock(return_value=multipart))
+
+        rows = [f'{i},{random.random()}\n' for i in range(3000)]
+
+        with patch('boto.connect_s3', return_value=Mock(get_bucket=Mock(return_value=bucket))), \
+                patch('leadgalaxy.utils.MultiPartUpload', return_value=multipart), \
+                patch.object(utils.AwsS3MultipartUpload, 'part_size', 1024):
+            upload = utils.AwsS3MultipartUpload('export.csv', compress=True, resumable=True)
+
+            checkpoint, resume_from = None, 0
+            for i, row in enumerate(rows[:2000]):
+                upload.write(row)
+                state = upload.checkpoint() if i % 100 == 99 else None
+                if state:
+                    checkpoint, resume_from = state, i + 1
+
+            self.assertIsNotNone(checkpoint)
+
+            # A new process continues the upload from the checkpoint
+            upload = utils.AwsS3MultipartUpload('export.csv', compress=True, resume=checkpoint)
+            for row in rows[resume_from:]:
+                upload.write(row)
+            upload.close()
+
+        content = b''.join(parts[i] for i in sorted(parts))
+        self.assertEqual(gzip.decompress(content).decode(), ''.join(rows))
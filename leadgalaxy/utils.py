@@ -11,9 +11,11 @@ import hmac
 import mimetypes
 import re
 import shutil
+import struct
 import tempfile
 import copy
 import random
+import zlib
 
 from urllib.parse import urlencode, urlsplit, parse_qs, urlunsplit, urlparse
 from hashlib import sha256
@@ -24,6 +26,7 @@ import requests
 import simplejson as json
 
 from boto.s3.key import Key
+from boto.s3.multipart import MultiPartUpload
 from unidecode import unidecode
 from collections import Counter
 
@@ -367,23 +370,23 @@ def format_shopify_error(data):
 def verify_shopify_permissions(store):
     permissions = []
 
-    r = requests.post(store.api('products'))
+    r = store.request.post(store.api('products'))
     if r.status_code == 403:
         permissions.append('Products')
 
-    r = requests.post(store.api('orders'))
+    r = store.request.post(store.api('orders'))
     if r.status_code == 403:
         permissions.append('Orders')
 
-    r = requests.post(store.api('customers'))
+    r = store.request.post(store.api('customers'))
     if r.status_code == 403:
         permissions.append('Customers')
 
-    r = requests.post(store.api('fulfillment_services'))
+    r = store.request.post(store.api('fulfillment_services'))
     if r.status_code == 403:
         permissions.append('Fulfillment Service')
 
-    r = requests.post(store.api('carrier_services'))
+    r = store.request.post(store.api('carrier_services'))
     if r.status_code == 403:
         permissions.append('Shipping Rates')
 
@@ -593,7 +596,7 @@ def get_myshopify_link(user, default_store, link):
     for store in stores:
         handle = link.split('/')[-1]
 
-        r = requests.get(store.api('products'), params={'handle': handle}).json()
+        r = store.request.get(store.api('products'), params={'handle': handle}).json()
         if len(r['products']) == 1:
             return store.get_link('/admin/products/{}'.format(r['products'][0]['id']))
 
@@ -808,7 +811,7 @@ def split_product(product, split_factor, store=None):
 
 
 def get_shopify_products_count(store):
-    return requests.get(url=store.api('products/count')).json().get('count', 0)
+    return store.request.get(url=store.api('products/count')).json().get('count', 0)
 
 
 def get_shopify_products(store, page_url=None, limit=50, all_products=False,
@@ -839,9 +842,9 @@ def get_shopify_products(store, page_url=None, limit=50, all_products=False,
                 else:
                     params['fields'] = fields
 
-            rep = requests.get(url=store.api('products'), params=params)
+            rep = store.request.get(url=store.api('products'), params=params)
         else:
-            rep = requests.get(url=store.api(page_url))
+            rep = store.request.get(url=store.api(page_url))
 
         rep.raise_for_status()
 
@@ -921,7 +924,7 @@ def get_shopify_inventories(store, inventory_item_ids, sleep=None):
             'location_ids': store.get_dropified_location(),
         }
 
-        rep = requests.get(
+        rep = store.request.get(
             url=store.api('inventory_levels'),
             params=params
         )
@@ -949,7 +952,7 @@ def get_shopify_inventories(store, inventory_item_ids, sleep=None):
 
 def get_shopify_product(store, product_id, raise_for_status=False):
     if store:
-        rep = requests.get(url=store.api('products', product_id))
+        rep = store.request.get(url=store.api('products', product_id))
 
         if raise_for_status:
             rep.raise_for_status()
@@ -1019,7 +1022,7 @@ def get_shopify_variant_image(store, product_id, variant_id):
 
 
 def get_shopify_order(store, order_id):
-    rep = requests.get(store.api('orders', order_id))
+    rep = store.request.get(store.api('orders', order_id))
     rep.raise_for_status()
 
     return rep.json()['order']
@@ -1056,7 +1059,7 @@ def get_shopify_order_note(store, order_id):
 
 
 def set_shopify_order_note(store, order_id, note):
-    rep = requests.put(
+    rep = store.request.put(
         url=store.api('orders', order_id),
         json={
             'order': {
@@ -1345,7 +1348,7 @@ def shopify_link_images(store, product):
             'variant_ids': image['variant_ids'],
         })
 
-    return requests.put(
+    return store.request.put(
         url=store.api('products', product['id']),
         json={'product': api_product}
     )
@@ -1356,7 +1359,7 @@ def update_shopify_product_vendor(store, product_shopify_id, vendor):
         'id': product_shopify_id,
         'vendor': vendor
     }
-    return requests.put(
+    return store.request.put(
         url=store.api('products', product_shopify_id),
         json={'product': api_product}
     )
@@ -1377,7 +1380,7 @@ def create_shopify_webhook(store, topic):
         }
     }
 
-    rep = requests.post(endpoint, json=data)
+    rep = store.request.post(endpoint, json=data)
 
     try:
         webhook_id = rep.json()['webhook']['id']
@@ -1431,7 +1434,7 @@ def check_webhooks(store):
     endpoint = store.api('webhooks')
 
     try:
-        webhooks = requests.get(endpoint).json()['webhooks']
+        webhooks = store.request.get(endpoint).json()['webhooks']
     except:
         return
 
@@ -1469,7 +1472,7 @@ def get_tracking_orders(store, tracker_orders):
         'ids': ','.join(ids),
     }
 
-    rep = requests.get(
+    rep = store.request.get(
         url=store.api('orders'),
         params=params
     )
@@ -1637,7 +1640,7 @@ def is_shipping_carrier(tracking_number, carrier, any_match=False):
 
 def order_fulfillement(store, order_id, line_id):
     try:
-        rep = requests.get(store.api('orders', order_id, 'fulfillment_orders'))
+        rep = store.request.get(store.api('orders', order_id, 'fulfillment_orders'))
         rep.raise_for_status()
 
         for order in rep.json()['fulfillment_orders']:
@@ -1660,6 +1663,8 @@ def order_track_fulfillment(**kwargs):
         source_tracking: Order Tracking Number
         order_track:     ShopifyOrderTrack to get above args. from (optional)
         user_config:     UserProfile config dict
+        fulfilled_lines: IDs of the order lines fulfilled by the same API call (optional),
+                         the line is added to it instead of being saved as fulfilled
     '''
 
     if kwargs.get('order_track'):
@@ -1798,11 +1803,20 @@ def order_track_fulfillment(**kwargs):
             if line.order.items_count <= 1:
                 data['fulfillment']['notify_customer'] = True
             else:
-                fulfilled = line.order.shopifyorderline_set.filter(fulfillment_status='fulfilled').exclude(id=line.id).count()
-                data['fulfillment']['notify_customer'] = (line.order.items_count <= fulfilled + 1)
+                fulfilled = line.order.shopifyorderline_set.filter(fulfillment_status='fulfilled').exclude(id=line.id)
 
-                line.fulfillment_status = 'fulfilled'
-                line.save()
+                fulfilled_lines = kwargs.get('fulfilled_lines')
+                if fulfilled_lines is not None:
+                    # The caller saves the lines once the API call succeeds
+                    fulfilled = fulfilled.exclude(id__in=fulfilled_lines).count() + len(fulfilled_lines)
+                    fulfilled_lines.append(line.id)
+                else:
+                    fulfilled = fulfilled.count()
+
+                    line.fulfillment_status = 'fulfilled'
+                    line.save()
+
+                data['fulfillment']['notify_customer'] = (line.order.items_count <= fulfilled + 1)
         else:
             data['fulfillment']['notify_customer'] = True
     else:
@@ -1833,7 +1847,7 @@ def do_order_fulfillment(store, fulfillment_data):
         line = api_data[1]
         api_data = api_data[0]
 
-    rep = requests.post(url=url, json=api_data)
+    rep = store.request.post(url=url, json=api_data)
 
     if fulfillment_data.get('return_line'):
         return (api_data, line, rep)
@@ -2413,6 +2427,150 @@ def aws_s3_upload(filename, content=None, fp=None, input_filename=None, mimetype
         return upload_url
 
 
+class AwsS3MultipartUpload:
+    """
+    File-like object that streams what is written to it to S3 using a multipart upload
+
+    Only the part being filled is kept in memory, so a large file can be generated
+    and uploaded without writing it to disk first. When `compress` is set the content
+    is gzipped on the fly and served with a `gzip` Content-Encoding.
+
+    A `resumable` upload only sends parts when `checkpoint()` is called, the returned
+    state can be passed as `resume` to continue the same upload from another process.
+    """
+
+    part_size = 5 * 1024 * 1024  # S3 minimum size for all parts but the last one
+    gzip_header = b'\x1f\x8b\x08\x00\x00\x00\x00\x00\x02\xff'
+
+    def __init__(self, filename, mimetype=None, compress=False, bucket_name=None, resumable=False, resume=None):
+        if bucket_name is None:
+            bucket_name = settings.AWS_STORAGE_BUCKET_NAME
+
+        if not mimetype:
+            mimetype = mimetypes.guess_type(filename)[0]
+
+        self.filename = filename
+        self.bucket_name = bucket_name
+        self.upload_start = time.time()
+        self.upload_time = None
+        self.resumable = resumable or resume is not None
+
+        # Uncompressed content checksum and size, written in the gzip trailer of resumable uploads
+        self.crc = resume['crc'] if resume else 0
+        self.size = resume['size'] if resume else 0
+
+        headers = {'Content-Type': mimetype}
+        if compress:
+            headers['Content-Encoding'] = 'gzip'
+            if self.resumable:
+                # Raw deflate stream with our own gzip header and trailer, a new compressor
+                # can continue the same gzip member after a checkpoint
+                self.compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+            else:
+                self.compressor = zlib.compressobj(9, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+        else:
+            self.compressor = None
+
+        conn = boto.connect_s3(settings.AWS_ACCESS_KEY_ID, settings.AWS_SECRET_ACCESS_KEY)
+        bucket = conn.get_bucket(bucket_name)
+
+        self.buffer = io.BytesIO()
+        self.closed = False
+
+        if resume:
+            self.multipart = MultiPartUpload(bucket)
+            self.multipart.key_name = filename
+            self.multipart.id = resume['upload_id']
+            self.part_num = resume['part_num']
+        else:
+            self.multipart = bucket.initiate_multipart_upload(filename, headers=headers, policy='public-read')
+            self.part_num = 0
+
+            if self.resumable and self.compressor is not None:
+                self.buffer.write(self.gzip_header)
+
+    @property
+    def url(self):
+        return 'https://%s.s3.amazonaws.com/%s' % (self.bucket_name, self.filename)
+
+    def write(self, data):
+        if type(data) is str:
+            data = data.encode()
+
+        if self.compressor is not None:
+            if self.resumable:
+                self.crc = zlib.crc32(data, self.crc)
+                self.size += len(data)
+
+            data = self.compressor.compress(data)
+
+        self._write_part(data)
+
+    def _write_part(self, data):
+        self.buffer.write(data)
+        if not self.resumable and self.buffer.tell() >= self.part_size:
+            self._upload_part()
+
+    def _upload_part(self):
+        self.part_num += 1
+        self.buffer.seek(0)
+        self.multipart.upload_part_from_file(self.buffer, part_num=self.part_num)
+
+        self.buffer.seek(0)
+        self.buffer.truncate()
+
+    def checkpoint(self):
+        """ Upload the written content if a part is full
+
+        Returns:
+            dict: State to resume the upload from, None if nothing was uploaded
+        """
+
+        if self.buffer.tell() < self.part_size:
+            return None
+
+        if self.compressor is not None:
+            self.buffer.write(self.compressor.flush(zlib.Z_FULL_FLUSH))
+
+        self._upload_part()
+
+        return {
+            'upload_id': self.multipart.id,
+            'part_num': self.part_num,
+            'crc': self.crc,
+            'size': self.size,
+        }
+
+    def flush(self):
+        pass
+
+    def close(self):
+        """ Upload the remaining content and complete the multipart upload """
+
+        if self.closed:
+            return
+
+        if self.compressor is not None:
+            self.buffer.write(self.compressor.flush())
+
+            if self.resumable:
+                self.buffer.write(struct.pack('<II', self.crc & 0xffffffff, self.size & 0xffffffff))
+
+        if self.buffer.tell() or not self.part_num:
+            self._upload_part()
+
+        self.multipart.complete_upload()
+        self.closed = True
+        self.upload_time = time.time() - self.upload_start
+
+    def cancel(self):
+        """ Abort the upload, S3 discards the parts already uploaded """
+
+        if not self.closed:
+            self.multipart.cancel_upload()
+            self.closed = True
+
+
 def upload_file_to_s3(url, user_id, fp=None, prefix=''):
     if fp is None:
         headers = {
@@ -2467,7 +2625,7 @@ def update_shopify_product(self, store_id, shopify_id, shopify_product=None, pro
             shopify_product = cache.get('webhook_product_{}_{}'.format(store_id, shopify_id))
 
         if shopify_product is None:
-            rep = requests.get(url=store.api('products', shopify_id))
+            rep = store.request.get(url=store.api('products', shopify_id))
 
             if rep.ok:
                 shopify_product = rep.json()['product']
@@ -2873,7 +3031,7 @@ class ShopifyOrderUpdater:
                 }
             }
 
-            rep = requests.put(
+            rep = self.store.request.put(
                 url=self.store.api('orders', self.order_id),
                 json=order_data
             )
@@ -2894,7 +3052,7 @@ class ShopifyOrderUpdater:
                 }
             }
 
-            rep = requests.put(
+            rep = self.store.request.put(
                 url=self.store.api('orders', self.order_id),
                 json=order_data
             )
@@ -2915,7 +3073,7 @@ class ShopifyOrderUpdater:
                 }
             }
 
-            rep = requests.put(
+            rep = self.store.request.put(
                 url=self.store.api('orders', self.order_id),
                 json=order_data
             )
@@ -2950,7 +3108,7 @@ class ShopifyOrderUpdater:
             order_data['note_attributes'] = []
 
         if len(list(order_data.keys())) > 1:
-            rep = requests.put(
+            rep = self.store.request.put(
                 url=self.store.api('orders', self.order_id),
                 json={'order': order_data}
             )
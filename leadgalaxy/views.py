@@ -43,7 +43,7 @@ from facebook_core.models import FBProduct, FBSupplier, FBUserUpload
 from google_core.models import GoogleProduct, GoogleSupplier, GoogleUserUpload
 from gearbubble_core.models import GearBubbleProduct, GearBubbleSupplier, GearUserUpload
 from groovekart_core.models import GrooveKartProduct, GrooveKartSupplier, GrooveKartUserUpload
-from infinite_pagination.paginator import InfinitePaginator
+from infinite_pagination.paginator import KeysetPaginator
 from lib.exceptions import capture_exception
 from phone_automation import billing_utils as billing
 from phone_automation.utils import get_month_limit, get_month_totals, get_phonenumber_usage
@@ -72,6 +72,7 @@ from shopified_core.utils import (
     jwt_decode,
     jwt_encode,
     order_data_cache,
+    order_data_cache_set_many,
     page_rpm_counter,
     products_filter,
     safe_float,
@@ -122,9 +123,8 @@ from .templatetags.template_helper import money_format
 from addons_core.models import Addon
 
 
-def get_product(request, filter_products, post_per_page=25, sort=None, store=None, board=None, load_boards=False):
+def get_product(request, filter_products, post_per_page=25, sort=None, store=None, board=None, load_boards=False, load_data=False):
     products = []
-    page = safe_int(request.GET.get('page'), 1)
     models_user = request.user.models_user
     user = request.user
     user_stores = list(request.user.profile.get_shopify_stores(flat=True))
@@ -132,6 +132,8 @@ def get_product(request, filter_products, post_per_page=25, sort=None, store=Non
                                 .defer('variants_map', 'shipping_map', 'notes') \
                                 .filter(user=models_user) \
                                 .filter(Q(store__in=user_stores) | Q(store=None))
+    if not load_data:
+        res = res.defer('data')
     if store:
         if store == 'c':  # connected
             res = res.exclude(shopify_id=0)
@@ -160,15 +162,8 @@ def get_product(request, filter_products, post_per_page=25, sort=None, store=Non
     if filter_products:
         res = products_filter(res, request.GET)
 
-    sort = sort if sort else '-date'
-    if sort:
-        if re.match(r'^-?(title|price|date)$', sort):
-            sort_columns = [sort.replace('date', 'created_at')]
-
-            if sort_columns[0].endswith('created_at'):
-                sort_columns.append('store_id')
-
-            res = res.order_by(*sort_columns)
+    sort = sort if sort and re.match(r'^-?(title|price|date)$', sort) else '-date'
+    sort_columns = [sort.replace('date', 'created_at')]
 
     if request.GET.get('product_board') in ['added', 'not_added']:
         board_list = request.user.models_user.shopifyboard_set.all()
@@ -177,10 +172,13 @@ def get_product(request, filter_products, post_per_page=25, sort=None, store=Non
         elif request.GET.get('product_board') == "not_added":
             res = res.exclude(shopifyboard__in=board_list)
 
-    paginator = InfinitePaginator(res, post_per_page)
-    page = paginator.page(page)
+    paginator = KeysetPaginator(res, post_per_page, sort_columns)
+    page = paginator.get_page(request.GET.get('cursor'))
     res = page
 
+    if not load_data:
+        ShopifyProduct.load_list_columns(page.object_list)
+
     for i in res:
         p = {
             'qelem': i,
@@ -189,7 +187,7 @@ def get_product(request, filter_products, post_per_page=25, sort=None, store=Non
             'shopify_url': i.shopify_link(),
             'created_at': i.created_at,
             'updated_at': i.updated_at,
-            'product': json.loads(i.data),
+            'product': i.data_json if load_data else i.list_data,
         }
 
         try:
@@ -788,7 +786,8 @@ def bulk_edit(request, what):
             'filter_products': (request.GET.get('f') == '1'),
             'post_per_page': settings.ITEMS_PER_PAGE,
             'sort': request.GET.get('sort'),
-            'store': 'n'
+            'store': 'n',
+            'load_data': True,
         }
 
         if args['filter_products'] and not request.user.can('product_filters.use'):
@@ -2509,19 +2508,12 @@ class OrdersView(AuthenticationMixin, TemplateView):
         self.paginator = paginator
 
         if self.current_page.object_list:
-            rep = requests.get(
-                url=self.store.api('orders'),
-                params={
-                    'ids': ','.join([str(i.order_id) for i in self.current_page]),
-                    'status': 'any',
-                    'fulfillment_status': 'any',
-                    'financial_status': 'any',
-                }
-            )
+            shopify_orders, fetched_ids = shopify_orders_utils.get_shopify_orders_data(self.store, self.current_page)
 
-            rep.raise_for_status()
-
-            shopify_orders = rep.json()['orders']
+            local_ids = [i.order_id for i in self.current_page if i.order_id not in fetched_ids]
+            if local_ids and cache.add(f'orders_freshness_{self.store.id}_{page_num}', True, timeout=300):
+                # Orders rendered from the local copy are checked in the background in case a webhook was missed
+                tasks.check_shopify_orders_freshness.apply_async(args=[self.store.id, local_ids], expires=600)
 
             self.current_page.object_list = shopify_orders_utils.sort_orders(shopify_orders, self.current_page)
 
@@ -2964,8 +2956,8 @@ class OrdersView(AuthenticationMixin, TemplateView):
         for i in self.orders_ids:
             active_orders['active_order_{}'.format(i)] = True
 
-        caches['orders'].set_many(raw_orders_cache, timeout=86400 if self.bulk_queue else 21600)
-        caches['orders'].set_many(orders_cache, timeout=86400 if self.bulk_queue else 21600)
+        order_data_cache_set_many(raw_orders_cache, timeout=86400 if self.bulk_queue else 21600)
+        order_data_cache_set_many(orders_cache, timeout=86400 if self.bulk_queue else 21600)
         caches['orders'].set_many(active_orders, timeout=86400 if self.bulk_queue else 3600)
 
         if self.sync.store_order_synced:
@@ -3029,7 +3021,6 @@ def orders_track(request):
     sorting = order_map.get(sorting, 'status_updated_at')
 
     post_per_page = safe_int(request.GET.get('ppp'), 20)
-    page = safe_int(request.GET.get('page'), 1)
     query = request.GET.get('query')
     tracking_filter = request.GET.get('tracking')
     fulfillment_filter = request.GET.get('fulfillment')
@@ -3153,10 +3144,8 @@ def orders_track(request):
     if sync_delay_notify_days > 0 and sync_delay_notify_highlight:
         order_threshold = timezone.now() - timezone.timedelta(days=sync_delay_notify_days)
 
-    orders = orders.order_by(sorting)
-
-    paginator = InfinitePaginator(orders, post_per_page)
-    page = paginator.page(page)
+    paginator = KeysetPaginator(orders, post_per_page, [sorting])
+    page = paginator.get_page(request.GET.get('cursor'))
     orders = page.object_list
 
     if len(orders):
@@ -3408,7 +3397,6 @@ def product_alerts(request):
         permissions.user_can_view(request.user, product)
 
     post_per_page = settings.ITEMS_PER_PAGE
-    page = safe_int(request.GET.get('page'), 1)
 
     changes = using_replica(ProductChange, request.GET.get('rep')).select_related('shopify_product') \
         .select_related('shopify_product__default_supplier') \
@@ -3434,10 +3422,8 @@ def product_alerts(request):
     if product_type:
         changes = changes.filter(shopify_product__product_type__icontains=product_type)
 
-    changes = changes.order_by('-updated_at')
-
-    paginator = InfinitePaginator(changes, post_per_page)
-    page = paginator.page(page)
+    paginator = KeysetPaginator(changes, post_per_page, ['-updated_at'])
+    page = paginator.get_page(request.GET.get('cursor'))
     changes = page.object_list
 
     products = []
@@ -9,14 +9,15 @@ from math import ceil
 
 import arrow
 import requests
+from django.core.cache import cache
 from django.db.models.query_utils import Q
 from django.urls import reverse
 from django.utils import timezone
 from django.utils.text import slugify
 from lib.exceptions import capture_exception, capture_message
 
-from shopified_core.utils import app_link, send_email_from_template, clean_query_id
-from leadgalaxy.utils import aws_s3_upload, order_track_fulfillment
+from shopified_core.utils import app_link, send_email_from_template, clean_query_id, hash_text
+from leadgalaxy.utils import AwsS3MultipartUpload, aws_s3_upload, order_track_fulfillment
 from leadgalaxy.shopify import ShopifyAPI
 from leadgalaxy.models import ShopifyOrderTrack, User, ShopifyStore
 from shopify_orders import utils as shopify_orders_utils
@@ -129,8 +130,8 @@ class ShopifyOrderExport():
             fieldnames.append(prefix + field[1])
         return fieldnames
 
-    def _percentage(self, current_page, max_pages):
-        return (max_pages / current_page) * 95
+    def _percentage(self, exported, count):
+        return min(int(exported * 95 / count), 95) if count else 0
 
     @property
     def _get_unique_code(self):
@@ -191,26 +192,76 @@ class ShopifyOrderExport():
         finally:
             log.save()
 
+    @property
+    def checkpoint_key(self):
+        return f'order_export_checkpoint_{self.order_export.id}'
+
+    @property
+    def can_resume(self):
+        return bool(cache.get(self.checkpoint_key))
+
     def generate_export(self):
+        """ Stream the orders to a gzipped CSV file on S3, page by page
+
+        Progress is saved after each uploaded part, a failed export resumes from the last saved page
+        """
+
         log = self.order_export.logs.create()
+        upload = None
+        checkpoint = None
 
         try:
             params = self._create_url_params()
+            params_hash = hash_text(json.dumps(params, sort_keys=True))
+
+            checkpoint = cache.get(self.checkpoint_key)
+            if not checkpoint or checkpoint['params'] != params_hash:
+                checkpoint = {
+                    'params': params_hash,
+                    's3_path': self._s3_path,
+                    'upload': None,
+                    'page_info': None,
+                    'exported': 0,
+                    'since_id': None,
+                }
 
             count = self._get_orders_count(params)
-            max_pages = int(ceil(float(count) / 250.0) + 1)
 
-            orders = []
-            for page in range(1, max_pages):
+            upload = AwsS3MultipartUpload(checkpoint['s3_path'], mimetype='text/csv', compress=True,
+                                          resumable=True, resume=checkpoint['upload'])
+
+            writer = self._get_csv_writer(upload)
+            if not checkpoint['upload']:
+                writer.writeheader()
+
+            api = ShopifyAPI(self.store)
+            pages = api.paginate_resource('orders', params=dict(params, limit=250),
+                                          page_info=checkpoint['page_info'], return_page_info=True)
+
+            for orders, next_page_info in pages:
+                self._write_orders(writer, orders)
+
+                checkpoint['exported'] += len(orders)
+                if len(orders):
+                    checkpoint['since_id'] = orders[-1]['id']
+
                 if not self.order_export.previous_day:
-                    self.order_export.progress = self._percentage(page, max_pages)
-                    self.order_export.save()
-                orders += self._get_orders(params=params, page=page)
+                    self.order_export.progress = self._percentage(checkpoint['exported'], count)
+                    self.order_export.save(update_fields=['progress'])
 
-            url = self.create_csv(orders)
+                upload_state = upload.checkpoint()
+                if upload_state and next_page_info:
+                    checkpoint['upload'] = upload_state
+                    checkpoint['page_info'] = next_page_info
+                    cache.set(self.checkpoint_key, checkpoint, timeout=86400)
+
+            upload.close()
+            cache.delete(self.checkpoint_key)
+
+            url = upload.url
 
-            if len(orders) > 1:
-                self.order_export.since_id = orders[-1]['id']
+            if checkpoint['exported'] > 1:
+                self.order_export.since_id = checkpoint['since_id']
 
             self.order_export.progress = 100
             self.order_export.url = url
@@ -227,6 +278,12 @@ class ShopifyOrderExport():
             log.finished_by = timezone.now()
             log.save()
 
+            # Parts uploaded since the last checkpoint are sent again when the export resumes
+            if upload is not None and not checkpoint['upload']:
+                upload.cancel()
+
+        return log.successful
+
     def get_query_info(self, limit=GENERATED_PAGE_LIMIT):
         if self.query.found_order_ids:
             count = self._get_orders_count(params={'ids': self.query.found_order_ids})
@@ -249,54 +306,59 @@ class ShopifyOrderExport():
     def get_data(self, page=1, limit=GENERATED_PAGE_LIMIT):
         raise NotImplementedError
 
-    def create_csv(self, orders=None):
-        if orders is None:
-            orders = []
-
-        vendor = slugify(self.order_export.filters.vendor.strip())
-
-        with open(self.file_path, 'w') as csv_file:
-            fields = self.order_export.fields_choices
-            fieldnames = self._get_fieldnames(fields)
-
-            line_fields = self.order_export.line_fields_choices
-            fieldnames += self._get_fieldnames(line_fields, 'Line Field - ')
-
-            shipping_address = self.order_export.shipping_address_choices
-            fieldnames += self._get_fieldnames(shipping_address, 'Shipping Address - ')
+    def _get_csv_writer(self, csv_file):
+        fieldnames = self._get_fieldnames(self.order_export.fields_choices)
+        fieldnames += self._get_fieldnames(self.order_export.line_fields_choices, 'Line Field - ')
+        fieldnames += self._get_fieldnames(self.order_export.shipping_address_choices, 'Shipping Address - ')
 
-            writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
+        return csv.DictWriter(csv_file, fieldnames=fieldnames)
 
-            writer.writeheader()
-            for order in orders:
-                if vendor != '':
-                    vendor_found = [o_line for o_line in order['line_items'] if slugify(o_line['vendor']) == vendor]
-                    if len(vendor_found) == 0:  # vendor not found on line items
+    def _write_orders(self, writer, orders):
+        vendor = slugify(self.order_export.filters.vendor.strip())
+        fields = self.order_export.fields_choices
+        line_fields = self.order_export.line_fields_choices
+        shipping_address = self.order_export.shipping_address_choices
+
+        for order in orders:
+            if vendor != '':
+                vendor_found = [o_line for o_line in order['line_items'] if slugify(o_line['vendor']) == vendor]
+                if len(vendor_found) == 0:  # vendor not found on line items
+                    continue
+
+            line = {}
+            write = False
+            if len(fields):
+                write = True
+                for field in fields:
+                    line[field[1]] = str(order[field[0]])
+
+            if len(shipping_address) and 'shipping_address' in order:
+                write = True
+                for field in shipping_address:
+                    line['Shipping Address - %s' % field[1]] = str(order['shipping_address'][field[0]])
+
+            if write:
+                writer.writerow(line)
+
+            if len(line_fields) and 'line_items' in order:
+                for line_item in order['line_items']:
+                    if vendor != '' and slugify(line_item['vendor']) != vendor:
                         continue
 
-                line = {}
-                if len(fields):
-                    write = True
-                    for field in fields:
-                        line[field[1]] = str(order[field[0]])
-
-                if len(shipping_address) and 'shipping_address' in order:
-                    write = True
-                    for field in shipping_address:
-                        line['Shipping Address - %s' % field[1]] = str(order['shipping_address'][field[0]])
-
-                if write:
+                    line = {}
+                    for line_field in line_fields:
+                        line['Line Field - %s' % line_field[1]] = str(line_item[line_field[0]])
                     writer.writerow(line)
 
-                if len(line_fields) and 'line_items' in order:
-                    for line_item in order['line_items']:
-                        if vendor != '' and slugify(line_item['vendor']) != vendor:
-                            continue
+    def create_csv(self, orders=None):
+        if orders is None:
+            orders = []
+
+        with open(self.file_path, 'w') as csv_file:
+            writer = self._get_csv_writer(csv_file)
+            writer.writeheader()
 
-                        line = {}
-                        for line_field in line_fields:
-                            line['Line Field - %s' % line_field[1]] = str(line_item[line_field[0]])
-                        writer.writerow(line)
+            self._write_orders(writer, orders)
 
         url = self.send_to_s3()
 
@@ -373,6 +435,8 @@ class ShopifyTrackOrderExport():
         file_name = self.file_path.split('/')[-1]
         self._s3_path = os.path.join('order-exports', file_name)
 
+        self.checkpoint_key = None
+
     def generate_tracked_export(self, params):
         self.user = User.objects.get(id=params["user_id"])
 
@@ -461,17 +525,36 @@ class ShopifyTrackOrderExport():
         elif orders_count > 1000:
             capture_message("Exporting a lot of orders", extra=params)
 
-        start = 0
+        self.checkpoint_key = 'track_order_export_checkpoint_{}'.format(hash_text(json.dumps(params, sort_keys=True, default=str)))
+        checkpoint = cache.get(self.checkpoint_key)
+        if not checkpoint:
+            checkpoint = {
+                's3_path': self._s3_path,
+                'upload': None,
+                'last_id': None,
+            }
+
         steps = 200
 
-        api = ShopifyAPI(self.store)
-        with open(self.file_path, 'w') as csv_file:
+        upload = AwsS3MultipartUpload(checkpoint['s3_path'], mimetype='text/csv', compress=True,
+                                      resumable=True, resume=checkpoint['upload'])
+
+        try:
             fieldnames = ['Shopify Order', 'Shopify Item', 'Shopify Product Title', 'Supplier Order ID', 'Tracking Number']
-            writer = csv.DictWriter(csv_file, fieldnames=fieldnames)
-            writer.writeheader()
+            writer = csv.DictWriter(upload, fieldnames=fieldnames)
+            if not checkpoint['upload']:
+                writer.writeheader()
+
+            api = ShopifyAPI(self.store)
+            orders = orders.order_by('-id')
+            last_id = checkpoint['last_id']
+
+            while True:
+                orders_chunk = orders.filter(id__lt=last_id) if last_id else orders
+                orders_chunk = list(orders_chunk[:steps])
+                if not orders_chunk:
+                    break
 
-            while start <= orders_count:
-                orders_chunk = orders[start:start + steps]
                 orders_ids = list(set([o.order_id for o in orders_chunk]))
 
                 shopify_orders = {}
@@ -499,17 +582,32 @@ class ShopifyTrackOrderExport():
                         'Tracking Number': f'="{order.source_tracking}"' if order.source_tracking else '',  # excel formula to format value as text,
                     })
 
-                start += steps
+                last_id = orders_chunk[-1].id
 
-        email_data['url'] = self.send_to_s3()
+                upload_state = upload.checkpoint()
+                if upload_state:
+                    checkpoint['upload'] = upload_state
+                    checkpoint['last_id'] = last_id
+                    cache.set(self.checkpoint_key, checkpoint, timeout=86400)
 
-        self.send_email(email_data)
+            upload.close()
 
-    def send_to_s3(self):
-        url = aws_s3_upload(self._s3_path, input_filename=self.file_path)
-        os.remove(self.file_path)
+        except Exception:
+            # Parts uploaded since the last checkpoint are sent again when the export resumes
+            if not checkpoint['upload']:
+                upload.cancel()
 
-        return url
+            raise
+
+        cache.delete(self.checkpoint_key)
+
+        email_data['url'] = upload.url
+
+        self.send_email(email_data)
+
+    @property
+    def can_resume(self):
+        return bool(self.checkpoint_key and cache.get(self.checkpoint_key))
 
     def send_email(self, data):
         send_email_from_template(
@@ -1,5 +1,6 @@
 import csv
 from io import StringIO
+from unittest.mock import patch
 
 import requests_mock
 from django.test import tag
@@ -10,6 +11,7 @@ from factory import fuzzy
 
 from django.contrib.auth.models import User
 from leadgalaxy.models import ShopifyStore
+from leadgalaxy.tests.factories import ShopifyOrderFactory, ShopifyOrderLineFactory
 from order_imports.utils import ShopifyOrderImport
 
 
@@ -148,3 +150,31 @@ class OrderImportFetchOrdersTestCase(BaseTestCase):
 
                 for item in order['items']:
                     self.assertTrue(item['shopify'] is not None)
+
+    @patch('order_imports.utils.ShopifyAPI')
+    @patch('order_imports.utils.ShopifyOrderImport._get_order_by_name')
+    @patch('order_imports.utils.ShopifyOrderImport._send_pusher_notification')
+    def test_orders_found_in_synced_orders(self, pusher_notification, get_order_by_name, shopify_api):
+        order = ShopifyOrderFactory(store=self.store, user=self.user, order_number=1089, order_id=4154418757)
+        ShopifyOrderLineFactory(order=order, line_id=7374191301)
+        ShopifyOrderLineFactory(order=order, line_id=7586832197)
+
+        get_order_by_name.return_value = {'id': 4154418758, 'line_items': [{'id': 4175570565, 'sku': '1100195-bulbasaur'}]}
+
+        # The second item is matched by SKU, which isn't saved in the synced lines
+        shopify_api.return_value.paginate_orders.return_value = [[
+            {'id': 4154418757, 'line_items': [
+                {'id': 7374191301, 'sku': '1100195-bulbasaur'},
+                {'id': 7586832197, 'sku': '911761-black-frame-gray'}
+            ]}
+        ]]
+
+        orders = self.api.find_orders(self.orders)
+
+        get_order_by_name.assert_called_once_with('#1039')
+        shopify_api.return_value.paginate_orders.assert_called_once_with(ids=[4154418757], fields='id,line_items')
+
+        self.assertEqual(orders['#1089']['shopify'], {'id': 4154418757})
+        self.assertEqual([i['shopify'] for i in orders['#1089']['items']], [{'id': 7374191301}, {'id': 7586832197}])
+        self.assertEqual(orders['#1039']['shopify'], {'id': 4154418758})
+        self.assertEqual(orders['#1039']['items'][0]['shopify'], {'id': 4175570565})
@@ -1,11 +1,11 @@
 import csv
 import logging
 import re
-import time
-
-import requests
 
+from leadgalaxy.shopify import ShopifyAPI
 from shopified_core.exceptions import ApiProcessException
+from shopified_core.utils import safe_int
+from shopify_orders.models import ShopifyOrder
 
 # Get an instance of a logger
 logger = logging.getLogger(__name__)
@@ -30,20 +30,18 @@ class ShopifyOrderImport():
         # concatenate the URL to be requested with the base url and do the request
         request_url = self.store.api(url)
         if params is not None:
-            response = requests.get(request_url, params=params)
+            response = self.store.request.get(request_url, params=params)
         else:
-            response = requests.get(request_url)
+            response = self.store.request.get(request_url)
 
-        time.sleep(0.5)
         return response
 
     def _post_response_from_url(self, url, data):
         """Access any given url and return the corresponding response"""
         # concatenate the URL to be requested with the base url and do the request
         request_url = self.store.api(url)
-        response = requests.post(request_url, json=data)
+        response = self.store.request.post(request_url, json=data)
 
-        time.sleep(0.5)
         return response
 
     def _get_order_by_name(self, name=''):
@@ -73,54 +71,127 @@ class ShopifyOrderImport():
             'loading': loading
         })
 
+    def _get_local_orders(self, names):
+        """ Find the orders by name in the synced orders tables
+
+        Local lines don't have a SKU, orders with items matched by SKU are loaded from Shopify by `fill_line_items`
+
+        Returns:
+            dict: {name: order} with orders in the same format as Shopify API orders
+        """
+
+        names_by_number = {}
+        for name in names:
+            number = safe_int(''.join(re.findall(r'[\d]+', name)), None)
+            if number is not None:
+                names_by_number.setdefault(number, []).append(name)
+
+        if not names_by_number:
+            return {}
+
+        orders = {}
+        shopify_orders = ShopifyOrder.objects.filter(store=self.store, order_number__in=list(names_by_number.keys())) \
+                                             .prefetch_related('shopifyorderline_set')
+
+        for order in shopify_orders:
+            order_data = {
+                'id': order.order_id,
+                'local': True,
+                'line_items': [{
+                    'id': line.line_id,
+                    'sku': None,
+                    'variant_title': line.variant_title,
+                } for line in order.shopifyorderline_set.all()]
+            }
+
+            for name in names_by_number[order.order_number]:
+                orders[name] = order_data
+
+        return orders
+
+    def _match_line_items(self, order):
+        """ Set the Shopify line item of the order items
+
+        Returns:
+            bool: True if all items were found
+        """
+
+        line_items = order['shopify']['line_items']
+        lines_by_id = {str(line_item['id']): line_item for line_item in line_items}
+        lines_by_sku = {}
+        for line_item in line_items:
+            if line_item.get('sku'):
+                lines_by_sku.setdefault(line_item['sku'], line_item)
+
+        all_found = True
+        for item in order['items']:
+            found = None
+            if item['key'] != '':
+                # Check for line item id then line item sku
+                found = lines_by_id.get(item['key']) or lines_by_sku.get(item['key'])
+
+            # Check for variant title
+            if found is None and item.get('identify', '') != '':
+                for line_item in line_items:
+                    if item['identify'] in (line_item.get('variant_title') or ''):
+                        found = line_item
+                        break
+
+            if found is not None:
+                item['shopify'] = {'id': found.get('id')}
+            else:
+                all_found = False
+
+        return all_found
+
     def fill_line_items(self, orders):
         self._send_pusher_notification('Loading Line Items', 50)
-        orders_half_length = len(orders) / 2
-        orders_count = 0
-        for name in orders:
-            orders_count += 1
-            order = orders[name]
 
+        unmatched = {}
+        for order in orders.values():
+            if order['shopify'] is not None and not self._match_line_items(order) and order['shopify'].get('local'):
+                unmatched[order['shopify']['id']] = order
+
+        if unmatched:
+            self._send_pusher_notification('Loading Line Items', 75)
+
+            # Items could be matched by SKU, which is only available from Shopify
+            api = ShopifyAPI(self.store)
+            order_ids = list(unmatched.keys())
+            for i in range(0, len(order_ids), self.MAX_ORDERS_PER_PAGE):
+                ids = order_ids[i:i + self.MAX_ORDERS_PER_PAGE]
+                for orders_page in api.paginate_orders(ids=ids, fields='id,line_items'):
+                    for shopify_order in orders_page:
+                        order = unmatched.get(shopify_order['id'])
+                        if order is not None:
+                            order['shopify'] = shopify_order
+                            self._match_line_items(order)
+
+        for order in orders.values():
             if order['shopify'] is not None:
-                for item in order['items']:
-                    for line_item in order['shopify']['line_items']:
-                        found = False
-                        if item['key'] != '':
-                            # Check for line item id
-                            if str(line_item['id']) == item['key']:
-                                found = True
-
-                            # Check for line item sku
-                            if line_item['sku'] == item['key']:
-                                found = True
-
-                        # Check for variant title
-                        if item.get('identify', '') != '' and item['identify'] in line_item['variant_title']:
-                            found = True
-
-                        if found:
-                            item['shopify'] = {'id': line_item.get('id')}
-                            break
-
                 # Clean not needed data
                 order['shopify'] = {'id': order['shopify'].get('id')}
 
-            # Send notification half way through it to show progress
-            if orders_count == orders_half_length:
-                self._send_pusher_notification('Loading Line Items', 75)
-
         return orders
 
     def find_orders(self, orders):
         self._send_pusher_notification('Loading Orders', 20)
-        orders_half_length = len(orders) / 2
-        orders_count = 0
+
+        local_orders = self._get_local_orders(list(orders.keys()))
+
+        missing = []
         for name in orders:
-            orders_count += 1
+            orders[name]['shopify'] = local_orders.get(name)
+            if orders[name]['shopify'] is None:
+                missing.append(name)
+
+        # Orders not synced yet are searched one by one
+        missing_half_length = len(missing) // 2
+        for orders_count, name in enumerate(missing, 1):
             orders[name]['shopify'] = self._get_order_by_name(name)
 
             # Send notification half way through it to show progress
-            if orders_count == orders_half_length:
+            if orders_count == missing_half_length:
                 self._send_pusher_notification('Loading Orders', 35)
 
         return self.fill_line_items(orders)
@@ -205,7 +276,7 @@ class ShopifyOrderImport():
             if headers.get('identify_column') and headers.get('identify_column') < len(row):
                 data['identify'] = row[headers.get('identify_column')]
 
-            if row[headers.get('order_id')] in list(orders.keys()):
+            if row[headers.get('order_id')] in orders:
                 orders[row[headers.get('order_id')]]['items'].append(data)
             else:
                 orders[row[headers.get('order_id')]] = {'items': [data], 'shopify': None, 'name': row[headers.get('order_id')]}
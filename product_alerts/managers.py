@@ -8,7 +8,7 @@ from lib.exceptions import capture_exception, capture_message
 from shopified_core.utils import app_link, safe_float, http_exception_response
 from leadgalaxy.models import PriceMarkupRule
 from leadgalaxy.utils import get_shopify_product
-from product_alerts.utils import variant_index_from_supplier_sku, calculate_price
+from product_alerts.utils import VariantMatcher, calculate_price
 from shopified_core.utils import http_excption_status_code
 
 
@@ -143,7 +143,16 @@ class ProductChangeManager():
         pass
 
     def get_variant(self, api_product_data, variant_change):
-        return variant_index_from_supplier_sku(self.product, variant_change.get('sku'), api_product_data.get('variants', []))
+        variants = api_product_data.get('variants', [])
+        if not variants:
+            return None
+
+        # All variant changes of a product are matched against the same variants list
+        matcher = getattr(self, '_variant_matcher', None)
+        if matcher is None or matcher.variants is not variants:
+            matcher = self._variant_matcher = VariantMatcher(self.product, variants)
+
+        return matcher.match(variant_change.get('sku'))
 
     def handle_variant_price_change(self, api_product_data, product_data, variant_change):
         pass
@@ -1,5 +1,5 @@
 from lib.test import BaseTestCase
-from unittest.mock import patch
+from unittest.mock import patch, Mock
 
 from django.conf import settings
 from django.test import tag
@@ -11,12 +11,36 @@ from ..utils import (
     match_sku_with_shopify_sku,
     match_sku_title_with_mapping_title,
     match_sku_title_with_shopify_variant_title,
-    variant_index_from_supplier_sku
+    variant_index_from_supplier_sku,
+    VariantMatcher
 )
 from leadgalaxy import utils
 from leadgalaxy.models import ShopifyProduct, ProductSupplier
 
 
+def match_variant_index(product, sku, variants):
+    """ Matching rules VariantMatcher replaced, checked one variant at a time """
+
+    matches = [[], [], [], []]
+    for idx, variant in enumerate(variants):
+        mapping = product.get_variant_mapping(variant['id'], for_extension=True)
+        if mapping and match_sku_with_mapping_sku(sku, mapping):
+            matches[0].append(idx)
+
+        elif variant.get('sku') and match_sku_with_shopify_sku(sku, variant.get('sku')):
+            matches[1].append(idx)
+
+        elif mapping and match_sku_title_with_mapping_title(sku, mapping):
+            matches[2].append(idx)
+
+        elif match_sku_title_with_shopify_variant_title(sku, variant):
+            matches[3].append(idx)
+
+    for found in matches:
+        if found:
+            return found.pop()
+
+
 class UtilTestCase(BaseTestCase):
     fixtures = ['product_changes.json']
 
@@ -293,3 +317,31 @@ class MappingUtilsTestCase(BaseTestCase):
         self.assertIsNotNone(index)
         self.assertEqualCaseInsensitive(variants[index]['option1'], 'RG black')
         self.assertEqualCaseInsensitive(variants[index]['option2'], '110CM')
+
+    def test_variant_matcher(self):
+        variants = [
+            {'id': 1, 'option1': 'Red', 'option2': 'L', 'option3': None, 'sku': ''},
+            {'id': 2, 'option1': 'Blue', 'option2': 'L', 'option3': None, 'sku': '14:175;5:361385'},
+            {'id': 3, 'option1': 'Green', 'option2': 'XL', 'option3': None, 'sku': ''},
+        ]
+
+        mapping = {
+            1: [{'title': 'Red', 'sku': 'sku-1-472496'}, {'title': 'L', 'sku': 'sku-2-361385'}],
+        }
+
+        product = Mock()
+        product.get_variant_mapping.side_effect = lambda variant_id, for_extension: mapping.get(variant_id)
+
+        matcher = VariantMatcher(product, variants)
+        self.assertEqual(product.get_variant_mapping.call_count, len(variants))
+
+        skus = [
+            '1100:472496#Red;774888:361385#L',  # Mapping SKU
+            '14:175#Sky Blue;5:361385#L;200007763:201336100#China',  # Store variant SKU without shipping
+            '1100:1#Red;774888:2#L',  # Mapping title
+            '14:999#Green;5:100#XL',  # Store variant title
+            '14:999#Yellow;5:100#XL',  # No match
+        ]
+
+        self.assertEqual([matcher.match(sku) for sku in skus], [0, 1, 0, 2, None])
+        self.assertEqual([matcher.match(sku) for sku in skus], [match_variant_index(product, sku, variants) for sku in skus])
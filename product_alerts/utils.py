@@ -4,7 +4,6 @@ from django.conf import settings
 from lib.exceptions import capture_exception
 
 import requests
-from munch import Munch
 
 from shopified_core.utils import app_link, url_join, safe_float, safe_int
 
@@ -328,42 +327,121 @@ def match_sku_title_with_shopify_variant_title(sku, variant):
     return ali_sku_titles.lower() == shopify_titles.lower()
 
 
-def variant_index_from_supplier_sku(product, sku, variants=None):
-    match = Munch(dict(
-        sku_mapping_sku=[],
-        sku_shopify_sku=[],
-        title_mapping_title=[],
-        title_shopify_title=[],
-    ))
-
-    if not sku:
-        if variants and len(variants) == 1:
-            return 0
-
-    if variants:
-        for idx, variant in enumerate(variants):
+def _clean_supplier_sku(options, remove_shipping=False, ids_only=False):
+    if remove_shipping:
+        options = [k for k in options if k['option_group'] != '200007763']
+
+    if ids_only:
+        return ';'.join(sorted(option['option_id'] for option in options))
+    else:
+        return ';'.join(f"{option['option_group']}:{option['option_id']}" for option in options)
+
+
+class VariantMatcher:
+    """ Find the store variant matching a supplier SKU
+
+    Same matching rules as match_sku_with_mapping_sku, match_sku_with_shopify_sku,
+    match_sku_title_with_mapping_title and match_sku_title_with_shopify_variant_title
+    but the variants mapping and SKUs are parsed once when the matcher is created,
+    build one matcher per product and call `match` for each supplier variant
+
+    Args:
+        product: Store product, used to get the variants mapping
+        variants: Store variants list
+    """
+
+    def __init__(self, product, variants=None):
+        self.variants = variants or []
+
+        # Each index maps a normalized key to the indexes of the variants having this key
+        self.mapping_skus = {}  # (mapping length, mapping SKUs)
+        self.shopify_skus = {}  # (parsed SKU length, remove shipping, clean SKU)
+        self.mapping_titles = {}
+        self.shopify_titles = {}
+
+        for idx, variant in enumerate(self.variants):
             variant_id = variant['id'] if 'id' in variant else variant.get('id_product_variant')  # TODO: excption for GKart
             mapping = product.get_variant_mapping(variant_id, for_extension=True)
-            if mapping and match_sku_with_mapping_sku(sku, mapping):
-                match.sku_mapping_sku.append(idx)
-
-            elif variant.get('sku') and match_sku_with_shopify_sku(sku, variant.get('sku')):
-                match.sku_shopify_sku.append(idx)
-
-            elif mapping and match_sku_title_with_mapping_title(sku, mapping):
-                match.title_mapping_title.append(idx)
-
-            elif match_sku_title_with_shopify_variant_title(sku, variant):
-                match.title_shopify_title.append(idx)
-
-    if match.sku_mapping_sku:
-        return match.sku_mapping_sku.pop()
-    elif match.sku_shopify_sku:
-        return match.sku_shopify_sku.pop()
-    elif match.title_mapping_title:
-        return match.title_mapping_title.pop()
-    elif match.title_shopify_title:
-        return match.title_shopify_title.pop()
+
+            if mapping:
+                # Remove "sku-n-" from old Aliexpress mapping and join them to look like Aliexpress SKU
+                mapping_skus = ';'.join(sorted([i['sku'].split('-').pop() for i in mapping if isinstance(i, dict) and i.get('sku')]))
+                self._add(self.mapping_skus, (len(mapping), mapping_skus), idx)
+
+                mapping_titles = []
+                for i in mapping:
+                    if type(i) is dict and i.get('title'):
+                        mapping_titles.append(i['title'])
+                    elif type(i) is str:
+                        mapping_titles.append(i)
+
+                self._add(self.mapping_titles, ';'.join(sorted(mapping_titles)).lower(), idx)
+
+            if variant.get('sku'):
+                options = parse_supplier_sku(variant['sku'], sort=True)
+                for remove_shipping in [False, True]:
+                    self._add(self.shopify_skus, (len(options), remove_shipping, _clean_supplier_sku(options, remove_shipping)), idx)
+
+            self._add(self.shopify_titles, self._variant_titles(variant).lower(), idx)
+
+        self.mapping_lengths = set([k[0] for k in self.mapping_skus])
+        self.sku_lengths = set([k[0] for k in self.shopify_skus])
+
+    def _add(self, index, key, idx):
+        index.setdefault(key, []).append(idx)
+
+    def _variant_titles(self, variant):
+        options = []
+        if 'option1' in variant:
+            # Shopify
+            options = [j for j in [variant['option1'], variant['option2'], variant['option3']] if bool(j)]
+        elif 'variant' in variant:
+            # CHQ
+            options = variant['variant']
+        elif 'variant_name' in variant:
+            # GKart, TODO: need handling other variant names, also SKU
+            options = [j for j in [variant['variant_name']] if bool(j)]
+
+        return ';'.join(sorted(options))
+
+    def match(self, sku):
+        """ Return the index of the variant matching the supplier `sku` or None """
+
+        if not sku:
+            if len(self.variants) == 1:
+                return 0
+
+        options = parse_supplier_sku(sku, sort=True)
+
+        found = set()
+        for length in self.mapping_lengths:
+            remove_shipping = len(options) != length
+            found.update(self.mapping_skus.get((length, _clean_supplier_sku(options, remove_shipping)), []))
+            found.update(self.mapping_skus.get((length, _clean_supplier_sku(options, remove_shipping, ids_only=True)), []))
+
+        if found:
+            return max(found)
+
+        for length in self.sku_lengths:
+            remove_shipping = len(options) != length
+            found.update(self.shopify_skus.get((length, remove_shipping, _clean_supplier_sku(options, remove_shipping)), []))
+
+        if found:
+            return max(found)
+
+        titles = ';'.join(sorted(option['option_title'] for option in options)).lower()
+        for index in [self.mapping_titles, self.shopify_titles]:
+            if titles in index:
+                return max(index[titles])
+
+
+def variant_index_from_supplier_sku(product, sku, variants=None):
+    """ Find the index of the variant matching `sku`, use VariantMatcher directly when matching many SKUs """
+
+    if not variants:
+        return None
+
+    return VariantMatcher(product, variants).match(sku)
 
 
 def calculate_price(user, old_value, new_value, current_price, current_compare_at, price_update_method, markup_rules):
@@ -8,7 +8,7 @@ from leadgalaxy.models import ShopifyProduct
 from shopified_core.models import ProductBase
 from woocommerce_core.models import WooProduct
 
-from .tasks import index_product_task, delete_product_task
+from .utils import queue_product_index
 
 
 @receiver(post_save, sender=ShopifyProduct)
@@ -18,7 +18,7 @@ from .tasks import index_product_task, delete_product_task
 @receiver(post_save, sender=BigCommerceProduct)
 def product_update_es_signal(sender, instance: ProductBase, created, **kwargs):
     if instance.user.profile.index_products:
-        index_product_task.delay(instance.id, sender.__name__)
+        queue_product_index(instance.id, sender.__name__)
 
 
 @receiver(post_delete, sender=ShopifyProduct)
@@ -28,4 +28,4 @@ def product_update_es_signal(sender, instance: ProductBase, created, **kwargs):
 @receiver(post_delete, sender=BigCommerceProduct)
 def product_delete_es_signal(sender, instance, **kwargs):
     if instance.user.profile.index_products:
-        delete_product_task.delay(instance.id, sender.__name__)
+        queue_product_index(instance.id, sender.__name__, deleted=True)
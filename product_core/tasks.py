@@ -1,6 +1,6 @@
 from app.celery_base import celery_app, CaptureFailure
 from lib.exceptions import capture_exception
-from product_core.utils import update_product_es, delete_product_es
+from product_core.utils import PRODUCTS_INDEX_QUEUE, bulk_index_products, update_product_es, delete_product_es
 from shopified_core.models_utils import get_product_model
 
 
@@ -19,3 +19,11 @@ def delete_product_task(self, product_id, platform):
         delete_product_es(product_id, platform)
     except:
         capture_exception(level='warning')
+
+
+@celery_app.task(base=CaptureFailure, ignore_result=True)
+def flush_products_index(batch_size=1000, max_batches=20):
+    """ Index the products queued by `queue_product_index` (scheduled by Celery beat) """
+
+    # Actions rejected by a temporary Elasticsearch error are sent again by the next run
+    PRODUCTS_INDEX_QUEUE.process(bulk_index_products, batch_size, max_batches)
@@ -1,10 +1,28 @@
+from collections import defaultdict
+
+from elasticsearch.helpers import streaming_bulk
+
+from lib.exceptions import capture_exception, capture_message
 from shopified_core.models import ProductBase
 from shopified_core.models_utils import get_product_model
 
-from shopified_core.utils import safe_str
+from shopified_core.utils import RedisSetQueue, safe_str
 from shopify_orders.utils import get_elastic
 
 
+def _dump_queued_product(product):
+    return '{}:{}'.format(*product)
+
+
+def _load_queued_product(member):
+    platform, product_id = member.split(':')
+    return platform, int(product_id)
+
+
+# (platform, product ID) of the products waiting to be indexed
+PRODUCTS_INDEX_QUEUE = RedisSetQueue('products_index_queue', dumps=_dump_queued_product, loads=_load_queued_product)
+
+
 def format_model_id(model, model_id=None, model_name=None):
     if model_id is None:
         model_id = model.id
@@ -69,3 +87,75 @@ def delete_product_es(product_id, platform):
             doc_type="product",
             id=format_model_id(None, product_id, platform)
         )
+
+
+def queue_product_index(product_id, platform, deleted=False):
+    """Queue the product to be indexed (or removed if deleted) by the next `flush_products_index` task run"""
+
+    try:
+        PRODUCTS_INDEX_QUEUE.add([(platform, product_id)])
+    except:
+        capture_exception(level='warning')
+
+        from .tasks import index_product_task, delete_product_task
+        if deleted:
+            delete_product_task.delay(product_id, platform)
+        else:
+            index_product_task.delay(product_id, platform)
+
+
+def get_products_index_actions(products):
+    """Index documents for existing products and delete actions for the removed ones"""
+
+    platforms = defaultdict(set)
+    for platform, product_id in products:
+        platforms[platform].add(product_id)
+
+    for platform, product_ids in platforms.items():
+        model = get_product_model(platform)
+        for product in model.objects.filter(id__in=product_ids):
+            product_ids.discard(product.id)
+            yield get_dataset(product, platform)
+
+        for product_id in product_ids:
+            yield {
+                "_op_type": "delete",
+                "_index": "products-index",
+                "_type": "product",
+                "_id": format_model_id(None, product_id, platform),
+            }
+
+
+def bulk_index_products(products):
+    """Send the queued products changes in bulk requests
+
+    Returns:
+        (list): (platform, product ID) of the actions that failed with a temporary error and can be retried
+    """
+
+    es = get_elastic()
+    if not es:
+        return []
+
+    products_ids = {format_model_id(None, product_id, platform): (platform, product_id) for platform, product_id in products}
+
+    retry = []
+    failed = []
+    actions = get_products_index_actions(products)
+    for ok, item in streaming_bulk(es, actions, chunk_size=500, raise_on_error=False):
+        if ok:
+            continue
+
+        op_type, result = list(item.items())[0]
+        if op_type == 'delete' and result.get('status') == 404:
+            continue
+
+        if result.get('status') == 429 or result.get('status', 500) >= 500:
+            retry.append(products_ids[result['_id']])
+        else:
+            failed.append(result['_id'])
+
+    if failed:
+        capture_message('Products Index Errors', level='warning', extra={'products': failed[:100], 'count': len(failed)})
+
+    return retry
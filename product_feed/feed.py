@@ -1,21 +1,28 @@
 from django.utils.html import strip_tags
 from django.utils import timezone
 from django.conf import settings
+from django.core.cache import cache
+from django.db import connection
 
+import hashlib
+import io
+import json
 import os
 import re
 import time
 
 from math import ceil
+from queue import Queue
 from tempfile import NamedTemporaryFile
+from threading import Thread
 from urllib.parse import urlparse
 
 from loxun import XmlWriter
 
+from lib.exceptions import capture_exception
 from shopified_core.utils import safe_str, safe_int
 from leadgalaxy.utils import (
-    aws_s3_upload,
-    get_shopify_products_count,
+    AwsS3MultipartUpload,
     get_shopify_products
 )
 
@@ -46,10 +53,46 @@ from .models import (
 )
 
 
-class ProductFeed():
+class FeedFragmentStream():
+    """ XmlWriter output that can capture the XML of a single product instead of writing it """
+
+    def __init__(self, out):
+        self.out = out
+        self.fragment = None
+
+    def write(self, data):
+        if self.fragment is not None:
+            self.fragment.write(data)
+        else:
+            self.out.write(data)
+
+    def start_fragment(self):
+        self.fragment = io.BytesIO()
+
+    def end_fragment(self):
+        fragment = self.fragment.getvalue()
+        self.fragment = None
+
+        return fragment
+
+    def write_fragment(self, fragment):
+        self.out.write(fragment)
+
+
+class ProductFeedBase():
+    """ Shared feed pipeline
+
+    Platform feeds provide their products with the `get_products` generator and turn
+    each product into `<item>` elements with `add_product`, the channel header, the
+    item writer and the output stream are common to all of them.
+    """
+
+    out_prefix = 'feed_'
+    revision_filename = True  # Separate file for each feed revision
+
     def __init__(self, store, revision=1, all_variants=True, include_variants=True, default_product_category='', feed=None):
         self.store = store
-        self.info = store.get_info
+        self.info = self.get_store_info()
 
         self.currency = self.info['currency']
         self.domain = self.info['domain']
@@ -65,14 +108,44 @@ class ProductFeed():
         else:
             self.google_settings = {}
 
+    def get_store_info(self):
+        domain = urlparse(self.store.api_url).netloc
+        return {'currency': self._get_store_currency(), 'domain': domain, 'name': self.store.title}
+
+    def get_store_link(self):
+        return self.store.get_store_url()
+
+    def _get_store_currency(self):
+        return 'USD'
+
     def _add_element(self, tag, text):
         self.writer.startTag(tag)
         self.writer.text(text)
         self.writer.endTag()
 
-    def init(self):
-        self.out = NamedTemporaryFile(suffix='.xml', prefix='feed_', delete=False)
-        self.writer = XmlWriter(self.out, pretty=True, indent='')
+    def _add_item(self, elements):
+        self.writer.startTag('item')
+
+        for tag, text in elements:
+            self._add_element(tag, text)
+
+        self.writer.endTag()
+
+    def _google_elements(self, mpn):
+        return [
+            ('g:age_group', self.google_settings.get('age_group') or 'Adult'),
+            ('g:gender', self.google_settings.get('gender') or 'Unisex'),
+            ('g:brand', self.google_settings.get('brand_name', self.store.title)),
+            ('g:mpn', mpn),
+        ]
+
+    def init(self, out=None):
+        if out is None:
+            out = NamedTemporaryFile(suffix='.xml', prefix=self.out_prefix, delete=False)
+
+        self.out = out
+        self.stream = FeedFragmentStream(self.out)
+        self.writer = XmlWriter(self.stream, pretty=True, indent='')
 
         self.writer.addNamespace("g", "http://base.google.com/ns/1.0")
 
@@ -80,7 +153,7 @@ class ProductFeed():
         self.writer.startTag("channel")
 
         self._add_element('title', self.info['name'])
-        self._add_element('link', 'https://{}'.format(self.info['domain']))
+        self._add_element('link', self.get_store_link())
         self._add_element('description', '{} Products Feed'.format(self.info['name']))
 
     def save(self):
@@ -92,18 +165,114 @@ class ProductFeed():
 
         return self.out
 
+    def get_products(self):
+        raise NotImplementedError
+
+    def add_product(self, product):
+        raise NotImplementedError
+
     def generate_feed(self):
-        count = get_shopify_products_count(self.store)
+        for product in self.get_products():
+            self.add_product(product)
 
-        if not count:
-            return
+    def out_file(self):
+        return self.out
 
-        if count > 5000:
-            print('Ignore Feed for ', self.store.shop, 'with', count, 'Products')
-            return
+    def out_filename(self):
+        return self.out.name
+
+    def delete_out(self):
+        os.unlink(self.out.name)
+
+
+class ProductFeed(ProductFeedBase):
+    page_limit = 250
+    fragment_timeout = 60 * 60 * 24 * 7
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        # Rendered items are only valid for the feed settings they were rendered with
+        self.fragment_version = hashlib.md5(json.dumps([
+            self.revision,
+            self.all_variants,
+            self.include_variants,
+            self.default_product_category,
+            self.google_settings,
+            self.currency,
+            self.domain,
+            self.store.title,
+        ], sort_keys=True).encode()).hexdigest()[:8]
 
-        for p in get_shopify_products(store=self.store, all_products=True):
-            self.add_product(p)
+    def get_store_info(self):
+        return self.store.get_info
+
+    def get_store_link(self):
+        return 'https://{}'.format(self.info['domain'])
+
+    def get_products(self):
+        for page in self._get_products_pages():
+            yield from page
+
+    def generate_feed(self):
+        """ Stream the store products to the feed one page at a time
+
+        Only product IDs and update dates are listed, products that changed since
+        their item was rendered are fetched in full and rendered again, the others
+        are written from the fragment cache.
+        """
+
+        for page in self._get_products_pages(fields='id,updated_at'):
+            fragment_keys = {p['id']: self._fragment_key(p['id']) for p in page}
+            fragments = cache.get_many(list(fragment_keys.values()))
+
+            changed_ids = []
+            for p in page:
+                fragment = fragments.get(fragment_keys[p['id']])
+                if not fragment or fragment['updated_at'] != p['updated_at']:
+                    changed_ids.append(str(p['id']))
+
+            if changed_ids:
+                rendered = {}
+                products = get_shopify_products(store=self.store, product_ids=changed_ids, limit=len(changed_ids))
+                for product in products:
+                    rendered[fragment_keys[product['id']]] = {
+                        'updated_at': product['updated_at'],
+                        'xml': self._render_product(product),
+                    }
+
+                fragments.update(rendered)
+
+                cache.set_many(rendered, timeout=self.fragment_timeout)
+
+            for p in page:
+                fragment = fragments.get(fragment_keys[p['id']])
+                if fragment:
+                    self.stream.write_fragment(fragment['xml'])
+
+    def _get_products_pages(self, fields=None):
+        next_page_url = None
+        while True:
+            links, products = get_shopify_products(store=self.store, page_url=next_page_url, limit=self.page_limit,
+                                                   fields=fields, return_links=True)
+            if products:
+                yield products
+
+            next_page_url = links.get('next', {}).get('url')
+            if not next_page_url:
+                break
+
+    def _fragment_key(self, product_id):
+        return 'feed_item_{}_{}_{}'.format(self.store.id, self.fragment_version, product_id)
+
+    def _render_product(self, product):
+        self.stream.start_fragment()
+        try:
+            self.add_product(product)
+        finally:
+            fragment = self.stream.end_fragment()
+
+        return fragment
 
     def add_product(self, product):
         if len(product['variants']) and product.get('published_at'):
@@ -129,8 +298,6 @@ class ProductFeed():
         else:
             return None
 
-        self.writer.startTag('item')
-
         if variant_id is None:
             variant_id = variant['id']
 
@@ -138,30 +305,31 @@ class ProductFeed():
             image = self.images_map[variant['image_id']]
 
         if self.revision == 1:
-            self._add_element('g:id', 'store_{p[id]}_{v[id]}'.format(p=product, v=variant))
+            elements = [('g:id', 'store_{p[id]}_{v[id]}'.format(p=product, v=variant))]
         else:
-            self._add_element('g:id', 'shopify_{}'.format(variant_id))
-            self._add_element('g:item_group_id', '{}'.format(variant_id))
-
-        self._add_element('g:link', 'https://{domain}/products/{p[handle]}?variant={v[id]}'.format(domain=self.domain, p=product, v=variant))
-        self._add_element('g:title', product.get('title'))
-        self._add_element('g:description', self._clean_description(product))
-        self._add_element('g:image_link', image)
-        self._add_element('g:price', '{amount} {currency}'.format(amount=variant.get('price'), currency=self.currency))
-        self._add_element('g:shipping_weight', '{variant[weight]} {variant[weight_unit]}'.format(variant=variant))
-        self._add_element('g:google_product_category', safe_str(product.get('product_type') or self.default_product_category))
-        self._add_element('g:availability', 'in stock')
-        self._add_element('g:condition', 'new')
+            elements = [
+                ('g:id', 'shopify_{}'.format(variant_id)),
+                ('g:item_group_id', '{}'.format(variant_id)),
+            ]
+
+        elements += [
+            ('g:link', 'https://{domain}/products/{p[handle]}?variant={v[id]}'.format(domain=self.domain, p=product, v=variant)),
+            ('g:title', product.get('title')),
+            ('g:description', self._clean_description(product)),
+            ('g:image_link', image),
+            ('g:price', '{amount} {currency}'.format(amount=variant.get('price'), currency=self.currency)),
+            ('g:shipping_weight', '{variant[weight]} {variant[weight_unit]}'.format(variant=variant)),
+            ('g:google_product_category', safe_str(product.get('product_type') or self.default_product_category)),
+            ('g:availability', 'in stock'),
+            ('g:condition', 'new'),
+        ]
 
         if self.revision == 3:
-            self._add_element('g:age_group', self.google_settings.get('age_group') or 'Adult')
-            self._add_element('g:gender', self.google_settings.get('gender') or 'Unisex')
-            self._add_element('g:brand', self.google_settings.get('brand_name', self.store.title))
-            self._add_element('g:mpn', 'store_{p[id]}_{v[id]}'.format(p=product, v=variant))
+            elements += self._google_elements('store_{p[id]}_{v[id]}'.format(p=product, v=variant))
         else:
-            self._add_element('g:brand', product.get('vendor'))
+            elements.append(('g:brand', product.get('vendor')))
 
-        self.writer.endTag()
+        self._add_item(elements)
 
     def _clean_description(self, product):
         text = product.get('body_html') or ''
@@ -178,65 +346,12 @@ class ProductFeed():
 
         return text
 
-    def out_file(self):
-        return self.out
-
-    def out_filename(self):
-        return self.out.name
-
-    def delete_out(self):
-        os.unlink(self.out.name)
-
-
-class CommerceHQProductFeed():
-    def __init__(self, store, revision=1, all_variants=True, include_variants=True, default_product_category='', feed=None):
-        self.store = store
-
-        domain = urlparse(store.api_url).netloc
-        self.info = {'currency': 'USD', 'domain': domain, 'name': store.title}
-
-        self.currency = self.info['currency']
-        self.domain = self.info['domain']
-
-        self.revision = safe_int(revision, 1)
-        self.all_variants = all_variants
-        self.include_variants = include_variants
-        self.default_product_category = default_product_category
-
-        self.feed = feed
-        if feed:
-            self.google_settings = self.feed.get_google_settings()
-        else:
-            self.google_settings = {}
-
-    def _add_element(self, tag, text):
-        self.writer.startTag(tag)
-        self.writer.text(text)
-        self.writer.endTag()
 
-    def init(self):
-        self.out = NamedTemporaryFile(suffix='.xml', prefix='chq_feed_', delete=False)
-        self.writer = XmlWriter(self.out, pretty=True, indent='')
+class CommerceHQProductFeed(ProductFeedBase):
+    out_prefix = 'chq_feed_'
+    revision_filename = False
 
-        self.writer.addNamespace("g", "http://base.google.com/ns/1.0")
-
-        self.writer.startTag("rss", {"version": "2.0"})
-        self.writer.startTag("channel")
-
-        self._add_element('title', self.store.title)
-        self._add_element('link', self.store.get_store_url())
-        self._add_element('description', '{} Products Feed'.format(self.store.title))
-
-    def save(self):
-        self.writer.endTag()
-        self.writer.endTag()
-        self.writer.close()
-
-        self.out.close()
-
-        return self.out
-
-    def generate_feed(self):
+    def get_products(self):
         limit = 200
         count = get_chq_products_count(self.store)
 
@@ -249,9 +364,7 @@ class CommerceHQProductFeed():
 
         pages = int(ceil(count / float(limit)))
         for page in range(1, pages + 1):
-            products = get_chq_products(store=self.store, page=page, limit=limit, all_products=False)
-            for p in products:
-                self.add_product(p)
+            yield from get_chq_products(store=self.store, page=page, limit=limit, all_products=False)
 
     def add_product(self, product):
         if product.get('is_draft'):
@@ -266,7 +379,7 @@ class CommerceHQProductFeed():
         else:
             self._add_variant(product, None)
 
-    def _add_variant(self, product, variant, variant_id=None):
+    def _add_variant(self, product, variant):
         if variant is None:
             variant = {
                 'id': 0,
@@ -280,93 +393,36 @@ class CommerceHQProductFeed():
         else:
             image = self.store.get_store_url()
 
-        self.writer.startTag('item')
-
-        if variant_id is None:
-            variant_id = variant['id']
-
-        self._add_element('g:id', 'store_{p[id]}_{v[id]}'.format(p=product, v=variant))
-
-        self._add_element('g:link', self.store.get_store_url('products', product['seo_url']))
-        self._add_element('g:title', product.get('title'))
-        self._add_element('g:description', product.get('title'))
-        self._add_element('g:image_link', image)
-        self._add_element('g:price', '{amount} {currency}'.format(amount=variant.get('price'), currency=self.currency))
-        self._add_element('g:shipping_weight', '{product[shipping_weight]} kg'.format(product=product))
-        self._add_element('g:google_product_category', safe_str(product.get('type') or self.default_product_category))
-        self._add_element('g:availability', 'in stock')
-        self._add_element('g:condition', 'new')
+        elements = [
+            ('g:id', 'store_{p[id]}_{v[id]}'.format(p=product, v=variant)),
+            ('g:link', self.store.get_store_url('products', product['seo_url'])),
+            ('g:title', product.get('title')),
+            ('g:description', product.get('title')),
+            ('g:image_link', image),
+            ('g:price', '{amount} {currency}'.format(amount=variant.get('price'), currency=self.currency)),
+            ('g:shipping_weight', '{product[shipping_weight]} kg'.format(product=product)),
+            ('g:google_product_category', safe_str(product.get('type') or self.default_product_category)),
+            ('g:availability', 'in stock'),
+            ('g:condition', 'new'),
+        ]
 
         if self.revision == 3:
-            self._add_element('g:age_group', self.google_settings.get('age_group') or 'Adult')
-            self._add_element('g:gender', self.google_settings.get('gender') or 'Unisex')
-            self._add_element('g:brand', self.google_settings.get('brand_name', self.store.title))
-            self._add_element('g:mpn', 'store_{}_{}'.format(product['id'], variant['id']))
+            elements += self._google_elements('store_{}_{}'.format(product['id'], variant['id']))
         else:
-            self._add_element('g:brand', product.get('vendor') or '')
+            elements.append(('g:brand', product.get('vendor') or ''))
 
-        self.writer.endTag()
+        self._add_item(elements)
 
-    def out_file(self):
-        return self.out
 
-    def out_filename(self):
-        return self.out.name
-
-    def delete_out(self):
-        os.unlink(self.out.name)
-
-
-class WooProductFeed():
-    def __init__(self, store, revision=1, all_variants=True, include_variants=True, default_product_category='', feed=None):
-        self.store = store
-
-        domain = urlparse(store.api_url).netloc
-        self.info = {'currency': self._get_store_currency(), 'domain': domain, 'name': store.title}
+class WooProductFeed(ProductFeedBase):
+    out_prefix = 'woo_feed_'
 
-        self.currency = self.info['currency']
-        self.domain = self.info['domain']
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
 
-        self.revision = safe_int(revision, 1)
-        self.all_variants = all_variants
-        self.include_variants = include_variants
-        self.default_product_category = default_product_category
         self.weight_unit = self._get_store_weight_unit()
 
-        self.feed = feed
-        if feed:
-            self.google_settings = self.feed.get_google_settings()
-        else:
-            self.google_settings = {}
-
-    def _add_element(self, tag, text):
-        self.writer.startTag(tag)
-        self.writer.text(text)
-        self.writer.endTag()
-
-    def init(self):
-        self.out = NamedTemporaryFile(suffix='.xml', prefix='woo_feed_', delete=False)
-        self.writer = XmlWriter(self.out, pretty=True, indent='')
-
-        self.writer.addNamespace("g", "http://base.google.com/ns/1.0")
-
-        self.writer.startTag("rss", {"version": "2.0"})
-        self.writer.startTag("channel")
-
-        self._add_element('title', self.store.title)
-        self._add_element('link', self.store.get_store_url())
-        self._add_element('description', '{} Products Feed'.format(self.store.title))
-
-    def save(self):
-        self.writer.endTag()
-        self.writer.endTag()
-        self.writer.close()
-
-        self.out.close()
-
-        return self.out
-
-    def generate_feed(self):
+    def get_products(self):
         limit = 100
         count = get_woo_products_count(self.store)
 
@@ -375,9 +431,7 @@ class WooProductFeed():
 
         pages = int(ceil(count / float(limit)))
         for page in range(1, pages + 1):
-            products = get_woo_products(store=self.store, page=page, limit=limit, all_products=False)
-            for p in products:
-                self.add_product(p)
+            yield from get_woo_products(store=self.store, page=page, limit=limit, all_products=False)
 
     def add_product(self, product):
         if not product['status'] == 'publish':
@@ -432,93 +486,41 @@ class WooProductFeed():
         if variant is None:
             variant = {'id': 0}
 
-        self.writer.startTag('item')
-
         if self.revision == 1:
-            self._add_element('g:id', 'store_{p[id]}_{v[id]}'.format(p=product, v=variant))
+            elements = [('g:id', 'store_{p[id]}_{v[id]}'.format(p=product, v=variant))]
         else:
-            self._add_element('g:id', 'woocommerce_{}'.format(variant['id']))
-            self._add_element('g:item_group_id', '{}'.format(variant['id']))
-
-        self._add_element('g:link', element['permalink'])
-        self._add_element('g:title', product.get('name', ''))
-        self._add_element('g:description', element['description'])
-        self._add_element('g:image_link', image)
-
-        self._add_element('g:price', '{amount} {currency}'.format(amount=element['price'], currency=self.currency))
-        self._add_element('g:shipping_weight', '{} {}'.format(element['weight'], self.weight_unit))
-        self._add_element('g:google_product_category', self.default_product_category)
-        self._add_element('g:availability', 'in stock')
-        self._add_element('g:condition', 'new')
+            elements = [
+                ('g:id', 'woocommerce_{}'.format(variant['id'])),
+                ('g:item_group_id', '{}'.format(variant['id'])),
+            ]
+
+        elements += [
+            ('g:link', element['permalink']),
+            ('g:title', product.get('name', '')),
+            ('g:description', element['description']),
+            ('g:image_link', image),
+            ('g:price', '{amount} {currency}'.format(amount=element['price'], currency=self.currency)),
+            ('g:shipping_weight', '{} {}'.format(element['weight'], self.weight_unit)),
+            ('g:google_product_category', self.default_product_category),
+            ('g:availability', 'in stock'),
+            ('g:condition', 'new'),
+        ]
 
         if self.revision == 3:
-            self._add_element('g:age_group', self.google_settings.get('age_group') or 'Adult')
-            self._add_element('g:gender', self.google_settings.get('gender') or 'Unisex')
-            self._add_element('g:brand', self.google_settings.get('brand_name', self.store.title))
-            self._add_element('g:mpn', 'store_{}_{}'.format(element['id'], variant['id']))
+            elements += self._google_elements('store_{}_{}'.format(element['id'], variant['id']))
 
-        self.writer.endTag()
+        self._add_item(elements)
 
-    def out_file(self):
-        return self.out
 
-    def out_filename(self):
-        return self.out.name
-
-    def delete_out(self):
-        os.unlink(self.out.name)
+class BigCommerceProductFeed(ProductFeedBase):
+    out_prefix = 'bigcommerce_feed_'
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
 
-class BigCommerceProductFeed():
-    def __init__(self, store, revision=1, all_variants=True, include_variants=True, default_product_category='', feed=None):
-        self.store = store
-
-        domain = urlparse(store.api_url).netloc
-        self.info = {'currency': self._get_store_currency(), 'domain': domain, 'name': store.title}
-
-        self.currency = self.info['currency']
-        self.domain = self.info['domain']
-
-        self.revision = safe_int(revision, 1)
-        self.all_variants = all_variants
-        self.include_variants = include_variants
-        self.default_product_category = default_product_category
         self.weight_unit = self._get_store_weight_unit()
 
-        self.feed = feed
-        if feed:
-            self.google_settings = self.feed.get_google_settings()
-        else:
-            self.google_settings = {}
-
-    def _add_element(self, tag, text):
-        self.writer.startTag(tag)
-        self.writer.text(text)
-        self.writer.endTag()
-
-    def init(self):
-        self.out = NamedTemporaryFile(suffix='.xml', prefix='bigcommerce_feed_', delete=False)
-        self.writer = XmlWriter(self.out, pretty=True, indent='')
-
-        self.writer.addNamespace("g", "http://base.google.com/ns/1.0")
-
-        self.writer.startTag("rss", {"version": "2.0"})
-        self.writer.startTag("channel")
-
-        self._add_element('title', self.store.title)
-        self._add_element('link', self.store.get_store_url())
-        self._add_element('description', '{} Products Feed'.format(self.store.title))
-
-    def save(self):
-        self.writer.endTag()
-        self.writer.endTag()
-        self.writer.close()
-
-        self.out.close()
-
-        return self.out
-
-    def generate_feed(self):
+    def get_products(self):
         limit = 100
         count = get_bigcommerce_products_count(self.store)
 
@@ -527,9 +529,7 @@ class BigCommerceProductFeed():
 
         pages = int(ceil(count / float(limit)))
         for page in range(1, pages + 1):
-            products = get_bigcommerce_products(store=self.store, page=page, limit=limit, all_products=False)
-            for p in products:
-                self.add_product(p)
+            yield from get_bigcommerce_products(store=self.store, page=page, limit=limit, all_products=False)
 
     def add_product(self, product):
         if not product['is_visible']:
@@ -570,81 +570,42 @@ class BigCommerceProductFeed():
         if variant is None:
             variant = {'id': 0}
 
-        self.writer.startTag('item')
-
         if self.revision == 1:
-            self._add_element('g:id', 'store_{p[id]}_{v[id]}'.format(p=product, v=variant))
+            elements = [('g:id', 'store_{p[id]}_{v[id]}'.format(p=product, v=variant))]
         else:
-            self._add_element('g:id', 'bigcommerce_{}'.format(variant['id']))
-            self._add_element('g:item_group_id', '{}'.format(variant['id']))
-
-        self._add_element('g:link', product.get('custom_url', {}).get('url', ''))
-        self._add_element('g:title', product.get('name', ''))
-        self._add_element('g:description', product.get('name', ''))
-        self._add_element('g:image_link', image)
-
-        self._add_element('g:price', '{amount} {currency}'.format(amount=element['price'], currency=self.currency))
-        self._add_element('g:shipping_weight', '{} {}'.format(element['weight'], self.weight_unit))
-        self._add_element('g:google_product_category', self.default_product_category)
-        self._add_element('g:availability', 'in stock')
-        self._add_element('g:condition', 'new')
+            elements = [
+                ('g:id', 'bigcommerce_{}'.format(variant['id'])),
+                ('g:item_group_id', '{}'.format(variant['id'])),
+            ]
+
+        elements += [
+            ('g:link', product.get('custom_url', {}).get('url', '')),
+            ('g:title', product.get('name', '')),
+            ('g:description', product.get('name', '')),
+            ('g:image_link', image),
+            ('g:price', '{amount} {currency}'.format(amount=element['price'], currency=self.currency)),
+            ('g:shipping_weight', '{} {}'.format(element['weight'], self.weight_unit)),
+            ('g:google_product_category', self.default_product_category),
+            ('g:availability', 'in stock'),
+            ('g:condition', 'new'),
+        ]
 
         if self.revision == 3:
-            self._add_element('g:age_group', self.google_settings.get('age_group') or 'Adult')
-            self._add_element('g:gender', self.google_settings.get('gender') or 'Unisex')
-            self._add_element('g:brand', self.google_settings.get('brand_name', self.store.title))
-            self._add_element('g:mpn', 'store_{}_{}'.format(element['id'], variant['id']))
-
-        self.writer.endTag()
-
-    def out_file(self):
-        return self.out
-
-    def out_filename(self):
-        return self.out.name
-
-    def delete_out(self):
-        os.unlink(self.out.name)
-
-
-class GearBubbleProductFeed(object):
-    def __init__(self, store, revision=1, all_variants=True, include_variants=True, default_product_category=''):
-        domain = urlparse(store.get_api_url('')).netloc
-        self.info = {'currency': self._get_store_currency(), 'domain': domain, 'name': store.title}
-        self.store = store
-        self.currency = self.info['currency']
-        self.domain = self.info['domain']
-        self.revision = safe_int(revision, 1)
-        self.all_variants = all_variants
-        self.include_variants = include_variants
-        self.default_product_category = default_product_category
+            elements += self._google_elements('store_{}_{}'.format(element['id'], variant['id']))
 
-    def _add_element(self, tag, text):
-        self.writer.startTag(tag)
-        self.writer.text(text)
-        self.writer.endTag()
+        self._add_item(elements)
 
-    def init(self):
-        self.out = NamedTemporaryFile(suffix='.xml', prefix='gear_feed_', delete=False)
-        self.writer = XmlWriter(self.out, pretty=True, indent='')
-        self.writer.addNamespace("g", "http://base.google.com/ns/1.0")
-        self.writer.startTag("rss", {"version": "2.0"})
-        self.writer.startTag("channel")
-        self._add_element('title', self.store.title)
-        self._add_element('link', self.store.get_store_url())
-        self._add_element('description', '{} Products Feed'.format(self.store.title))
 
-    def save(self):
-        self.writer.endTag()
-        self.writer.endTag()
-        self.writer.close()
-        self.out.close()
+class GearBubbleProductFeed(ProductFeedBase):
+    out_prefix = 'gear_feed_'
+    revision_filename = False
 
-        return self.out
+    def get_store_info(self):
+        domain = urlparse(self.store.get_api_url('')).netloc
+        return {'currency': self._get_store_currency(), 'domain': domain, 'name': self.store.title}
 
-    def generate_feed(self):
-        for p in self.store.get_gearbubble_products():
-            self.add_product(p)
+    def get_products(self):
+        yield from self.store.get_gearbubble_products()
 
     def add_product(self, product):
         has_variants = bool(product.get('variants'))
@@ -677,84 +638,43 @@ class GearBubbleProductFeed(object):
             image = images_by_id.get(variant['image_id'], {}).get('src', '')
             variant_id = variant['id']
 
-        self.writer.startTag('item')
-
-        self._add_element('g:id', 'store_{}_{}'.format(product_data['id'], variant_id))
-        self._add_element('g:link', permalink)
-        self._add_element('g:title', product_data['title'])
-        self._add_element('g:description', description)
-        self._add_element('g:image_link', image)
+        elements = [
+            ('g:id', 'store_{}_{}'.format(product_data['id'], variant_id)),
+            ('g:link', permalink),
+            ('g:title', product_data['title']),
+            ('g:description', description),
+            ('g:image_link', image),
+        ]
 
         if variant:
-            self._add_element('g:price', '{amount} {currency}'.format(amount=variant['price'], currency=self.currency))
-            self._add_element('g:shipping_weight', '{} {}'.format(variant['weight'], variant['weight_unit']))
-
-        self._add_element('g:google_product_category', self.default_product_category)
-        self._add_element('g:availability', 'in stock')
-        self._add_element('g:condition', 'new')
-
-        self.writer.endTag()
-
-    def out_file(self):
-        return self.out
+            elements += [
+                ('g:price', '{amount} {currency}'.format(amount=variant['price'], currency=self.currency)),
+                ('g:shipping_weight', '{} {}'.format(variant['weight'], variant['weight_unit'])),
+            ]
 
-    def out_filename(self):
-        return self.out.name
-
-    def delete_out(self):
-        os.unlink(self.out.name)
-
-
-class GrooveKartProductFeed(object):
-    def __init__(self, store, revision=1, all_variants=True, include_variants=True, default_product_category='', feed=None):
-        domain = urlparse(store.get_api_url('')).netloc
-        self.store = store
-        self.info = {'currency': self._get_store_currency(), 'domain': domain, 'name': store.title}
-        self.store_categories = {c.get('id'): c.get('title') for c in get_store_categories(store)}
-
-        self.currency = self.info['currency']
-        self.domain = self.info['domain']
-
-        self.revision = safe_int(revision, 1)  # 1,2: For FaceBook - 3: For Google
-        self.all_variants = all_variants
-        self.include_variants = include_variants
-        self.default_product_category = default_product_category
-
-        self.feed = feed
-        if feed:
-            self.google_settings = self.feed.get_google_settings()
-        else:
-            self.google_settings = {}
-
-    def _add_element(self, tag, text):
-        self.writer.startTag(tag)
-        self.writer.text(text)
-        self.writer.endTag()
+        elements += [
+            ('g:google_product_category', self.default_product_category),
+            ('g:availability', 'in stock'),
+            ('g:condition', 'new'),
+        ]
 
-    def init(self):
-        self.out = NamedTemporaryFile(suffix='.xml', prefix='gkart_feed_', delete=False)
-        self.writer = XmlWriter(self.out, pretty=True, indent='')
+        self._add_item(elements)
 
-        self.writer.addNamespace("g", "http://base.google.com/ns/1.0")
 
-        self.writer.startTag("rss", {"version": "2.0"})
-        self.writer.startTag("channel")
+class GrooveKartProductFeed(ProductFeedBase):
+    out_prefix = 'gkart_feed_'
 
-        self._add_element('title', self.store.title)
-        self._add_element('link', self.store.get_store_url())
-        self._add_element('description', '{} Products Feed'.format(self.store.title))
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
 
-    def save(self):
-        self.writer.endTag()
-        self.writer.endTag()
-        self.writer.close()
-        self.out.close()
+        self.store_categories = {c.get('id'): c.get('title') for c in get_store_categories(self.store)}
 
-        return self.out
+    def get_store_info(self):
+        domain = urlparse(self.store.get_api_url('')).netloc
+        return {'currency': self._get_store_currency(), 'domain': domain, 'name': self.store.title}
 
-    def generate_feed(self):
-        for p in self.store.get_groovekart_products(limit=5000):
-            self.add_product(p)
+    def get_products(self):
+        yield from self.store.get_groovekart_products(limit=5000)
 
     def add_product(self, product):
         has_variants = bool(product.get('variants'))
@@ -788,46 +708,40 @@ class GrooveKartProductFeed(object):
             image = image.get('url') or ''
             variant_id = variant['id_product_variant']
 
-        self.writer.startTag('item')
-
         if self.revision == 1:
-            self._add_element('g:id', 'store_{}_{}'.format(product_data['id'], variant_id))
+            elements = [('g:id', 'store_{}_{}'.format(product_data['id'], variant_id))]
         else:
-            self._add_element('g:id', 'groovekart_{}'.format(variant_id))
-            self._add_element('g:item_group_id', '{}'.format(variant_id))
-
-        self._add_element('g:link', product_data['product_url'])
-        self._add_element('g:title', product_data['product_title'])
-        self._add_element('g:description', description)
-        self._add_element('g:image_link', image)
+            elements = [
+                ('g:id', 'groovekart_{}'.format(variant_id)),
+                ('g:item_group_id', '{}'.format(variant_id)),
+            ]
+
+        elements += [
+            ('g:link', product_data['product_url']),
+            ('g:title', product_data['product_title']),
+            ('g:description', description),
+            ('g:image_link', image),
+        ]
 
         if variant:
-            self._add_element('g:price', '{amount} {currency}'.format(amount=variant['price'], currency=self.currency))
-            self._add_element('g:shipping_weight', '{} {}'.format(variant['weight'], 'lb'))
+            elements += [
+                ('g:price', '{amount} {currency}'.format(amount=variant['price'], currency=self.currency)),
+                ('g:shipping_weight', '{} {}'.format(variant['weight'], 'lb')),
+            ]
 
         product_category = self.store_categories.get(product_data['id_category_default'])
-        self._add_element('g:google_product_category', safe_str(product_category or self.default_product_category))
-        self._add_element('g:availability', 'in stock')
-        self._add_element('g:condition', 'new')
+        elements += [
+            ('g:google_product_category', safe_str(product_category or self.default_product_category)),
+            ('g:availability', 'in stock'),
+            ('g:condition', 'new'),
+        ]
 
         if self.revision == 3:
-            self._add_element('g:age_group', self.google_settings.get('age_group') or 'Adult')
-            self._add_element('g:gender', self.google_settings.get('gender') or 'Unisex')
-            self._add_element('g:brand', self.google_settings.get('brand_name', self.store.title))
-            self._add_element('g:mpn', 'store_{}_{}'.format(product_data['id'], variant_id))
+            elements += self._google_elements('store_{}_{}'.format(product_data['id'], variant_id))
         else:
-            self._add_element('g:brand', product_data.get('manufacturer_name') or '')
+            elements.append(('g:brand', product_data.get('manufacturer_name') or ''))
 
-        self.writer.endTag()
-
-    def out_file(self):
-        return self.out
-
-    def out_filename(self):
-        return self.out.name
-
-    def delete_out(self):
-        os.unlink(self.out.name)
+        self._add_item(elements)
 
 
 def get_store_feed(store):
@@ -896,57 +810,16 @@ def get_bigcommerce_store_feed(store):
         )
 
 
-def generate_product_feed(feed_status, nocache=False, revision=None):
-    store = feed_status.store
+def generate_store_product_feed(feed_class, feed_status, nocache=False, revision=None):
+    """ Generate a store feed and stream it to S3
 
-    if not store.user.can('product_feeds.use') and not store.user.can('google_product_feed.use'):
-        return False
-
-    feed_start = time.time()
-
-    if not feed_status.feed_exists(revision=revision) or nocache:
-        if revision is None:
-            revision = feed_status.revision
-
-        feed = ProductFeed(store,
-                           revision,
-                           feed_status.all_variants,
-                           feed_status.include_variants_id,
-                           feed_status.default_product_category,
-                           feed=feed_status)
-
-        feed.init()
-
-        feed_status.status = 2
-        feed_status.save()
-
-        feed.generate_feed()
-        feed.save()
-
-        feed_status.generation_time = time.time() - feed_start
-        feed_status.updated_at = timezone.now()
-
-        feed_s3_url, upload_time = aws_s3_upload(
-            filename=feed_status.get_filename(revision=revision),
-            input_filename=feed.out_filename(),
-            mimetype='application/xml',
-            upload_time=True,
-            compress=True,
-            bucket_name=settings.S3_PRODUCT_FEED_BUCKET
-        )
-
-        feed.delete_out()
-
-    else:
-        feed_s3_url = feed_status.get_url(revision=revision)
-
-    feed_status.status = 1
-    feed_status.save()
-
-    return feed_s3_url
+    Args:
+        feed_class: ProductFeedBase subclass for the store platform
+        feed_status: Platform feed status model
+        nocache: Generate the feed even if it's already uploaded
+        revision: Feed revision to generate, default to the feed status revision
+    """
 
-
-def generate_chq_product_feed(feed_status, nocache=False):
     store = feed_status.store
 
     if not store.user.can('product_feeds.use') and not store.user.can('google_product_feed.use'):
@@ -954,134 +827,49 @@ def generate_chq_product_feed(feed_status, nocache=False):
 
     feed_start = time.time()
 
-    if not feed_status.feed_exists() or nocache:
-        feed = CommerceHQProductFeed(store,
-                                     feed_status.revision,
-                                     feed_status.all_variants,
-                                     feed_status.include_variants_id,
-                                     feed_status.default_product_category,
-                                     feed=feed_status)
-
-        feed.init()
-
-        feed_status.status = 2
-        feed_status.save()
-
-        feed.generate_feed()
-        feed.save()
-
-        feed_status.generation_time = time.time() - feed_start
-        feed_status.updated_at = timezone.now()
-
-        feed_s3_url, upload_time = aws_s3_upload(
-            filename=feed_status.get_filename(),
-            input_filename=feed.out_filename(),
-            mimetype='application/xml',
-            upload_time=True,
-            compress=True,
-            bucket_name=settings.S3_PRODUCT_FEED_BUCKET
-        )
-
-        feed.delete_out()
-
-    else:
-        feed_s3_url = feed_status.get_url()
-
-    feed_status.status = 1
-    feed_status.save()
-
-    return feed_s3_url
-
+    # CommerceHQ and GearBubble feeds use the same file for all revisions
+    file_revision = revision if feed_class.revision_filename else None
 
-def generate_woo_product_feed(feed_status, nocache=False, revision=None):
-    store = feed_status.store
-
-    if not store.user.can('product_feeds.use') and not store.user.can('google_product_feed.use'):
-        return False
-
-    feed_start = time.time()
-
-    if not feed_status.feed_exists(revision=revision) or nocache:
+    if not feed_status.feed_exists(revision=file_revision) or nocache:
         if revision is None:
             revision = feed_status.revision
 
-        feed = WooProductFeed(store,
-                              revision,
-                              feed_status.all_variants,
-                              feed_status.include_variants_id,
-                              feed_status.default_product_category,
-                              feed=feed_status)
-
-        feed.init()
-
-        feed_status.status = 2
-        feed_status.save()
-
-        feed.generate_feed()
-        feed.save()
+        if feed_class.revision_filename:
+            file_revision = revision
 
-        feed_status.generation_time = time.time() - feed_start
-        feed_status.updated_at = timezone.now()
+        feed = feed_class(store,
+                          revision,
+                          feed_status.all_variants,
+                          feed_status.include_variants_id,
+                          feed_status.default_product_category,
+                          feed=feed_status)
 
-        feed_s3_url, upload_time = aws_s3_upload(
-            filename=feed_status.get_filename(revision=revision),
-            input_filename=feed.out_filename(),
+        feed_upload = AwsS3MultipartUpload(
+            filename=feed_status.get_filename(revision=file_revision),
             mimetype='application/xml',
-            upload_time=True,
             compress=True,
             bucket_name=settings.S3_PRODUCT_FEED_BUCKET
         )
 
-        feed.delete_out()
-
-    else:
-        feed_s3_url = feed_status.get_url(revision=revision)
-
-    feed_status.status = 1
-    feed_status.save()
-
-    return feed_s3_url
-
-
-def generate_gear_product_feed(feed_status, nocache=False):
-    store = feed_status.store
-
-    if not store.user.can('product_feeds.use') and not store.user.can('google_product_feed.use'):
-        return False
-
-    feed_start = time.time()
-
-    if not feed_status.feed_exists() or nocache:
-        feed = GearBubbleProductFeed(store,
-                                     feed_status.revision,
-                                     feed_status.all_variants,
-                                     feed_status.include_variants_id,
-                                     feed_status.default_product_category)
-
-        feed.init()
+        feed.init(out=feed_upload)
 
         feed_status.status = 2
         feed_status.save()
 
-        feed.generate_feed()
-        feed.save()
+        try:
+            feed.generate_feed()
+            feed.save()
+        except:
+            feed_upload.cancel()
+            raise
 
         feed_status.generation_time = time.time() - feed_start
         feed_status.updated_at = timezone.now()
 
-        feed_s3_url, upload_time = aws_s3_upload(
-            filename=feed_status.get_filename(),
-            input_filename=feed.out_filename(),
-            mimetype='application/xml',
-            upload_time=True,
-            compress=True,
-            bucket_name=settings.S3_PRODUCT_FEED_BUCKET
-        )
-
-        feed.delete_out()
+        feed_s3_url = feed_upload.url
 
     else:
-        feed_s3_url = feed_status.get_url()
+        feed_s3_url = feed_status.get_url(revision=file_revision)
 
     feed_status.status = 1
     feed_status.save()
@@ -1089,101 +877,80 @@ def generate_gear_product_feed(feed_status, nocache=False):
     return feed_s3_url
 
 
-def generate_gkart_product_feed(feed_status, nocache=False, revision=None):
-    store = feed_status.store
-
-    if not store.user.can('product_feeds.use') and not store.user.can('google_product_feed.use'):
-        return False
-
-    feed_start = time.time()
-
-    if not feed_status.feed_exists(revision=revision) or nocache:
-        if revision is None:
-            revision = feed_status.revision
+def generate_product_feed(feed_status, nocache=False, revision=None):
+    return generate_store_product_feed(ProductFeed, feed_status, nocache=nocache, revision=revision)
 
-        feed = GrooveKartProductFeed(store,
-                                     revision,
-                                     feed_status.all_variants,
-                                     feed_status.include_variants_id,
-                                     feed_status.default_product_category,
-                                     feed=feed_status)
 
-        feed.init()
+def generate_chq_product_feed(feed_status, nocache=False):
+    return generate_store_product_feed(CommerceHQProductFeed, feed_status, nocache=nocache)
 
-        feed_status.status = 2
-        feed_status.save()
 
-        feed.generate_feed()
-        feed.save()
+def generate_woo_product_feed(feed_status, nocache=False, revision=None):
+    return generate_store_product_feed(WooProductFeed, feed_status, nocache=nocache, revision=revision)
 
-        feed_status.generation_time = time.time() - feed_start
-        feed_status.updated_at = timezone.now()
 
-        feed_s3_url, upload_time = aws_s3_upload(
-            filename=feed_status.get_filename(revision=revision),
-            input_filename=feed.out_filename(),
-            mimetype='application/xml',
-            upload_time=True,
-            compress=True,
-            bucket_name=settings.S3_PRODUCT_FEED_BUCKET
-        )
+def generate_gear_product_feed(feed_status, nocache=False):
+    return generate_store_product_feed(GearBubbleProductFeed, feed_status, nocache=nocache)
 
-        feed.delete_out()
 
-    else:
-        feed_s3_url = feed_status.get_url(revision=revision)
+def generate_gkart_product_feed(feed_status, nocache=False, revision=None):
+    return generate_store_product_feed(GrooveKartProductFeed, feed_status, nocache=nocache, revision=revision)
 
-    feed_status.status = 1
-    feed_status.save()
 
-    return feed_s3_url
+def generate_bigcommerce_product_feed(feed_status, nocache=False, revision=None):
+    return generate_store_product_feed(BigCommerceProductFeed, feed_status, nocache=nocache, revision=revision)
 
 
-def generate_bigcommerce_product_feed(feed_status, nocache=False, revision=None):
-    store = feed_status.store
+def generate_feed_worker(q, generate_feed, nocache):
+    while True:
+        feed_status = q.get()
+        if feed_status is None:
+            q.task_done()
+            break
 
-    if not store.user.can('product_feeds.use') and not store.user.can('google_product_feed.use'):
-        return False
+        try:
+            generate_feed(feed_status, nocache=nocache)
+        except:
+            feed_status.status = 0
+            feed_status.generation_time = -1
+            feed_status.save()
 
-    feed_start = time.time()
+            capture_exception()
 
-    if not feed_status.feed_exists(revision=revision) or nocache:
-        if revision is None:
-            revision = feed_status.revision
+        q.task_done()
 
-        feed = BigCommerceProductFeed(store,
-                                      revision,
-                                      feed_status.all_variants,
-                                      feed_status.include_variants_id,
-                                      feed_status.default_product_category,
-                                      feed=feed_status)
+    connection.close()
 
-        feed.init()
 
-        feed_status.status = 2
-        feed_status.save()
+def generate_product_feeds(feed_statuses, generate_feed, nocache=True, threads=4, callback=None):
+    """ Generate many feeds at once, most of the time is spent waiting for the
+    platforms API so feeds are generated concurrently by a pool of threads
 
-        feed.generate_feed()
-        feed.save()
+    Args:
+        feed_statuses: Iterable of feed status models
+        generate_feed: One of the generate_*_product_feed functions
+        nocache: Generate feeds even if they are already uploaded
+        threads: Number of feeds to generate at the same time
+        callback: Called with each feed status before it's queued
+    """
 
-        feed_status.generation_time = time.time() - feed_start
-        feed_status.updated_at = timezone.now()
+    q = Queue(maxsize=threads * 2)
+    workers = []
+    for i in range(threads):
+        t = Thread(target=generate_feed_worker, args=(q, generate_feed, nocache))
+        t.daemon = True
+        t.start()
 
-        feed_s3_url, upload_time = aws_s3_upload(
-            filename=feed_status.get_filename(revision=revision),
-            input_filename=feed.out_filename(),
-            mimetype='application/xml',
-            upload_time=True,
-            compress=True,
-            bucket_name=settings.S3_PRODUCT_FEED_BUCKET
-        )
+        workers.append(t)
 
-        feed.delete_out()
+    for feed_status in feed_statuses:
+        if callback:
+            callback(feed_status)
 
-    else:
-        feed_s3_url = feed_status.get_url(revision=revision)
+        q.put(feed_status)
 
-    feed_status.status = 1
-    feed_status.save()
+    for t in workers:
+        q.put(None)
 
-    return feed_s3_url
+    for t in workers:
+        t.join()
@@ -1,10 +1,14 @@
-from unittest.mock import patch
+import io
+from unittest.mock import patch, MagicMock, PropertyMock
+
+from django.core.cache import cache
 
 from lib.test import BaseTestCase
 
 from gearbubble_core.tests.factories import GearBubbleStoreFactory
+from leadgalaxy.tests.factories import ShopifyStoreFactory
 
-from ..feed import GearBubbleProductFeed
+from ..feed import GearBubbleProductFeed, ProductFeed, generate_product_feeds
 
 
 class GearBubbleProductFeedTestCase(BaseTestCase):
@@ -15,3 +19,84 @@ class GearBubbleProductFeedTestCase(BaseTestCase):
         feed = GearBubbleProductFeed(store)
         feed.generate_feed()
         self.assertTrue(get_gearbubble_products.called)
+
+
+class ProductFeedTestCase(BaseTestCase):
+    def setUp(self):
+        cache.clear()
+
+        self.store = ShopifyStoreFactory()
+        self.product = {
+            'id': 1001,
+            'title': 'Test Product',
+            'handle': 'test-product',
+            'body_html': '<p>Test Description</p>',
+            'product_type': '',
+            'vendor': 'Dropified',
+            'published_at': '2022-01-01T00:00:00-05:00',
+            'updated_at': '2022-01-01T00:00:00-05:00',
+            'image': {'src': 'https://cdn.shopify.com/1.jpg'},
+            'images': [],
+            'variants': [{'id': 2001, 'price': '9.99', 'weight': 1, 'weight_unit': 'kg'}],
+        }
+
+    def generate_feed(self, get_shopify_products):
+        def products(store, product_ids=None, return_links=False, **kwargs):
+            if return_links:
+                return {}, [{'id': self.product['id'], 'updated_at': self.product['updated_at']}]
+            return [self.product]
+
+        get_shopify_products.side_effect = products
+
+        with patch('leadgalaxy.models.ShopifyStore.get_info', new_callable=PropertyMock) as get_info:
+            get_info.return_value = {'currency': 'USD', 'domain': 'test.myshopify.com', 'name': 'Test Store'}
+            feed = ProductFeed(self.store)
+
+        out = io.BytesIO()
+        feed.init(out=out)
+        feed.generate_feed()
+        feed.writer.endTag()
+        feed.writer.endTag()
+        feed.writer.close()
+
+        return out.getvalue().decode()
+
+    @patch('product_feed.feed.get_shopify_products')
+    def test_must_render_changed_products_only(self, get_shopify_products):
+        xml = self.generate_feed(get_shopify_products)
+        self.assertIn('Test Product', xml)
+        self.assertEqual(get_shopify_products.call_count, 2)
+
+        xml = self.generate_feed(get_shopify_products)
+        self.assertIn('Test Product', xml)
+        self.assertEqual(get_shopify_products.call_count, 3)
+
+        self.product['updated_at'] = '2022-01-02T00:00:00-05:00'
+        self.product['title'] = 'Updated Product'
+        xml = self.generate_feed(get_shopify_products)
+        self.assertIn('Updated Product', xml)
+        self.assertEqual(get_shopify_products.call_count, 5)
+
+
+class GenerateProductFeedsTestCase(BaseTestCase):
+    def test_must_generate_all_feeds(self):
+        statuses = [MagicMock(id=i) for i in range(10)]
+        generate_feed = MagicMock(return_value='https://test-url.com')
+
+        generate_product_feeds(statuses, generate_feed, threads=3)
+
+        self.assertEqual(generate_feed.call_count, 10)
+        generated = sorted(call[0][0].id for call in generate_feed.call_args_list)
+        self.assertEqual(generated, list(range(10)))
+
+    @patch('product_feed.feed.capture_exception')
+    def test_must_reset_failed_feeds(self, capture_exception):
+        status = MagicMock(status=2)
+        generate_feed = MagicMock(side_effect=Exception('API Error'))
+
+        generate_product_feeds([status], generate_feed, threads=1)
+
+        self.assertEqual(status.status, 0)
+        self.assertEqual(status.generation_time, -1)
+        self.assertTrue(status.save.called)
+        self.assertTrue(capture_exception.called)
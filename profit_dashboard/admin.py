@@ -5,6 +5,8 @@ from .models import (
     FacebookAdCost,
     AliexpressFulfillmentCost,
     OtherCost,
+    OrderRefund,
+    ProfitRollup,
 )
 
 
@@ -41,3 +43,17 @@ class OtherCostAdmin(admin.ModelAdmin):
     list_display = ('store', 'date', 'amount')
     raw_id_fields = ('store',)
     search_fields = ('store__shop', 'date')
+
+
+@admin.register(OrderRefund)
+class OrderRefundAdmin(admin.ModelAdmin):
+    list_display = ('order_id', 'refund_id', 'amount', 'processed_at')
+    raw_id_fields = ('store',)
+    search_fields = ('store__shop', 'order_id', 'refund_id')
+
+
+@admin.register(ProfitRollup)
+class ProfitRollupAdmin(admin.ModelAdmin):
+    list_display = ('store', 'date', 'revenue', 'refunds', 'fulfillment_cost', 'ad_spend', 'other_costs', 'updated_at')
+    raw_id_fields = ('store',)
+    search_fields = ('store__shop', 'date')
@@ -0,0 +1,96 @@
+from django.db.models import Max, Min
+
+from lib.exceptions import capture_exception
+from leadgalaxy.models import ShopifyStore
+from leadgalaxy.shopify import ShopifyAPI
+from shopified_core.commands import DropifiedBaseCommand
+from shopify_orders.models import ShopifyOrder, ShopifyOrderData
+from profit_dashboard.models import ProfitRollup
+from profit_dashboard.utils import save_orders_refunds, update_profit_rollups
+
+
+class Command(DropifiedBaseCommand):
+    help = 'Save the orders refunds from the saved orders payload (or Shopify when missing) and rebuild the profit rollups'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--store', action='append', type=int, help='Only process these stores')
+        parser.add_argument('--batch', type=int, default=500, help='Number of orders payload to load per query')
+        parser.add_argument('--skip-refunds', dest='refunds', action='store_false', help='Do not save the orders refunds')
+
+    def start_command(self, *args, **options):
+        if options['refunds']:
+            self.save_refunds(options['store'], options['batch'])
+            self.fetch_refunds(options['store'])
+
+        self.rebuild_rollups(options['store'])
+
+    def save_refunds(self, store_ids, batch_size):
+        orders_data = ShopifyOrderData.objects.filter(order__financial_status__in=['partially_refunded', 'refunded'])
+        if store_ids:
+            orders_data = orders_data.filter(order__store__in=store_ids)
+
+        self.write('Save refunds of {} orders'.format(orders_data.count()))
+        self.progress_total(orders_data.count())
+
+        last_id = 0
+        while True:
+            batch = list(orders_data.filter(id__gt=last_id).select_related('order__store').order_by('id')[:batch_size])
+            if not batch:
+                break
+
+            stores_orders = {}
+            for order_data in batch:
+                data = order_data.get_data()
+                if data:
+                    stores_orders.setdefault(order_data.order.store, []).append(data)
+
+            for store, data in stores_orders.items():
+                save_orders_refunds(store, data)
+
+            last_id = batch[-1].id
+            self.progress_update(len(batch))
+
+        self.progress_close()
+
+    def fetch_refunds(self, store_ids):
+        """ Orders synced before their payload was saved get their refunds from the Shopify API """
+
+        orders = ShopifyOrder.objects.filter(financial_status__in=['partially_refunded', 'refunded'], order_data__isnull=True)
+        if store_ids:
+            orders = orders.filter(store__in=store_ids)
+
+        self.write('Fetch refunds of {} orders without payload'.format(orders.count()))
+        self.progress_total(orders.count())
+
+        for store in ShopifyStore.objects.filter(id__in=orders.values('store_id')):
+            order_ids = list(orders.filter(store=store).values_list('order_id', flat=True))
+
+            api = ShopifyAPI(store)
+            for i in range(0, len(order_ids), 250):
+                try:
+                    for orders_data in api.paginate_orders(ids=order_ids[i:i + 250], fields='id,created_at,refunds'):
+                        save_orders_refunds(store, orders_data)
+                except Exception as e:
+                    capture_exception(extra={'store': store.id})
+                    self.write(f'> Store #{store.id} refunds error: {repr(e)}')
+
+                self.progress_update(len(order_ids[i:i + 250]))
+
+        self.progress_close()
+
+    def rebuild_rollups(self, store_ids):
+        stores = ProfitRollup.objects.values('store_id').annotate(start=Min('date'), end=Max('date')).order_by('store_id')
+        if store_ids:
+            stores = stores.filter(store__in=store_ids)
+
+        stores = list(stores)
+        self.write('Rebuild profit rollups of {} stores'.format(len(stores)))
+        self.progress_total(len(stores))
+
+        for store in stores:
+            rollup = ProfitRollup.objects.filter(store_id=store['store_id']).select_related('store').latest('updated_at')
+            update_profit_rollups(rollup.store, store['start'], store['end'], rollup.timezone)
+
+            self.progress_update()
+
+        self.progress_close()
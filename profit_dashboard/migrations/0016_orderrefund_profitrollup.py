@@ -0,0 +1,53 @@
+# Generated by Django 3.2.14 on 2026-10-18 16:02
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('leadgalaxy', '0265_shopifyproduct_list_columns'),
+        ('profit_dashboard', '0015_auto_20180927_1515'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ProfitRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('timezone', models.CharField(default='UTC', max_length=64)),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('refunds', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('fulfillment_cost', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('shipping_cost', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('ad_spend', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('other_costs', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('orders_count', models.IntegerField(default=0)),
+                ('fulfillments_count', models.IntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='leadgalaxy.shopifystore')),
+            ],
+            options={
+                'ordering': ['-date'],
+                'unique_together': {('store', 'date')},
+            },
+        ),
+        migrations.CreateModel(
+            name='OrderRefund',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_id', models.BigIntegerField()),
+                ('refund_id', models.BigIntegerField()),
+                ('processed_at', models.DateTimeField()),
+                ('amount', models.DecimalField(decimal_places=2, default=0, max_digits=12)),
+                ('store', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='leadgalaxy.shopifystore')),
+            ],
+            options={
+                'ordering': ['-processed_at'],
+                'unique_together': {('store', 'refund_id')},
+                'index_together': {('store', 'processed_at')},
+            },
+        ),
+    ]
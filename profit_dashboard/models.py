@@ -303,3 +303,43 @@ class OtherCost(models.Model):
 
     class Meta:
         ordering = ['-date']
+
+
+class OrderRefund(models.Model):
+    """ Refunds of the synced Shopify orders, saved from the orders webhooks payload """
+
+    class Meta:
+        ordering = ['-processed_at']
+        unique_together = ('store', 'refund_id')
+        index_together = ['store', 'processed_at']
+
+    store = models.ForeignKey(ShopifyStore, on_delete=models.CASCADE)
+    order_id = models.BigIntegerField()
+    refund_id = models.BigIntegerField()
+
+    processed_at = models.DateTimeField()
+    amount = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+
+
+class ProfitRollup(models.Model):
+    """ Store profits of a day, `date` is in the store `timezone` """
+
+    class Meta:
+        ordering = ['-date']
+        unique_together = ('store', 'date')
+
+    store = models.ForeignKey(ShopifyStore, on_delete=models.CASCADE)
+    date = models.DateField()
+    timezone = models.CharField(max_length=64, default='UTC')
+
+    revenue = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    refunds = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    fulfillment_cost = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    shipping_cost = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    ad_spend = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+    other_costs = models.DecimalField(decimal_places=2, max_digits=12, default=0)
+
+    orders_count = models.IntegerField(default=0)
+    fulfillments_count = models.IntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
@@ -26,3 +26,21 @@ def fetch_facebook_insights(self, store_id, facebook_access_ids):
             'success': False,
             'error': 'Facebook API Error',
         })
+
+
+@celery_app.task(base=CaptureFailure, ignore_result=True)
+def sync_tracks_costs(batch_size=500, max_batches=20):
+    """ Save the costs of Order Tracks queued by `queue_track_costs` (scheduled by Celery beat) """
+
+    from .utils import TRACK_COSTS_QUEUE, save_queued_tracks_costs
+
+    TRACK_COSTS_QUEUE.process(save_queued_tracks_costs, batch_size, max_batches)
+
+
+@celery_app.task(base=CaptureFailure, ignore_result=True)
+def sync_profit_rollups(batch_size=500, max_batches=20):
+    """ Rebuild the profit rollups of days queued by `queue_profit_rollups` (scheduled by Celery beat) """
+
+    from .utils import PROFIT_ROLLUPS_QUEUE, rebuild_queued_profit_rollups
+
+    PROFIT_ROLLUPS_QUEUE.process(rebuild_queued_profit_rollups, batch_size, max_batches)
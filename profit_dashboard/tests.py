@@ -1,6 +1,6 @@
 import simplejson as json
 import uuid
-from datetime import timedelta
+from datetime import date, datetime, timedelta
 from dateutil.parser import parse as date_parser
 from random import randint
 from urllib.parse import urlencode
@@ -24,8 +24,17 @@ from leadgalaxy.tests import factories as f
 from shopify_orders.models import ShopifyOrder
 from shopify_orders.tests.factories import ShopifyOrderFactory
 
-from .models import AliexpressFulfillmentCost
-from .utils import get_facebook_ads, get_profits, get_date_range
+from .models import AliexpressFulfillmentCost, OrderRefund, OtherCost, ProfitRollup
+from .utils import (
+    PROFIT_ROLLUPS_QUEUE,
+    get_facebook_ads,
+    get_profit_details,
+    get_profits,
+    get_date_range,
+    save_orders_refunds,
+    save_tracks_costs,
+    update_profit_rollups,
+)
 
 
 NOW = timezone.now()
@@ -193,6 +202,137 @@ class FulfillmentCostTestCase(BaseTestCase):
         pass
 
 
+class SaveTracksCostsTestCase(BaseTestCase):
+    def setUp(self):
+        self.user = f.UserFactory()
+        self.store = f.ShopifyStoreFactory(user=self.user)
+
+    def create_track(self, total, end_reason=''):
+        return f.ShopifyOrderTrackFactory(
+            store=self.store,
+            user=self.user,
+            source_id=uuid.uuid4().hex,
+            data=json.dumps({'aliexpress': {'order_details': {'cost': {
+                'total': total, 'shipping': 1.0, 'products': total - 1.0}}, 'end_reason': end_reason}})
+        )
+
+    def test_save_tracks_costs(self):
+        tracks = [self.create_track(10.0), self.create_track(20.0)]
+        AliexpressFulfillmentCost.objects.all().delete()
+
+        self.assertEqual(save_tracks_costs(tracks), (0, 2, 0))
+        self.assertEqual(AliexpressFulfillmentCost.objects.count(), 2)
+
+        # Saving the same tracks again only updates the costs
+        self.assertEqual(save_tracks_costs(tracks), (2, 0, 0))
+        self.assertEqual(AliexpressFulfillmentCost.objects.count(), 2)
+
+        cost = AliexpressFulfillmentCost.objects.get(source_id=tracks[1].source_id)
+        self.assertAlmostEqual(float(cost.total_cost), 20.0)
+        self.assertAlmostEqual(float(cost.products_cost), 19.0)
+
+    def test_save_cancelled_tracks_costs(self):
+        track = self.create_track(10.0)
+        save_tracks_costs([track])
+        self.assertEqual(AliexpressFulfillmentCost.objects.filter(source_id=track.source_id).count(), 1)
+
+        track.data = json.dumps({'aliexpress': {'order_details': {'cost': {
+            'total': 10.0, 'shipping': 1.0, 'products': 9.0}}, 'end_reason': 'buyer_pay_timeout'}})
+
+        self.assertEqual(save_tracks_costs([track]), (0, 0, 1))
+        self.assertFalse(AliexpressFulfillmentCost.objects.filter(source_id=track.source_id).exists())
+
+    def test_skip_malformed_tracks_costs(self):
+        track = self.create_track(10.0)
+        malformed = self.create_track(20.0)
+        malformed.data = json.dumps({'aliexpress': {'order_details': {'cost': {'total': 20.0, 'shipping': 1.0, 'products': 19.0}}}})  # No end_reason
+        AliexpressFulfillmentCost.objects.all().delete()
+
+        self.assertEqual(save_tracks_costs([malformed, track]), (0, 1, 0))
+        self.assertTrue(AliexpressFulfillmentCost.objects.filter(source_id=track.source_id).exists())
+        self.assertFalse(AliexpressFulfillmentCost.objects.filter(source_id=malformed.source_id).exists())
+
+
+class ProfitRollupTestCase(BaseTestCase):
+    def setUp(self):
+        self.user = f.UserFactory()
+        self.store = f.ShopifyStoreFactory(user=self.user)
+
+        # 2020-03-09 23:00 and 2020-03-10 11:00 in New York
+        self.order = ShopifyOrderFactory(store=self.store, user=self.user, total_price=100.0, financial_status='paid',
+                                         created_at=timezone.make_aware(datetime(2020, 3, 10, 3)))
+        self.second_order = ShopifyOrderFactory(store=self.store, user=self.user, total_price=50.0, financial_status='paid',
+                                                created_at=timezone.make_aware(datetime(2020, 3, 10, 15)))
+        ShopifyOrderFactory(store=self.store, user=self.user, total_price=30.0, financial_status='pending',
+                            created_at=timezone.make_aware(datetime(2020, 3, 10, 15)))
+
+        AliexpressFulfillmentCost.objects.create(store=self.store, order_id=self.order.order_id, source_id='1',
+                                                 created_at=date(2020, 3, 10), total_cost=10, shipping_cost=2)
+        OtherCost.objects.create(store=self.store, date=date(2020, 3, 10), amount=5)
+
+    @patch('profit_dashboard.utils.queue_profit_rollups')
+    def test_save_orders_refunds(self, queue_profit_rollups):
+        orders_data = [{
+            'id': self.order.order_id,
+            'created_at': '2020-03-09T23:00:00-04:00',
+            'refunds': [{
+                'id': 1001,
+                'processed_at': '2020-03-10T12:00:00-04:00',
+                'transactions': [{'kind': 'refund', 'amount': '20.00'}, {'kind': 'refund', 'amount': '5.00', 'test': True}],
+            }]
+        }]
+
+        self.assertEqual(save_orders_refunds(self.store, orders_data), (0, 1))
+        self.assertEqual(save_orders_refunds(self.store, orders_data), (1, 0))
+        self.assertAlmostEqual(float(OrderRefund.objects.get(store=self.store, refund_id=1001).amount), 20.0)
+        queue_profit_rollups.assert_called_with(self.store.id, ['2020-03-09T23:00:00-04:00', datetime(2020, 3, 10, 16, tzinfo=timezone.utc)])
+
+    def test_deleted_order_day_is_queued(self):
+        from webhooks.views import ShopifyOrderDeleteWebhook
+
+        PROFIT_ROLLUPS_QUEUE.pop(1000)
+        ShopifyOrderDeleteWebhook().process_webhook(self.store, {'id': self.order.order_id})
+
+        self.assertFalse(ShopifyOrder.objects.filter(id=self.order.id).exists())
+        self.assertEqual(PROFIT_ROLLUPS_QUEUE.pop(1000), [(self.store.id, date(2020, 3, 10))])
+
+    def test_update_profit_rollups(self):
+        OrderRefund.objects.create(store=self.store, order_id=self.order.order_id, refund_id=1001, amount=20,
+                                   processed_at=timezone.make_aware(datetime(2020, 3, 10, 16)))
+
+        for i in range(2):  # Rebuilding the same days gives the same rows
+            update_profit_rollups(self.store, date(2020, 3, 9), date(2020, 3, 10), 'America/New_York')
+
+        rollups = {i.date: i for i in ProfitRollup.objects.filter(store=self.store)}
+        self.assertEqual(len(rollups), 2)
+
+        first, second = rollups[date(2020, 3, 9)], rollups[date(2020, 3, 10)]
+        self.assertEqual(first.timezone, 'America/New_York')
+        self.assertEqual((first.orders_count, float(first.revenue), float(first.refunds)), (1, 100.0, 0.0))
+        self.assertEqual((float(first.fulfillment_cost), float(first.shipping_cost), first.fulfillments_count), (10.0, 2.0, 1))
+        self.assertEqual((second.orders_count, float(second.revenue), float(second.refunds)), (1, 50.0, 20.0))
+        self.assertEqual((float(second.other_costs), float(second.fulfillment_cost)), (5.0, 0.0))
+
+
+    @patch('profit_dashboard.utils.ShopifyAPI')
+    def test_profit_details_are_paginated(self, shopify_api):
+        shopify_api.return_value.paginate_orders.return_value = []
+
+        # Refunded the day the order was created (New York time) and the next day
+        OrderRefund.objects.create(store=self.store, order_id=self.order.order_id, refund_id=1001, amount=20,
+                                   processed_at=timezone.make_aware(datetime(2020, 3, 10, 3, 30)))
+        OrderRefund.objects.create(store=self.store, order_id=self.order.order_id, refund_id=1002, amount=5,
+                                   processed_at=timezone.make_aware(datetime(2020, 3, 10, 16)))
+
+        date_range = (timezone.make_aware(datetime(2020, 3, 9)), timezone.make_aware(datetime(2020, 3, 11)))
+        details, paginator = get_profit_details(self.store, date_range, limit=2, page=1, store_timezone='America/New_York')
+        self.assertEqual(paginator.count, 3)
+        self.assertEqual([(i['order_id'], i['profit']) for i in details], [(self.order.order_id, -5.0), (self.second_order.order_id, 50.0)])
+
+        details, paginator = get_profit_details(self.store, date_range, limit=2, page=2, store_timezone='America/New_York')
+        self.assertEqual([(i['order_id'], i['date_as_string'], i['profit']) for i in details], [(self.order.order_id, '03/09/2020', 80.0)])
+
+
 class SearchTestCase(BaseTestCase):
     def setUp(self):
         params = (('date_range', '03/01/2020-04/01/2020'),)
@@ -1,13 +1,21 @@
 import arrow
+import pytz
 import re
 import simplejson as json
+from datetime import datetime, time, timedelta
 from decimal import Decimal
 
-from collections import OrderedDict
+from collections import defaultdict
 
-from django.db.models import Sum
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.db.models import BooleanField, Count, Exists, F, Min, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import TruncDate
+from django.utils import timezone
 
-from shopified_core.paginators import SimplePaginator
+from lib.exceptions import capture_exception
+from shopified_core.paginators import FakePaginator
+from shopified_core.utils import RedisSetQueue
 from shopify_orders.models import ShopifyOrder
 from leadgalaxy.utils import safe_float
 from leadgalaxy.models import ShopifyOrderTrack
@@ -17,10 +25,43 @@ from .models import (
     FacebookAccess,
     FacebookAdCost,
     AliexpressFulfillmentCost,
-    OtherCost
+    OtherCost,
+    OrderRefund,
+    ProfitRollup,
 )
 from functools import reduce
 
+
+def _dump_queued_rollup(day):
+    return '{}:{}'.format(day[0], day[1].isoformat())
+
+
+def _load_queued_rollup(member):
+    store_id, day = member.split(':')
+    return int(store_id), arrow.get(day).date()
+
+
+# ShopifyOrderTrack IDs waiting for their costs to be saved
+TRACK_COSTS_QUEUE = RedisSetQueue('profit_dashboard_track_costs')
+
+# (store ID, UTC date) of the days waiting for their profit rollups to be rebuilt
+PROFIT_ROLLUPS_QUEUE = RedisSetQueue('profit_dashboard_rollups', dumps=_dump_queued_rollup, loads=_load_queued_rollup)
+
+PROFIT_ROLLUP_FIELDS = [
+    'timezone',
+    'revenue',
+    'refunds',
+    'fulfillment_cost',
+    'shipping_cost',
+    'ad_spend',
+    'other_costs',
+    'orders_count',
+    'fulfillments_count',
+    'updated_at',
+]
+
+PROFIT_ORDERS_FINANCIAL_STATUS = ['authorized', 'partially_paid', 'paid', 'partially_refunded', 'refunded']
+
 # Note: Ignore this status: buyer_accept_goods_timeout, buyer_accept_goods
 ALIEXPRESS_CANCELLED_STATUS = [
     'buyer_pay_timeout',
@@ -46,6 +87,8 @@ def create_facebook_ads(facebook_account, campaign_insight):
         }
     )
 
+    queue_profit_rollups(facebook_account.access.store_id, [campaign_insight['created_at']])
+
 
 def get_facebook_ads(facebook_access_id, store, verbosity=1):
     """ Get Insights from all accounts/campaigns selected from the facebook_access_id
@@ -85,166 +128,278 @@ def calculate_profits(profits):
     return profits
 
 
-def get_profits(store, start, end, store_timezone=''):
-    store_id = store.id
-    days = list(arrow.Arrow.range('day', start, end))
-    profits_data = OrderedDict()
-    for day in reversed(days):
-        date_key = day.format('YYYY-MM-DD')
-        profits_data[date_key] = {
-            'date_as_string': day.format('MM/DD/YYYY'),
-            'date_as_slug': date_key,
-            'week_day': day.strftime('%A'),
-            'empty': True,
-            'css_empty': 'empty',
-            'revenue': 0.0,
-            'fulfillment_cost': 0.0,
-            'fulfillments_count': 0,
-            'orders_count': 0,
-            'ad_spend': 0.0,
-            'other_costs': 0.0,
-            'outcome': 0.0,
-            'profit': 0.0,
-        }
+def get_profit_orders(store):
+    """Orders counted in the store revenue"""
 
-    # Shopify Orders
-    orders = ShopifyOrder.objects.filter(store_id=store_id,
-                                         created_at__range=(start, end),
-                                         financial_status__in=['authorized', 'partially_paid', 'paid', 'partially_refunded', 'refunded'])
+    orders = ShopifyOrder.objects.filter(store_id=store.id, financial_status__in=PROFIT_ORDERS_FINANCIAL_STATUS)
 
     # https://app.intercom.io/a/apps/k9cb5frr/inbox/inbox/conversation/24951703596
     if store.user_id == 81339:
         orders = orders.filter(cancelled_at__isnull=True)
 
-    orders_map = {}
-    totals_orders_count = 0
-    for order in orders.values('created_at', 'total_price', 'order_id'):
-        try:
-            # Correct our database date to show these at the correct day
-            created_at = arrow.get(order['created_at']).to(store_timezone)
-        except:
-            pass
+    return orders
 
-        date_key = created_at.format('YYYY-MM-DD')
-        if date_key not in profits_data:
-            continue
 
-        totals_orders_count += 1
-        orders_map[order['order_id']] = {
-            'date': created_at.datetime,
-            'date_as_string': created_at.format('MM/DD/YYYY'),
-            'order_id': order['order_id'],
-            'total_price': order['total_price'],
-            'total_refund': 0.0,
-            'profit': order['total_price'],
-            'products': [],
-            'refunded_products': [],
-            'aliexpress_track': []
-        }
+def update_profit_rollups(store, start_date, end_date, store_timezone=''):
+    """Rebuild the store daily profit rollups from `start_date` to `end_date` (included)
 
-        profits_data[date_key]['profit'] += order['total_price']
-        profits_data[date_key]['revenue'] += order['total_price']
-        profits_data[date_key]['orders_count'] += 1
-        profits_data[date_key]['empty'] = False
-        profits_data[date_key]['css_empty'] = ''
+    Each day is recomputed with one grouped query per orders, refunds and costs table,
+    rebuilding the same days again gives the same result
 
-    # Account for refunds processed within date range
-    refunds = []
-    total_refunds = 0.0
-    for refund in order_refunds(store, start, end, store_timezone):
-        refunds.append(refund)
+    Args:
+        store (ShopifyStore): Profit Dashboard store
+        start_date (date): First day in the store timezone
+        end_date (date): Last day in the store timezone
+        store_timezone (str, optional): Store timezone name, days are in UTC if empty
 
-        date_key = arrow.get(refund['processed_at']).format('YYYY-MM-DD')
-        if date_key not in profits_data:
-            continue
+    Returns:
+        (list): ProfitRollup of every day in the range
+    """
 
-        refund_amount = get_refund_amount(refund.get('transactions'))
-        if refund_amount:
-            total_refunds += refund_amount
-            profits_data[date_key]['profit'] -= refund_amount
-            profits_data[date_key]['revenue'] -= refund_amount
-            profits_data[date_key]['empty'] = False
-            profits_data[date_key]['css_empty'] = ''
+    store_timezone = store_timezone or 'UTC'
+    tzinfo = pytz.timezone(store_timezone)
+    start = tzinfo.localize(datetime.combine(start_date, time.min))
+    end = tzinfo.localize(datetime.combine(end_date + timedelta(days=1), time.min))
+
+    now = timezone.now()
+    rollups = {}
+    for day in arrow.Arrow.range('day', arrow.get(start_date), arrow.get(end_date)):
+        rollups[day.date()] = ProfitRollup(store=store, date=day.date(), timezone=store_timezone, updated_at=now)
+
+    # Revenue of the orders created that day
+    orders = get_profit_orders(store).filter(created_at__gte=start, created_at__lt=end)
+    for row in orders.annotate(day=TruncDate('created_at', tzinfo=tzinfo)) \
+                     .values('day') \
+                     .annotate(revenue=Sum('total_price'), count=Count('id')) \
+                     .order_by('day'):
+        if row['day'] in rollups:
+            rollups[row['day']].revenue = row['revenue'] or 0
+            rollups[row['day']].orders_count = row['count']
+
+    # Refunds processed that day
+    refunds = OrderRefund.objects.filter(store=store, processed_at__gte=start, processed_at__lt=end)
+    for row in refunds.annotate(day=TruncDate('processed_at', tzinfo=tzinfo)) \
+                      .values('day') \
+                      .annotate(amount=Sum('amount')) \
+                      .order_by('day'):
+        if row['day'] in rollups:
+            rollups[row['day']].refunds = row['amount'] or 0
+
+    # Aliexpress costs are shown the same day as their order
+    order_created_at = get_profit_orders(store).filter(order_id=OuterRef('order_id')).values('created_at')[:1]
+    costs = AliexpressFulfillmentCost.objects.filter(store=store, order_id__in=orders.values('order_id'))
+    for row in costs.annotate(order_created_at=Subquery(order_created_at)) \
+                    .annotate(day=TruncDate('order_created_at', tzinfo=tzinfo)) \
+                    .values('day') \
+                    .annotate(total=Sum('total_cost'), shipping=Sum('shipping_cost'), count=Count('id')) \
+                    .order_by('day'):
+        if row['day'] in rollups:
+            rollups[row['day']].fulfillment_cost = row['total'] or 0
+            rollups[row['day']].shipping_cost = row['shipping'] or 0
+            rollups[row['day']].fulfillments_count = row['count']
 
-    # Aliexpress costs
-    shippings = AliexpressFulfillmentCost.objects.filter(store_id=store_id, order_id__in=orders.values('order_id'))
+    # Facebook Insights
+    ad_costs = FacebookAdCost.objects.filter(account__access__store_id=store.id, created_at__range=(start_date, end_date))
+    for row in ad_costs.values('created_at').annotate(total=Sum('spend')).order_by('created_at'):
+        if row['created_at'] in rollups:
+            rollups[row['created_at']].ad_spend = row['total'] or 0
 
-    total_fulfillments_count = 0
-    for shipping in shippings:
-        if shipping.order_id not in orders_map:
-            continue
+    # Other Costs
+    other_costs = OtherCost.objects.filter(store=store, date__range=(start_date, end_date))
+    for row in other_costs.values('date').annotate(total=Sum('amount')).order_by('date'):
+        if row['date'] in rollups:
+            rollups[row['date']].other_costs = row['total'] or 0
 
-        date_key = orders_map.get(shipping.order_id, {}).get('date')
-        date_key = arrow.get(date_key).format('YYYY-MM-DD')
-        if date_key not in profits_data:
-            continue
+    with transaction.atomic():
+        for rollup in ProfitRollup.objects.filter(store=store, date__range=(start_date, end_date)).only('id', 'date'):
+            rollups[rollup.date].id = rollup.id
 
-        profits_data[date_key]['profit'] -= safe_float(shipping.total_cost)
-        profits_data[date_key]['fulfillment_cost'] += safe_float(shipping.total_cost)
-        profits_data[date_key]['fulfillments_count'] += 1
-        total_fulfillments_count += 1
-        profits_data[date_key]['empty'] = False
-        profits_data[date_key]['css_empty'] = ''
+        to_update = [i for i in rollups.values() if i.id]
+        if to_update:
+            ProfitRollup.objects.bulk_update(to_update, PROFIT_ROLLUP_FIELDS, batch_size=500)
 
-    # Facebook Insights
-    ad_costs = FacebookAdCost.objects.filter(account__access__store_id=store_id,
-                                             created_at__range=(start, end)) \
-                                     .extra({'date_key': 'date(created_at)'}) \
-                                     .values('date_key') \
-                                     .annotate(Sum('spend')) \
-                                     .order_by('date_key')
-
-    total_ad_costs = 0.0
-    for ad_cost in ad_costs:
-        date_key = arrow.get(ad_cost['date_key']).format('YYYY-MM-DD')
-        if date_key not in profits_data:
-            continue
+        to_create = [i for i in rollups.values() if not i.id]
+        if to_create:
+            # Days built at the same time by another worker have the same values
+            ProfitRollup.objects.bulk_create(to_create, batch_size=500, ignore_conflicts=True)
 
-        ad_cost_amount = safe_float(ad_cost['spend__sum'])
-        profits_data[date_key]['profit'] -= safe_float(ad_cost['spend__sum'])
-        profits_data[date_key]['ad_spend'] = ad_cost_amount
-        profits_data[date_key]['empty'] = False
-        profits_data[date_key]['css_empty'] = ''
-        total_ad_costs += ad_cost_amount
+    return list(rollups.values())
 
-    # Other Costs
-    other_costs = OtherCost.objects.filter(store_id=store_id,
-                                           date__range=(start.date(), end.date())) \
-                                   .extra({'date_key': 'date(date)'}) \
-                                   .values('date_key') \
-                                   .annotate(Sum('amount')) \
-                                   .order_by('date_key')
-
-    for other_cost in other_costs:
-        date_key = arrow.get(other_cost['date_key']).format('YYYY-MM-DD')
-        if date_key not in profits_data:
-            continue
 
-        other_cost_value = safe_float(other_cost['amount__sum'])
-        is_empty = profits_data[date_key]['empty']
+def get_profit_rollups(store, start_date, end_date, store_timezone=''):
+    """Return the store ProfitRollup by day, days missing in this timezone are built first"""
 
-        profits_data[date_key]['profit'] -= other_cost_value
-        profits_data[date_key]['other_costs'] = other_cost_value
-        # Other costs might be saved as 0
-        profits_data[date_key]['empty'] = is_empty and other_cost_value == 0
-        profits_data[date_key]['css_empty'] = ''
+    store_timezone = store_timezone or 'UTC'
+    rollups = ProfitRollup.objects.filter(store=store, date__range=(start_date, end_date), timezone=store_timezone)
+    rollups = {i.date: i for i in rollups}
+
+    missing = [day.date() for day in arrow.Arrow.range('day', arrow.get(start_date), arrow.get(end_date)) if day.date() not in rollups]
+    if missing:
+        for rollup in update_profit_rollups(store, min(missing), max(missing), store_timezone):
+            rollups[rollup.date] = rollup
+
+    return rollups
+
+
+def queue_profit_rollups(store_id, dates):
+    """Queue the days of `dates` to have their rollups rebuilt by the next `sync_profit_rollups` task run
+
+    Args:
+        store_id (int): ShopifyStore ID
+        dates (list): date, datetime or ISO 8601 strings, the surrounding days are rebuilt in the store timezone
+    """
+
+    days = set(arrow.get(i).to('UTC').date() for i in dates if i)
+    if not days:
+        return
 
-    # Totals
+    try:
+        PROFIT_ROLLUPS_QUEUE.add([(store_id, day) for day in days])
+    except:
+        capture_exception(level='warning')
+
+        # Rebuilt the next time they are shown
+        for day in days:
+            ProfitRollup.objects.filter(store_id=store_id, date__range=(day - timedelta(days=1), day + timedelta(days=1))).delete()
+
+
+def queue_orders_profit_rollups(store_ids, order_ids):
+    """Queue the rollup days of orders with changed costs"""
+
+    stores_dates = defaultdict(list)
+    orders = ShopifyOrder.objects.filter(store_id__in=store_ids, order_id__in=order_ids)
+    for store_id, created_at in orders.values_list('store_id', 'created_at'):
+        stores_dates[store_id].append(created_at)
+
+    for store_id, dates in stores_dates.items():
+        queue_profit_rollups(store_id, dates)
+
+
+def rebuild_queued_profit_rollups(days):
+    """Rebuild the rollups of (store ID, UTC date) days popped from PROFIT_ROLLUPS_QUEUE"""
+
+    stores_days = defaultdict(set)
+    for store_id, day in days:
+        # Queued days are in UTC, rollups are in the store timezone
+        stores_days[store_id].update([day - timedelta(days=1), day, day + timedelta(days=1)])
+
+    # Stores without rollups get them built the first time the dashboard is shown
+    rollups = ProfitRollup.objects.filter(store_id__in=list(stores_days.keys())) \
+                                  .select_related('store') \
+                                  .order_by('store_id', '-updated_at') \
+                                  .distinct('store_id')
+
+    for rollup in rollups:
+        store_days = sorted(stores_days[rollup.store_id])
+
+        # Rebuild each run of consecutive days at once
+        start = end = store_days[0]
+        for day in store_days[1:] + [None]:
+            if day is not None and day - end == timedelta(days=1):
+                end = day
+                continue
+
+            update_profit_rollups(rollup.store, start, end, rollup.timezone)
+            start = end = day
+
+
+def save_orders_refunds(store, orders_data):
+    """Save the refunds of Shopify orders payload and queue the profit rollups of the orders and refunds days
+
+    Args:
+        store (ShopifyStore): Orders store
+        orders_data (list): Shopify orders payload
+
+    Returns:
+        (tuple): Number of (updated, created) refunds
+    """
+
+    refunds = {}
+    for data in orders_data:
+        for refund in data.get('refunds') or []:
+            refunds[refund['id']] = OrderRefund(
+                store=store,
+                order_id=data['id'],
+                refund_id=refund['id'],
+                processed_at=arrow.get(refund.get('processed_at') or refund['created_at']).datetime,
+                amount=get_refund_amount(refund.get('transactions') or []))
+
+    to_update = []
+    for saved in OrderRefund.objects.filter(store=store, refund_id__in=list(refunds.keys())).only('id', 'refund_id'):
+        refunds[saved.refund_id].id = saved.id
+        to_update.append(refunds[saved.refund_id])
+
+    to_create = [i for i in refunds.values() if not i.id]
+
+    if to_update:
+        OrderRefund.objects.bulk_update(to_update, ['processed_at', 'amount'], batch_size=500)
+
+    if to_create:
+        OrderRefund.objects.bulk_create(to_create, batch_size=500, ignore_conflicts=True)
+
+    queue_profit_rollups(store.id, [i.get('created_at') for i in orders_data] + [i.processed_at for i in refunds.values()])
+
+    return len(to_update), len(to_create)
+
+
+def get_profits(store, start, end, store_timezone=''):
+    store_timezone = store_timezone or 'UTC'
+    days = list(arrow.Arrow.range('day', arrow.get(start).to(store_timezone), arrow.get(end).to(store_timezone)))
+    rollups = get_profit_rollups(store, days[0].date(), days[-1].date(), store_timezone)
+
+    profits_data = []
     totals = {
-        'revenue': orders.aggregate(total=Sum('total_price'))['total'] or 0.0,
-        'fulfillment_cost': shippings.aggregate(total=Sum('total_cost'))['total'] or 0.0,
-        'ads_spend': total_ad_costs,
-        'other_costs': other_costs.aggregate(total=Sum('amount__sum'))['total'] or 0.0,
+        'revenue': 0.0,
+        'fulfillment_cost': 0.0,
+        'ads_spend': 0.0,
+        'other_costs': 0.0,
         'average_profit': 0.0,
         'average_revenue': 0.0,
-        'refunds': total_refunds,
+        'refunds': 0.0,
+        'orders_count': 0,
+        'fulfillments_count': 0,
     }
-    totals['outcome'] = safe_float(totals['fulfillment_cost']) + safe_float(totals['ads_spend']) + safe_float(totals['other_costs'])
-    totals['profit'] = safe_float(totals['revenue']) - safe_float(totals['outcome']) - safe_float(total_refunds)
-    totals['orders_count'] = totals_orders_count
-    totals['fulfillments_count'] = total_fulfillments_count
+
+    for day in reversed(days):
+        rollup = rollups[day.date()]
+        revenue = safe_float(rollup.revenue)
+        refunds = safe_float(rollup.refunds)
+        fulfillment_cost = safe_float(rollup.fulfillment_cost)
+        ad_spend = safe_float(rollup.ad_spend)
+        other_costs = safe_float(rollup.other_costs)
+        outcome = fulfillment_cost + ad_spend + other_costs
+
+        # Other costs might be saved as 0
+        empty = not (rollup.orders_count or rollup.fulfillments_count or refunds or ad_spend or other_costs)
+
+        profits_data.append({
+            'date_as_string': day.format('MM/DD/YYYY'),
+            'date_as_slug': day.format('YYYY-MM-DD'),
+            'week_day': day.strftime('%A'),
+            'empty': empty,
+            'css_empty': 'empty' if empty else '',
+            'revenue': revenue - refunds,
+            'fulfillment_cost': fulfillment_cost,
+            'fulfillments_count': rollup.fulfillments_count,
+            'orders_count': rollup.orders_count,
+            'ad_spend': ad_spend,
+            'other_costs': other_costs,
+            'outcome': outcome,
+            'profit': revenue - refunds - outcome,
+        })
+
+        totals['revenue'] += revenue
+        totals['refunds'] += refunds
+        totals['fulfillment_cost'] += fulfillment_cost
+        totals['ads_spend'] += ad_spend
+        totals['other_costs'] += other_costs
+        totals['orders_count'] += rollup.orders_count
+        totals['fulfillments_count'] += rollup.fulfillments_count
+
+    totals['outcome'] = totals['fulfillment_cost'] + totals['ads_spend'] + totals['other_costs']
+    totals['profit'] = totals['revenue'] - totals['outcome'] - totals['refunds']
     totals['orders_per_day'] = totals['orders_count'] / len(days)
-    totals['fulfillments_per_day'] = Decimal(total_fulfillments_count / len(days)).quantize(Decimal('.01'))
+    totals['fulfillments_per_day'] = Decimal(totals['fulfillments_count'] / len(days)).quantize(Decimal('.01'))
     totals['profit_margin'] = calculate_profit_margin(totals['revenue'], totals['profit'])
     if totals['orders_count'] != 0:
         totals['average_profit'] = totals['profit'] / totals['orders_count']
@@ -254,24 +409,20 @@ def get_profits(store, start, end, store_timezone=''):
                                  (start, end),
                                  limit=20,
                                  page=1,
-                                 orders_map=orders_map,
-                                 refunds_list=refunds,
                                  store_timezone=store_timezone)
 
-    return list(profits_data.values()), totals, details
+    return profits_data, totals, details
 
 
-def get_costs_from_track(track, commit=False):
-    """Get Aliexpress cost data from Order Track and (optionally) commit changes to the database
+def parse_track_costs(track):
+    """Parse Aliexpress cost data from the Order Track
 
     Args:
         track (ShopifyOrderTrack): Order Track
-        commit (bool, optional): Commit changes to the database:
-            - Update or create AliexpressFulfillmentCost from the track data
-            - Remove AliexpressFulfillmentCost is the order is canceled in Aliexpress
 
     Returns:
-        (dict/None): Return None in case of error or track doesn't have costs
+        (tuple): (costs, cancelled) costs is None in case of error or if the track doesn't have costs,
+                 cancelled is True when the order is canceled in Aliexpress
     """
 
     costs = {
@@ -283,7 +434,7 @@ def get_costs_from_track(track, commit=False):
     try:
         data = json.loads(track.data) if track.data else {}
     except:
-        return
+        return None, False
 
     if data.get('aliexpress') and data.get('aliexpress').get('order_details') and \
             data.get('aliexpress').get('order_details').get('cost'):
@@ -301,14 +452,7 @@ def get_costs_from_track(track, commit=False):
             costs['products_cost'] = cost.get('products').replace(',', '.')
 
         if data['aliexpress']['end_reason'] and data['aliexpress']['end_reason'].lower() in ALIEXPRESS_CANCELLED_STATUS:
-            # Remove cancelled fulfillment costs
-            if commit:
-                AliexpressFulfillmentCost.objects.filter(
-                    store=track.store,
-                    order_id=track.order_id,
-                    source_id=track.source_id
-                ).delete()
-            return
+            return None, True
 
         try:
             float(costs['total_cost']) + float(costs['shipping_cost']) + float(costs['products_cost'])
@@ -320,9 +464,42 @@ def get_costs_from_track(track, commit=False):
         try:
             float(costs['total_cost']) + float(costs['shipping_cost']) + float(costs['products_cost'])
         except:
-            return
+            return None, False
 
     if any(costs.values()):
+        return costs, False
+
+    return None, False
+
+
+def get_costs_from_track(track, commit=False):
+    """Get Aliexpress cost data from Order Track and (optionally) commit changes to the database
+
+    Args:
+        track (ShopifyOrderTrack): Order Track
+        commit (bool, optional): Commit changes to the database:
+            - Update or create AliexpressFulfillmentCost from the track data
+            - Remove AliexpressFulfillmentCost is the order is canceled in Aliexpress
+
+    Returns:
+        (dict/None): Return None in case of error or track doesn't have costs
+    """
+
+    costs, cancelled = parse_track_costs(track)
+
+    if cancelled:
+        # Remove cancelled fulfillment costs
+        if commit:
+            AliexpressFulfillmentCost.objects.filter(
+                store=track.store,
+                order_id=track.order_id,
+                source_id=track.source_id
+            ).delete()
+
+            queue_orders_profit_rollups([track.store_id], [track.order_id])
+        return
+
+    if costs:
         if commit:
             while True:
                 try:
@@ -349,124 +526,215 @@ def get_costs_from_track(track, commit=False):
 
                 break
 
+            queue_orders_profit_rollups([track.store_id], [track.order_id])
+
         return costs
 
 
-def order_refunds(store, start, end, store_timezone=''):
-    params = {
-        'updated_at_min': arrow.get(start).isoformat(),
-        'updated_at_max': arrow.get(end).isoformat(),
-        'fields': 'refunds',
-    }
+def save_tracks_costs(tracks):
+    """Update or create AliexpressFulfillmentCost of many Order Tracks in bulk
+
+    Costs are recomputed from the current tracks data, saving the same tracks again gives the same result
+
+    Args:
+        tracks (list): ShopifyOrderTrack list, when many tracks share the same order and source ID the last one is used
+
+    Returns:
+        (tuple): Number of (updated, created, deleted) costs
+    """
+
+    tracks_costs = {}
+    for track in tracks:
+        try:
+            costs, cancelled = parse_track_costs(track)
+        except:
+            # Malformed track data is skipped, raising would queue the whole batch again
+            capture_exception(extra={'track': track.id})
+            continue
+
+        if costs or cancelled:
+            tracks_costs[(track.store_id, track.order_id, track.source_id)] = (track, costs)
+
+    if not tracks_costs:
+        return 0, 0, 0
+
+    existing = {}
+    fulfillment_costs = AliexpressFulfillmentCost.objects.filter(
+        store_id__in=set(k[0] for k in tracks_costs),
+        order_id__in=set(k[1] for k in tracks_costs))
+
+    for fulfillment_cost in fulfillment_costs.order_by('id'):
+        key = (fulfillment_cost.store_id, fulfillment_cost.order_id, fulfillment_cost.source_id)
+        if key in tracks_costs:
+            existing.setdefault(key, []).append(fulfillment_cost)
+
+    to_update = []
+    to_create = []
+    to_delete = []
+    for key, (track, costs) in tracks_costs.items():
+        found = existing.get(key, [])
+        if not costs:
+            # Remove cancelled fulfillment costs
+            to_delete.extend([i.id for i in found])
+            continue
+
+        if found:
+            fulfillment_cost = found[0]
+            to_delete.extend([i.id for i in found[1:]])  # Duplicated costs
+        else:
+            fulfillment_cost = AliexpressFulfillmentCost(store_id=track.store_id, order_id=track.order_id, source_id=track.source_id)
+
+        fulfillment_cost.created_at = track.created_at.date()
+        fulfillment_cost.shipping_cost = costs['shipping_cost']
+        fulfillment_cost.products_cost = costs['products_cost']
+        fulfillment_cost.total_cost = costs['total_cost']
+
+        if fulfillment_cost.id:
+            to_update.append(fulfillment_cost)
+        else:
+            to_create.append(fulfillment_cost)
+
+    if to_delete:
+        AliexpressFulfillmentCost.objects.filter(id__in=to_delete).delete()
+
+    if to_update:
+        AliexpressFulfillmentCost.objects.bulk_update(
+            to_update,
+            ['created_at', 'shipping_cost', 'products_cost', 'total_cost'],
+            batch_size=500)
+
+    if to_create:
+        AliexpressFulfillmentCost.objects.bulk_create(to_create, batch_size=500)
+
+    queue_orders_profit_rollups(set(k[0] for k in tracks_costs), set(k[1] for k in tracks_costs))
+
+    return len(to_update), len(to_create), len(to_delete)
+
+
+def queue_track_costs(track):
+    """Queue the Order Track costs to be saved by the next `sync_tracks_costs` task run"""
+
+    try:
+        TRACK_COSTS_QUEUE.add([track.id])
+    except:
+        capture_exception(level='warning')
+
+        try:
+            if track.user.can('profit_dashboard.use'):
+                get_costs_from_track(track, commit=True)
+        except User.DoesNotExist:
+            pass
+        except:
+            capture_exception()
+
+
+def save_queued_tracks_costs(track_ids):
+    """Save the costs of Order Tracks popped from TRACK_COSTS_QUEUE for users who can use the dashboard"""
 
-    def retrieve_refunds(params):
-        api = ShopifyAPI(store)
-        for shopify_orders in api.paginate_orders(**params):
-            for order in shopify_orders:
-                for refund in order.get('refunds'):
-                    # Correct our database date to show these at the correct day
-                    processed_at = arrow.get(refund.get('processed_at')).to(store_timezone)
-                    # Only yield refunds processed within date range
-                    if start < processed_at < end:
-                        refund['processed_at_datetime'] = processed_at
-                        yield refund
-
-    # Partially refunded
-    params['financial_status'] = 'partially_refunded'
-    for refund in retrieve_refunds(params):
-        yield refund
-
-    # Refunded and partially refunded can only be retrieved separately
-    params['financial_status'] = 'refunded'
-    for refund in retrieve_refunds(params):
-        yield refund
+    users_access = {}
+    tracks = []
+    for track in ShopifyOrderTrack.objects.filter(id__in=track_ids).select_related('user').order_by('id'):
+        if track.user_id not in users_access:
+            users_access[track.user_id] = track.user.can('profit_dashboard.use')
+
+        if users_access[track.user_id]:
+            tracks.append(track)
+
+    save_tracks_costs(tracks)
 
 
 def get_refund_amount(transactions):
     refund_amount = 0.0
-    for transaction in transactions:
-        kind = transaction.get('kind', 'refund')
-        test_transaction = transaction.get('test', False)
+    for refund_transaction in transactions:
+        kind = refund_transaction.get('kind', 'refund')
+        test_transaction = refund_transaction.get('test', False)
         if not test_transaction and kind == 'refund':
-            refund_amount += float(transaction.get('amount'))
+            refund_amount += float(refund_transaction.get('amount'))
 
     return refund_amount
 
 
-def get_profit_details(store, date_range, limit=20, page=1, orders_map=None, refunds_list=None, store_timezone=''):
+def get_profit_details(store, date_range, limit=20, page=1, store_timezone=''):
     """
     Returns each refund, order and aliexpress fulfillment sorted by date
+
+    Orders and refunds rows are paginated in the database, only the rows of the page are loaded
     """
-    start, end = date_range
-
-    if not orders_map:
-        orders_map = {}
-        orders = ShopifyOrder.objects.filter(
-            store_id=store.id,
-            created_at__range=date_range,
-            financial_status__in=['authorized', 'partially_paid', 'paid', 'partially_refunded', 'refunded']
-        ).values('created_at', 'total_price', 'order_id')
-        for order in orders:
-            created_at = arrow.get(order['created_at'])
-            try:
-                created_at = created_at.to(store_timezone)
-            except:
-                pass
-
-            orders_map[order['order_id']] = {
-                'date': created_at.datetime,
-                'date_as_string': created_at.format('MM/DD/YYYY'),
-                'order_id': order['order_id'],
+
+    try:
+        tzinfo = pytz.timezone(store_timezone)
+    except:
+        tzinfo = pytz.utc
+
+    orders = get_profit_orders(store).filter(created_at__range=date_range)
+    refunds = OrderRefund.objects.filter(store=store, processed_at__range=date_range) \
+                                 .annotate(day=TruncDate('processed_at', tzinfo=tzinfo))
+
+    # Refunds processed the day their order was created are shown in the order row,
+    # later refunds of the same order and day are shown in a refund row
+    same_day_order = orders.filter(order_id=OuterRef('order_id')) \
+                           .annotate(day=TruncDate('created_at', tzinfo=tzinfo)) \
+                           .filter(day=OuterRef('day'))
+    refund_rows = refunds.filter(~Exists(same_day_order)) \
+                         .values('order_id', 'day') \
+                         .annotate(row_date=Min('processed_at'), is_order=Value(False, output_field=BooleanField())) \
+                         .values_list('order_id', 'row_date', 'is_order')
+    order_rows = orders.annotate(row_date=F('created_at'), is_order=Value(True, output_field=BooleanField())) \
+                       .values_list('order_id', 'row_date', 'is_order')
+
+    # Paginate profit details
+    paginator = FakePaginator(range(0, order_rows.count() + refund_rows.count()), limit)
+    page = min(max(1, page), paginator.num_pages)
+    rows = order_rows.union(refund_rows, all=True).order_by('-row_date', '-is_order', 'order_id')
+    rows = list(rows[(page - 1) * limit:page * limit])
+
+    orders_data = orders.filter(order_id__in=[i[0] for i in rows if i[2]]).values('created_at', 'total_price', 'order_id')
+    orders_data = {i['order_id']: i for i in orders_data}
+
+    profit_details = []
+    details_map = {}
+    for order_id, row_date, is_order in rows:
+        row_date = arrow.get(row_date).to(tzinfo)
+        if is_order:
+            order = orders_data[order_id]
+            detail = {
+                'date': row_date.datetime,
+                'date_as_string': row_date.format('MM/DD/YYYY'),
+                'order_id': order_id,
                 'total_price': order['total_price'],
                 'total_refund': 0.0,
                 'profit': order['total_price'],
                 'products': [],
                 'refunded_products': [],
+                'refund_ids': [],
                 'aliexpress_track': []
             }
+        else:
+            detail = {
+                'date': row_date.datetime,
+                'date_as_string': row_date.format('MM/DD/YYYY'),
+                'order_id': order_id,
+                'profit': 0.0,
+                'total_refund': 0.0,
+                'refunded_products': [],
+                'refund_ids': [],
+            }
 
-    if not refunds_list:
-        refunds_list = order_refunds(store, start, end, store_timezone)
-
-    # Merge refunds with orders
-    new_refunds = {}  # For refunds done later than order.created_at
-    for refund in refunds_list:
-        order_id = refund.get('order_id')
-        processed_at = refund['processed_at_datetime']
-        order_created_at = orders_map.get(order_id, {}).get('date')
-
-        # Sum refund amount
-        refund_amount = get_refund_amount(refund.get('transactions'))
+        details_map[(order_id, row_date.date())] = detail
+        profit_details.append(detail)
 
-        # Refunded products
-        refunded_products = [i.get('line_item') for i in refund.get('refund_line_items', [])]
+    # Merge refunds with the rows being shown
+    for refund in refunds.filter(order_id__in=set(i[0] for i in rows)):
+        detail = details_map.get((refund.order_id, refund.day))
+        if detail is None:
+            continue
 
-        # Same refund.processed_at as order.created_at shows at the same row
-        if order_created_at and order_created_at.date() == processed_at.date():
-            orders_map[order_id]['total_refund'] -= refund_amount
-            orders_map[order_id]['profit'] -= refund_amount
-            orders_map[order_id]['refunded_products'] += refunded_products
-        else:
-            refunds_key = '{}-{}'.format(processed_at.format('YYYY-MM-DD'), order_id)
-            if refunds_key not in new_refunds:
-                new_refunds[refunds_key] = {
-                    'date': processed_at.datetime,
-                    'date_as_string': processed_at.format('MM/DD/YYYY'),
-                    'order_id': refund.get('order_id'),
-                    'profit': 0.0,
-                    'total_refund': 0.0,
-                    'refunded_products': [],
-                }
-
-            new_refunds[refunds_key]['profit'] -= refund_amount
-            new_refunds[refunds_key]['total_refund'] -= refund_amount
-            new_refunds[refunds_key]['refunded_products'] += refunded_products
+        refund_amount = safe_float(refund.amount)
+        detail['total_refund'] -= refund_amount
+        detail['profit'] -= refund_amount
+        detail['refund_ids'].append(refund.refund_id)
 
-    # Paginate profit details
-    profit_details = list(orders_map.values()) + list(new_refunds.values())
-    profit_details = sorted(profit_details, key=lambda k: k['date'], reverse=True)
-    paginator = SimplePaginator(profit_details, limit)
-    page = min(max(1, page), paginator.num_pages)
+    paginator.set_orders(profit_details)
     profit_details = paginator.page(page)
 
     # Get track for orders being shown
@@ -496,20 +764,27 @@ def get_profit_details(store, date_range, limit=20, page=1, orders_map=None, ref
         return x + float(y['costs']['total_cost'])
 
     shopify_orders = {}
+    refunded_products = {}
     api = ShopifyAPI(store)
-    for shopify_orders_page in api.paginate_orders(ids=order_ids, fields='name,id,line_items'):
+    for shopify_orders_page in api.paginate_orders(ids=order_ids, fields='name,id,line_items,refunds'):
         for order in shopify_orders_page:
             shopify_orders[order['id']] = {
                 'name': order['name'],
                 'line_items': order.get('line_items', [])
             }
 
+            for refund in order.get('refunds') or []:
+                refunded_products[refund['id']] = [i.get('line_item') for i in refund.get('refund_line_items', [])]
+
     # Merge tracks with orders
     for detail in profit_details:
         order_id = detail.get('order_id')
         shopify_order = shopify_orders.get(order_id, {})
         row_with_order = 'total_price' in detail
 
+        for refund_id in detail.pop('refund_ids', []):
+            detail['refunded_products'] += refunded_products.get(refund_id, [])
+
         if row_with_order:  # Only get tracks and line items if not just a refund
             detail['products'] = shopify_order.get('line_items', [])
 
@@ -22,12 +22,14 @@ from .utils import (
     calculate_profits,
     get_profit_details,
     get_date_range,
+    queue_profit_rollups,
 )
 from .models import (
     INITIAL_DATE,
     CONFIG_CHOICES,
     FacebookAccess,
     FacebookAccount,
+    FacebookAdCost,
     OtherCost,
 )
 from .tasks import fetch_facebook_insights
@@ -336,6 +338,8 @@ def save_other_costs(request):
         except OtherCost.MultipleObjectsReturned:
             OtherCost.objects.filter(store=store, date=date).delete()
 
+    queue_profit_rollups(store.id, [date])
+
     return JsonResponse({'status': 'ok'})
 
 
@@ -356,6 +360,9 @@ def facebook_remove_account(request):
         access.account_ids = ','.join(account_ids)
         access.save()
 
+        ad_costs = FacebookAdCost.objects.filter(account__in=account)
+        queue_profit_rollups(store.id, ad_costs.values_list('created_at', flat=True).distinct())
+
         account.delete()
 
         return JsonResponse({'success': True})
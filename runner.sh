@@ -22,6 +22,9 @@ elif [[ "$TYPE" == "worker2" ]]; then
 
     newrelic-admin run-program celery worker -A app.celery_base -O fair -Q priority_high
 
+elif [[ "$TYPE" == "beat" ]]; then
+    celery beat -A app.celery_base
+
 elif [[ "$TYPE" == "worker3" ]]; then
     python manage.py consume_alibaba_messages
 
@@ -7,7 +7,9 @@ from django.contrib.auth import logout as user_logout
 from django.contrib.auth.models import User
 from django.core.cache import cache
 from django.core.validators import ValidationError, validate_email
-from django.http import JsonResponse
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast
+from django.http import HttpResponseNotModified, JsonResponse
 from django.template.defaultfilters import slugify
 from django.views.generic import View
 
@@ -40,6 +42,18 @@ from .mixins import ApiResponseMixin
 class ShopifiedApi(ApiResponseMixin, View):
     login_non_required = ['login', 'extension-settings']
 
+    orders_sync_sources = [
+        ('shopify', ShopifyOrderTrack, 'get_shopify_stores'),
+        ('chq', CommerceHQOrderTrack, 'get_chq_stores'),
+        ('woo', WooOrderTrack, 'get_woo_stores'),
+        ('gear', GearBubbleOrderTrack, 'get_gear_stores'),
+        ('gkart', GrooveKartOrderTrack, 'get_gkart_stores'),
+        ('bigcommerce', BigCommerceOrderTrack, 'get_bigcommerce_stores'),
+        ('ebay', EbayOrderTrack, 'get_ebay_stores'),
+        ('fb', FBOrderTrack, 'get_fb_stores'),
+        ('google', GoogleOrderTrack, 'get_google_stores'),
+    ]
+
     def post_login(self, request, user, data):
         email = data.get('username')
         password = data.get('password')
@@ -270,8 +284,6 @@ class ShopifiedApi(ApiResponseMixin, View):
         if not user.can('orders.use'):
             return self.api_error('Order is not included in your account', status=402)
 
-        orders = []
-
         since_key = 'sync_since_{}'.format(user.id)
         all_orders = cache.get(since_key) is None
 
@@ -281,166 +293,67 @@ class ShopifiedApi(ApiResponseMixin, View):
             since = arrow.now().replace(days=-30).datetime
             cache.set(since_key, arrow.utcnow().timestamp, timeout=86400)
 
-        # Shopify
-        store_ids = list(user.profile.get_shopify_stores(flat=True))
-        if store_ids:
-            order_tracks = core_utils.using_replica(ShopifyOrderTrack) \
-                .filter(store__in=store_ids) \
-                .filter(created_at__gte=since) \
-                .filter(source_tracking='') \
-                .filter(shopify_status='') \
-                .exclude(source_status='FINISH') \
-                .filter(hidden=False) \
-                .only(*core_utils.serializers_orders_fields()) \
-                .order_by('created_at')
-
-            if data.get('store'):
-                order_tracks = order_tracks.filter(store=data.get('store'))
-
-            orders.extend(core_utils.serializers_orders_track(order_tracks, 'shopify'))
-
-        # CommerceHQ
-        store_ids = list(user.profile.get_chq_stores(flat=True))
-        if store_ids:
-            order_tracks = core_utils.using_replica(CommerceHQOrderTrack) \
-                .filter(store__in=store_ids) \
-                .filter(created_at__gte=since) \
-                .filter(source_tracking='') \
-                .exclude(source_status='FINISH') \
-                .filter(hidden=False) \
-                .defer('data') \
-                .order_by('created_at')
-
-            if data.get('store'):
-                order_tracks = order_tracks.filter(store=data.get('store'))
-
-            orders.extend(core_utils.serializers_orders_track(order_tracks, 'chq'))
-
-        # WooCommerce
-        store_ids = list(user.profile.get_woo_stores(flat=True))
-        if store_ids:
-            order_tracks = core_utils.using_replica(WooOrderTrack) \
-                .filter(store__in=store_ids) \
-                .filter(created_at__gte=since) \
-                .filter(source_tracking='') \
-                .exclude(source_status='FINISH') \
-                .filter(hidden=False) \
-                .defer('data') \
-                .order_by('created_at')
-
-            if data.get('store'):
-                order_tracks = order_tracks.filter(store=data.get('store'))
-
-            orders.extend(core_utils.serializers_orders_track(order_tracks, 'woo'))
-
-        # GearBubble
-        store_ids = list(user.profile.get_gear_stores(flat=True))
-        if store_ids:
-            order_tracks = core_utils.using_replica(GearBubbleOrderTrack) \
-                .filter(store__in=store_ids) \
-                .filter(created_at__gte=since) \
-                .filter(source_tracking='') \
-                .exclude(source_status='FINISH') \
-                .filter(hidden=False) \
-                .defer('data') \
-                .order_by('created_at')
-
-            if data.get('store'):
-                order_tracks = order_tracks.filter(store=data.get('store'))
-
-            orders.extend(core_utils.serializers_orders_track(order_tracks, 'gear'))
-
-        # GrooveKart
-        store_ids = list(user.profile.get_gkart_stores(flat=True))
-        if store_ids:
-            order_tracks = core_utils.using_replica(GrooveKartOrderTrack) \
+        etag = core_utils.hash_text('{}_{}_{}_{}_{}'.format(
+            core_utils.get_orders_sync_version(user.models_user.id),
+            user.id,
+            since.timestamp() if not all_orders else '',
+            data.get('store', ''),
+            arrow.utcnow().format('YYYY-MM-DD')))
+
+        # Nothing changed since the extension's last poll
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH') or data.get('etag') or ''
+        if not all_orders and if_none_match.strip('"') == etag:
+            return HttpResponseNotModified()
+
+        order_tracks = []
+        int_lines = []
+        for store_type, model, get_stores in self.orders_sync_sources:
+            if model._meta.get_field('line_id').get_internal_type() != 'CharField':
+                int_lines.append(store_type)
+
+            store_ids = getattr(user.profile, get_stores)(flat=True)
+            if settings.READ_REPLICA:
+                store_ids = store_ids.using(settings.READ_REPLICA)
+
+            tracks = core_utils.using_replica(model) \
                 .filter(store__in=store_ids) \
                 .filter(created_at__gte=since) \
                 .filter(source_tracking='') \
                 .exclude(source_status='FINISH') \
-                .filter(hidden=False) \
-                .defer('data') \
-                .order_by('created_at')
-
-            if data.get('store'):
-                order_tracks = order_tracks.filter(store=data.get('store'))
-
-            orders.extend(core_utils.serializers_orders_track(order_tracks, 'gkart'))
+                .filter(hidden=False)
 
-        # BigCommerce
-        store_ids = list(user.profile.get_bigcommerce_stores(flat=True))
-        if store_ids:
-            order_tracks = core_utils.using_replica(BigCommerceOrderTrack) \
-                .filter(store__in=store_ids) \
-                .filter(created_at__gte=since) \
-                .filter(source_tracking='') \
-                .exclude(source_status='FINISH') \
-                .filter(hidden=False) \
-                .defer('data') \
-                .order_by('created_at')
+            if model is ShopifyOrderTrack:
+                tracks = tracks.filter(shopify_status='')
 
             if data.get('store'):
-                order_tracks = order_tracks.filter(store=data.get('store'))
+                tracks = tracks.filter(store=data.get('store'))
 
-            orders.extend(core_utils.serializers_orders_track(order_tracks, 'bigcommerce'))
+            # Line IDs are strings for some stores, cast them to have the same column type in the UNION
+            tracks = tracks.annotate(store_type=Value(store_type, output_field=CharField()),
+                                     sync_line_id=Cast('line_id', output_field=CharField())) \
+                .values('id', 'order_id', 'sync_line_id', 'source_id', 'source_status', 'source_type',
+                        'source_tracking', 'created_at', 'updated_at', 'store_type') \
+                .order_by()
 
-        # eBay
-        store_ids = list(user.profile.get_ebay_stores(flat=True))
-        if store_ids:
-            order_tracks = core_utils.using_replica(EbayOrderTrack) \
-                .filter(store__in=store_ids) \
-                .filter(created_at__gte=since) \
-                .filter(source_tracking='') \
-                .exclude(source_status='FINISH') \
-                .filter(hidden=False) \
-                .defer('data') \
-                .order_by('created_at')
+            order_tracks.append(tracks)
 
-            if data.get('store'):
-                order_tracks = order_tracks.filter(store=data.get('store'))
-
-            orders.extend(core_utils.serializers_orders_track(order_tracks, 'ebay'))
-
-        # Facebook
-        store_ids = list(user.profile.get_fb_stores(flat=True))
-        if store_ids:
-            order_tracks = core_utils.using_replica(FBOrderTrack) \
-                .filter(store__in=store_ids) \
-                .filter(created_at__gte=since) \
-                .filter(source_tracking='') \
-                .exclude(source_status='FINISH') \
-                .filter(hidden=False) \
-                .defer('data') \
-                .order_by('created_at')
-
-            if data.get('store'):
-                order_tracks = order_tracks.filter(store=data.get('store'))
-
-            orders.extend(core_utils.serializers_orders_track(order_tracks, 'fb'))
-
-        # Google
-        store_ids = list(user.profile.get_google_stores(flat=True))
-        if store_ids:
-            order_tracks = core_utils.using_replica(GoogleOrderTrack) \
-                .filter(store__in=store_ids) \
-                .filter(created_at__gte=since) \
-                .filter(source_tracking='') \
-                .exclude(source_status='FINISH') \
-                .filter(hidden=False) \
-                .defer('data') \
-                .order_by('created_at')
-
-            if data.get('store'):
-                order_tracks = order_tracks.filter(store=data.get('store'))
+        orders = []
+        order_tracks = order_tracks[0].union(*order_tracks[1:], all=True).order_by('created_at')
+        for fields in order_tracks:
+            line_id = fields.pop('sync_line_id')
+            fields['line_id'] = int(line_id) if fields['store_type'] in int_lines else line_id
 
-            orders.extend(core_utils.serializers_orders_track(order_tracks, 'google'))
+            orders.extend(core_utils.format_orders_track_fields(fields))
 
-        return self.api_success({
+        response = self.api_success({
             'orders': orders,
             'all_orders': all_orders,
             'date': arrow.utcnow().timestamp
         })
 
+        response['ETag'] = f'"{etag}"'
+        return response
+
     def get_ali_login(self, request, user, data):
         # Ensure the Dropified Secret key match with our app's setting key
         if settings.API_SECRECT_KEY != request.META.get('HTTP_X_DROPIFIED_SECRET'):
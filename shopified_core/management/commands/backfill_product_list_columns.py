@@ -0,0 +1,67 @@
+import json
+
+from django.apps import apps
+
+from shopified_core.commands import DropifiedBaseCommand
+
+PRODUCT_MODELS = {
+    'shopify': 'leadgalaxy.ShopifyProduct',
+    'chq': 'commercehq_core.CommerceHQProduct',
+    'woo': 'woocommerce_core.WooProduct',
+    'gear': 'gearbubble_core.GearBubbleProduct',
+    'gkart': 'groovekart_core.GrooveKartProduct',
+    'bigcommerce': 'bigcommerce_core.BigCommerceProduct',
+    'fb_marketplace': 'fb_marketplace_core.FBMarketplaceProduct',
+}
+
+
+class Command(DropifiedBaseCommand):
+    help = 'Fill the product list columns (image, price range, vendor...) from the products data'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--store-type', dest='store_types', action='append', choices=list(PRODUCT_MODELS.keys()),
+                            help='Only backfill this store type products (default: all)')
+        parser.add_argument('--user', type=int, help='Only backfill this user products')
+        parser.add_argument('--batch', type=int, default=1000, help='Number of products to update per query')
+        parser.add_argument('--all', dest='all_products', action='store_true', help='Update products that already have list columns')
+
+    def start_command(self, *args, **options):
+        for store_type in options['store_types'] or PRODUCT_MODELS.keys():
+            model = apps.get_model(PRODUCT_MODELS[store_type])
+
+            products = model.objects.all()
+            if options['user']:
+                products = products.filter(user_id=options['user'])
+
+            if not options['all_products']:
+                products = products.filter(variants_count=None)
+
+            self.write(f'Backfill {store_type} products')
+            self.progress_total(products.count())
+
+            last_id = 0
+            while True:
+                batch = list(products.filter(id__gt=last_id).only('id', 'data').order_by('id')[:options['batch']])
+                if not batch:
+                    break
+
+                updated = []
+                for product in batch:
+                    try:
+                        data = json.loads(product.data or '{}')
+                    except ValueError:
+                        data = None
+
+                    if not isinstance(data, dict):
+                        self.write(f'> Invalid data for product #{product.id}')
+                        continue
+
+                    product.update_list_columns(data)
+                    updated.append(product)
+
+                model.objects.bulk_update(updated, model.LIST_COLUMNS)
+
+                last_id = batch[-1].id
+                self.progress_update(len(batch))
+
+            self.progress_close()
@@ -1,5 +1,9 @@
+import hashlib
+import time
+
 from django.conf import settings
 from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.http import JsonResponse
 from django.http import QueryDict
 from django.views.generic import View
@@ -10,6 +14,43 @@ from lib.exceptions import capture_exception, capture_message
 from shopified_core.utils import jwt_decode
 from .exceptions import ApiLoginException
 
+TOKEN_USER_CACHE_TIMEOUT = 300
+
+
+def token_cache_key(token):
+    return f'api_token_user_{hashlib.sha256(token.encode()).hexdigest()}'
+
+
+def user_tokens_cache_key(user_id):
+    return f'api_token_digests_{user_id}'
+
+
+def cache_token_user(token, user_id, timeout=TOKEN_USER_CACHE_TIMEOUT):
+    """ Map the token digest to the user ID and remember it so it can be cleared with `clear_token_cache` """
+
+    key = token_cache_key(token)
+    cache.set(key, user_id, timeout=timeout)
+
+    tokens_key = user_tokens_cache_key(user_id)
+    keys = cache.get(tokens_key) or []
+    if key not in keys:
+        cache.set(tokens_key, keys[-19:] + [key], timeout=TOKEN_USER_CACHE_TIMEOUT)
+
+
+def clear_token_cache(user_id=None, token=None):
+    """ Remove cached tokens of a user (logout, deleted user) or a single token (deleted access token) """
+
+    keys = []
+    if token:
+        keys.append(token_cache_key(token))
+
+    if user_id:
+        keys.extend(cache.get(user_tokens_cache_key(user_id)) or [])
+        keys.append(user_tokens_cache_key(user_id))
+
+    if keys:
+        cache.delete_many(keys)
+
 
 class RequestDataMixin:
     def request_data(self, request):
@@ -97,26 +138,53 @@ class AuthenticationMixin(RequestDataMixin):
         return user
 
     def user_from_token(self, token):
-        if token:
+        if not token:
+            return
+
+        # The profile and plan are used by most API calls
+        users = User.objects.select_related('profile', 'profile__plan')
+
+        user_id = cache.get(token_cache_key(token))
+        if user_id:
             try:
-                return User.objects.get(accesstoken__token=token)
+                return users.get(id=user_id)
             except User.DoesNotExist:
-                pass
-            except:
-                capture_exception()
+                clear_token_cache(user_id=user_id, token=token)
 
+        user = None
+        info = {}
+        try:
+            user = users.get(accesstoken__token=token)
+        except User.DoesNotExist:
+            pass
+        except:
+            capture_exception()
+
+        if user is None:
             try:
                 info = jwt_decode(token)
-                return User.objects.get(id=info['id'])
+                user = users.get(id=info['id'])
             except:
                 pass
 
+        if user is None:
             try:
                 info = jwt_decode(token, key=settings.SSO_SECRET_KEY)
-                return User.objects.get(id=info['id'])
+                user = users.get(id=info['id'])
             except:
                 pass
 
+        if user is not None:
+            # JWT must not stay cached after they expire
+            timeout = TOKEN_USER_CACHE_TIMEOUT
+            if info.get('exp'):
+                timeout = min(timeout, int(info['exp'] - time.time()))
+
+            if timeout > 0:
+                cache_token_user(token, user.id, timeout=timeout)
+
+        return user
+
 
 class ApiResponseMixin(AuthenticationMixin, View):
     login_non_required = []
@@ -11,7 +11,51 @@ from django.utils.functional import cached_property
 
 from shopified_core.utils import get_domain, add_http_schema
 from supplements.models import SUPPLEMENTS_SUPPLIER, UserSupplement
-from .utils import ALIEXPRESS_SOURCE_STATUS, OrderErrors, safe_str, prefix_from_model, base64_encode
+from .utils import ALIEXPRESS_SOURCE_STATUS, OrderErrors, safe_float, safe_str, prefix_from_model, base64_encode
+
+
+class ParsedJSON:
+    """ Decoded value of a JSON text field
+
+    The text is decoded once and cached on the instance until the field is assigned a new value,
+    assigning a value to the attribute serializes it to the field.
+    Values that are not of the default type (null, a list instead of an object) decode to the default.
+    The returned value is shared between calls, copy it before modifying it or save it back.
+    """
+
+    def __init__(self, field_name, default=dict):
+        self.field_name = field_name
+        self.default = default
+
+    def __set_name__(self, owner, name):
+        self.cache_name = f'_{name}_cache'
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+
+        text = getattr(instance, self.field_name)
+        cached = instance.__dict__.get(self.cache_name)
+        if cached is not None and cached[0] is text:
+            return cached[1]
+
+        try:
+            value = json.loads(text) if text else self.default()
+        except:
+            value = self.default()
+
+        if not isinstance(value, type(self.default())):
+            value = self.default()
+
+        instance.__dict__[self.cache_name] = (text, value)
+
+        return value
+
+    def __set__(self, instance, value):
+        text = json.dumps(value)
+        setattr(instance, self.field_name, text)
+
+        instance.__dict__[self.cache_name] = (text, value)
 
 
 class StoreBase(models.Model):
@@ -51,6 +95,8 @@ class SupplierBase(models.Model):
     class Meta:
         abstract = True
 
+    variants_map_json = ParsedJSON('variants_map')
+
     @property
     def is_dropified(self):
         return 'dropified.com' in self.product_url \
@@ -145,6 +191,13 @@ class ProductBase(models.Model):
     tags = models.TextField(blank=True, null=True, default='')
     boards_list = ArrayField(models.IntegerField(), null=True, blank=True)
 
+    # Copied from ``data`` on save so product lists don't have to decode it
+    image = models.TextField(blank=True, default='')
+    original_url = models.TextField(blank=True, default='')
+    vendor = models.CharField(max_length=255, blank=True, default='')
+    price_range = ArrayField(models.FloatField(), size=2, null=True, blank=True)
+    variants_count = models.IntegerField(null=True, blank=True)
+
     data = models.TextField(default='{}', null=True, blank=True)
     notes = models.TextField(null=True, blank=True)
 
@@ -165,11 +218,80 @@ class ProductBase(models.Model):
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
     updated_at = models.DateTimeField(auto_now=True)
 
-    def get_bundle_mapping(self, variant=None, default=None):
+    data_json = ParsedJSON('data')
+    config_json = ParsedJSON('config')
+    variants_map_json = ParsedJSON('variants_map')
+    supplier_map_json = ParsedJSON('supplier_map')
+    shipping_map_json = ParsedJSON('shipping_map')
+    bundle_map_json = ParsedJSON('bundle_map')
+
+    LIST_COLUMNS = ['title', 'tags', 'product_type', 'price', 'image', 'original_url', 'vendor', 'price_range', 'variants_count']
+
+    def update_list_columns(self, data=None):
+        if data is None:
+            data = self.data_json
+
+        self.title = data.get('title', '')
+        self.tags = safe_str(data.get('tags', ''))[:1024]
+        self.product_type = safe_str(data.get('type', ''))[:254]
+        self.vendor = safe_str(data.get('vendor', ''))[:254]
+        self.original_url = safe_str(data.get('original_url', ''))
+
         try:
-            bundle_map = json.loads(self.bundle_map)
+            self.price = '%.02f' % float(data['price'])
         except:
-            bundle_map = {}
+            self.price = 0.0
+
+        price_range = data.get('price_range')
+        if type(price_range) is list and len(price_range) == 2:
+            self.price_range = [safe_float(i) for i in price_range]
+        else:
+            self.price_range = None
+
+        images = data.get('images')
+        self.image = safe_str(images[0]) if type(images) is list and images else ''
+
+        self.variants_count = 1
+        for option in data.get('variants') or []:
+            if type(option) is dict and option.get('values'):
+                self.variants_count *= len(option['values'])
+
+    @property
+    def list_data(self):
+        """
+        Subset of ``data`` used by product lists, read from the list columns
+        """
+
+        return {
+            'title': self.title,
+            'type': self.product_type,
+            'tags': self.tags,
+            'vendor': self.vendor,
+            'original_url': self.original_url,
+            'price': self.price,
+            'price_range': self.price_range,
+            'images': [self.image] if self.image else [],
+            'variants_count': self.variants_count,
+        }
+
+    @classmethod
+    def load_list_columns(cls, products):
+        """
+        Fill the list columns of products saved before they existed, ``data`` is
+        fetched in one query since lists usually defer it
+        """
+
+        missing = [i for i in products if i.variants_count is None]
+        if missing:
+            products_data = dict(cls.objects.filter(id__in=[i.id for i in missing]).values_list('id', 'data'))
+            for product in missing:
+                product.data = products_data.get(product.id) or '{}'
+                product.update_list_columns()
+
+        return products
+
+    def get_bundle_mapping(self, variant=None, default=None):
+        bundle_map = self.bundle_map_json
 
         if variant is None:
             return bundle_map
@@ -180,10 +302,10 @@ class ProductBase(models.Model):
             return bundle_map.get(str(variant), default)
 
     def set_bundle_mapping(self, mapping):
-        bundle_map = self.get_bundle_mapping()
+        bundle_map = dict(self.get_bundle_mapping())
         bundle_map.update(mapping)
 
-        self.bundle_map = json.dumps(bundle_map)
+        self.bundle_map_json = bundle_map
 
     def get_real_variant_id(self, variant_id):
         """
@@ -197,10 +319,7 @@ class ProductBase(models.Model):
         return variant_id
 
     def to_json(self):
-        try:
-            data = json.loads(self.data)
-        except:
-            data = {}
+        data = self.data_json
 
         return {
             'id': self.id,
@@ -255,6 +374,10 @@ class OrderTrackBase(models.Model):
         abstract = True
         ordering = ['-created_at']
         index_together = ['store', 'order_id', 'line_id']
+        indexes = [
+            # Orders pending a sync from the extension (orders-sync endpoint)
+            models.Index(fields=['store', 'created_at'], name='%(class)s_sync', condition=Q(source_tracking='', hidden=False)),
+        ]
 
     CUSTOM_TRACKING_KEY = 'aftership_domain'
 
@@ -281,12 +404,10 @@ class OrderTrackBase(models.Model):
     updated_at = models.DateTimeField(auto_now=True, verbose_name='Last update')
     status_updated_at = models.DateTimeField(auto_now_add=True, verbose_name='Last Status Update')
 
-    def save(self, *args, **kwargs):
-        try:
-            data = json.loads(self.data)
-        except:
-            data = None
+    data_json = ParsedJSON('data')
 
+    def save(self, *args, **kwargs):
+        data = self.data_json
         if data:
             if data.get('bundle'):
                 status = []
@@ -308,7 +429,7 @@ class OrderTrackBase(models.Model):
                 self.source_status_details = ','.join(end_reasons)
 
             else:
-                self.source_status_details = json.loads(self.data)['aliexpress']['end_reason']
+                self.source_status_details = data['aliexpress']['end_reason']
 
         if self.source_id:
             source_id = str(self.source_id).strip(' ,')
@@ -536,12 +657,7 @@ class OrderTrackBase(models.Model):
                 self.commit()
 
     def get_errors_details(self):
-        try:
-            data = json.loads(self.data)
-        except:
-            data = {}
-
-        return list(set(data.get('errors', [])))
+        return list(set(self.data_json.get('errors', [])))
 
     get_source_status.admin_order_field = 'source_status'
 
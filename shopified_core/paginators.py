@@ -1,5 +1,12 @@
-from django.core.paginator import Paginator
-from rest_framework.pagination import PageNumberPagination
+from collections import OrderedDict
+
+from django.core.paginator import InvalidPage, Paginator
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from infinite_pagination.paginator import KeysetPaginator
 
 
 class SimplePaginator(Paginator):
@@ -55,3 +62,64 @@ class RESTResultsPagination(PageNumberPagination):
     page_size = 20
     page_size_query_param = 'page_size'
     max_page_size = 50
+
+
+class KeysetResultsPagination(BasePagination):
+    """
+    Cursor based pagination using ``KeysetPaginator``, the view's ``ordering``
+    attribute (defaults to newest first) sets the sort keys
+    """
+
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 50
+    cursor_query_param = 'cursor'
+    ordering = ['-pk']
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+            if page_size > 0:
+                return min(page_size, self.max_page_size)
+        except (KeyError, ValueError):
+            pass
+
+        return self.page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        ordering = getattr(view, 'ordering', None) or self.ordering
+        if isinstance(ordering, str):
+            ordering = [ordering]
+
+        paginator = KeysetPaginator(queryset, self.get_page_size(request), list(ordering))
+
+        try:
+            self.page = paginator.page(request.query_params.get(self.cursor_query_param))
+        except InvalidPage as e:
+            raise NotFound(str(e))
+
+        return list(self.page)
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_link(self.page.next_cursor)),
+            ('previous', self.get_link(self.page.previous_cursor)),
+            ('results', data),
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
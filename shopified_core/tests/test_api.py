@@ -1,8 +1,14 @@
+import time
 from unittest.mock import patch
 
+from django.core.cache import cache
+
 from lib.test import BaseTestCase
 
+from leadgalaxy.models import AccessToken
 from leadgalaxy.tests import factories as f
+from shopified_core.mixins import AuthenticationMixin, token_cache_key
+from shopified_core.utils import jwt_encode
 
 
 class ApiBaseTestCase(BaseTestCase):
@@ -41,3 +47,40 @@ class ApiBaseTestCase(BaseTestCase):
         r = self.client.post('/api/add-extra-store', data)
         self.assertEqual(r.status_code, 403)
         self.assertEqual(self.store.extra.count(), 0)
+
+
+class AuthenticationMixinTestCase(BaseTestCase):
+    def setUp(self):
+        self.user = f.UserFactory()
+        self.token = AccessToken.objects.create(user=self.user)
+        self.mixin = AuthenticationMixin()
+
+    def tearDown(self):
+        cache.delete(token_cache_key(self.token.token))
+
+    def test_user_from_token_is_cached(self):
+        self.assertEqual(self.mixin.user_from_token(self.token.token), self.user)
+        self.assertEqual(cache.get(token_cache_key(self.token.token)), self.user.id)
+
+        # Token is resolved from the cache, the profile and plan are loaded with the user
+        with self.assertNumQueries(1):
+            user = self.mixin.user_from_token(self.token.token)
+            self.assertEqual(user.profile.plan_id, self.user.profile.plan_id)
+
+    def test_deleted_token_is_removed_from_cache(self):
+        self.mixin.user_from_token(self.token.token)
+
+        token = self.token.token
+        self.token.delete()
+
+        self.assertIsNone(cache.get(token_cache_key(token)))
+        self.assertIsNone(self.mixin.user_from_token(token))
+
+    def test_jwt_is_not_cached_after_expiration(self):
+        token = jwt_encode({'id': self.user.id, 'exp': int(time.time()) + 60}, expire=0)
+
+        with patch('shopified_core.mixins.cache_token_user') as cache_token_user:
+            self.assertEqual(self.mixin.user_from_token(token), self.user)
+
+        cache_token_user.assert_called_once()
+        self.assertLessEqual(cache_token_user.call_args[1]['timeout'], 60)
@@ -88,3 +88,26 @@ class GetAllOrdersSyncTest(BaseTestCase):
         self.assertEqual(order['store_type'], 'gkart')
         self.assertEqual(order['order_id'], track.order_id)
         self.assertEqual(order['line_id'], track.line_id)
+
+    def test_must_return_not_modified_if_tracks_did_not_change(self):
+        store = GearBubbleStoreFactory(user=self.user)
+        GearBubbleOrderTrackFactory(user=self.user, store=store)
+        self.user.is_superuser = True
+        self.user.save()
+        self.login()
+
+        r = self.client.get('/api/orders-sync')
+        self.assertTrue(json.loads(r.content)['all_orders'])
+
+        since = json.loads(r.content)['date']
+        r = self.client.get(f'/api/orders-sync?since={since}')
+        self.assertEqual(r.status_code, 200)
+        self.assertFalse(json.loads(r.content)['all_orders'])
+
+        etag = r['ETag']
+        r = self.client.get(f'/api/orders-sync?since={since}', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 304)
+
+        GearBubbleOrderTrackFactory(user=self.user, store=store)
+        r = self.client.get(f'/api/orders-sync?since={since}', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(r.status_code, 200)
@@ -18,6 +18,8 @@ from shopified_core.utils import (
     random_hash,
     prefix_from_model,
     order_data_cache,
+    order_data_cache_many,
+    order_data_cache_set_many,
     order_phone_number,
     unique_username,
     hash_url_filename,
@@ -27,6 +29,9 @@ from shopified_core.utils import (
     get_next_page_from_request,
     normalize_product_title,
     clean_tracking_number,
+    invalidate_memoize_tags,
+    memoize,
+    RedisSetQueue,
 )
 
 from shopified_core.utils import base64_encode
@@ -236,7 +241,7 @@ class UtilsTestCase(BaseTestCase):
             },
         }
 
-        caches['orders'].set_many(orders)
+        order_data_cache_set_many(orders, timeout=3600)
 
         self.assertEqual(order_data_cache(1, 333, 111111), orders['order_1_333_111111'])
         self.assertEqual(order_data_cache('1', '333', '111111'), orders['order_1_333_111111'])
@@ -263,6 +268,26 @@ class UtilsTestCase(BaseTestCase):
         self.assertIn(data[0], [orders['order_1_222_333333'], orders['order_1_222_444444']])
         self.assertIn(data[1], [orders['order_1_222_333333'], orders['order_1_222_444444']])
 
+        self.assertEqual(list(order_data_cache('woo_order', 1, 3, '*').values()), [orders['woo_order_1_3_111222333']])
+        self.assertEqual(order_data_cache(1, 999, '*'), {})
+
+    def test_order_data_many(self):
+        order_data_cache_set_many({
+            'order_1_222_333333': {'id': '1_222_333333'},
+            'order_1_222_444444': {'id': '1_222_444444'},
+            'order_1_333_111111': {'id': '1_333_111111'},
+            'order_2_333_555555': {'id': '2_333_555555'},
+            'order_raw_1_222_333333': {'id': '1_222_333333'},
+        }, timeout=3600)
+
+        data = order_data_cache_many(1, [222, 333, 444])
+        self.assertEqual(set(data['222'].keys()), {'order_1_222_333333', 'order_1_222_444444'})
+        self.assertEqual(list(data['333'].keys()), ['order_1_333_111111'])
+        self.assertEqual(data['444'], {})
+
+        caches['orders'].delete('order_1_222_444444')
+        self.assertEqual(list(order_data_cache_many(1, [222])['222'].keys()), ['order_1_222_333333'])
+
     def test_unique_username(self):
         username = unique_username()
         self.assertEqual(username, 'user')
@@ -460,6 +485,105 @@ class UtilsTestCase(BaseTestCase):
         self.assertEqual(clean_tracking_number('    '), '')
 
 
+class MemoizeTestCase(BaseTestCase):
+    def setUp(self):
+        cache.delete_pattern('memoize_*')
+
+    def test_memoize_result(self):
+        counter = Mock(return_value=None)
+
+        @memoize(timeout=60)
+        def compute(a, b=1):
+            counter()
+            return [a, b]
+
+        self.assertEqual(compute(1, b=2), [1, 2])
+        self.assertEqual(compute(1, b=2), [1, 2])
+        self.assertEqual(counter.call_count, 1)
+
+        self.assertEqual(compute(2), [2, 1])
+        self.assertEqual(counter.call_count, 2)
+
+    def test_memoize_none_result(self):
+        counter = Mock(return_value=None)
+
+        @memoize(timeout=60)
+        def compute():
+            return counter()
+
+        self.assertIsNone(compute())
+        self.assertIsNone(compute())
+        self.assertEqual(counter.call_count, 1)
+
+    def test_memoize_model_instances(self):
+        user = User.objects.create(username='memoize')
+        counter = Mock(return_value=None)
+
+        @memoize(timeout=60)
+        def username(user):
+            counter()
+            return user.username
+
+        self.assertEqual(username(user), 'memoize')
+        self.assertEqual(username(User.objects.get(id=user.id)), 'memoize')
+        self.assertEqual(counter.call_count, 1)
+
+    def test_memoize_tags(self):
+        counter = Mock(return_value=None)
+
+        @memoize(timeout=60, tags=lambda user_id: [f'user_{user_id}'])
+        def compute(user_id):
+            counter()
+            return user_id
+
+        compute(1)
+        compute(2)
+        compute(1)
+        self.assertEqual(counter.call_count, 2)
+
+        invalidate_memoize_tags('user_1')
+        compute(1)
+        compute(2)
+        self.assertEqual(counter.call_count, 3)
+
+    def test_memoize_cache_if(self):
+        counter = Mock(return_value=None)
+
+        @memoize(timeout=60, cache_if=lambda result: result is not None)
+        def compute():
+            return counter()
+
+        compute()
+        compute()
+        self.assertEqual(counter.call_count, 2)
+
+
+class RedisSetQueueTestCase(BaseTestCase):
+    def setUp(self):
+        self.queue = RedisSetQueue('test_redis_set_queue')
+        self.queue.pop(100)
+
+    def test_items_are_processed_once(self):
+        self.queue.add([1, 2, 2, 3])
+
+        handler = Mock(return_value=None)
+        self.queue.process(handler, batch_size=2, max_batches=10)
+
+        self.assertEqual(sorted(i for call in handler.call_args_list for i in call[0][0]), [1, 2, 3])
+        self.assertEqual(self.queue.pop(100), [])
+
+    def test_failed_items_are_queued_again(self):
+        self.queue.add([1, 2, 3])
+
+        # Returned items are retried by the next run, a batch that raises stops this run
+        self.queue.process(Mock(side_effect=lambda items: items[:1]), batch_size=2, max_batches=1)
+        self.assertEqual(len(self.queue.pop(100)), 2)
+
+        self.queue.add([1, 2, 3])
+        self.queue.process(Mock(side_effect=ValueError), batch_size=2, max_batches=10)
+        self.assertEqual(sorted(self.queue.pop(100)), [1, 2, 3])
+
+
 class ShippingHelperFunctionsTestCase(BaseTestCase):
 
     def test_fix_br_address(self):
@@ -1,6 +1,5 @@
 import arrow
 import base64
-import binascii
 import ctypes
 import hashlib
 import hmac
@@ -22,15 +21,17 @@ from django.contrib.auth.models import User
 from django.core import serializers
 from django.core.cache import cache, caches
 from django.core.mail import send_mail
+from django.db import models
 from django.http import JsonResponse
 from django.template import Context, Template
 from django.template.defaultfilters import pluralize
 from django.urls import reverse
-from django.utils import timezone
 from django.utils.crypto import get_random_string
 from django.utils.module_loading import import_string
+from django_redis import get_redis_connection
 
-from last_seen.models import BrowserUserAgent, ExtensionVersion, UserIpRecord
+from last_seen.models import buffer_user_ip
+from lib.exceptions import capture_exception
 from shopified_core.shipping_helper import aliexpress_country_code_map, ebay_country_code_map
 
 ALIEXPRESS_REJECTED_STATUS = {
@@ -531,26 +532,181 @@ def version_compare(left, right):
     return compare(normalize(left), normalize(right))
 
 
-def cached_return(function, timeout=3600, force=False, **unique):
-    def decorator(*args, **kwargs):
-        if not settings.DEBUG and not force:
-            return function(*args, **kwargs)
+MEMOIZE_STATS_KEY = 'memoize_stats'
+
+
+def memoize_key_part(value):
+    """ Stable representation of a memoized function argument
+
+    Model instances are represented by their PK and `updated_at` (when available),
+    a saved instance gets a new cache entry without explicit invalidation
+    """
+
+    if isinstance(value, models.Model):
+        updated_at = getattr(value, 'updated_at', None)
+        updated_at = updated_at.timestamp() if updated_at else ''
+        return f'{value._meta.label}:{value.pk}:{updated_at}'
+
+    elif isinstance(value, (list, tuple, set)):
+        values = [memoize_key_part(i) for i in value]
+        if isinstance(value, set):
+            values = sorted(values)
+
+        return f"[{','.join(values)}]"
+
+    elif isinstance(value, dict):
+        return f"{{{','.join(f'{k}:{memoize_key_part(v)}' for k, v in sorted(value.items(), key=lambda i: str(i[0])))}}}"
+
+    return f'{type(value).__name__}:{value}'
+
+
+def memoize_tag_key(tag):
+    return f'memoize_tag_{tag}'
+
+
+def invalidate_memoize_tags(*tags):
+    """ Expire every memoized result cached with one of the `tags` """
+
+    cache.delete_many([memoize_tag_key(tag) for tag in tags])
+
+
+def memoize_invalidate_on(model, tags):
+    """ Invalidate `tags(instance)` when a `model` instance is saved or deleted """
+
+    from django.db.models.signals import post_delete, post_save
+
+    def invalidate(sender, instance, **kwargs):
+        invalidate_memoize_tags(*tags(instance))
+
+    uid = f'memoize_{model._meta.label}_{id(tags)}'
+    post_save.connect(invalidate, sender=model, weak=False, dispatch_uid=f'{uid}_save')
+    post_delete.connect(invalidate, sender=model, weak=False, dispatch_uid=f'{uid}_delete')
+
+
+def memoize(timeout=3600, key=None, tags=None, cache_if=None, lock_timeout=30):
+    """ Cache the decorated function result
+
+    Args:
+        timeout: Cache timeout in seconds
+        key: Callable receiving the function arguments and returning what identifies the call,
+             all the arguments are used by default
+        tags: Callable receiving the function arguments and returning a list of tags,
+              `invalidate_memoize_tags` expires all results cached with a tag
+        cache_if: Callable receiving the result, the result is only cached when it returns True
+        lock_timeout: Only one caller computes a missing result, others wait up to `lock_timeout` seconds for it
+    """
+
+    def decorator(function):
+        name = f'{function.__module__}.{function.__qualname__}'
+
+        def stats(event):
+            try:
+                get_redis_connection('default').hincrby(MEMOIZE_STATS_KEY, f'{name}:{event}', 1)
+            except:
+                pass
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            call_key = key(*args, **kwargs) if key else [args, kwargs]
+
+            call_tags = tags(*args, **kwargs) if tags else []
+            if call_tags:
+                # A tag version changes when the tag is invalidated
+                tag_keys = [memoize_tag_key(tag) for tag in call_tags]
+                versions = cache.get_many(tag_keys)
+                for tag_key in tag_keys:
+                    if tag_key not in versions:
+                        versions[tag_key] = get_random_string(8)
+                        cache.add(tag_key, versions[tag_key], timeout=None)
+                        versions[tag_key] = cache.get(tag_key, versions[tag_key])
+
+                call_key = [call_key, [versions[k] for k in tag_keys]]
+
+            cache_key = f'memoize_{name}_{hash_text(memoize_key_part(call_key))}'
+            lock_key = f'{cache_key}_lock'
+
+            locked = False
+            cached = cache.get(cache_key)
+            if cached is None:
+                locked = cache.add(lock_key, 1, timeout=lock_timeout)
+                if not locked:
+                    # Another caller is computing the result
+                    wait_until = time.time() + lock_timeout
+                    while cached is None and time.time() < wait_until and cache.get(lock_key):
+                        time.sleep(0.1)
+                        cached = cache.get(cache_key)
+
+            if cached is not None:
+                stats('hit')
+                return cached['value']
+
+            stats('miss')
+            try:
+                result = function(*args, **kwargs)
+                if cache_if is None or cache_if(result):
+                    cache.set(cache_key, {'value': result}, timeout=timeout)
+            finally:
+                if locked:
+                    cache.delete(lock_key)
 
-        token = ','.join(str(a) for a in args)
-        token += ','.join(f"{k}:{v}" for k, v in kwargs.items())
-        token += ','.join(f"{k}:{v}" for k, v in unique.items())
-        token = binascii.crc32(token.encode('ascii'))
-        cache_key = f"{function.__module__}_{function.__name__}_{token}"
-        result = cache.get(cache_key)
-        if result:
             return result
 
-        result = function(*args, **kwargs)
-        cache.set(cache_key, result, timeout=timeout)
-        return result
+        return wrapper
+
     return decorator
 
 
+class RedisSetQueue:
+    """ Items waiting in a Redis set to be processed in batches by a Celery beat task
+
+    An item queued many times before the task runs is only processed once.
+
+    Args:
+        key (str): Redis set key
+        dumps (callable): Convert an item to the set member string
+        loads (callable): Convert a set member string back to an item
+    """
+
+    def __init__(self, key, dumps=str, loads=int):
+        self.key = key
+        self.dumps = dumps
+        self.loads = loads
+
+    def add(self, items):
+        if items:
+            get_redis_connection('default').sadd(self.key, *[self.dumps(i) for i in items])
+
+    def pop(self, count):
+        """ Return up to `count` queued items and remove them from the queue """
+
+        members = get_redis_connection('default').spop(self.key, count)
+
+        return [self.loads(m.decode() if isinstance(m, bytes) else m) for m in members or []]
+
+    def process(self, handler, batch_size, max_batches):
+        """ Call `handler` with batches of queued items
+
+        Items returned by `handler` and the items of a batch that raised are queued again
+        for the next run, `handler` must give the same result when called again with them
+        """
+
+        retry = []
+        for i in range(max_batches):
+            items = self.pop(batch_size)
+            if not items:
+                break
+
+            try:
+                retry.extend(handler(items) or [])
+            except:
+                capture_exception()
+
+                retry.extend(items)
+                break
+
+        self.add(retry)
+
+
 def order_data_cache_key(*args, prefix='order'):
     order_key = '_'.join([str(i) for i in args])
 
@@ -561,11 +717,84 @@ def order_data_cache_key(*args, prefix='order'):
     return order_key
 
 
+ORDER_DATA_KEY_RE = re.compile(r'^((?:[a-z]+_)?order)_(\d+)_(\d+)_([^_]+)$')
+
+
+def order_data_index_key(prefix, store_id, order_id):
+    """ Key of the set holding the cached line keys of a single order """
+
+    return f'{prefix}_lines_{store_id}_{order_id}'
+
+
+def order_data_cache_set_many(data, timeout):
+    """ Cache order data and index line keys by store and order
+
+    Keys that aren't order line data (raw order data, quantities, etc.) are cached but not indexed
+    """
+
+    orders_cache = caches['orders']
+    orders_cache.set_many(data, timeout=timeout)
+
+    indexes = {}
+    for key in data.keys():
+        match = ORDER_DATA_KEY_RE.match(key)
+        if match:
+            prefix, store_id, order_id, line_id = match.groups()
+            indexes.setdefault(order_data_index_key(prefix, store_id, order_id), []).append(key)
+
+    if not indexes:
+        return
+
+    pipe = get_redis_connection('orders').pipeline(transaction=False)
+    for index_key, line_keys in indexes.items():
+        index_key = orders_cache.make_key(index_key)
+        pipe.sadd(index_key, *line_keys)
+        pipe.expire(index_key, timeout)
+
+    pipe.execute()
+
+
+def order_data_cache_many(store_id, order_ids, prefix='order'):
+    """ Get cached line data for a list of orders
+
+    Returns:
+        dict: {order_id: {line_key: order_data}}
+    """
+
+    orders_cache = caches['orders']
+    order_ids = [str(i) for i in order_ids]
+    if not order_ids:
+        return {}
+
+    pipe = get_redis_connection('orders').pipeline(transaction=False)
+    for order_id in order_ids:
+        pipe.smembers(orders_cache.make_key(order_data_index_key(prefix, store_id, order_id)))
+
+    orders_lines = {}
+    line_keys = []
+    for order_id, members in zip(order_ids, pipe.execute()):
+        orders_lines[order_id] = [m.decode() for m in members]
+        line_keys.extend(orders_lines[order_id])
+
+    data = orders_cache.get_many(line_keys) if line_keys else {}
+
+    result = {}
+    for order_id, keys in orders_lines.items():
+        result[order_id] = {k: data[k] for k in keys if k in data}
+
+    return result
+
+
 def order_data_cache(*args, prefix='order'):
     order_key = order_data_cache_key(*args, prefix=prefix)
 
-    if '*' in order_key:
-        data = caches['orders'].get_many(caches['orders'].keys(order_key))
+    if order_key.endswith('_*'):
+        match = ORDER_DATA_KEY_RE.match(order_key)
+        if not match:
+            return {}
+
+        prefix, store_id, order_id = match.groups()[:3]
+        data = order_data_cache_many(store_id, [order_id], prefix=prefix)[order_id]
     else:
         data = caches['orders'].get(order_key)
 
@@ -637,81 +866,17 @@ def get_client_ip(request):
     return ip
 
 
-def get_browser_user_agent(request):
-    user_agent = request.META.get('HTTP_USER_AGENT', 'N/A')
-    if user_agent:
-        browser, created = BrowserUserAgent.objects.get_or_create(
-            user_agent=user_agent
-        )
-
-        return browser
-
-
-def get_extension_version(request):
-    version = request.META.get('HTTP_X_EXTENSION_VERSION')
-    if version:
-        ext, created = ExtensionVersion.objects.get_or_create(
-            version=version
-        )
-
-        return ext
-
-
-def get_user_session(request):
-    try:
-        session = request.session._get_session_from_db()
-    except:
-        session = None
-
-    return session
-
-
-def get_current_request_hash(request):
-    ip = get_client_ip(request)
-    user_agent = safe_str(request.META.get('HTTP_USER_AGENT', 'N/A'))
-    version = safe_str(request.META.get('HTTP_X_EXTENSION_VERSION', ''))
-
-    return f'request_hash_{hash_list([ip, user_agent, version])}'
-
-
 def save_user_ip(request):
     if 'api/captcha-credits' in request.path or 'api/can' in request.path:
         return
 
-    request_hash = get_current_request_hash(request)
-    if cache.get(request_hash):
-        return
-
-    user = request.user
-    ip = get_client_ip(request)
-    browser = get_browser_user_agent(request)
-    extension = get_extension_version(request)
-    session = get_user_session(request)
-
-    created = False
-    match = {'user': user, 'ip': ip, 'browser': browser, 'session': session}
-    try:
-        user_ip, created = UserIpRecord.objects.update_or_create(
-            **match,
-            defaults={
-                'last_seen_at': timezone.now(),
-            }
-        )
-    except UserIpRecord.MultipleObjectsReturned:
-        user_ip = UserIpRecord.objects.filter(**match).order_by('-last_seen_at').first()
-        UserIpRecord.objects.filter(**match).exclude(id=user_ip.id).delete()
-
-    if created or not user_ip.country:
-        from last_seen.tasks import update_ip_details
-        update_ip_details.apply_async(args=[user_ip.id], expires=600)
-
-    if extension and not user_ip.extension:
-        user_ip.extension = extension
-        user_ip.save()
-
-    user.profile.add_ip(ip)
-
-    cache.set(request_hash, 1, timeout=500)
+    # Saved to UserIpRecord in bulk by last_seen.tasks.flush_last_seen
+    buffer_user_ip(
+        user=request.user,
+        ip=get_client_ip(request),
+        user_agent=request.META.get('HTTP_USER_AGENT', 'N/A'),
+        version=request.META.get('HTTP_X_EXTENSION_VERSION'),
+        session_key=request.session.session_key)
 
 
 def unique_username(username='user', fullname=None):
@@ -835,6 +1000,27 @@ def last_executed(unique_ids, timeout, save=True):
     return seen
 
 
+def last_executed_many(unique_ids, timeout, save=True):
+    """ Same as last_executed for a list of ids using two cache round trips
+
+    Returns:
+        set: ids that were already executed in the last `timeout` seconds
+    """
+
+    keys = {}
+    for unique_id in unique_ids:
+        key = '_last_executed_{}'.format(hash_list(unique_id))
+        keys[key.replace(' ', '_')] = unique_id
+
+    seen = cache.get_many(list(keys.keys()))
+
+    if save:
+        now = arrow.utcnow().timestamp
+        cache.set_many({key: now for key in keys if not seen.get(key)}, timeout=timeout)
+
+    return set([keys[key] for key, value in seen.items() if value])
+
+
 def http_response_extra(rep):
     return {
         'status': rep.status_code,
@@ -912,33 +1098,63 @@ def serializers_orders_track(tracks, store_type, humanize=False):
         fields['id'] = i['pk']
         fields['store_type'] = store_type
 
-        if humanize:
-            fields['created_at'] = arrow.get(fields['created_at']).humanize()
+        orders.extend(format_orders_track_fields(fields, humanize=humanize))
+
+    return orders
 
-        if not fields['source_type']:
-            fields['source_type'] = 'aliexpress'
-        elif fields['source_type'] == 'other':
-            continue
-        elif not humanize:
-            if fields['source_type'] == 'dropified-print':
-                continue
-            elif fields['source_type'] == 'ebay' \
-                    and fields['source_status'].strip() != '' \
-                    and fields['updated_at'] > arrow.get().shift(hours=-12).datetime:
-                continue
-
-        if fields['source_id'] and ',' in fields['source_id']:
-            for j in fields['source_id'].split(','):
-                order_fields = deepcopy(fields)
-                order_fields['source_id'] = j
-                order_fields['bundle'] = True
-                orders.append(order_fields)
-        else:
-            orders.append(fields)
+
+def format_orders_track_fields(fields, humanize=False):
+    """ Format a serialized order track for the extension, bundled orders are split by source ID """
+
+    if humanize:
+        fields['created_at'] = arrow.get(fields['created_at']).humanize()
+
+    if not fields['source_type']:
+        fields['source_type'] = 'aliexpress'
+    elif fields['source_type'] == 'other':
+        return []
+    elif not humanize:
+        if fields['source_type'] == 'dropified-print':
+            return []
+        elif fields['source_type'] == 'ebay' \
+                and fields['source_status'].strip() != '' \
+                and fields['updated_at'] > arrow.get().shift(hours=-12).datetime:
+            return []
+
+    orders = []
+    if fields['source_id'] and ',' in fields['source_id']:
+        for j in fields['source_id'].split(','):
+            order_fields = deepcopy(fields)
+            order_fields['source_id'] = j
+            order_fields['bundle'] = True
+            orders.append(order_fields)
+    else:
+        orders.append(fields)
 
     return orders
 
 
+def orders_sync_version_key(user_id):
+    return f'orders_sync_version_{user_id}'
+
+
+def get_orders_sync_version(user_id):
+    version = cache.get(orders_sync_version_key(user_id))
+    if version is None:
+        version = bump_orders_sync_version(user_id)
+
+    return version
+
+
+def bump_orders_sync_version(user_id):
+    """ Invalidate the orders sync ETag of the user's stores """
+
+    version = get_random_string(8)
+    cache.set(orders_sync_version_key(user_id), version, timeout=604800)
+
+    return version
+
+
 class CancelledOrderAlert():
 
     def __init__(self, user, source_id, new_status, current_status, order_track, store_type=''):
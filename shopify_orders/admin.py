@@ -3,6 +3,7 @@ from django.contrib import admin
 from shopify_orders.models import (
     ShopifyFulfillementRequest,
     ShopifyOrder,
+    ShopifyOrderData,
     ShopifyOrderLine,
     ShopifyOrderLog,
     ShopifyOrderRevenue,
@@ -30,6 +31,13 @@ class ShopifyOrderApiAdmin(admin.ModelAdmin):
     search_fields = ('store__id', 'store__shop') + USER_SEARCH_FIELDS
 
 
+@admin.register(ShopifyOrderData)
+class ShopifyOrderDataAdmin(admin.ModelAdmin):
+    list_display = ('order', 'updated_at')
+    raw_id_fields = ('order',)
+    exclude = ('data',)
+
+
 @admin.register(ShopifyOrderLine)
 class ShopifyOrderLineAdmin(admin.ModelAdmin):
     list_display = ('line_id', 'order', 'track', 'variant_title')
@@ -1,12 +1,18 @@
+import math
 import time
-from datetime import timedelta
+from queue import Queue
+from threading import Lock, Thread
 
+import arrow
+
+from django.db import connection
+from django.db.models import Q
 from django.utils import timezone
 
 from lib.exceptions import capture_exception
 from shopified_core.commands import DropifiedBaseCommand
-from shopify_orders.models import ShopifySyncStatus, ShopifyOrder, ShopifyOrderLine
-from shopify_orders.utils import update_shopify_order, get_customer_name, get_datetime, safe_int, str_max, delete_store_orders
+from shopify_orders.models import ShopifySyncStatus
+from shopify_orders.utils import update_shopify_order, update_shopify_orders, delete_store_orders
 from leadgalaxy.models import ShopifyStore
 from leadgalaxy.utils import get_shopify_order
 from leadgalaxy.shopify import ShopifyAPI
@@ -25,6 +31,11 @@ class Command(DropifiedBaseCommand):
         parser.add_argument('--store', dest='store_id', action='append', type=int, help='Store ID')
         parser.add_argument('--max_orders', dest='max_orders', type=int, help='Sync Stores with Maximum Orders count')
         parser.add_argument('--max_import', dest='max_import', type=int, help='Maximum number of orders to import')
+        parser.add_argument('--threads', dest='threads', type=int, default=4, help='Number of import threads per store')
+        parser.add_argument('--window-orders', dest='window_orders', type=int, default=25000,
+                            help='Split stores with more orders than this into created_at windows imported in parallel')
+        parser.add_argument('--stale-minutes', dest='stale_minutes', type=int, default=30,
+                            help='Resume imports that saved no progress for this number of minutes (killed workers)')
 
     def reset_stores(self, store_ids, verbose=True):
         if type(store_ids) is not list:
@@ -38,7 +49,7 @@ class Command(DropifiedBaseCommand):
 
             self.write_success(f'Deleted Orders: {deleted}', show=verbose)
 
-            ShopifySyncStatus.objects.filter(store_id=store.id).update(sync_status=0, pending_orders=None, elastic=False)
+            ShopifySyncStatus.objects.filter(store_id=store.id).update(sync_status=0, pending_orders=None, elastic=False, import_checkpoint=None)
 
     def start_command(self, *args, **options):
         if options['reset']:
@@ -49,9 +60,21 @@ class Command(DropifiedBaseCommand):
         if not options['sync_status']:
             options['sync_status'] = [0, 6]
 
+        self.threads = max(options['threads'], 1)
+        self.window_orders = max(options['window_orders'], 1)
+        self.show_progress = options['progress']
+        self.failed_stores = set()
+
         while True:
             try:
-                order_sync = ShopifySyncStatus.objects.filter(sync_type=self.sync_type, sync_status__in=options['sync_status'])
+                # Stores that failed or whose worker was killed in a previous run resume from their saved checkpoint
+                stale = timezone.now() - timezone.timedelta(minutes=options['stale_minutes'])
+                order_sync = ShopifySyncStatus.objects.filter(sync_type=self.sync_type) \
+                    .filter(Q(sync_status__in=options['sync_status'])
+                            | Q(sync_status=4, import_checkpoint__isnull=False)
+                            | Q(sync_status=1, import_checkpoint__isnull=False, import_heartbeat__lt=stale)) \
+                    .exclude(store__in=self.failed_stores)
+
                 if options.get('max_orders'):
                     order_sync = order_sync.filter(orders_count__lte=options.get('max_orders'))
 
@@ -68,20 +91,21 @@ class Command(DropifiedBaseCommand):
 
             if order_sync.sync_status == 6:
                 self.reset_stores(order_sync.store.pk)
+                order_sync.refresh_from_db()
 
+            # Only save the changed fields, webhooks add pending orders and import threads save the checkpoint concurrently
             order_sync.sync_status = 1
-            order_sync.save()
+            order_sync.import_heartbeat = timezone.now()
+            order_sync.save(update_fields=['sync_status', 'import_heartbeat', 'updated_at'])
 
             try:
-                count = order_sync.store.get_orders_count(status='any', fulfillment='any', financial='any', days=365 * 2)
-                self.progress_total(count, enable=options['progress'])
-
-                self.fetch_orders(order_sync.store, count)
+                self.fetch_orders(order_sync)
 
                 order_sync.sync_status = 2
                 order_sync.elastic = False  # Orders are not indexed by default
                 order_sync.revision = 2  # New imported (or re-imported) orders support Product filters by default
-                order_sync.save()
+                order_sync.import_checkpoint = None
+                order_sync.save(update_fields=['sync_status', 'elastic', 'revision', 'import_checkpoint', 'updated_at'])
 
                 self.progress_close()
 
@@ -90,87 +114,174 @@ class Command(DropifiedBaseCommand):
             except:
                 capture_exception(extra={'store': order_sync.store, 'user': order_sync.store.user})
 
-                self.reset_stores(order_sync.store.pk)
+                # Keep the imported orders and the checkpoint, the next run will continue from where this one stopped
+                self.failed_stores.add(order_sync.store_id)
+                self.progress_close()
 
                 order_sync.sync_status = 4
-                order_sync.save()
+                order_sync.save(update_fields=['sync_status', 'updated_at'])
 
             if options.get('max_import') and self.total_order_fetch > options.get('max_import'):
                 break
 
-    def fetch_orders(self, store, count):
-        self.write_success(f'Import {count} Order for: {store.title}')
+    def get_import_windows(self, store, count):
+        """ Split the last 2 years into created_at windows holding around `window_orders` orders each """
+
+        # Whole seconds, the next window starts one second after the previous one ends
+        end = arrow.utcnow().floor('second')
+        start = end.shift(days=-365 * 2)
+
+        windows_count = min(max(int(math.ceil(count / float(self.window_orders))), 1), 16)
+        window_seconds = int(math.ceil((end - start).total_seconds() / windows_count))
+
+        windows = []
+        for i in range(windows_count):
+            window_min = start.shift(seconds=window_seconds * i)
+            if i + 1 < windows_count:
+                # Windows must not overlap, Shopify created_at filters are inclusive
+                window_max = window_min.shift(seconds=window_seconds - 1)
+            else:
+                window_max = end
+
+            windows.append({
+                'created_at_min': window_min.isoformat(),
+                'created_at_max': window_max.isoformat(),
+                'page_info': None,
+                'done': False,
+            })
+
+        return windows
+
+    def extend_import_windows(self, windows):
+        """ Import the orders created since a resumed import started """
+
+        now = arrow.utcnow().floor('second')
+        last_window = windows[-1]
+        if arrow.get(last_window['created_at_max']) >= now:
+            return windows
+
+        if not last_window['done'] and not last_window['page_info']:
+            last_window['created_at_max'] = now.isoformat()
+        else:
+            # Started windows keep their filters in the page_info cursor, new orders get their own window
+            windows.append({
+                'created_at_min': arrow.get(last_window['created_at_max']).shift(seconds=1).isoformat(),
+                'created_at_max': now.isoformat(),
+                'page_info': None,
+                'done': False,
+            })
+
+        return windows
+
+    def fetch_orders(self, order_sync):
+        store = order_sync.store
+
+        checkpoint = order_sync.get_import_checkpoint()
+        if checkpoint and checkpoint.get('windows'):
+            count = checkpoint['count']
+            self.extend_import_windows(checkpoint['windows'])
+            self.write_success(f'Resume {count} Orders import for: {store.title}')
+        else:
+            count = store.get_orders_count(status='any', fulfillment='any', financial='any', days=365 * 2)
+            checkpoint = {'count': count, 'imported': 0, 'windows': self.get_import_windows(store, count)}
+            self.write_success(f'Import {count} Order for: {store.title}')
+
         if not count:
             return
 
-        self.products_map = store.shopifyproduct_set.exclude(shopify_id=0) \
-                                 .values_list('id', 'shopify_id') \
-                                 .order_by('created_at')
-        self.products_map = dict([(a[1], a[0]) for a in self.products_map])
+        self.progress_total(count, enable=self.show_progress)
+        self.progress_update(checkpoint['imported'])
 
-        self.filtered_map = store.shopifyproduct_set.filter(is_excluded=True).values_list('shopify_id', flat=True)
+        self.imported_orders = set()
+        self.import_errors = []
+        self.checkpoint_lock = Lock()
 
-        self.tracking_map = store.shopifyordertrack_set.values_list('id', 'line_id')
-        self.tracking_map = dict([(a[1], a[0]) for a in self.tracking_map])
+        import_start = time.time()
 
-        self.imported_orders = []
-        self.saved_orders = {}
-        self.saved_orders_last = 0
-        self.rate_limit = ''
-        self.req_time = 0
+        order_sync.set_import_checkpoint(checkpoint)
 
-        import_start = time.time()
+        windows = [w for w in checkpoint['windows'] if not w['done']]
 
-        api = ShopifyAPI(store)
+        q = Queue()
+        for window in windows:
+            q.put(window)
 
-        # date before 2 years ago in ISO 8601 format
-        date_before = (timezone.now() - timedelta(days=365 * 2)).isoformat()
-        for orders in api.paginate_orders(created_at_min=date_before):
-            self.proccess_orders(store, orders)
+        threads = []
+        for i in range(min(self.threads, len(windows))):
+            q.put(None)
 
-            self.progress_update(len(orders))
-            self.total_order_fetch += len(orders)
+            t = Thread(target=self.fetch_orders_worker, args=(q, order_sync, checkpoint))
+            t.daemon = True
+            t.start()
+            threads.append(t)
+
+        for t in threads:
+            t.join()
+
+        if self.import_errors:
+            raise self.import_errors[0]
 
         m, s = divmod(time.time() - import_start, 60)
         self.write_success(f'Orders imported in {int(m)}:{int(s)}')
 
-    def proccess_orders(self, store, orders_list):
-        # Bulk import orders
-        orders = []
-        already_imported = []
-        for order in orders_list:
-            if order['id'] not in self.imported_orders:
-                orders.append(self.prepare_order(order, store))
+    def fetch_orders_worker(self, q, order_sync, checkpoint):
+        api = ShopifyAPI(order_sync.store)
 
-                self.imported_orders.append(order['id'])
-            else:
-                already_imported.append(order['id'])
-                self.write(f"Order #{order['id']} Already Imported", self.style.WARNING)
+        while True:
+            window = q.get()
+            if window is None:
+                break
 
-        if len(orders):
-            ShopifyOrder.objects.bulk_create(orders)
-        else:
-            self.write('Empty Orders', self.style.WARNING)
+            if self.import_errors:
+                # Another window failed, the remaining ones are imported on the next run
+                continue
 
-        self.load_saved_orders(store)
+            try:
+                self.fetch_window_orders(api, window, order_sync, checkpoint)
+            except Exception as e:
+                self.import_errors.append(e)
 
-        # Bulk import order lines
-        lines = []
+        connection.close()
 
-        for order in orders_list:
-            if order['id'] not in already_imported:
-                saved_order = self.get_saved_order(store, order['id'])
+    def fetch_window_orders(self, api, window, order_sync, checkpoint):
+        pages = api.paginate_orders(
+            page_info=window['page_info'],
+            return_page_info=True,
+            created_at_min=window['created_at_min'],
+            created_at_max=window['created_at_max'])
 
-                for line in self.prepare_lines(order, saved_order):
-                    lines.append(line)
+        for orders, next_page_info in pages:
+            self.proccess_orders(order_sync.store, orders)
 
-            else:
-                self.write(f"Line Already Imported of order #{order['id']}", self.style.WARNING)
+            with self.checkpoint_lock:
+                window['page_info'] = next_page_info
+                window['done'] = next_page_info is None
+                checkpoint['imported'] += len(orders)
 
-        if len(lines):
-            ShopifyOrderLine.objects.bulk_create(lines)
+                order_sync.set_import_checkpoint(checkpoint)
+
+                self.progress_update(len(orders))
+                self.total_order_fetch += len(orders)
+
+            if self.import_errors:
+                break
+
+    def proccess_orders(self, store, orders_list):
+        # Bulk import orders and their lines
+        orders = []
+        with self.checkpoint_lock:
+            for order in orders_list:
+                if order['id'] not in self.imported_orders:
+                    orders.append(order)
+
+                    self.imported_orders.add(order['id'])
+                else:
+                    self.write(f"Order #{order['id']} Already Imported", self.style.WARNING)
+
+        if len(orders):
+            update_shopify_orders(store, orders, sync_check=False)
         else:
-            self.write('Empty Order Lines', self.style.WARNING)
+            self.write('Empty Orders', self.style.WARNING)
 
     def update_pending_orders(self, order_sync):
         store = order_sync.store
@@ -190,80 +301,3 @@ class Command(DropifiedBaseCommand):
                 update_shopify_order(store, order, sync_check=False)
             except:
                 capture_exception()
-
-    def load_saved_orders(self, store):
-        self.saved_orders = {}
-        for order in ShopifyOrder.objects.filter(store=store, user=store.user).filter(id__gte=self.saved_orders_last):
-            if order.order_id not in self.saved_orders:
-                self.saved_orders[order.order_id] = order
-                self.saved_orders_last = max(self.saved_orders_last, order.id)
-
-    def get_saved_order(self, store, order_id):
-        saved_order = self.saved_orders.get(order_id)
-        if saved_order is None:
-            self.write(f'Get Order from database #{order_id}')
-            saved_order = ShopifyOrder.objects.get(store=store, order_id=order_id)
-
-        return saved_order
-
-    def prepare_order(self, data, store):
-        address = data.get('shipping_address', data.get('customer', {}).get('default_address', {}))
-        customer = data.get('customer', address)
-
-        connected_items = 0
-        need_fulfillment = len(data.get('line_items', []))
-
-        for line in data.get('line_items', []):
-            product_id = self.products_map.get(safe_int(line['product_id']))
-            track_id = self.tracking_map.get(safe_int(line['id']))
-
-            if product_id:
-                connected_items += 1
-
-            if track_id or line['fulfillment_status'] == 'fulfilled' or line['product_id'] in self.filtered_map:
-                need_fulfillment -= 1
-
-        order = ShopifyOrder(
-            store=store,
-            user=store.user,
-            order_id=data['id'],
-            order_number=data['number'],
-            customer_id=customer.get('id', 0),
-            customer_name=str_max(get_customer_name(address), 255),
-            customer_email=str_max(customer.get('email'), 255),
-            financial_status=data['financial_status'],
-            fulfillment_status=data['fulfillment_status'],
-            total_price=data['total_price'],
-            tags=data['tags'],
-            city=str_max(address.get('city'), 63),
-            zip_code=str_max(address.get('zip'), 31),
-            country_code=str_max(address.get('country_code'), 31),
-            items_count=len(data.get('line_items', [])),
-            need_fulfillment=need_fulfillment,
-            connected_items=connected_items,
-            created_at=get_datetime(data['created_at']),
-            updated_at=get_datetime(data['updated_at']),
-            closed_at=get_datetime(data['closed_at']),
-            cancelled_at=get_datetime(data['cancelled_at']),
-        )
-
-        return order
-
-    def prepare_lines(self, data, order):
-        lines = []
-        for line in data.get('line_items', []):
-            lines.append(ShopifyOrderLine(
-                order=order,
-                line_id=line['id'],
-                shopify_product=safe_int(line['product_id']),
-                title=line['title'],
-                price=line['price'],
-                quantity=line['quantity'],
-                variant_id=safe_int(line.get('variant_id')),
-                variant_title=line['variant_title'],
-                fulfillment_status=line['fulfillment_status'],
-                product_id=self.products_map.get(safe_int(line['product_id'])),
-                track_id=self.tracking_map.get(safe_int(line['id']))
-            ))
-
-        return lines
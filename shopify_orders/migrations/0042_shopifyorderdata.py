@@ -0,0 +1,23 @@
+# Generated by Django 3.2.16 on 2026-10-18 10:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopify_orders', '0041_shopifyfulfillementrequest_request_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShopifyOrderData',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('data', models.BinaryField()),
+                ('updated_at', models.DateTimeField(verbose_name='Shopify Order Update Date')),
+                ('order', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='order_data', to='shopify_orders.shopifyorder')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2026-10-18 11:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopify_orders', '0042_shopifyorderdata'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shopifysyncstatus',
+            name='import_checkpoint',
+            field=models.TextField(blank=True, null=True, verbose_name='Orders import progress'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.14 on 2026-10-18 15:20
+
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    atomic = False
+
+    dependencies = [
+        ('shopify_orders', '0043_shopifysyncstatus_import_checkpoint'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='shopifyorderline',
+            index=models.Index(fields=['shopify_product'], name='shopifyorderline_product'),
+        ),
+    ]
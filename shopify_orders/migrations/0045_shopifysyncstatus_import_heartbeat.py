@@ -0,0 +1,18 @@
+# Generated by Django 3.2.16 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shopify_orders', '0044_shopifyorderline_product'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='shopifysyncstatus',
+            name='import_heartbeat',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Last orders import progress'),
+        ),
+    ]
@@ -1,9 +1,12 @@
+import zlib
+
 import arrow
 import requests
 import simplejson as json
 
 from django.db import models
 from django.contrib.auth.models import User
+from django.utils import timezone
 
 from leadgalaxy.models import (
     ShopifyStore,
@@ -31,6 +34,8 @@ class ShopifySyncStatus(models.Model):
     orders_count = models.IntegerField(default=0)
     pending_orders = models.TextField(blank=True, null=True)
     revision = models.IntegerField(default=1)
+    import_checkpoint = models.TextField(blank=True, null=True, verbose_name='Orders import progress')
+    import_heartbeat = models.DateTimeField(blank=True, null=True, verbose_name='Last orders import progress')
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -39,6 +44,27 @@ class ShopifySyncStatus(models.Model):
     def __str__(self):
         return '{} / {}'.format(self.sync_type, self.store.title)
 
+    def get_import_checkpoint(self):
+        try:
+            return json.loads(self.import_checkpoint)
+        except:
+            return None
+
+    def set_import_checkpoint(self, checkpoint):
+        """ Save the import progress without touching the other fields, the import threads update it concurrently
+
+        `import_heartbeat` is refreshed too, imports without recent progress are considered stopped
+        """
+
+        self.import_checkpoint = json.dumps(checkpoint) if checkpoint is not None else None
+        self.import_heartbeat = timezone.now()
+        ShopifySyncStatus.objects.filter(id=self.id).update(import_checkpoint=self.import_checkpoint, import_heartbeat=self.import_heartbeat)
+
+    def save_pending_orders(self):
+        """ Save the pending orders only, webhooks add them while the import updates the checkpoint """
+
+        ShopifySyncStatus.objects.filter(id=self.id).update(pending_orders=self.pending_orders)
+
     def add_pending_order(self, order_id, commit=True):
         try:
             pending_orders = self.pending_orders.split(',')
@@ -51,7 +77,7 @@ class ShopifySyncStatus(models.Model):
             self.pending_orders = ','.join(pending_orders)
 
             if commit:
-                self.save()
+                self.save_pending_orders()
 
     def pop_pending_orders(self, commit=True):
         try:
@@ -66,7 +92,7 @@ class ShopifySyncStatus(models.Model):
             order = None
 
         if commit:
-            self.save()
+            self.save_pending_orders()
 
         return order
 
@@ -113,9 +139,40 @@ class ShopifyOrder(models.Model):
         return False
 
 
+class ShopifyOrderData(models.Model):
+    """ Compressed copy of the complete Shopify order payload
+
+    Kept up to date by the orders webhooks so the orders page can be rendered
+    without fetching each page from Shopify.
+    """
+
+    order = models.OneToOneField(ShopifyOrder, related_name='order_data', on_delete=models.CASCADE)
+    data = models.BinaryField()
+    updated_at = models.DateTimeField(verbose_name='Shopify Order Update Date')
+
+    def __str__(self):
+        return 'OrderData #{}'.format(self.order_id)
+
+    def get_data(self):
+        try:
+            return json.loads(zlib.decompress(bytes(self.data)))
+        except:
+            return None
+
+    def set_data(self, data, commit=True):
+        self.data = zlib.compress(json.dumps(data).encode())
+        self.updated_at = arrow.get(data['updated_at']).datetime
+
+        if commit:
+            self.save()
+
+
 class ShopifyOrderLine(models.Model):
     class Meta:
         unique_together = ('order', 'line_id')
+        indexes = [
+            models.Index(fields=['shopify_product'], name='shopifyorderline_product'),
+        ]
 
     order = models.ForeignKey(ShopifyOrder, on_delete=models.CASCADE)
     product = models.ForeignKey(ShopifyProduct, null=True, on_delete=models.deletion.SET_NULL)
@@ -1,9 +1,20 @@
+from unittest.mock import patch, MagicMock, Mock
+
+import arrow
+
 from lib.test import BaseTestCase
 from django.utils import timezone
 from django.db.models import Max
 
 from shopify_orders.models import ShopifyOrder, ShopifyOrderLine
-from leadgalaxy.tests.factories import ShopifyProductFactory
+from shopify_orders.utils import (
+    get_shopify_orders_data,
+    save_shopify_order_data,
+    update_elasticsearch_orders_lines,
+    update_line_export,
+    update_shopify_orders,
+)
+from leadgalaxy.tests.factories import ShopifyProductFactory, ShopifyStoreFactory
 import factory
 
 
@@ -100,3 +111,198 @@ class UtilsTestCase(BaseTestCase):
         values = orders.values_list('order_id', 'connected')
         self.assertEqual(len(values), 0)
         self.assertEqual(orders.count(), 0)
+
+
+class ShopifyOrderDataTestCase(BaseTestCase):
+    def setUp(self):
+        self.order = ShopifyOrderFactory(order_id=5415135176, updated_at=arrow.get('2022-01-01T10:00:00Z').datetime)
+        self.data = {
+            'id': 5415135176,
+            'name': '#1031',
+            'updated_at': '2022-01-01T10:00:00Z',
+            'line_items': [{'id': 1654812, 'title': 'Test Product'}],
+        }
+
+    def test_must_compress_order_data(self):
+        order_data = save_shopify_order_data(self.order, self.data)
+        order_data.refresh_from_db()
+
+        self.assertEqual(order_data.get_data(), self.data)
+        self.assertLess(len(bytes(order_data.data)), len(str(self.data)))
+
+    @patch('shopify_orders.utils.ShopifyAPI.get_orders')
+    def test_must_use_saved_order_data(self, get_orders):
+        save_shopify_order_data(self.order, self.data)
+
+        orders, fetched_ids = get_shopify_orders_data(self.order.store, [self.order])
+
+        self.assertEqual(orders, [self.data])
+        self.assertEqual(fetched_ids, [])
+        get_orders.assert_not_called()
+
+    @patch('shopify_orders.utils.ShopifyAPI.get_orders')
+    def test_must_fetch_outdated_order_data(self, get_orders):
+        save_shopify_order_data(self.order, self.data)
+
+        self.order.updated_at = arrow.get('2022-01-02T10:00:00Z').datetime
+        self.order.save()
+
+        updated_data = dict(self.data, updated_at='2022-01-02T10:00:00Z')
+        get_orders.return_value = ([updated_data], None, None)
+
+        orders, fetched_ids = get_shopify_orders_data(self.order.store, [self.order])
+
+        self.assertEqual(orders, [updated_data])
+        self.assertEqual(fetched_ids, [self.order.order_id])
+        self.assertEqual(self.order.order_data.get_data(), updated_data)
+
+
+class UpdateShopifyOrdersTestCase(BaseTestCase):
+    def setUp(self):
+        self.store = ShopifyStoreFactory()
+        self.product = ShopifyProductFactory(store=self.store, user=self.store.user, shopify_id=7001)
+
+    def order_data(self, order_id, line_ids, **kwargs):
+        data = {
+            'id': order_id,
+            'number': order_id % 1000,
+            'customer': {'id': 1, 'first_name': 'John', 'last_name': 'Doe', 'email': 'john@example.com'},
+            'shipping_address': {'city': 'New York', 'zip': '10001', 'country_code': 'US'},
+            'financial_status': 'paid',
+            'fulfillment_status': None,
+            'total_price': '10.00',
+            'tags': '',
+            'created_at': '2022-01-01T10:00:00Z',
+            'updated_at': '2022-01-01T10:00:00Z',
+            'closed_at': None,
+            'cancelled_at': None,
+            'line_items': [{
+                'id': line_id,
+                'product_id': 7001 if idx == 0 else 7002,
+                'title': 'Test Product',
+                'price': '5.00',
+                'quantity': 1,
+                'variant_id': 8001,
+                'variant_title': 'Red',
+                'fulfillment_status': None,
+            } for idx, line_id in enumerate(line_ids)],
+        }
+
+        data.update(kwargs)
+        return data
+
+    def test_must_create_orders_and_lines(self):
+        orders = update_shopify_orders(self.store, [
+            self.order_data(5001, [6001, 6002]),
+            self.order_data(5002, [6003]),
+        ], sync_check=False)
+
+        self.assertEqual(len(orders), 2)
+        self.assertEqual(ShopifyOrder.objects.filter(store=self.store).count(), 2)
+        self.assertEqual(ShopifyOrderLine.objects.filter(order__store=self.store).count(), 3)
+
+        order = ShopifyOrder.objects.get(store=self.store, order_id=5001)
+        self.assertEqual(order.connected_items, 1)
+        self.assertEqual(order.need_fulfillment, 2)
+        self.assertEqual(order.customer_name, 'John Doe')
+        self.assertEqual(order.shopifyorderline_set.get(line_id=6001).product, self.product)
+        self.assertEqual(order.order_data.get_data()['id'], 5001)
+
+    def test_must_update_existing_orders(self):
+        update_shopify_orders(self.store, [self.order_data(5001, [6001, 6002])], sync_check=False)
+        update_shopify_orders(self.store, [
+            self.order_data(5001, [6001, 6002], financial_status='refunded', updated_at='2022-01-02T10:00:00Z'),
+        ], sync_check=False)
+
+        self.assertEqual(ShopifyOrder.objects.filter(store=self.store).count(), 1)
+        self.assertEqual(ShopifyOrderLine.objects.filter(order__store=self.store).count(), 2)
+
+        order = ShopifyOrder.objects.get(store=self.store, order_id=5001)
+        self.assertEqual(order.financial_status, 'refunded')
+        self.assertEqual(order.order_data.get_data()['financial_status'], 'refunded')
+
+    def test_must_not_update_orders_of_not_synced_store(self):
+        orders = update_shopify_orders(self.store, [self.order_data(5001, [6001])])
+
+        self.assertEqual(orders, [])
+        self.assertFalse(ShopifyOrder.objects.filter(store=self.store).exists())
+
+    def test_update_line_export_must_connect_lines_of_product(self):
+        update_shopify_orders(self.store, [
+            self.order_data(5001, [6001, 6002]),
+            self.order_data(5002, [6003, 6004]),
+        ], sync_check=False)
+
+        product = ShopifyProductFactory(store=self.store, user=self.store.user, shopify_id=7002)
+        self.assertEqual(update_line_export(self.store, 7002), (2, 2))
+
+        for order in ShopifyOrder.objects.filter(store=self.store):
+            self.assertEqual(order.connected_items, 2)
+            self.assertEqual(order.shopifyorderline_set.get(shopify_product=7002).product, product)
+
+        # Nothing changed, orders are not updated again
+        self.assertEqual(update_line_export(self.store, 7002), (2, 0))
+
+        # Same connected items count but lines connected to another product
+        other = ShopifyProductFactory(store=self.store, user=self.store.user, shopify_id=7003)
+        ShopifyOrderLine.objects.filter(shopify_product=7002).update(product=other)
+        self.assertEqual(update_line_export(self.store, 7002), (2, 2))
+        self.assertFalse(ShopifyOrderLine.objects.filter(product=other).exists())
+
+        product.delete()
+        self.assertEqual(update_line_export(self.store, 7002), (2, 2))
+        self.assertEqual(ShopifyOrder.objects.get(store=self.store, order_id=5001).connected_items, 1)
+
+    @patch('shopify_orders.utils.capture_message')
+    @patch('shopify_orders.utils.streaming_bulk')
+    @patch('shopify_orders.utils.get_elastic', Mock(return_value=MagicMock()))
+    def test_failed_orders_lines_updates_are_reported(self, streaming_bulk, capture_message):
+        streaming_bulk.return_value = [
+            (True, {'update': {'_id': 1, 'status': 200}}),
+            (False, {'update': {'_id': 2, 'status': 404}}),
+            (False, {'update': {'_id': 3, 'status': 429}}),
+        ]
+
+        update_elasticsearch_orders_lines([1, 2, 3])
+
+        capture_message.assert_called_once()
+        self.assertEqual(capture_message.call_args[1]['extra'], {'orders': [3], 'count': 1})
+
+
+class OrdersFetchWindowsTestCase(BaseTestCase):
+    def setUp(self):
+        from shopify_orders.management.commands.orders_fetch import Command
+
+        self.command = Command()
+        self.command.window_orders = 1000
+
+    def test_small_store_is_imported_in_one_window(self):
+        windows = self.command.get_import_windows(None, 500)
+        self.assertEqual(len(windows), 1)
+
+    def test_windows_must_not_overlap(self):
+        windows = self.command.get_import_windows(None, 5500)
+        self.assertEqual(len(windows), 6)
+
+        for window, next_window in zip(windows, windows[1:]):
+            self.assertEqual(arrow.get(window['created_at_max']).shift(seconds=1), arrow.get(next_window['created_at_min']))
+
+    def test_windows_count_is_limited(self):
+        windows = self.command.get_import_windows(None, 100000)
+        self.assertEqual(len(windows), 16)
+
+    def test_resumed_windows_are_extended(self):
+        windows = self.command.get_import_windows(None, 2500)
+        windows[-1]['created_at_max'] = arrow.utcnow().shift(hours=-1).isoformat()
+
+        self.command.extend_import_windows(windows)
+        self.assertEqual(len(windows), 3)
+        self.assertGreater(arrow.get(windows[-1]['created_at_max']), arrow.utcnow().shift(minutes=-1))
+
+        # A started window keeps its filters, new orders are imported in another window
+        windows[-1]['created_at_max'] = arrow.utcnow().shift(hours=-1).floor('second').isoformat()
+        windows[-1]['page_info'] = 'next-page'
+
+        self.command.extend_import_windows(windows)
+        self.assertEqual(len(windows), 4)
+        self.assertEqual(arrow.get(windows[2]['created_at_max']).shift(seconds=1), arrow.get(windows[3]['created_at_min']))
@@ -1,5 +1,8 @@
-from django.core.cache import cache
 from django.conf import settings
+from django.contrib.postgres.aggregates import ArrayAgg
+from django.db import transaction
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
 
 import re
 import arrow
@@ -9,9 +12,18 @@ from unidecode import unidecode
 import simplejson as json
 
 from elasticsearch import Elasticsearch
+from elasticsearch.helpers import bulk, streaming_bulk
 from aliexpress_core.models import AliexpressAccount
-
-from shopify_orders.models import ShopifySyncStatus, ShopifyOrder, ShopifyOrderLine, ShopifyFulfillementRequest
+from lib.exceptions import capture_message
+from leadgalaxy.shopify import ShopifyAPI
+
+from shopify_orders.models import (
+    ShopifySyncStatus,
+    ShopifyOrder,
+    ShopifyOrderData,
+    ShopifyOrderLine,
+    ShopifyFulfillementRequest
+)
 from shopified_core.utils import OrderErrors, delete_model_from_db, safe_int, ensure_title
 from shopified_core.shipping_helper import country_from_code
 
@@ -83,6 +95,33 @@ def get_elastic(verify_certs=True):
     return None
 
 
+def get_elasticsearch_order_source(order):
+    return dict(
+        store=order.store_id,
+        user=order.user_id,
+        order_id=order.order_id,
+        order_number=order.order_number,
+        customer_id=order.customer_id,
+        customer_name=order.customer_name,
+        customer_email=order.customer_email,
+        financial_status=order.financial_status,
+        fulfillment_status=order.fulfillment_status,
+        total_price=order.total_price,
+        tags=order.tags,
+        city=order.city,
+        zip_code=order.zip_code,
+        country_code=order.country_code,
+        items_count=order.items_count,
+        need_fulfillment=order.need_fulfillment,
+        connected_items=order.connected_items,
+        created_at=order.created_at,
+        updated_at=order.updated_at,
+        closed_at=order.closed_at,
+        cancelled_at=order.cancelled_at,
+        product_ids=[ll.product_id for ll in order.shopifyorderline_set.all()]
+    )
+
+
 def update_elasticsearch_shopify_order(order):
     es = get_elastic()
 
@@ -93,163 +132,401 @@ def update_elasticsearch_shopify_order(order):
         index="shopify-order",
         doc_type="order",
         id=order.id,
-        body=dict(
-            store=order.store_id,
-            user=order.user_id,
-            order_id=order.order_id,
-            order_number=order.order_number,
-            customer_id=order.customer_id,
-            customer_name=order.customer_name,
-            customer_email=order.customer_email,
-            financial_status=order.financial_status,
-            fulfillment_status=order.fulfillment_status,
-            total_price=order.total_price,
-            tags=order.tags,
-            city=order.city,
-            zip_code=order.zip_code,
-            country_code=order.country_code,
-            items_count=order.items_count,
-            need_fulfillment=order.need_fulfillment,
-            connected_items=order.connected_items,
-            created_at=order.created_at,
-            updated_at=order.updated_at,
-            closed_at=order.closed_at,
-            cancelled_at=order.cancelled_at,
-            product_ids=[ll.product_id for ll in order.shopifyorderline_set.all()]
-        )
+        body=get_elasticsearch_order_source(order)
     )
 
 
-def update_shopify_order(store, data, sync_check=True):
-    if sync_check:
-        try:
-            sync_status = ShopifySyncStatus.objects.get(store=store)
+def update_elasticsearch_shopify_orders(orders):
+    """ Index many orders with a single bulk request
 
-            if sync_status.sync_status == 1:
-                sync_status.add_pending_order(data['id'])
-                return
+    Args:
+        orders: ShopifyOrder queryset, lines are prefetched to get the product IDs
+    """
 
-            elif sync_status.sync_status not in [2, 5, 6]:
-                # Retrn if not Completed, Disabled or in Reset
-                return
+    es = get_elastic()
 
-        except ShopifySyncStatus.DoesNotExist:
-            return
+    if not es:
+        return
+
+    actions = []
+    for order in orders.prefetch_related('shopifyorderline_set'):
+        actions.append({
+            '_index': 'shopify-order',
+            '_type': 'order',
+            '_id': order.id,
+            '_source': get_elasticsearch_order_source(order)
+        })
+
+    if actions:
+        bulk(es, actions)
+
+
+def get_shopify_order_fields(store, data):
+    """ ShopifyOrder fields values from a Shopify order payload """
 
     address = data.get('shipping_address', data.get('customer', {}).get('default_address', {}))
     customer = data.get('customer', address)
 
-    order, created = ShopifyOrder.objects.update_or_create(
-        order_id=data['id'],
-        store=store,
-        defaults={
-            'user': store.user,
-            'order_number': data['number'],
-            'customer_id': customer.get('id', 0),
-            'customer_name': str_max(get_customer_name(customer), 255),
-            'customer_email': str_max(customer.get('email'), 255).replace('\x00', ''),
-            'financial_status': data['financial_status'],
-            'fulfillment_status': data['fulfillment_status'],
-            'total_price': data['total_price'],
-            'tags': data['tags'],
-            'city': str_max(address.get('city'), 63),
-            'zip_code': str_max(address.get('zip'), 31),
-            'country_code': str_max(address.get('country_code'), 31),
-            'items_count': len(data.get('line_items', [])),
-            'created_at': get_datetime(data['created_at']),
-            'updated_at': get_datetime(data['updated_at']),
-            'closed_at': get_datetime(data['closed_at']),
-            'cancelled_at': get_datetime(data['cancelled_at']),
-        }
-    )
+    return {
+        'user': store.user,
+        'order_number': data['number'],
+        'customer_id': customer.get('id', 0),
+        'customer_name': str_max(get_customer_name(customer), 255),
+        'customer_email': str_max(customer.get('email'), 255).replace('\x00', ''),
+        'financial_status': data['financial_status'],
+        'fulfillment_status': data['fulfillment_status'],
+        'total_price': data['total_price'],
+        'tags': data['tags'],
+        'city': str_max(address.get('city'), 63),
+        'zip_code': str_max(address.get('zip'), 31),
+        'country_code': str_max(address.get('country_code'), 31),
+        'items_count': len(data.get('line_items', [])),
+        'created_at': get_datetime(data['created_at']),
+        'updated_at': get_datetime(data['updated_at']),
+        'closed_at': get_datetime(data['closed_at']),
+        'cancelled_at': get_datetime(data['cancelled_at']),
+    }
+
+
+ORDER_UPDATE_FIELDS = [
+    'user', 'order_number', 'customer_id', 'customer_name', 'customer_email', 'financial_status',
+    'fulfillment_status', 'total_price', 'tags', 'city', 'zip_code', 'country_code', 'items_count',
+    'created_at', 'updated_at', 'closed_at', 'cancelled_at', 'need_fulfillment', 'connected_items',
+]
+
+LINE_UPDATE_FIELDS = [
+    'shopify_product', 'title', 'price', 'quantity', 'variant_id', 'variant_title',
+    'fulfillment_status', 'product', 'track',
+]
+
+
+def update_shopify_order(store, data, sync_check=True):
+    return update_shopify_orders(store, [data], sync_check=sync_check)
+
+
+def update_shopify_orders(store, orders_data, sync_check=True):
+    """ Create or update Shopify orders and their lines in bulk
+
+    Products and tracks of all the orders lines are loaded with a single query each,
+    orders, lines and orders payload are written with bulk queries and indexed with
+    a single Elasticsearch bulk request.
+
+    Args:
+        store (ShopifyStore): Orders store
+        orders_data (list): Shopify orders payload
+        sync_check (bool): Only save orders if the store orders are synced
+
+    Returns:
+        list: Saved ShopifyOrder models
+    """
+
+    sync_status = ShopifySyncStatus.objects.filter(store=store).first()
+
+    if sync_check:
+        if sync_status is None:
+            return []
+
+        if sync_status.sync_status in [1, 4]:
+            # Import started or stopped on an error and resumed later, orders are updated once it's completed
+            for data in orders_data:
+                sync_status.add_pending_order(data['id'], commit=False)
+
+            sync_status.save_pending_orders()
+            return []
+
+        elif sync_status.sync_status not in [2, 5, 6]:
+            # Retrn if not Completed, Disabled or in Reset
+            return []
+
+    # Only keep the last payload if an order is present more than once
+    orders_data = list({data['id']: data for data in orders_data}.values())
+    if not orders_data:
+        return []
+
+    order_ids = [data['id'] for data in orders_data]
+
+    products = {}
+    product_ids = set(safe_int(line['product_id']) for data in orders_data for line in data.get('line_items', []))
+    for product in store.shopifyproduct_set.filter(shopify_id__in=product_ids).only('id', 'shopify_id', 'is_excluded').order_by('id'):
+        products.setdefault(product.shopify_id, product)
+
+    tracks = {}
+    for track in store.shopifyordertrack_set.filter(order_id__in=order_ids).only('id', 'order_id', 'line_id').order_by('id'):
+        tracks.setdefault((track.order_id, track.line_id), track)
+
+    with transaction.atomic():
+        saved_orders = {o.order_id: o for o in ShopifyOrder.objects.filter(store=store, order_id__in=order_ids)}
+
+        new_orders = []
+        updated_orders = []
+        for data in orders_data:
+            fields = get_shopify_order_fields(store, data)
+
+            connected_items = 0
+            need_fulfillment = len(data.get('line_items', []))
+            for line in data.get('line_items', []):
+                product = products.get(safe_int(line['product_id']))
+                track = tracks.get((data['id'], line['id']))
+
+                if product:
+                    connected_items += 1
+
+                if track or line['fulfillment_status'] == 'fulfilled' or (product and product.is_excluded) or type(line.get('tip')) is dict:
+                    need_fulfillment -= 1
+
+            fields['need_fulfillment'] = need_fulfillment
+            fields['connected_items'] = connected_items
+
+            order = saved_orders.get(data['id'])
+            if order is None:
+                new_orders.append(ShopifyOrder(store=store, order_id=data['id'], **fields))
+            else:
+                for name, value in fields.items():
+                    setattr(order, name, value)
+
+                updated_orders.append(order)
+
+        if new_orders:
+            ShopifyOrder.objects.bulk_create(new_orders, batch_size=500)
+
+        if updated_orders:
+            ShopifyOrder.objects.bulk_update(updated_orders, ORDER_UPDATE_FIELDS, batch_size=500)
+
+        # Reload created orders to get their IDs on all database backends
+        orders = {o.order_id: o for o in ShopifyOrder.objects.filter(store=store, order_id__in=order_ids)}
+
+        saved_lines = {}
+        for line in ShopifyOrderLine.objects.filter(order__in=orders.values()):
+            saved_lines[(line.order_id, line.line_id)] = line
+
+        new_lines = []
+        updated_lines = []
+        for data in orders_data:
+            order = orders[data['id']]
+            for line in data.get('line_items', []):
+                fields = {
+                    'shopify_product': safe_int(line['product_id']),
+                    'title': line['title'],
+                    'price': line['price'],
+                    'quantity': line['quantity'],
+                    'variant_id': safe_int(line['variant_id']),
+                    'variant_title': line['variant_title'],
+                    'fulfillment_status': line['fulfillment_status'],
+                    'product': products.get(safe_int(line['product_id'])),
+                    'track': tracks.get((data['id'], line['id'])),
+                }
+
+                order_line = saved_lines.get((order.id, line['id']))
+                if order_line is None:
+                    new_lines.append(ShopifyOrderLine(order=order, line_id=line['id'], **fields))
+                else:
+                    for name, value in fields.items():
+                        setattr(order_line, name, value)
+
+                    updated_lines.append(order_line)
+
+        if new_lines:
+            ShopifyOrderLine.objects.bulk_create(new_lines, batch_size=500)
+
+        if updated_lines:
+            ShopifyOrderLine.objects.bulk_update(updated_lines, LINE_UPDATE_FIELDS, batch_size=500)
+
+        save_shopify_orders_data(orders, orders_data)
 
-    connected_items = 0
-    need_fulfillment = len(data.get('line_items', []))
-    for line in data.get('line_items', []):
-        cache_key = 'export_product_{}_{}'.format(store.id, line['product_id'])
-        product = cache.get(cache_key)
-        if product is None:
-            product = store.shopifyproduct_set.filter(shopify_id=safe_int(line['product_id'])).first()
-            cache.set(cache_key, product.id if product else 0, timeout=300)
+    from profit_dashboard.utils import save_orders_refunds
+    save_orders_refunds(store, orders_data)
+
+    if sync_status and sync_status.elastic:
+        update_elasticsearch_shopify_orders(ShopifyOrder.objects.filter(id__in=[o.id for o in orders.values()]))
+
+    return list(orders.values())
+
+
+def save_shopify_order_data(order, data):
+    """ Save the complete Shopify order payload of a ShopifyOrder """
+
+    try:
+        order_data = order.order_data
+    except ShopifyOrderData.DoesNotExist:
+        order_data = ShopifyOrderData(order=order)
+
+    order_data.set_data(data)
+
+    return order_data
+
+
+def save_shopify_orders_data(orders, orders_data):
+    """ Save the complete Shopify payload of many orders
+
+    Args:
+        orders (dict): ShopifyOrder models by Shopify Order ID
+        orders_data (list): Shopify orders payload
+    """
+
+    saved = {i.order_id: i for i in ShopifyOrderData.objects.filter(order__in=orders.values())}
+
+    new_data = []
+    updated_data = []
+    for data in orders_data:
+        order = orders[data['id']]
+        order_data = saved.get(order.id)
+        if order_data is None:
+            order_data = ShopifyOrderData(order=order)
+            new_data.append(order_data)
         else:
-            product = store.shopifyproduct_set.get(id=product) if product != 0 else None
-
-        track = store.shopifyordertrack_set.filter(order_id=data['id'], line_id=line['id']).first()
-
-        if product:
-            connected_items += 1
-
-        if track or line['fulfillment_status'] == 'fulfilled' or (product and product.is_excluded) or type(line.get('tip')) is dict:
-            need_fulfillment -= 1
-
-        ShopifyOrderLine.objects.update_or_create(
-            order=order,
-            line_id=line['id'],
-            defaults={
-                'shopify_product': safe_int(line['product_id']),
-                'title': line['title'],
-                'price': line['price'],
-                'quantity': line['quantity'],
-                'variant_id': safe_int(line['variant_id']),
-                'variant_title': line['variant_title'],
-                'fulfillment_status': line['fulfillment_status'],
-                'product': product,
-                'track': track
-            })
+            updated_data.append(order_data)
+
+        order_data.set_data(data, commit=False)
+
+    if new_data:
+        ShopifyOrderData.objects.bulk_create(new_data, batch_size=500)
+
+    if updated_data:
+        ShopifyOrderData.objects.bulk_update(updated_data, ['data', 'updated_at'], batch_size=500)
 
-    order.need_fulfillment = need_fulfillment
-    order.connected_items = connected_items
-    order.save()
 
-    if sync_status.elastic:
-        update_elasticsearch_shopify_order(order)
+def get_shopify_orders_data(store, orders):
+    """ Get the Shopify payload of the orders in `orders` from the local copy
+
+    Orders without a local copy, or with a copy older than the order itself, are
+    fetched from Shopify in a single request and saved for the next time.
+
+    Args:
+        store (ShopifyStore): Orders store
+        orders (list): ShopifyOrder models
+
+    Returns:
+        (list, list): Shopify orders payload and the Order IDs fetched from Shopify
+    """
+
+    db_orders = {o.id: o for o in orders}
+
+    shopify_orders = []
+    for order_data in ShopifyOrderData.objects.filter(order_id__in=list(db_orders.keys())):
+        order = db_orders[order_data.order_id]
+        data = order_data.get_data()
+        if data and order_data.updated_at >= order.updated_at:
+            shopify_orders.append(data)
+            db_orders.pop(order.id)
+
+    fetched_ids = [o.order_id for o in db_orders.values()]
+    if fetched_ids:
+        # Rate limited with the other API calls of the store
+        orders_data, next_page_info, previous_page_info = ShopifyAPI(store).get_orders({
+            'ids': ','.join([str(i) for i in fetched_ids]),
+            'limit': 250,
+            'status': 'any',
+            'fulfillment_status': 'any',
+            'financial_status': 'any',
+        })
+
+        orders_map = {o.order_id: o for o in db_orders.values()}
+        for data in orders_data:
+            shopify_orders.append(data)
+            save_shopify_order_data(orders_map[data['id']], data)
+
+    return shopify_orders, fetched_ids
 
 
 def update_line_export(store, shopify_id):
     """
     Update ShopifyOrderLine.product when a supplier is added or changed
     :param shopify_id: Shopify Product ID
+    :return: Number of updated lines and orders
     """
 
-    try:
-        sync_status = ShopifySyncStatus.objects.get(store=store)
-    except ShopifySyncStatus.DoesNotExist:
-        sync_status = None
+    shopify_id = safe_int(shopify_id)
+    product = store.shopifyproduct_set.filter(shopify_id=shopify_id).first()
 
-    update_elastic = is_store_synced(store) and sync_status.elastic
+    connected_items = ShopifyOrderLine.objects.filter(order=OuterRef('pk'), product__isnull=False) \
+                                              .order_by().values('order').annotate(count=Count('id')).values('count')
+    connected_items = Coalesce(Subquery(connected_items), 0)
 
-    product = store.shopifyproduct_set.filter(shopify_id=shopify_id).first()
-    seen_orders = []
-    # TODO: Index shopify_product column
-    # TODO: Limit to last 30 days
-    for order in ShopifyOrder.objects.filter(store=store, shopifyorderline__shopify_product=shopify_id):
-        if order.id not in seen_orders:
-            seen_orders.append(order.id)
-        else:
-            continue
+    lines = ShopifyOrderLine.objects.filter(order__store=store, shopify_product=shopify_id)
+    if product:
+        changed_lines = lines.exclude(product=product)
+    else:
+        changed_lines = lines.filter(product__isnull=False)
 
-        connected_items = 0
-        for line in order.shopifyorderline_set.all():
-            if line.shopify_product == safe_int(shopify_id):
-                line.product = product
-                line.save()
+    with transaction.atomic():
+        # Orders with lines connected to another product keep the same count but not the same product IDs
+        order_ids = set(changed_lines.values_list('order_id', flat=True))
 
-                if product:
-                    connected_items += 1
+        lines_count = lines.update(product=product)
+
+        # Lines of deleted products are disconnected before this runs, their orders only need a new count
+        orders = ShopifyOrder.objects.filter(store=store, shopifyorderline__shopify_product=shopify_id) \
+                                     .annotate(new_connected_items=connected_items) \
+                                     .exclude(connected_items=F('new_connected_items')) \
+                                     .values_list('id', flat=True) \
+                                     .distinct()
+        orders = set(orders)
+
+        if orders:
+            ShopifyOrder.objects.filter(id__in=orders).update(connected_items=connected_items)
+
+        order_ids.update(orders)
 
-            elif line.product_id:
-                connected_items += 1
+    if order_ids and is_store_synced(store) and ShopifySyncStatus.objects.filter(store=store, elastic=True).exists():
+        update_elasticsearch_orders_lines(sorted(order_ids))
 
-        if order.connected_items != connected_items:
-            ShopifyOrder.objects.filter(id=order.id).update(connected_items=connected_items)
+    return lines_count, len(order_ids)
 
-            if update_elastic:
-                # TODO: Make this a single elastic query?
-                update_elasticsearch_shopify_order(order)
+
+def update_elasticsearch_orders_lines(order_ids, chunk_size=500):
+    """ Update the indexed orders connected items count and product IDs in bulk requests
+
+    Args:
+        order_ids: List of ShopifyOrder IDs
+    """
+
+    es = get_elastic()
+
+    if not es:
+        return
+
+    def get_actions():
+        for i in range(0, len(order_ids), chunk_size):
+            chunk = order_ids[i:i + chunk_size]
+
+            orders = {order_id: {'connected_items': 0, 'product_ids': []} for order_id in chunk}
+            lines = ShopifyOrderLine.objects.filter(order_id__in=chunk) \
+                                            .order_by() \
+                                            .values('order_id') \
+                                            .annotate(count=Count('product'), product_ids=ArrayAgg('product_id', ordering='id'))
+            for line in lines:
+                orders[line['order_id']] = {'connected_items': line['count'], 'product_ids': line['product_ids']}
+
+            for order_id, doc in orders.items():
+                yield {
+                    '_op_type': 'update',
+                    '_index': 'shopify-order',
+                    '_type': 'order',
+                    '_id': order_id,
+                    'doc': doc,
+                }
+
+    failed = []
+    for ok, item in streaming_bulk(es, get_actions(), chunk_size=chunk_size, raise_on_error=False):
+        if ok:
+            continue
+
+        # Orders that are not indexed yet will get their lines when they are
+        result = item['update']
+        if result.get('status') != 404:
+            failed.append(result['_id'])
+
+    if failed:
+        capture_message('Orders Lines Index Errors', level='warning', extra={'orders': failed[:100], 'count': len(failed)})
 
 
 def delete_shopify_order(store, data):
-    ShopifyOrder.objects.filter(store=store, order_id=data['id']).delete()
+    from profit_dashboard.utils import queue_profit_rollups
+
+    orders = ShopifyOrder.objects.filter(store=store, order_id=data['id'])
+    queue_profit_rollups(store.id, orders.values_list('created_at', flat=True))
+
+    orders.delete()
 
 
 def is_store_synced(store, sync_type='orders'):
@@ -219,7 +219,7 @@ class MakePaymentTestCase(PLSBaseTestCase):
 
     def do_test(self, count=1):
         self.client.force_login(self.user)
-        with patch('leadgalaxy.models.requests.get',
+        with patch('leadgalaxy.shopify.ShopifyClient.get',
                    return_value=self.mock_order_response), \
                 patch('shopified_core.api_base.order_data_cache',
                       return_value=self.order_data_cache), \
@@ -425,7 +425,7 @@ class MakePaymentBundleTestCase(PLSBaseTestCase):
 
     def do_test(self, count=1, item_count=2):
         self.client.force_login(self.user)
-        with patch('leadgalaxy.models.requests.get',
+        with patch('leadgalaxy.shopify.ShopifyClient.get',
                    return_value=self.mock_order_response), \
                 patch('shopified_core.api_base.order_data_cache',
                       return_value=self.order_data_cache), \
@@ -754,7 +754,7 @@ class BasketTestCase(PLSBaseTestCase):
             'shipping_address': 'true',
         }
 
-        with patch('leadgalaxy.models.requests.get',
+        with patch('leadgalaxy.shopify.ShopifyClient.get',
                    return_value=self.mock_order_response), \
                 patch('shopified_core.api_base.order_data_cache',
                       return_value=self.order_data_cache), \
@@ -580,7 +580,8 @@ class OrdersShippedWebHookTestCase(BaseTestCase):
         self.setup_data()
 
         with patch('product_common.views.get_shipstation_shipments') as mock_func, \
-                patch('requests.post'), patch('shopify_orders.tasks.check_track_errors.delay'):
+                patch('requests.post'), patch('leadgalaxy.shopify.ShopifyClient.post'), \
+                patch('shopify_orders.tasks.check_track_errors.delay'):
             mock_func.return_value = self.shipments
             response = self.client.post(self.url,
                                         data=json.dumps(self.data),
@@ -1,15 +1,36 @@
 import json
 import requests
 from copy import deepcopy
+from functools import wraps
 
 from django.conf import settings
 
 from lib.exceptions import capture_exception
-from shopified_core.utils import cached_return, safe_float
+from shopified_core.utils import invalidate_memoize_tags, memoize, memoize_invalidate_on, safe_float
 from suredone_core.models import SureDoneAccount
 from suredone_core.param_encoder import param
 
 
+def options_cache_tag(api_username):
+    return f'suredone_options_{api_username}'
+
+
+def clears_account_options(method):
+    """ Expire the cached account options after a call changing the account settings or channels """
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            invalidate_memoize_tags(options_cache_tag(self.HEADERS['X-Auth-User']))
+
+    return wrapper
+
+
+memoize_invalidate_on(SureDoneAccount, lambda account: [options_cache_tag(account.api_username)])
+
+
 class SureDoneApiHandler:
     API_ENDPOINT = 'https://api.suredone.com'
     API_EDITOR_PATH = '/v1/editor/items'
@@ -53,6 +74,7 @@ class SureDoneApiHandler:
 
         return requests.get(url, params=params, headers=self.HEADERS)
 
+    @clears_account_options
     def authorize_channel_v1(self, request_data: dict):
         url = f'{self.API_ENDPOINT}/v1/authorize'
         data = param(request_data)
@@ -99,6 +121,7 @@ class SureDoneApiHandler:
 
         return requests.get(url, params=request_data, headers=self.HEADERS)
 
+    @clears_account_options
     def authorize_ebay_complete(self, code: str, state: str):
         url = f'{self.API_ENDPOINT}/v3/authorize/ebay/complete'
         data = {'code': code, 'state': state}
@@ -118,6 +141,7 @@ class SureDoneApiHandler:
             else:
                 return {"result": "error", "message": "Something went wrong, please try again."}
 
+    @clears_account_options
     def authorize_ebay_complete_legacy(self):
         url = f'{self.API_ENDPOINT}/v3/authorize/ebay/complete'
         data = {'legacy': True}
@@ -137,6 +161,7 @@ class SureDoneApiHandler:
             else:
                 return {"result": "error", "message": "Something went wrong, please try again."}
 
+    @clears_account_options
     def update_settings(self, request_data: dict):
         url = f'{self.API_ENDPOINT}/v1/settings'
         data = param(request_data)
@@ -156,12 +181,14 @@ class SureDoneApiHandler:
             else:
                 return {"result": "error", "message": "Something went wrong, please try again."}
 
+    @clears_account_options
     def update_user_settings(self, request_data: dict):
         url = f'{self.API_ENDPOINT}/v1/settings'
         data = param(request_data)
 
         return requests.post(url, data=data, headers=self.HEADERS)
 
+    @clears_account_options
     def add_new_ebay_instance(self):
         url = f'{self.API_ENDPOINT}/v1/settings'
         data = param({'ebay_instance_add': 'on'})
@@ -174,6 +201,7 @@ class SureDoneApiHandler:
 
         return requests.get(url, params=request_data, headers=self.HEADERS)
 
+    @clears_account_options
     def post_fb_onboard_instance(self, cms_id: str, instance_id: int):
         url = f'{self.API_ENDPOINT}/v3/authorize/facebook/onboard'
         data = param({
@@ -183,12 +211,14 @@ class SureDoneApiHandler:
 
         return requests.post(url, data=data, headers=self.HEADERS)
 
+    @clears_account_options
     def add_new_fb_instance(self, instance_id: int):
         url = f'{self.API_ENDPOINT}/v3/authorize/facebook/create'
         data = param({'instance': instance_id})
 
         return requests.post(url, data=data, headers=self.HEADERS)
 
+    @clears_account_options
     def remove_fb_channel_auth(self, instance_id):
         url = f'{self.API_ENDPOINT}/v3/authorize/facebook/revoke'
         headers = {**self.HEADERS, 'Content-Type': 'Application/json'}
@@ -203,6 +233,7 @@ class SureDoneApiHandler:
         else:
             pass
 
+    @clears_account_options
     def authorize_fb_complete(self, instance, code, granted_scopes, denied_scopes, state):
         url = f'{self.API_ENDPOINT}/v3/authorize/facebook/complete'
         data = param({
@@ -221,6 +252,7 @@ class SureDoneApiHandler:
 
         return requests.get(url, params=request_data, headers=self.HEADERS)
 
+    @clears_account_options
     def post_google_onboard_instance(self, cms_id: str, instance_id: int):
         url = f'{self.API_ENDPOINT}/v3/authorize/google/onboard'
         data = param({
@@ -230,12 +262,14 @@ class SureDoneApiHandler:
 
         return requests.post(url, data=data, headers=self.HEADERS)
 
+    @clears_account_options
     def add_new_google_instance(self, instance_id: int):
         url = f'{self.API_ENDPOINT}/v3/authorize/google/create'
         data = param({'instance': instance_id})
 
         return requests.post(url, data=data, headers=self.HEADERS)
 
+    @clears_account_options
     def remove_google_channel_auth(self, instance_id):
         url = f'{self.API_ENDPOINT}/v3/authorize/google/revoke'
         headers = {**self.HEADERS, 'Content-Type': 'Application/json'}
@@ -250,6 +284,7 @@ class SureDoneApiHandler:
         else:
             pass
 
+    @clears_account_options
     def authorize_google_complete(self, instance, code, granted_scopes, denied_scopes, state):
         url = f'{self.API_ENDPOINT}/v3/authorize/google/complete'
         data = param({
@@ -459,7 +494,7 @@ class SureDoneApiHandler:
                 new_token = self.handle_invalid_token_error(response)
                 if new_token:
                     self.HEADERS['X-Auth-Token'] = new_token
-                    return self.get_all_account_options(option_type)
+                    return self.__get_all_account_options(option_type)
                 else:
                     return {"result": "error", "message": "Something went wrong, please try again."}
         except(requests.exceptions.ConnectTimeout, requests.exceptions.ReadTimeout):
@@ -468,9 +503,13 @@ class SureDoneApiHandler:
                 'suredone_account_username': self.HEADERS['X-Auth-User'],
             })
 
+    @memoize(
+        timeout=300,
+        key=lambda self, option_type=None: [self.HEADERS['X-Auth-User'], option_type],
+        tags=lambda self, option_type=None: [options_cache_tag(self.HEADERS['X-Auth-User'])],
+        cache_if=lambda result: isinstance(result, dict) and result.get('result') != 'error')
     def get_all_account_options(self, option_type: str = None):
-        cached_func = cached_return(self.__get_all_account_options, user=self.HEADERS['X-Auth-User'])
-        return cached_func(option_type)
+        return self.__get_all_account_options(option_type)
 
     def get_platform_statuses(self):
         url = f'{self.API_ENDPOINT}/v3/channel/statuses'
@@ -532,10 +571,12 @@ class SureDoneApiHandler:
 
         return requests.patch(url, data=api_data, params=params, headers=headers)
 
+    @clears_account_options
     def update_plugin_settings(self, data: dict):
         url = f'{self.API_ENDPOINT}/v1/settings/plugins'
         return requests.post(url, data=param(data), headers=self.HEADERS)
 
+    @clears_account_options
     def update_plugin_settings_json(self, data: dict):
         url = f'{self.API_ENDPOINT}/v1/settings'
         headers = {**self.HEADERS, 'Content-Type': 'Application/json'}
@@ -555,6 +596,7 @@ class SureDoneApiHandler:
 
         return requests.get(url, headers=self.HEADERS)
 
+    @clears_account_options
     def post_new_ebay_products_import_job(self, store_prefix: str):
         url = f'{self.API_ENDPOINT}/v1/settings'
         data = param({
@@ -565,6 +607,7 @@ class SureDoneApiHandler:
         })
         return requests.post(url, data=data, headers=self.HEADERS)
 
+    @clears_account_options
     def post_new_products_import_job(self, store_prefix: str):
         url = f'{self.API_ENDPOINT}/v1/settings'
         name = store_prefix.rstrip('0123456789')
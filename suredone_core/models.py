@@ -300,10 +300,7 @@ class SureDoneProductBase(ProductBase):
 
     @property
     def parsed(self):
-        try:
-            return json.loads(self.data)
-        except:
-            return {}
+        return self.data_json
 
     @property
     def variants_config_parsed(self):
@@ -330,10 +327,7 @@ class SureDoneProductBase(ProductBase):
             return []
 
     def get_config(self):
-        try:
-            return json.loads(self.config)
-        except:
-            return {}
+        return self.config_json
 
     @property
     def is_connected(self):
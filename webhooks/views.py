@@ -43,7 +43,7 @@ from woocommerce_core.tasks import update_woo_order
 from lib.exceptions import capture_message, capture_exception
 from metrics.activecampaign import ActiveCampaignAPI
 from product_alerts.models import ProductChange
-from product_alerts.utils import delete_product_monitor, unmonitor_store, variant_index_from_supplier_sku
+from product_alerts.utils import delete_product_monitor, unmonitor_store, VariantMatcher
 from profit_dashboard.models import FacebookAccess
 from shopified_core.models_utils import get_product_model
 from shopified_core.tasks import export_user_activity
@@ -530,7 +530,7 @@ class ShopifyOrderDeleteWebhook(ShopifyWebhookMixing):
     def process_webhook(self, store, shopify_data):
         cache.set(f'saved_orders_clear_{store.id}', True, timeout=300)
 
-        ShopifyOrder.objects.filter(store=store, order_id=shopify_data['id']).delete()
+        shopify_orders_utils.delete_shopify_order(store, shopify_data)
 
 
 class ShopifyFulfillmentOrderWebhook(View, ShopifyWebhookVerifyMixing):
@@ -790,10 +790,11 @@ def price_monitor_webhook(request):
             except:
                 return JsonResponse({'error': 'Product Not Found'}, status=404)
 
+        variant_matcher = VariantMatcher(product, vrnts)
         for i, changes in enumerate(data):
             if data[i]['name'] == 'price':
                 variant_id = 0
-                index = variant_index_from_supplier_sku(product, changes['sku'], vrnts)
+                index = variant_matcher.match(changes['sku'])
                 if index is not None:
                     variant_id = vrnts[index]['id']
                 if variant_id > 0:
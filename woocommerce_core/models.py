@@ -15,7 +15,6 @@ from django.urls import reverse
 
 from shopified_core.utils import (
     get_domain,
-    safe_str,
 )
 from shopified_core.decorators import add_to_class
 from shopified_core.models import StoreBase, ProductBase, SupplierBase, BoardBase, OrderTrackBase, UserUploadBase, OrdersSyncStatusAbstract
@@ -216,10 +215,7 @@ class WooProduct(ProductBase):
 
     @property
     def parsed(self):
-        try:
-            return json.loads(self.data)
-        except:
-            return {}
+        return self.data_json
 
     @property
     def woocommerce_url(self):
@@ -253,22 +249,12 @@ class WooProduct(ProductBase):
     def save(self, *args, **kwargs):
         data = json.loads(self.data)
 
-        self.title = data.get('title', '')
-        self.tags = safe_str(data.get('tags', ''))[:1024]
-        self.product_type = safe_str(data.get('type', ''))[:254]
-
-        try:
-            self.price = '%.02f' % float(data['price'])
-        except:
-            self.price = 0.0
+        self.update_list_columns(data)
 
         super(WooProduct, self).save(*args, **kwargs)
 
     def get_config(self):
-        try:
-            return json.loads(self.config)
-        except:
-            return {}
+        return self.config_json
 
     def update_data(self, data):
         if type(data) is not dict:
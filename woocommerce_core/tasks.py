@@ -52,7 +52,7 @@ from .utils import (
 
 from product_alerts.utils import (
     get_supplier_variants,
-    variant_index_from_supplier_sku,
+    VariantMatcher,
 )
 
 
@@ -429,10 +429,11 @@ def sync_woo_product_quantities(self, product_id):
 
         variant_quantities = get_supplier_variants(product.default_supplier.supplier_type(), product.default_supplier.get_source_id())
         if product_data and variant_quantities:
+            variant_matcher = VariantMatcher(product, product_data['variants'])
             for variant in variant_quantities:
                 sku = variant.get('sku')
                 variant_id = 0
-                idx = variant_index_from_supplier_sku(product, sku, product_data['variants'])
+                idx = variant_matcher.match(sku)
                 if idx is not None:
                     variant_id = product_data['variants'][idx]['id']
                 if variant_id > 0:
@@ -540,6 +541,7 @@ def products_supplier_sync(self, store_id, products, sync_price, price_markup, c
                     updated = True
 
             if (sync_price and not same_price) or sync_inventory:
+                variant_matcher = VariantMatcher(product, variants)
                 for i, variant in enumerate(supplier_variants):
                     sku = variant.get('sku')
                     if not sku:
@@ -548,7 +550,7 @@ def products_supplier_sync(self, store_id, products, sync_price, price_markup, c
                         else:
                             continue
                     else:
-                        idx = variant_index_from_supplier_sku(product, sku, variants)
+                        idx = variant_matcher.match(sku)
 
                         variant_id = 0
                         if idx is not None:
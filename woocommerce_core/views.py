@@ -51,6 +51,7 @@ from shopified_core.utils import (
     safe_json,
     http_excption_status_code,
     order_data_cache,
+    order_data_cache_set_many,
     format_queueable_orders
 )
 from shopified_core.tasks import keen_order_event
@@ -1274,8 +1275,8 @@ class OrdersList(ListView):
                         countdown=5
                     )
 
-        caches['orders'].set_many(orders_cache, timeout=86400 if self.bulk_queue else 21600)
-        caches['orders'].set_many(raw_orders_cache, timeout=86400 if self.bulk_queue else 21600)
+        order_data_cache_set_many(orders_cache, timeout=86400 if self.bulk_queue else 21600)
+        order_data_cache_set_many(raw_orders_cache, timeout=86400 if self.bulk_queue else 21600)
 
 
 class OrdersTrackList(ListView):